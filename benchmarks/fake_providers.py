@@ -0,0 +1,329 @@
+import base64
+import datetime
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+import time
+import urllib.parse
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import google_crc32c
+
+from tests.fake_server import FakeServer, Response
+
+# 各プロバイダのサーバの名前
+PROVIDERS = ('fitbit', 'health_planet', 'twitter', 'gcs')
+
+
+@dataclass
+class ProviderConfig:
+    '''ローカルで起動する各プロバイダのサーバの設定
+
+    Attributes:
+        latency_ms (float): 各リクエストに応答するまでの遅延(ミリ秒)
+        fitbit_payload_kb (int): Fitbitの1日分のデータのおおよそのサイズ(KB)
+        images (int): Twitterの検索結果に含める実績画像の枚数
+        image_kb (int): 実績画像1枚のサイズ(KB)
+    '''
+    latency_ms: float = 20.0
+    fitbit_payload_kb: int = 64
+    images: int = 2
+    image_kb: int = 512
+
+
+def _json(body: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    res_headers = {'Content-Type': 'application/json'}
+    res_headers.update(headers or {})
+    return status, res_headers, json.dumps(body).encode('utf-8')
+
+
+def _pad(payload: Dict[str, Any], key: str, record: Dict[str, Any], size: int) -> Dict[str, Any]:
+    '''payload[key]にrecordを追加し, jsonのサイズをおおよそsizeバイトにする
+    '''
+    record_size = len(json.dumps(record)) + 2
+    count = max(0, (size - len(json.dumps(payload))) // record_size)
+    payload[key] = payload.get(key, []) + [dict(record, index=i) for i in range(count)]
+    return payload
+
+
+def _dates(from_date: str, to_date: str) -> List[str]:
+    start = datetime.date.fromisoformat(from_date)
+    end = datetime.date.fromisoformat(to_date)
+    return [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def fitbit_handler(config: ProviderConfig):
+    '''Fitbit Web APIのうちmain.runとバックフィルで使用するエンドポイントを再現する
+    '''
+    size = config.fitbit_payload_kb * 1024
+    headers = {'Fitbit-Rate-Limit-Limit': '150', 'Fitbit-Rate-Limit-Remaining': '149', 'Fitbit-Rate-Limit-Reset': '3600'}
+    level = {'dateTime': '2021-11-24T00:00:00.000', 'level': 'light', 'seconds': 30}
+
+    def handler(method: str, path: str, req_headers: Dict[str, str], body: bytes) -> Response:
+        path = urllib.parse.urlsplit(path).path
+        m = re.match(r'^/1\.2/user/-/(activities|foods/log|sleep)/date/([0-9-]{10})\.json$', path)
+        if m is not None:
+            category, date = m.groups()
+            if category == 'sleep':
+                sleep = _pad({'dateOfSleep': date, 'logId': 1, 'minutesAsleep': 420, 'timeInBed': 450}, 'levels', level, size)
+                return _json({'sleep': [sleep], 'summary': {'totalMinutesAsleep': 420, 'totalTimeInBed': 450}}, headers=headers)
+            if category == 'activities':
+                activity = {'activityId': 90013, 'name': 'Walk', 'calories': 120, 'steps': 1500, 'startTime': '07:00'}
+                return _json(_pad({'summary': {'steps': 8000, 'caloriesOut': 2300}}, 'activities', activity, size), headers=headers)
+            food = {'logId': 1, 'loggedFood': {'name': 'rice', 'calories': 250, 'amount': 1}, 'logDate': date}
+            return _json(_pad({'summary': {'calories': 2000, 'water': 1500}}, 'foods', food, size), headers=headers)
+
+        m = re.match(r'^/1\.2/user/-/sleep/date/([0-9-]{10})/([0-9-]{10})\.json$', path)
+        if m is not None:
+            sleep = [{'dateOfSleep': d, 'logId': i, 'minutesAsleep': 420, 'timeInBed': 450} for i, d in enumerate(_dates(*m.groups()))]
+            return _json({'sleep': sleep}, headers=headers)
+
+        m = re.match(r'^/1/user/-/(activities|foods/log)/(\w+)/date/([0-9-]{10})/([0-9-]{10})\.json$', path)
+        if m is not None:
+            category, resource, from_date, to_date = m.groups()
+            key = '{}-{}'.format(category.replace('/', '-'), resource)
+            return _json({key: [{'dateTime': d, 'value': '100'} for d in _dates(from_date, to_date)]}, headers=headers)
+
+        m = re.match(r'^/1/user/-/body/log/(weight|fat)/date/([0-9-]{10})/([0-9-]{10})\.json$', path)
+        if m is not None:
+            return _json({m.group(1): []}, headers=headers)
+        if method == 'POST' and re.match(r'^/1/user/-/body/log/(weight|fat)\.json$', path):
+            return _json({}, status=201, headers=headers)
+        return _json({'errors': [{'message': 'not found'}]}, status=404)
+    return handler
+
+
+def health_planet_handler(config: ProviderConfig):
+    '''Health Planetの体組成データのエンドポイントを再現する, 期間内の毎日7:12に体重と体脂肪率を記録したものとする
+    '''
+    def handler(method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        parsed = urllib.parse.urlsplit(path)
+        if parsed.path.rstrip('/') != '/status/innerscan.json':
+            return _json({}, status=404)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        from_date = datetime.datetime.strptime(query['from'][:8], '%Y%m%d').date().isoformat()
+        to_date = datetime.datetime.strptime(query['to'][:8], '%Y%m%d').date().isoformat()
+        data = []
+        for d in _dates(from_date, to_date):
+            date = d.replace('-', '') + '0712'
+            data.append({'date': date, 'keydata': '70.10', 'model': '01000117', 'tag': '6021'})
+            data.append({'date': date, 'keydata': '20.50', 'model': '01000117', 'tag': '6022'})
+        return _json({'birth_date': '19880101', 'data': data, 'height': '170', 'sex': 'male'})
+    return handler
+
+
+def twitter_handler(config: ProviderConfig, server: FakeServer):
+    '''Twitter API v2の検索と, 検索結果に含める実績画像を再現する
+    '''
+    image = b'\x89PNG\r\n\x1a\n' + bytes(i % 251 for i in range(config.image_kb * 1024 - 8))
+
+    def handler(method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        parsed = urllib.parse.urlsplit(path)
+        if parsed.path == '/2/tweets/search/recent':
+            media = [{'media_key': str(i), 'type': 'photo', 'url': '{}/media/{}.png'.format(server.url, i)} for i in range(config.images)]
+            return _json({'data': [{'id': '1', 'text': '#RingFitAdventure'}], 'includes': {'media': media}})
+        if parsed.path.startswith('/media/'):
+            return 200, {'Content-Type': 'image/png'}, image
+        return _json({}, status=404)
+    return handler
+
+
+class FakeGcs:
+    '''gcsのJSON APIのうちgoogle-cloud-storageのBlobで使用するエンドポイントを再現する
+
+    STORAGE_EMULATOR_HOSTにサーバのurlを設定するとgcsのクライアントの接続先となる
+    '''
+
+    def __init__(self) -> None:
+        self.objects: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.uploaded_bytes = 0
+        self.next_generation = 1
+        self.server: Optional[FakeServer] = None
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        '''格納したオブジェクトと転送されたバイト数を破棄する
+        '''
+        with self.lock:
+            self.objects.clear()
+            self.uploads.clear()
+            self.uploaded_bytes = 0
+
+    def _metadata(self, bucket: str, name: str) -> Dict[str, Any]:
+        obj = self.objects[(bucket, name)]
+        data = obj['data']
+        metadata = {
+            'kind': 'storage#object',
+            'bucket': bucket,
+            'name': name,
+            'generation': str(obj['generation']),
+            'metageneration': '1',
+            'size': str(len(data)),
+            'md5Hash': base64.b64encode(hashlib.md5(data).digest()).decode('utf-8'),
+            'crc32c': base64.b64encode(google_crc32c.Checksum(data).digest()).decode('utf-8'),
+            'contentType': obj['metadata'].get('contentType', 'application/octet-stream'),
+        }
+        if obj['metadata'].get('contentEncoding') is not None:
+            metadata['contentEncoding'] = obj['metadata']['contentEncoding']
+        return metadata
+
+    def _put(self, bucket: str, metadata: Dict[str, Any], data: bytes, query: Dict[str, str]) -> Response:
+        name = metadata.get('name') or query['name']
+        with self.lock:
+            current = self.objects.get((bucket, name))
+            if 'ifGenerationMatch' in query and int(query['ifGenerationMatch']) != (0 if current is None else current['generation']):
+                return _json({'error': {'code': 412, 'message': 'Precondition Failed'}}, status=412)
+            self.objects[(bucket, name)] = {'data': data, 'metadata': metadata, 'generation': self.next_generation}
+            self.next_generation += 1
+            self.uploaded_bytes += len(data)
+            return _json(self._metadata(bucket, name))
+
+    def handler(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        parsed = urllib.parse.urlsplit(path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        headers = {k.lower(): v for k, v in headers.items()}
+
+        m = re.match(r'^/upload/storage/v1/b/([^/]+)/o$', parsed.path)
+        if m is not None and method == 'POST' and query.get('uploadType') == 'multipart':
+            boundary = re.search(r'boundary="?([^";]+)"?', headers['content-type']).group(1).encode('utf-8')
+            parts = body.split(b'--' + boundary)[1:3]
+            metadata, data = [p.partition(b'\r\n\r\n')[2][:-2] for p in parts]
+            return self._put(m.group(1), json.loads(metadata.decode('utf-8')), data, query)
+        if m is not None and method == 'POST' and query.get('uploadType') == 'resumable':
+            with self.lock:
+                upload_id = str(len(self.uploads) + 1)
+                self.uploads[upload_id] = {'bucket': m.group(1), 'metadata': json.loads(body or b'{}'), 'data': b'', 'query': query}
+            location = '{}{}?uploadType=resumable&upload_id={}'.format(self.server.url, parsed.path, upload_id)
+            return 200, {'Location': location}, b''
+        if m is not None and method == 'PUT' and 'upload_id' in query:
+            upload = self.uploads[query['upload_id']]
+            # NOTE: Content-Rangeは"bytes 0-262143/*", "bytes 262144-300000/300001", "bytes */300001"のいずれか
+            content_range = re.match(r'^bytes (\*|(\d+)-(\d+))/(\*|\d+)$', headers['content-range'])
+            if content_range.group(2) is not None:
+                upload['data'] = upload['data'][:int(content_range.group(2))] + body
+            total = content_range.group(4)
+            if total != '*' and len(upload['data']) == int(total):
+                return self._put(upload['bucket'], upload['metadata'], upload['data'], upload['query'])
+            res_headers = {'Range': 'bytes=0-{}'.format(len(upload['data']) - 1)} if len(upload['data']) > 0 else {}
+            return 308, res_headers, b''
+
+        m = re.match(r'^(/download)?/storage/v1/b/([^/]+)/o/([^/]+)$', parsed.path)
+        if m is not None and method == 'GET':
+            bucket, name = m.group(2), urllib.parse.unquote(m.group(3))
+            if (bucket, name) not in self.objects:
+                return _json({'error': {'code': 404, 'message': 'No such object: {}'.format(name)}}, status=404)
+            if query.get('alt') == 'media':
+                metadata = self._metadata(bucket, name)
+                x_goog_hash = 'crc32c={},md5={}'.format(metadata['crc32c'], metadata['md5Hash'])
+                return 200, {'X-Goog-Hash': x_goog_hash, 'X-Goog-Generation': metadata['generation']}, self.objects[(bucket, name)]['data']
+            return _json(self._metadata(bucket, name))
+        if m is not None and method == 'DELETE' and m.group(1) is None:
+            with self.lock:
+                if self.objects.pop((m.group(2), urllib.parse.unquote(m.group(3))), None) is None:
+                    return _json({'error': {'code': 404, 'message': 'not found'}}, status=404)
+            return 204, {}, b''
+
+        m = re.match(r'^/storage/v1/b/([^/]+)$', parsed.path)
+        if m is not None:
+            return _json({'kind': 'storage#bucket', 'name': m.group(1)})
+        return _json({'error': {'code': 404, 'message': 'not found'}}, status=404)
+
+
+def _with_latency(config: ProviderConfig, handler, counts: Dict[str, int], name: str):
+    '''応答に遅延を加え, リクエスト数を数える
+    '''
+    def wrapped(method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        counts[name] += 1
+        if config.latency_ms > 0:
+            time.sleep(config.latency_ms / 1000)
+        return handler(method, path, headers, body)
+    return wrapped
+
+
+def _serve(config: Dict[str, Any], conn: Any) -> None:
+    '''子プロセスで各プロバイダのサーバを起動し, 親プロセスからの指示(stats, stop)に応答する
+    '''
+    provider_config = ProviderConfig(**config)
+    counts = {name: 0 for name in PROVIDERS}
+    gcs = FakeGcs()
+    servers: Dict[str, FakeServer] = {}
+    servers['fitbit'] = FakeServer(_with_latency(provider_config, fitbit_handler(provider_config), counts, 'fitbit'))
+    servers['health_planet'] = FakeServer(_with_latency(provider_config, health_planet_handler(provider_config), counts, 'health_planet'))
+    # NOTE: 実績画像のurlにサーバ自身のurlを使用するため, 起動前にhandlerを差し替える
+    servers['twitter'] = FakeServer(None)
+    servers['twitter'].handler = _with_latency(provider_config, twitter_handler(provider_config, servers['twitter']), counts, 'twitter')
+    servers['gcs'] = FakeServer(_with_latency(provider_config, gcs.handler, counts, 'gcs'))
+    gcs.server = servers['gcs']
+    for server in servers.values():
+        server.__enter__()
+        # NOTE: 長時間の計測でリクエストボディを保持し続けないよう, 記録は使用しない
+        server.requests = _Discard()
+    try:
+        conn.send({name: server.url for name, server in servers.items()})
+        while True:
+            command = conn.recv()
+            if command == 'stats':
+                conn.send({'requests': dict(counts), 'gcs_objects': len(gcs.objects), 'gcs_uploaded_bytes': gcs.uploaded_bytes})
+            elif command == 'reset':
+                gcs.reset()
+                for name in counts:
+                    counts[name] = 0
+                conn.send(True)
+            else:
+                break
+    finally:
+        for server in servers.values():
+            server.__exit__(None, None, None)
+
+
+class _Discard(list):
+    '''追加した要素を保持しないlist
+    '''
+
+    def append(self, item: Any) -> None:
+        pass
+
+
+class FakeProviders:
+    '''Fitbit, Health Planet, Twitter, gcsを再現するサーバを子プロセスで起動する
+
+    計測するプロセスのメモリ使用量にサーバの分を含めないよう, サーバは別のプロセスで動かす
+    '''
+
+    def __init__(self, config: Optional[ProviderConfig] = None) -> None:
+        '''
+        Args:
+            config (Optional[ProviderConfig], optional): サーバの設定, Noneならば既定値とする. Defaults to None.
+        '''
+        self.config = config if config is not None else ProviderConfig()
+        self.urls: Dict[str, str] = {}
+        self._conn: Any = None
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+
+    def __enter__(self) -> 'FakeProviders':
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(asdict(self.config), child_conn), daemon=True)
+        self._process.start()
+        self.urls = self._conn.recv()
+        return self
+
+    def stats(self) -> Dict[str, Any]:
+        '''サーバごとのリクエスト数と, gcsに格納したオブジェクト数・転送されたバイト数を返す
+        '''
+        self._conn.send('stats')
+        return self._conn.recv()
+
+    def reset(self) -> None:
+        '''gcsに格納したオブジェクトとリクエスト数を破棄する
+        '''
+        self._conn.send('reset')
+        self._conn.recv()
+
+    def __exit__(self, *exc) -> None:
+        self._conn.send('stop')
+        self._process.join(timeout=10)
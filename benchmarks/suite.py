@@ -0,0 +1,367 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from benchmarks.fake_providers import FakeProviders, ProviderConfig
+
+# 出力するjsonの形式のバージョン
+RESULT_VERSION = 1
+
+# main.runの保存先, gcsはローカルで起動したgcsのサーバとする
+STORAGES = ('gcs', 'local', 'memory')
+
+
+@dataclass
+class BenchmarkConfig:
+    '''ベンチマークの設定
+
+    Attributes:
+        provider (ProviderConfig): ローカルで起動する各プロバイダのサーバの設定
+        repeat (int): ケースごとに計測する回数
+        max_workers (int): main.runなどに与える並行数
+        compression (Optional[str]): main.runで保存するjsonの圧縮形式
+        low_memory (bool): main.runを省メモリで実行するか
+        storage (str): main.runの保存先("gcs", "local", "memory")
+    '''
+    provider: ProviderConfig = field(default_factory=ProviderConfig)
+    repeat: int = 5
+    max_workers: int = 4
+    compression: Optional[str] = None
+    low_memory: bool = False
+    storage: str = 'gcs'
+
+
+# ケースの定義, (各回の前に実行する準備, 計測する処理)を返す関数
+Case = Callable[[BenchmarkConfig, Dict[str, str]], Tuple[Callable[[], None], Callable[[], None]]]
+
+
+def _yesterday() -> str:
+    from src.dates import yesterday_str
+
+    return yesterday_str()
+
+
+def _fitbit(urls: Dict[str, str], config: BenchmarkConfig) -> Any:
+    from src.fitbit import Fitbit
+    from src.transport import HttpTransport
+
+    return Fitbit(
+        client_id='bench_client_id',
+        client_secret='bench_client_secret',
+        access_token='bench_access_token',
+        api_base=urls['fitbit'],
+        transport=HttpTransport(max_connections_per_host=config.max_workers)
+    )
+
+
+def case_fitbit_fetch_trace_data(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''運動・食事・睡眠の1日分のデータを順に取得する
+    '''
+    fb = _fitbit(urls, config)
+    day_str = _yesterday()
+
+    def run() -> None:
+        for category in ['activities', 'foods', 'sleep']:
+            fb.fetch_trace_data(category, day_str)
+    return (lambda: None), run
+
+
+def case_fitbit_fetch_trace_data_range(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''運動・食事・睡眠の30日分のデータを期間を指定して取得する
+    '''
+    fb = _fitbit(urls, config)
+    to_date = datetime.date.fromisoformat(_yesterday())
+    from_date = (to_date - datetime.timedelta(days=29)).isoformat()
+
+    def run() -> None:
+        for category in ['activities', 'foods', 'sleep']:
+            fb.fetch_trace_data_range(category, from_date, to_date.isoformat())
+    return (lambda: None), run
+
+
+def case_fitbit_sync_body_logs(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''30日分の体重と体脂肪率をFitbitに記録する
+    '''
+    from src.fitbit import BodyLogEntry
+
+    fb = _fitbit(urls, config)
+    to_date = datetime.date.fromisoformat(_yesterday())
+    entries = [
+        BodyLogEntry(body_type, 70.0, (to_date - datetime.timedelta(days=i)).isoformat(), '07:12:00')
+        for i in range(30) for body_type in ['weight', 'fat']
+    ]
+    return (lambda: None), (lambda: fb.sync_body_logs(entries, max_workers=config.max_workers))
+
+
+def case_health_planet_fetch_body_composition_data(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''1日分の体組成データを取得する
+    '''
+    from src.health_planet import HealthPlanet
+    from src.transport import HttpTransport
+
+    hp = HealthPlanet(access_token='bench_access_token', transport=HttpTransport(), api_base=urls['health_planet'])
+    day_str = _yesterday()
+    return (lambda: None), (lambda: hp.fetch_body_composition_data(day_str, day_str))
+
+
+def case_twitter_search_ringfitadventure_results(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''リングフィットの実績画像を検索する
+    '''
+    from src.transport import HttpTransport
+    from src.twitter import Twitter
+
+    tw = Twitter('bench_user_id', 'bench_token', transport=HttpTransport(), api_base=urls['twitter'])
+    day_str = _yesterday()
+    return (lambda: None), (lambda: tw.search_ringfitadventure_results(day_str))
+
+
+def case_gcp_store_gcs_data(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''Fitbitの1日分と同程度のjsonをgcsへ転送する
+    '''
+    from src.gcp import store_gcs_data
+
+    data = json.dumps({'levels': ['x' * 64] * (config.provider.fitbit_payload_kb * 16)}).encode('utf-8')
+    return (lambda: None), (lambda: store_gcs_data(data, 'bench/store_gcs_data.json', content_type='application/json'))
+
+
+def case_main_run(config: BenchmarkConfig, urls: Dict[str, str]):
+    '''main.runを実行する, 各回の前にmanifestを削除し前日のデータが未保存の状態とする
+    '''
+    import main
+    from src.storage import GcsBackend, LocalBackend, MemoryBackend
+
+    # NOTE: ローカル環境(prj=None)として実行し, 接続情報はlocal.iniから読み込む
+    workdir = tempfile.mkdtemp(prefix='dieter-bench-')
+    with open(os.path.join(workdir, 'local.ini'), 'w') as f:
+        f.write('\n'.join([
+            '[HEALTH PLANET]', 'access-token = bench',
+            '[FITBIT]', 'client-id = bench', 'client-secret = bench', 'access-token = bench', 'refresh-token = bench',
+            '[TWITTER]', 'user-id = bench', 'escaped-bearer-token = bench',
+        ]) + '\n')
+    os.chdir(workdir)
+
+    build_clients = main._build_clients
+
+    def fake_build_clients(*args, **kwargs):
+        hp, fb, tw = build_clients(*args, **kwargs)
+        hp.api_base, fb.api_base, tw.api_base = urls['health_planet'], urls['fitbit'], urls['twitter']
+        return hp, fb, tw
+
+    # NOTE: gcsは従来どおりstorageを指定せずに実行し, ローカル環境のdataディレクトリにも保存する
+    if config.storage == 'local':
+        storage = LocalBackend(os.path.join(workdir, 'export_from_devices'))
+    elif config.storage == 'memory':
+        storage = MemoryBackend()
+    else:
+        storage = GcsBackend()
+
+    def prepare() -> None:
+        if storage.exists('manifest.json'):
+            storage.delete('manifest.json')
+
+    def run() -> None:
+        with mock.patch.object(main, '_build_clients', fake_build_clients):
+            main.run(
+                max_workers=config.max_workers,
+                compression=config.compression,
+                low_memory=config.low_memory,
+                storage=None if config.storage == 'gcs' else storage
+            )
+    return prepare, run
+
+
+CASES: Dict[str, Case] = {
+    'fitbit.fetch_trace_data': case_fitbit_fetch_trace_data,
+    'fitbit.fetch_trace_data_range': case_fitbit_fetch_trace_data_range,
+    'fitbit.sync_body_logs': case_fitbit_sync_body_logs,
+    'health_planet.fetch_body_composition_data': case_health_planet_fetch_body_composition_data,
+    'twitter.search_ringfitadventure_results': case_twitter_search_ringfitadventure_results,
+    'gcp.store_gcs_data': case_gcp_store_gcs_data,
+    'main.run': case_main_run,
+}
+
+
+def _max_rss_bytes() -> int:
+    '''プロセスの最大RSS(バイト)を返す
+    '''
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: ru_maxrssの単位はLinuxではKB, macOSではバイト
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _measure(name: str, config: BenchmarkConfig, urls: Dict[str, str]) -> Dict[str, Any]:
+    '''子プロセスで1つのケースを計測する
+
+    計測時間はtracemallocを止めた状態でrepeat回計測し, 確保したメモリの最大値は最後にもう1回実行して求める
+    '''
+    os.environ['STORAGE_EMULATOR_HOST'] = urls['gcs']
+    prepare, run = CASES[name](config, urls)
+
+    # NOTE: 接続やモジュールの読み込みを含めないよう, 1回実行してから計測する
+    prepare()
+    run()
+    seconds = []
+    for _ in range(config.repeat):
+        prepare()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+
+    prepare()
+    tracemalloc.start()
+    run()
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'repeat': config.repeat,
+        'wall_seconds': {
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+            'mean': statistics.mean(seconds),
+            'max': max(seconds),
+        },
+        'peak_alloc_bytes': peak_alloc,
+        'max_rss_bytes': _max_rss_bytes(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(config: Optional[BenchmarkConfig] = None, cases: Optional[List[str]] = None) -> Dict[str, Any]:
+    '''ローカルのサーバに対して各ケースを計測する
+
+    ケースごとに新しいプロセスで計測するため, max_rss_bytesは他のケースの影響を受けない
+
+    Args:
+        config (Optional[BenchmarkConfig], optional): ベンチマークの設定, Noneならば既定値とする. Defaults to None.
+        cases (Optional[List[str]], optional): CASESから計測するケースを選択, Noneならば全て. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: 計測結果, jsonに変換できる形式
+    '''
+    config = config if config is not None else BenchmarkConfig()
+    names = list(CASES) if cases is None else cases
+    if type(config.repeat) != int:
+        raise TypeError('"repeat" type must be int.')
+    if config.repeat < 1:
+        raise ValueError('"repeat" must be over 1.')
+    if not set(names) <= set(CASES):
+        raise ValueError('"cases" must be in {}.'.format(list(CASES)))
+    if config.storage not in STORAGES:
+        raise ValueError('"storage" must be in {}.'.format(list(STORAGES)))
+
+    results: Dict[str, Any] = {}
+    with FakeProviders(config.provider) as providers:
+        for name in names:
+            providers.reset()
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(_measure, name, config, providers.urls).result()
+            result.update(providers.stats())
+            results[name] = result
+            print('{}: median {:.3f}s, peak alloc {:.1f}MB, max rss {:.1f}MB'.format(
+                name, result['wall_seconds']['median'], result['peak_alloc_bytes'] / 2 ** 20, result['max_rss_bytes'] / 2 ** 20
+            ), file=sys.stderr)
+    return {
+        'version': RESULT_VERSION,
+        'commit': _git_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': asdict(config),
+        'results': results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.2) -> List[str]:
+    '''2つの計測結果を比較し, 実行時間の中央値もしくは最大RSSがthresholdの割合を超えて増えたケースを返す
+
+    Args:
+        baseline (Dict[str, Any]): 比較元の計測結果
+        current (Dict[str, Any]): 比較先の計測結果
+        threshold (float, optional): 悪化とみなす増加の割合. Defaults to 0.2.
+
+    Returns:
+        List[str]: 悪化したケースと指標の説明
+    '''
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        metrics = [
+            ('wall_seconds.median', base['wall_seconds']['median'], result['wall_seconds']['median']),
+            ('max_rss_bytes', base['max_rss_bytes'], result['max_rss_bytes']),
+        ]
+        for metric, before, after in metrics:
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append('{} {}: {:.6g} -> {:.6g} (+{:.1%})'.format(name, metric, before, after, (after - before) / before))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    '''コマンドラインから実行する
+
+    Returns:
+        int: 終了コード, baselineと比較して悪化したケースがあれば1
+    '''
+    parser = argparse.ArgumentParser(description='ローカルのサーバに対してmain.runと各クライアントの処理時間・メモリ使用量を計測する')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='各リクエストに応答するまでの遅延(ミリ秒)')
+    parser.add_argument('--fitbit-payload-kb', type=int, default=64, help='Fitbitの1日分のデータのサイズ(KB)')
+    parser.add_argument('--images', type=int, default=2, help='実績画像の枚数')
+    parser.add_argument('--image-kb', type=int, default=512, help='実績画像1枚のサイズ(KB)')
+    parser.add_argument('--repeat', type=int, default=5, help='ケースごとに計測する回数')
+    parser.add_argument('--max-workers', type=int, default=4, help='main.runなどに与える並行数')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='main.runで保存するjsonの圧縮形式')
+    parser.add_argument('--low-memory', action='store_true', help='main.runを省メモリで実行する')
+    parser.add_argument('--storage', choices=STORAGES, default='gcs', help='main.runの保存先')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None, help='計測するケース')
+    parser.add_argument('--output', default=None, help='計測結果(json)の出力先, 未指定ならば標準出力')
+    parser.add_argument('--baseline', default=None, help='比較する過去の計測結果(json)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='悪化とみなす増加の割合')
+    args = parser.parse_args(argv)
+
+    config = BenchmarkConfig(
+        provider=ProviderConfig(args.latency_ms, args.fitbit_payload_kb, args.images, args.image_kb),
+        repeat=args.repeat,
+        max_workers=args.max_workers,
+        compression=args.compression,
+        low_memory=args.low_memory,
+        storage=args.storage
+    )
+    result = run_suite(config, args.cases)
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, 'r') as f:
+        regressions = compare(json.load(f), result, args.threshold)
+    for r in regressions:
+        print('regression: ' + r, file=sys.stderr)
+    return 1 if len(regressions) > 0 else 0
@@ -1,170 +1,898 @@
-import configparser
+import datetime
 import json
 import os
+import threading
 import traceback
-import urllib.error
-import urllib.request
-from typing import Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple, Union
 
-import pandas as pd
-from google.cloud import secretmanager
-from pandas.tseries.offsets import DateOffset
-
-from src.fitbit import Fitbit
-from src.gcp import store_gcs
+from src.backfill import FITBIT_CATEGORIES, Checkpoint, WorkUnit, batch_work_units, plan_work_units
+from src.cassette import REDACTED, Cassette, RecordingTransport, ReplayTransport
+from src.codec import compress, validate_compression
+from src.dates import now_jst, today_jst, yesterday_str
+from src.fitbit import RANGE_MAX_DAYS as FITBIT_RANGE_MAX_DAYS
+from src.fitbit import BodyLogEntry, BodyLogSyncResult, Fitbit
+from src.gcp import UploadResult, md5_base64
+from src.health_planet import RANGE_MAX_DAYS as HEALTH_PLANET_RANGE_MAX_DAYS
 from src.health_planet import HealthPlanet
+from src.manifest import HashingReader, Manifest
+from src.memory import MemoryMonitor, PayloadLimiter
+from src.response_cache import ResponseCache
+from src.retry import CircuitBreaker, RetryPolicy
+from src.secret import INI_OPTIONS, IniSecretProvider, SecretManagerProvider, SecretProvider
+from src.storage import GcsBackend, LocalBackend, StorageBackend, open_storage
+from src.tracing import OtlpExporter, Tracer, propagate, span
+from src.transport import HttpTransport
 from src.twitter import Twitter
 
+# 画像をgcsへ転送する際に1度に読み込むサイズ(256KBの倍数)
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+# 接続情報のうち認証情報ではなく, リクエストのurlに含むためcassetteに記録するもの
+CASSETTE_VALUES = ('tw-user-id',)
+
+# 実行環境ごとの接続情報の取得元, warm startの間は取得した値を保持する
+_secret_providers: Dict[Optional[str], SecretProvider] = {}
+_secret_providers_lock = threading.Lock()
+
 
 def main(event, context) -> None:
     '''cloud functions上で実行
     '''
     # GCP_PROJECT = os.getenv('GCP_PROJECT') <- python3.7のみ
     GCP_PROJECT = 'dieter-329006'
-    run(GCP_PROJECT)
+    # NOTE: 割り当てたメモリ(cloudbuild.yamlの--memory)が少ないため, 環境変数DIETER_LOW_MEMORY=1で省メモリで実行する
+    run(GCP_PROJECT, low_memory=os.getenv('DIETER_LOW_MEMORY') == '1')
 
 
-def run(prj: Union[None, str] = None) -> None:
+def run(
+    prj: Union[None, str] = None,
+    max_workers: int = 4,
+    keep_local: bool = False,
+    use_manifest: bool = True,
+    skip_if_identical: bool = False,
+    response_cache_dir: Optional[str] = None,
+    compression: Optional[str] = None,
+    low_memory: bool = False,
+    trace_allocations: bool = False,
+    record_to: Optional[str] = None,
+    replay_from: Optional[str] = None,
+    replay_latency: float = 0.0,
+    storage: Union[None, str, StorageBackend] = None
+) -> None:
     '''実行日の前日の健康データを各APIから取得・更新しgcsへデータを保存する(ローカル環境で実行する場合はこちら)
 
     Args:
         prj (Union[None, str], optional): 関数を実行する環境，未入力(None)ならばローカルとする.
+        max_workers (int, optional): 取得・転送を並行して実行するスレッド数, 1ならば逐次実行する. Defaults to 4.
+        keep_local (bool, optional): ローカル環境でgcsへの転送後もdataディレクトリのファイルを残すか. Defaults to False.
+        use_manifest (bool, optional): gcsのmanifestを参照し保存済みのデータを取得・転送しないか. Defaults to True.
+        skip_if_identical (bool, optional): 取得したデータが格納済みのオブジェクトと同一ならばgcsへ転送しないか. Defaults to False.
+        response_cache_dir (Optional[str], optional): Fitbitのレスポンスをキャッシュするディレクトリ, Noneならばキャッシュしない.
+        compression (Optional[str], optional): jsonの圧縮形式("gzip", "zstd"), Noneならば圧縮しない.
+            パスは変えずにContent-Encodingを設定するため, src.codecの関数で圧縮形式によらず読み込める.
+        low_memory (bool, optional): 取得したデータを保持する処理を1件ずつ実行し, 処理を終えるたびにメモリを解放するか.
+            取得以外(Twitterの検索など)は並行して実行する. Defaults to False.
+        trace_allocations (bool, optional): tracemallocで段階ごとにpythonのオブジェクトに割り当てたメモリも計測するか,
+            処理が遅くなるため調査時のみ使用する. Defaults to False.
+        record_to (Optional[str], optional): 各APIと実績画像のリクエストとレスポンスを認証情報を伏せて記録するcassetteのパス.
+        replay_from (Optional[str], optional): 各APIと実績画像へリクエストせず, レスポンスを再生するcassetteのパス.
+            接続情報は取得せず, 記録した日付のデータを記録した時刻に実行したものとして取得する.
+            storageを指定しなければ"memory://"へ保存し, manifestは参照しない(use_manifest=False).
+        replay_latency (float, optional): cassetteを再生する際に各レスポンスを返すまでに待機する時間(秒). Defaults to 0.0.
+        storage (Union[None, str, StorageBackend], optional): データとmanifestの保存先, "gs://バケット名", "file://ディレクトリ",
+            "memory://"もしくはStorageBackend. Noneならばgcsのバケットexport_from_devicesとし,
+            ローカル環境ではdataディレクトリにも保存する. Defaults to None.
+    '''
+    # 引数max_workersの値確認
+    if type(max_workers) != int:
+        raise TypeError('"max_workers" type must be int.')
+    if max_workers < 1:
+        raise ValueError('"max_workers" must be over 1.')
+    if record_to is not None and replay_from is not None:
+        raise ValueError('"record_to" and "replay_from" cannot be specified at the same time.')
+
+    # cassetteの記録・再生
+    if replay_from is not None:
+        cassette: Optional[Cassette] = Cassette(replay_from).load()
+        if storage is None:
+            # NOTE: 再生したデータで本番のバケットとmanifestを上書きしないよう, 保存先を指定しなければメモリ上に保存する
+            storage, use_manifest = 'memory://', False
+    elif record_to is not None:
+        cassette = Cassette(record_to, meta={'day': yesterday_str(), 'recorded_at': now_jst().isoformat()})
+    else:
+        cassette = None
+
+    # 段階ごとの処理時間・転送量・メモリ使用量を記録し, 終了時に1件の構造化ログとして出力する
+    memory = MemoryMonitor(use_tracemalloc=trace_allocations)
+    tracer = Tracer(memory=memory)
+    try:
+        with memory, tracer.span('run', env='local' if prj is None else 'GCP', max_workers=max_workers, low_memory=low_memory):
+            _run(
+                prj, max_workers, keep_local, use_manifest, skip_if_identical, response_cache_dir, compression, low_memory,
+                cassette, replay_from is not None, replay_latency, storage
+            )
+    finally:
+        _emit_trace(tracer)
+
+
+def _run(
+    prj: Union[None, str],
+    max_workers: int,
+    keep_local: bool,
+    use_manifest: bool,
+    skip_if_identical: bool,
+    response_cache_dir: Optional[str],
+    compression: Optional[str],
+    low_memory: bool,
+    cassette: Optional[Cassette] = None,
+    replay: bool = False,
+    replay_latency: float = 0.0,
+    storage: Union[None, str, StorageBackend] = None
+) -> None:
+    '''runの引数を確認した後の処理, cassetteは記録先(replayならば再生するもの)とし, 他の引数はrunと同じ
     '''
     # 設定
     print('project env: {}'.format('local' if prj is None else 'GCP'))
-    additional_path = '' if prj is None else '/tmp/'
-    day = pd.Timestamp.today(tz='Asia/Tokyo') - DateOffset(days=1)
-    day_str = day.strftime('%Y-%m-%d')
-
-    # 一時的にファイルを保存するディレクトリを用意(cloud functions限定)
-    if prj is not None:
-        os.makedirs('/tmp/data/health_planet/', exist_ok=True)
-        os.makedirs('/tmp/data/fitbit/activities/', exist_ok=True)
-        os.makedirs('/tmp/data/fitbit/foods/', exist_ok=True)
-        os.makedirs('/tmp/data/fitbit/sleep/', exist_ok=True)
-        os.makedirs('/tmp/data/ring_fit_adventure/', exist_ok=True)
+    retry_policy = RetryPolicy()
+    backend = _build_storage(storage, retry_policy)
+    with span('manifest.load', enabled=use_manifest):
+        manifest = Manifest(storage=backend).load() if use_manifest else None
+    output = _Output(
+        local_dir='data' if prj is None and storage is None else None,
+        keep_local=keep_local,
+        manifest=manifest,
+        skip_if_identical=skip_if_identical,
+        retry_policy=retry_policy,
+        compression=compression,
+        storage=backend
+    )
+    day_str = yesterday_str() if cassette is None else cassette.meta['day']
 
     # secret managerから値を取得
-    if prj is None:
-        ini_path = './local.ini'
-        config_ini = configparser.ConfigParser()
-        config_ini.read(ini_path, encoding='utf-8')
-        api_connect_values = {
-            'hp-access-token': config_ini.get('HEALTH PLANET', 'access-token'),
-            'fb-client-id': config_ini.get('FITBIT', 'client-id'),
-            'fb-client-secret': config_ini.get('FITBIT', 'client-secret'),
-            'fb-access-token': config_ini.get('FITBIT', 'access-token'),
-            'fb-refresh-token': config_ini.get('FITBIT', 'refresh-token'),
-            'tw-user-id': config_ini.get('TWITTER', 'user-id'),
-            'tw-beare-token': config_ini.get('TWITTER', 'escaped-bearer-token')
-        }
+    if replay:
+        # NOTE: cassetteの認証情報は伏せてあるため接続情報を取得せず, 再取得したトークンも保存しない
+        # NOTE: 再生時の時刻では有効期限を判断できないため, 有効期限は不明(事前に更新しない)とする
+        api_connect_values = {k: cassette.meta.get(k, REDACTED) for k in INI_OPTIONS}
+        api_connect_values['fb-expires-at'] = ''
+        save_tokens: Callable[[Fitbit], None] = lambda fb: None  # noqa: E731
     else:
-        secret_manager_client = secretmanager.SecretManagerServiceClient()
-        api_connect_values = {}
-        for k in ['hp-access-token', 'fb-client-id', 'fb-client-secret', 'fb-access-token', 'fb-refresh-token', 'tw-user-id', 'tw-beare-token']:
-            name = secret_manager_client.secret_version_path(prj, k, 'latest')
-            response = secret_manager_client.access_secret_version(request={'name': name})
-            api_connect_values[k] = response.payload.data.decode('utf-8')
-
-    # Health Planetから体組成データを取得
-    hp = HealthPlanet(
-        access_token=api_connect_values['hp-access-token']
-    )
-    body_compositions = hp.fetch_body_composition_data(day_str, day_str)
+        with span('secrets.load'):
+            api_connect_values, save_tokens = _load_api_connect_values(prj)
+        if cassette is not None:
+            cassette.meta.update({k: api_connect_values[k] for k in CASSETTE_VALUES})
 
-    # 体組成データを保存
-    hp_path = additional_path + 'data/health_planet/{}.json'.format(day_str)
-    with open(hp_path, 'w') as jsonfile:
-        jsonfile.write(json.dumps(body_compositions))
+    # 各APIのクライアントで接続と再送・遮断の方針を共有するHttpTransportを使用する
+    transport = _build_transport(max_workers, output.retry_policy, cassette, replay, replay_latency)
+    response_cache = ResponseCache(response_cache_dir) if response_cache_dir is not None else None
+    hp, fb, tw = _build_clients(api_connect_values, transport, save_tokens, response_cache)
+    if replay:
+        # NOTE: 取得できる期間は記録した時刻を基準に確認する
+        recorded_at = datetime.datetime.fromisoformat(cassette.meta['recorded_at'])
+        hp.now = tw.now = lambda: recorded_at
 
-    # 体組成データをgcsへ転送
-    try:
-        store_gcs(hp_path, 'health_planet/{}.json'.format(day_str))
-        os.remove(hp_path)
-    except Exception:
-        print(traceback.format_exc())
+    # 依存関係のない取得・転送を並行して実行する
+    # NOTE: Fitbitへの体組成データの転送のみHealth Planetの取得結果とFitbitの取得(トークンの更新)を待つ
+    # NOTE: manifestに記録済みのデータは再実行(Pub/Subの再配信など)でも取得・転送しない
+    # NOTE: 他のスレッドで実行する処理のスパンをrunの子として記録するため, propagateで包んでsubmitする
+    # NOTE: 省メモリの場合は取得したデータを保持する処理を1件ずつ実行し, 次の処理を開始する前にメモリを解放する
+    limiter = PayloadLimiter(max_in_flight=1) if low_memory else None
 
-    # Fitbitから運動・食事・睡眠データを取得し保存，転送
-    fb = Fitbit(
-        client_id=api_connect_values['fb-client-id'],
-        client_secret=api_connect_values['fb-client-secret'],
-        access_token=api_connect_values['hp-access-token'],
-        refresh_token=api_connect_values['fb-refresh-token']
-    )
-    for c in ['activities', 'foods', 'sleep']:
-        # 取得
-        try:
-            data = fb.fetch_trace_data(c, day_str)
-        except urllib.error.HTTPError:
-            print('execute method "refresh_access_token"')
-            fb.refresh_access_token()
-            if prj is None:
-                # 実行環境がローカルであればiniファイルを上書き
-                config_ini.set('FITBIT', 'access-token', fb.access_token)
-                config_ini.set('FITBIT', 'refresh-token', fb.refresh_token)
-                with open(ini_path, 'w') as f:
-                    config_ini.write(f)
+    def stage(fn: Callable[..., Any]) -> Callable[..., Any]:
+        return propagate(fn if limiter is None else limiter.wrap(fn))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hp_future = None
+        if not output.is_stored(WorkUnit('health_planet', 'body_composition', day_str)):
+            hp_future = executor.submit(stage(_store_health_planet), hp, day_str, output)
+        elif prj is not None:
+            # NOTE: 転送済みでもFitbitへの体組成データの転送は中断している可能性があるため, 取得のみ再実行する
+            # NOTE: Fitbitに記録済みの値はsync_body_logsで記録しない
+            print('health planet data is already stored. fetch it again to sync body logs.')
+            hp_future = executor.submit(stage(hp.fetch_body_composition_data), day_str, day_str)
+        else:
+            print('health planet data is already stored.')
+        fb_futures = [
+            executor.submit(stage(_store_fitbit_trace_data), fb, c, day_str, output)
+            for c in FITBIT_CATEGORIES
+            if not output.is_stored(WorkUnit('fitbit', c, day_str))
+        ]
+        tw_future = executor.submit(propagate(_search_ring_fit_adventure_figures), tw, day_str)
+
+        # Twitterからリングフィットの実績画像URLを取得し画像ごとに転送
+        figure_futures = []
+        figure_urls = _result(tw_future)
+        if figure_urls is None:
+            pass
+        elif len(figure_urls) > 0:
+            figure_futures = [
+                executor.submit(stage(_store_ring_fit_adventure_figure), u, day_str, output, transport)
+                for u in figure_urls
+            ]
+        else:
+            print('ringfitadventures results are nothing.')
+
+        # Fitbitに体組成データの転送
+        body_compositions = None if hp_future is None else _result(hp_future)
+        for f in fb_futures:
+            _result(f)
+        if prj is not None and body_compositions is not None:
+            body_compositions_data = body_compositions['data']
+            if len(body_compositions_data) > 0:
+                _result(executor.submit(propagate(_sync_body_logs), fb, body_compositions_data, max_workers))
             else:
-                # 実行環境がcloud functions上であればsecretに新たなveersionを追加
-                # NOTE: 現時点の最新versionを停止した後に再取得したトークンの値をsecretに追加する
-                tmp_values = {
-                    'fb-access-token': fb.access_token,
-                    'fb-refresh-token': fb.refresh_token
-                }
-                for k in ['fb-access-token', 'fb-refresh-token']:
-                    name = secret_manager_client.secret_version_path(prj, k, 'latest')
-                    v_response = secret_manager_client.get_secret_version(request={'name': name})
-                    response = secret_manager_client.disable_secret_version(request={'name': v_response.name})
-                    parent = secret_manager_client.secret_path(prj, k)
-                    response = secret_manager_client.add_secret_version(
-                        request={'parent': parent, 'payload': {'data': tmp_values[k].encode('utf-8')}}
-                    )
-            data = fb.fetch_trace_data(c, day_str)
+                print('body compositions is empty.')
+
+        for f in figure_futures:
+            _result(f)
+    transport.close()
+    if cassette is not None and not replay:
+        cassette.save()
+    output.commit_manifest()
+    _close_response_cache(response_cache)
+
+
+def backfill(
+    from_date: str,
+    to_date: str,
+    prj: Union[None, str] = None,
+    max_workers: int = 4,
+    checkpoint_path: str = './backfill_checkpoint.json',
+    sources: Optional[List[str]] = None,
+    keep_local: bool = False,
+    use_manifest: bool = True,
+    skip_if_identical: bool = False,
+    fitbit_range: bool = False,
+    health_planet_range: bool = True,
+    response_cache_dir: Optional[str] = None,
+    compression: Optional[str] = None,
+    storage: Union[None, str, StorageBackend] = None
+) -> None:
+    '''指定した期間の健康データを各APIから取得しgcsへ保存する, 中断した場合はチェックポイントから再開する
+
+    Args:
+        from_date (str): バックフィルの開始日, "yyyy-mm-dd"形式で入力
+        to_date (str): バックフィルの終了日, "yyyy-mm-dd"形式で入力, 実行日の前日まで指定可能
+        prj (Union[None, str], optional): 関数を実行する環境，未入力(None)ならばローカルとする.
+        max_workers (int, optional): 作業単位を並行して実行するスレッド数. Defaults to 4.
+        checkpoint_path (str, optional): 完了した作業単位を記録するファイルのパス. Defaults to './backfill_checkpoint.json'.
+        sources (Optional[List[str]], optional): "health_planet", "fitbit", "ring_fit_adventure"から対象を選択, Noneならば全て.
+        keep_local (bool, optional): ローカル環境でgcsへの転送後もdataディレクトリのファイルを残すか. Defaults to False.
+        use_manifest (bool, optional): gcsのmanifestを参照し保存済みの作業単位を取得・転送しないか. Defaults to True.
+        skip_if_identical (bool, optional): 取得したデータが格納済みのオブジェクトと同一ならばgcsへ転送しないか. Defaults to False.
+        fitbit_range (bool, optional): Fitbitは連続した日付をまとめて期間を指定するエンドポイントで取得するか,
+            日ごとのデータはsummaryの主な項目のみとなるため"fitbit_range"の作業単位として別のパスへ保存する. Defaults to False.
+        health_planet_range (bool, optional): Health Planetは連続した日付をまとめて1回のリクエストで取得するか. Defaults to True.
+        response_cache_dir (Optional[str], optional): Fitbitのレスポンスをキャッシュするディレクトリ, Noneならばキャッシュしない.
+            確定期間より前の日付は再実行してもリクエストしない.
+        compression (Optional[str], optional): jsonの圧縮形式("gzip", "zstd"), Noneならば圧縮しない.
+        storage (Union[None, str, StorageBackend], optional): データとmanifestの保存先, runと同じ. Defaults to None.
+    '''
+    # 引数max_workersの値確認
+    if type(max_workers) != int:
+        raise TypeError('"max_workers" type must be int.')
+    if max_workers < 1:
+        raise ValueError('"max_workers" must be over 1.')
+
+    # 作業単位の列挙
+    # NOTE: Health Planetは3ヶ月, Twitterは7日より前の日付を取得できないため作業単位から除外する
+    today = today_jst()
+    units = plan_work_units(from_date, to_date, today, sources)
+    if fitbit_range:
+        # NOTE: 期間を指定して取得したデータは1日分のエンドポイントの内容を含まないため, 別の作業単位として記録する
+        units = [WorkUnit('fitbit_range', u.category, u.date) if u.source == 'fitbit' else u for u in units]
+    checkpoint = Checkpoint(checkpoint_path)
+    retry_policy = RetryPolicy()
+    backend = _build_storage(storage, retry_policy)
+    manifest = Manifest(storage=backend).load() if use_manifest else None
+    output = _Output(
+        local_dir='data' if prj is None and storage is None else None,
+        keep_local=keep_local,
+        manifest=manifest,
+        skip_if_identical=skip_if_identical,
+        retry_policy=retry_policy,
+        compression=compression,
+        storage=backend
+    )
+    # NOTE: 実績画像は日付ごとに枚数が異なるため, manifestでは画像ごとに保存済みか確認する
+    pending_units = [
+        u for u in units
+        if not checkpoint.is_done(u) and (u.source == 'ring_fit_adventure' or not output.is_stored(u))
+    ]
+    print('backfill: {} units, {} pending'.format(len(units), len(pending_units)))
+
+    # 設定
+    api_connect_values, save_tokens = _load_api_connect_values(prj)
+    # 各APIのクライアントで接続と再送・遮断の方針を共有するHttpTransportを使用する
+    transport = _build_transport(max_workers, output.retry_policy)
+    response_cache = ResponseCache(response_cache_dir) if response_cache_dir is not None else None
+    hp, fb, tw = _build_clients(api_connect_values, transport, save_tokens, response_cache)
+
+    # NOTE: 連続した日付を1回のリクエスト(Fitbitはリソースごと)にまとめ, レート制限の消費を抑える
+    max_days = {}
+    if fitbit_range:
+        max_days['fitbit_range'] = FITBIT_RANGE_MAX_DAYS
+    if health_planet_range:
+        max_days['health_planet'] = HEALTH_PLANET_RANGE_MAX_DAYS
+    batches = batch_work_units(pending_units, max_days)
+
+    def process(batch: List[WorkUnit]) -> None:
+        '''作業単位をまとめて取得・転送し，成功すればチェックポイントに記録する
+        '''
+        unit = batch[0]
+        if unit.source == 'health_planet' and health_planet_range:
+            _store_health_planet_range(hp, [u.date for u in batch], output, strict=True)
+        elif unit.source == 'health_planet':
+            _store_health_planet(hp, unit.date, output, strict=True)
+        elif unit.source == 'fitbit_range':
+            _store_fitbit_trace_data_range(fb, unit.category, [u.date for u in batch], output, strict=True)
+        elif unit.source == 'fitbit':
+            _store_fitbit_trace_data(fb, unit.category, unit.date, output, strict=True)
+        else:
+            for u in tw.search_ringfitadventure_results(unit.date, unit.date):
+                _store_ring_fit_adventure_figure(u, unit.date, output, transport, strict=True)
+        for u in batch:
+            checkpoint.mark_done(u)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process, b) for b in batches]
+        for f in futures:
+            _result(f)
+    transport.close()
+    output.commit_manifest()
+    _close_response_cache(response_cache)
+    failed_count = sum(len(b) for b, f in zip(batches, futures) if f.exception() is not None)
+    print('backfill: {} units failed'.format(failed_count))
+    print('fitbit rate limit remaining: {}'.format(fb.rate_limit.remaining))
+
+
+@dataclass
+class _Output:
+    '''取得したデータの保存先
+
+    Attributes:
+        local_dir (Optional[str]): ローカルに保存するディレクトリ, Noneならばファイルを経由せずメモリから直接転送する
+        keep_local (bool): 転送に成功した後もローカルのファイルを残すか
+        manifest (Optional[Manifest]): 転送したデータを記録するmanifest, Noneならば記録しない
+        skip_if_identical (bool): storeで同一のデータが格納済みならば転送しないか
+        retry_policy (Optional[RetryPolicy]): gcsへの転送で一時的な失敗を再送する方針, Noneならばクライアントの既定に従う
+        compression (Optional[str]): storeで保存するデータの圧縮形式("gzip", "zstd"), Noneならば圧縮しない
+        storage (Optional[StorageBackend]): 転送先, Noneならばgcsのバケットexport_from_devices(retry_policyで再送する)とする
+    '''
+    local_dir: Optional[str] = None
+    keep_local: bool = False
+    manifest: Optional[Manifest] = None
+    skip_if_identical: bool = False
+    retry_policy: Optional[RetryPolicy] = None
+    compression: Optional[str] = None
+    storage: Optional[StorageBackend] = None
+
+    def __post_init__(self) -> None:
+        validate_compression(self.compression)
+        if self.storage is None:
+            self.storage = GcsBackend(retry_policy=self.retry_policy)
+        self._local = LocalBackend(self.local_dir) if self.local_dir is not None else None
+
+    def is_stored(self, unit: WorkUnit, gcs_path: Optional[str] = None) -> bool:
+        '''作業単位(gcs_pathを指定した場合はそのパス)のデータがmanifestに記録済みか確認する
+
+        Args:
+            unit (WorkUnit): 作業単位
+            gcs_path (Optional[str], optional): 転送先のパス. Defaults to None.
+
+        Returns:
+            bool: 記録済みであればTrue, manifestを使用しない場合は常にFalse
+        '''
+        if self.manifest is None:
+            return False
+        if gcs_path is None:
+            return self.manifest.contains(unit)
+        return self.manifest.contains_object(gcs_path)
+
+    def commit_manifest(self) -> None:
+        '''記録したデータをgcsのmanifestに反映する
+        '''
+        if self.manifest is None:
+            return
+        with span('manifest.commit') as s:
+            committed = self.manifest.commit()
+            s.set(committed=committed)
+        if not committed:
+            print('manifest was not committed due to conflicts.')
+
+    def store(
+        self,
+        data: bytes,
+        gcs_path: str,
+        content_type: str,
+        strict: bool = False,
+        unit: Optional[WorkUnit] = None
+    ) -> Optional[UploadResult]:
+        '''データをstorageへ転送する, local_dirが指定されていればローカルにも保存する
+
+        compressionが指定されていれば, ローカルのファイルと転送先のオブジェクトは同じパスのまま圧縮したデータとする
+
+        Args:
+            data (bytes): 保存するデータ
+            gcs_path (str): 転送先のパス, ローカルではlocal_dirからの相対パスとする
+            content_type (str): 保存するデータのContent-Type
+            strict (bool, optional): Trueならば転送に失敗した際に例外を送出する. Defaults to False.
+            unit (Optional[WorkUnit], optional): manifestに記録する作業単位, Noneならば記録しない. Defaults to None.
+
+        Returns:
+            Optional[UploadResult]: 転送結果, 転送に失敗した場合はNone(strictがFalseの場合)
+        '''
+        # 圧縮
+        data, content_encoding = compress(data, self.compression)
 
         # 保存
-        fb_path = additional_path + 'data/fitbit/{}/{}.json'.format(c, day_str)
-        with open(fb_path, 'w') as jsonfile:
-            jsonfile.write(json.dumps(data))
+        if self._local is not None:
+            self._local.put(data, gcs_path)
 
         # 転送
-        fb_gcs_path = 'fitbit/{}/{}.json'.format(c, day_str)
+        # NOTE: cloud functionsの/tmpはメモリを消費するため, ファイルに書き出さずメモリ上のデータを転送する
         try:
-            store_gcs(fb_path, fb_gcs_path)
-            os.remove(fb_path)
+            with span('storage.put', path=gcs_path, bytes=len(data)) as s:
+                result = self.storage.put(
+                    data,
+                    gcs_path,
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    skip_if_identical=self.skip_if_identical
+                )
+                s.set(result=result.status)
+            if result.status == 'skipped':
+                print('{} is identical to the stored object.'.format(gcs_path))
+            if self.manifest is not None and unit is not None:
+                self.manifest.record(unit, gcs_path, len(data), md5_base64(data))
+            if self._local is not None and not self.keep_local:
+                self._local.delete(gcs_path)
+            return result
         except Exception:
+            if strict:
+                raise
             print(traceback.format_exc())
+            return None
 
-    # Fitbitに体組成データの転送
-    if prj is not None:
-        body_compositions_data = body_compositions['data']
-        if len(body_compositions_data) > 0:
-            for i in body_compositions_data:
-                created_datetime = pd.to_datetime(i['date']).strftime('%Y-%m-%d %H:%M')
-                splited_created_datetime = created_datetime.split(' ')
-                fb.create_body_log(
-                    body_type='weight' if i['tag'] == '6021' else 'fat',
-                    value=float(i['keydata']),
-                    created_date=splited_created_datetime[0],
-                    created_time=splited_created_datetime[1] + ':00'
-                )
-        else:
-            print('body compositions is empty.')
-
-    # Twitterからリングフィットの実績画像URLを取得
-    tw = Twitter(api_connect_values['tw-user-id'], api_connect_values['tw-beare-token'])
-    figure_urls = tw.search_ringfitadventure_results(day_str)
-    if len(figure_urls) > 0:
-        for u in figure_urls:
-            figure_name = day_str + '_' + u.replace('https://pbs.twimg.com/media/', '')
-            figure_path = additional_path + 'data/ring_fit_adventure/' + figure_name
-            urllib.request.urlretrieve(u, figure_path)
-            try:
-                figure_gcs_path = 'ring_fit_adventure/' + figure_name
-                store_gcs(figure_path, figure_gcs_path)
-            except Exception:
-                print('figures are saved local folder.')
-    else:
-        print('ringfitadventures results are nothing.')
+    def store_stream(
+        self,
+        stream: IO[bytes],
+        gcs_path: str,
+        content_type: str,
+        strict: bool = False,
+        unit: Optional[WorkUnit] = None
+    ) -> None:
+        '''ストリームをMEDIA_CHUNK_SIZEずつ読み込みながらstorageへ転送する, local_dirが指定されていればローカルにも保存する
+
+        Args:
+            stream (IO[bytes]): 保存するデータのストリーム
+            gcs_path (str): 転送先のパス, ローカルではlocal_dirからの相対パスとする
+            content_type (str): 保存するデータのContent-Type
+            strict (bool, optional): Trueならば転送に失敗した際に例外を送出する. Defaults to False.
+            unit (Optional[WorkUnit], optional): manifestに記録する作業単位, Noneならば記録しない. Defaults to None.
+        '''
+        # NOTE: manifestに記録するサイズとmd5は読み込みながら求める
+        reader = HashingReader(stream)
+        try:
+            with span('storage.put', path=gcs_path) as s:
+                if self._local is None:
+                    # NOTE: データ全体をメモリやファイルに載せずに転送する
+                    self.storage.put(reader, gcs_path, content_type=content_type, chunk_size=MEDIA_CHUNK_SIZE)
+                    self._record(unit, gcs_path, reader)
+                    s.set(bytes=reader.size)
+                    return
+
+                # 保存
+                self._local.put(reader, gcs_path, chunk_size=MEDIA_CHUNK_SIZE)
+
+                # 転送
+                with self._local.open(gcs_path) as f:
+                    self.storage.put(f, gcs_path, content_type=content_type, chunk_size=MEDIA_CHUNK_SIZE)
+                self._record(unit, gcs_path, reader)
+                s.set(bytes=reader.size)
+                if not self.keep_local:
+                    self._local.delete(gcs_path)
+        except Exception:
+            if strict:
+                raise
+            print(traceback.format_exc())
+
+    def _record(self, unit: Optional[WorkUnit], gcs_path: str, reader: HashingReader) -> None:
+        '''読み込みながら転送したデータをmanifestに記録する
+        '''
+        if self.manifest is not None and unit is not None:
+            self.manifest.record(unit, gcs_path, reader.size, reader.md5)
+
+
+def _build_storage(storage: Union[None, str, StorageBackend], retry_policy: RetryPolicy) -> StorageBackend:
+    '''データとmanifestの保存先を返す
+
+    Args:
+        storage (Union[None, str, StorageBackend]): runのstorage, Noneならばgcsのバケットexport_from_devicesとする
+        retry_policy (RetryPolicy): gcsへの転送で一時的な失敗を再送する方針
+
+    Returns:
+        StorageBackend: 保存先
+    '''
+    if storage is None:
+        return GcsBackend(retry_policy=retry_policy)
+    if isinstance(storage, str):
+        return open_storage(storage, retry_policy=retry_policy)
+    return storage
+
+
+def _get_secret_provider(prj: Union[None, str]) -> SecretProvider:
+    '''実行環境に応じた接続情報の取得元を返す, warm startでは前回の実行で生成したものを使い回す
+
+    Args:
+        prj (Union[None, str]): 関数を実行する環境，Noneならばローカルとする.
+
+    Returns:
+        SecretProvider: 接続情報の取得元
+    '''
+    with _secret_providers_lock:
+        if prj not in _secret_providers:
+            ttl = float(os.getenv('DIETER_SECRET_TTL', '600'))
+            if prj is None:
+                _secret_providers[prj] = IniSecretProvider('./local.ini', ttl=ttl)
+            else:
+                _secret_providers[prj] = SecretManagerProvider(prj, ttl=ttl, bundle_secret=os.getenv('DIETER_SECRET_BUNDLE'))
+        return _secret_providers[prj]
+
+
+def _load_api_connect_values(prj: Union[None, str]) -> Tuple[Dict[str, str], Callable[[Fitbit], None]]:
+    '''各APIの接続情報を実行環境に応じてiniファイルもしくはsecret managerから取得する
+
+    Args:
+        prj (Union[None, str]): 関数を実行する環境，Noneならばローカルとする.
+
+    Returns:
+        Tuple[Dict[str, str], Callable[[Fitbit], None]]: 接続情報と, 再取得したFitbitのトークンを保存する関数
+    '''
+    provider = _get_secret_provider(prj)
+    api_connect_values = provider.get_many(list(INI_OPTIONS))
+
+    def save_tokens(fb: Fitbit) -> None:
+        '''再取得したFitbitのトークンを実行環境に応じて保存する(iniファイルの上書きもしくはsecretのversion追加)
+        '''
+        with span('secrets.save'):
+            # NOTE: secret`fb-expires-at`を作成していなくてもトークンは保存されるよう, 有効期限は最後に書き込む
+            provider.update({
+                'fb-access-token': fb.access_token,
+                'fb-refresh-token': fb.refresh_token,
+                'fb-expires-at': '' if fb.expires_at is None else '{:.0f}'.format(fb.expires_at)
+            })
+
+    return api_connect_values, save_tokens
+
+
+def _build_transport(
+    max_workers: int,
+    retry_policy: Optional[RetryPolicy],
+    cassette: Optional[Cassette] = None,
+    replay: bool = False,
+    replay_latency: float = 0.0
+) -> HttpTransport:
+    '''各APIのクライアントで共有するHttpTransportを生成する
+
+    Args:
+        max_workers (int): 並行して実行するスレッド数, 接続先ごとの接続数の上限とする
+        retry_policy (Optional[RetryPolicy]): 一時的な失敗を再送する方針
+        cassette (Optional[Cassette], optional): リクエストとレスポンスを記録するcassette. Defaults to None.
+        replay (bool, optional): cassetteに記録したレスポンスを再生するか. Defaults to False.
+        replay_latency (float, optional): 再生する際に各レスポンスを返すまでに待機する時間(秒). Defaults to 0.0.
+
+    Returns:
+        HttpTransport: 接続を使い回し, 障害が続く接続先へのリクエストは遮断するHttpTransport
+    '''
+    kwargs: Dict[str, Any] = dict(
+        max_connections_per_host=max_workers,
+        retry_policy=retry_policy,
+        circuit_breaker=CircuitBreaker()
+    )
+    if cassette is None:
+        return HttpTransport(**kwargs)
+    if replay:
+        return ReplayTransport(cassette, latency=replay_latency, **kwargs)
+    return RecordingTransport(cassette, **kwargs)
+
+
+def _build_clients(
+    api_connect_values: Dict[str, str],
+    transport: HttpTransport,
+    save_tokens: Callable[[Fitbit], None],
+    response_cache: Optional[ResponseCache] = None
+) -> Tuple[HealthPlanet, Fitbit, Twitter]:
+    '''接続情報から各APIのクライアントを生成する
+
+    Args:
+        api_connect_values (Dict[str, str]): 各APIの接続情報
+        transport (HttpTransport): 各クライアントで共有するHttpTransport
+        save_tokens (Callable[[Fitbit], None]): Fitbitのトークンを更新した際に保存する関数
+        response_cache (Optional[ResponseCache], optional): Fitbitのレスポンスのキャッシュ. Defaults to None.
+
+    Returns:
+        Tuple[HealthPlanet, Fitbit, Twitter]: 各APIのクライアント
+    '''
+    hp = HealthPlanet(
+        access_token=api_connect_values['hp-access-token'],
+        transport=transport
+    )
+    fb = Fitbit(
+        client_id=api_connect_values['fb-client-id'],
+        client_secret=api_connect_values['fb-client-secret'],
+        access_token=api_connect_values['fb-access-token'],
+        refresh_token=api_connect_values['fb-refresh-token'],
+        expires_at=float(api_connect_values['fb-expires-at']) if api_connect_values['fb-expires-at'] != '' else None,
+        transport=transport,
+        response_cache=response_cache,
+        on_token_refresh=save_tokens
+    )
+    tw = Twitter(api_connect_values['tw-user-id'], api_connect_values['tw-beare-token'], transport=transport)
+    return hp, fb, tw
+
+
+def _close_response_cache(response_cache: Optional[ResponseCache]) -> None:
+    '''レスポンスのキャッシュの使用状況を出力し, 保存期間と合計サイズの上限を超えたものを削除する
+
+    Args:
+        response_cache (Optional[ResponseCache]): レスポンスのキャッシュ, Noneならば何もしない
+    '''
+    if response_cache is None:
+        return
+    removed = response_cache.evict()
+    print('response cache: {} hits, {} revalidated, {} evicted'.format(
+        response_cache.hits, response_cache.revalidated, len(removed)
+    ))
+
+
+def _emit_trace(tracer: Tracer) -> None:
+    '''記録したスパンを構造化ログとして出力し, 環境変数DIETER_OTLP_ENDPOINTが指定されていればcollectorへ送信する
+
+    Args:
+        tracer (Tracer): 1回の実行のスパンを記録したTracer
+    '''
+    tracer.log()
+    endpoint = os.getenv('DIETER_OTLP_ENDPOINT')
+    if endpoint is None:
+        return
+    # NOTE: トレースの送信に失敗しても実行結果には影響させない
+    try:
+        OtlpExporter(endpoint, service_name=os.getenv('DIETER_OTLP_SERVICE_NAME', 'dieter')).export(tracer)
+    except Exception:
+        print(traceback.format_exc())
+
+
+def _result(future: Future) -> Any:
+    '''並行して実行したタスクの結果を取得する, 例外が送出された場合は出力してNoneを返す
+
+    Args:
+        future (Future): 実行したタスク
+
+    Returns:
+        Any: タスクの戻り値
+    '''
+    try:
+        return future.result()
+    except Exception:
+        print(traceback.format_exc())
+        return None
+
+
+def _store_health_planet(hp: HealthPlanet, day_str: str, output: _Output, strict: bool = False) -> Dict[str, Any]:
+    '''Health Planetから体組成データを取得し保存，gcsへ転送する
+
+    Args:
+        hp (HealthPlanet): Health Planetのクライアント
+        day_str (str): 取得する日付, "yyyy-mm-dd"
+        output (_Output): データの保存先
+        strict (bool, optional): Trueならばgcsへの転送に失敗した際に例外を送出する. Defaults to False.
+
+    Returns:
+        Dict[str, Any]: 体組成データ
+    '''
+    with span('health_planet.store', date=day_str):
+        # Health Planetから体組成データを取得
+        body_compositions = hp.fetch_body_composition_data(day_str, day_str)
+
+        # 体組成データを保存しgcsへ転送
+        output.store(
+            json.dumps(body_compositions).encode('utf-8'),
+            'health_planet/{}.json'.format(day_str),
+            'application/json',
+            strict=strict,
+            unit=WorkUnit('health_planet', 'body_composition', day_str)
+        )
+    return body_compositions
+
+
+def _store_health_planet_range(
+    hp: HealthPlanet,
+    dates: List[str],
+    output: _Output,
+    strict: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    '''Health Planetから連続した日付の体組成データを1回のリクエストで取得し, 測定日ごとに保存，gcsへ転送する
+
+    Args:
+        hp (HealthPlanet): Health Planetのクライアント
+        dates (List[str]): 取得する連続した日付, "yyyy-mm-dd"
+        output (_Output): データの保存先
+        strict (bool, optional): Trueならばgcsへの転送に失敗した際に例外を送出する. Defaults to False.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: 日付ごとの体組成データ
+    '''
+    # 取得
+    body_compositions = hp.fetch_body_composition_data_by_date(dates[0], dates[-1])
+
+    # 保存，転送
+    # NOTE: 日ごとのパスは1日分を取得した場合と同じとする
+    for day_str in dates:
+        output.store(
+            json.dumps(body_compositions[day_str]).encode('utf-8'),
+            'health_planet/{}.json'.format(day_str),
+            'application/json',
+            strict=strict,
+            unit=WorkUnit('health_planet', 'body_composition', day_str)
+        )
+    return body_compositions
+
+
+def _store_fitbit_trace_data(
+    fb: Fitbit,
+    category: str,
+    day_str: str,
+    output: _Output,
+    strict: bool = False
+) -> None:
+    '''Fitbitから運動・食事・睡眠のいずれかのデータを取得し保存，gcsへ転送する
+
+    Args:
+        fb (Fitbit): Fitbitのクライアント
+        category (str): "activities", "foods", "sleep"のいずれか
+        day_str (str): 取得する日付, "yyyy-mm-dd"
+        output (_Output): データの保存先
+        strict (bool, optional): Trueならばgcsへの転送に失敗した際に例外を送出する. Defaults to False.
+    '''
+    with span('fitbit.store', category=category, date=day_str):
+        # 取得
+        # NOTE: access_tokenの期限切れはFitbitクラスの中で更新し, 同時に更新が必要になった場合も1回にまとめる
+        # NOTE: 転送中に取得したdictを保持しないよう, jsonに変換したデータのみを残す
+        payload = json.dumps(fb.fetch_trace_data(category, day_str)).encode('utf-8')
+
+        # 保存，転送
+        fb_gcs_path = 'fitbit/{}/{}.json'.format(category, day_str)
+        output.store(
+            payload,
+            fb_gcs_path,
+            'application/json',
+            strict=strict,
+            unit=WorkUnit('fitbit', category, day_str)
+        )
+
+
+def _store_fitbit_trace_data_range(
+    fb: Fitbit,
+    category: str,
+    dates: List[str],
+    output: _Output,
+    strict: bool = False
+) -> None:
+    '''Fitbitから連続した日付のデータを期間を指定して取得し, 日ごとに保存，gcsへ転送する
+
+    日ごとのデータはsummaryの主な項目のみのため, 1日分のエンドポイントで取得したデータ("fitbit/")とは別のパスへ保存し,
+    manifestには"fitbit_range"の作業単位として記録する
+
+    Args:
+        fb (Fitbit): Fitbitのクライアント
+        category (str): "activities", "foods", "sleep"のいずれか
+        dates (List[str]): 取得する連続した日付, "yyyy-mm-dd"
+        output (_Output): データの保存先
+        strict (bool, optional): Trueならばgcsへの転送に失敗した際に例外を送出する. Defaults to False.
+    '''
+    # 取得
+    data = fb.fetch_trace_data_range(category, dates[0], dates[-1])
+
+    # 保存，転送
+    for day_str in dates:
+        output.store(
+            json.dumps(data[day_str]).encode('utf-8'),
+            'fitbit_range/{}/{}.json'.format(category, day_str),
+            'application/json',
+            strict=strict,
+            unit=WorkUnit('fitbit_range', category, day_str)
+        )
+
+
+def _to_body_log_entries(records: List[Dict[str, str]]) -> List[BodyLogEntry]:
+    '''Health Planetの体組成データをFitbitに記録する値へ変換する
+
+    Args:
+        records (List[Dict[str, str]]): Health Planetの体組成データのレコード
+
+    Returns:
+        List[BodyLogEntry]: Fitbitに記録する値
+    '''
+    # NOTE: 測定日時("yyyymmddHHMM")はAsia/Tokyoの時刻のため, 日時として解釈せず文字列を分割する
+    return [
+        BodyLogEntry(
+            body_type='weight' if r['tag'] == '6021' else 'fat',
+            value=float(r['keydata']),
+            date='{}-{}-{}'.format(r['date'][:4], r['date'][4:6], r['date'][6:8]),
+            time='{}:{}:00'.format(r['date'][8:10], r['date'][10:12])
+        )
+        for r in records
+    ]
+
+
+def _sync_body_logs(fb: Fitbit, records: List[Dict[str, str]], max_workers: int = 4) -> BodyLogSyncResult:
+    '''Health Planetの体組成データのうちFitbitに未記録のものを記録する
+
+    Args:
+        fb (Fitbit): Fitbitのクライアント
+        records (List[Dict[str, str]]): Health Planetの体組成データのレコード
+        max_workers (int, optional): 並行して記録する数. Defaults to 4.
+
+    Returns:
+        BodyLogSyncResult: 同期結果
+    '''
+    with span('fitbit.sync_body_logs', records=len(records)) as s:
+        result = fb.sync_body_logs(_to_body_log_entries(records), max_workers=max_workers)
+        s.set(created=len(result.created), skipped=len(result.skipped), failed=len(result.failed))
+    print('body logs: {} created, {} skipped, {} failed'.format(len(result.created), len(result.skipped), len(result.failed)))
+    for entry, error in result.failed:
+        print('failed to create body log {}: {!r}'.format(entry, error))
+    return result
+
+
+def _search_ring_fit_adventure_figures(tw: Twitter, day_str: str) -> List[str]:
+    '''Twitterからリングフィットの実績画像のurlを取得する
+
+    Args:
+        tw (Twitter): Twitterのクライアント
+        day_str (str): 実績の日付, "yyyy-mm-dd"
+
+    Returns:
+        List[str]: 実績画像のurl
+    '''
+    with span('twitter.search', date=day_str) as s:
+        figure_urls = tw.search_ringfitadventure_results(day_str)
+        s.set(figures=len(figure_urls))
+    return figure_urls
+
+
+def _store_ring_fit_adventure_figure(
+    url: str,
+    day_str: str,
+    output: _Output,
+    transport: HttpTransport,
+    strict: bool = False
+) -> None:
+    '''リングフィットの実績画像をpbs.twimg.comから読み込みながらgcsへ転送する
+
+    Args:
+        url (str): 実績画像のurl
+        day_str (str): 実績の日付, "yyyy-mm-dd"
+        output (_Output): データの保存先
+        transport (HttpTransport): 画像の取得に使用するHttpTransport
+        strict (bool, optional): Trueならばgcsへの転送に失敗した際に例外を送出する. Defaults to False.
+    '''
+    figure_name = day_str + '_' + url.rsplit('/', 1)[-1]
+    figure_gcs_path = 'ring_fit_adventure/' + figure_name
+    unit = WorkUnit('ring_fit_adventure', 'figure', day_str)
+    if output.is_stored(unit, figure_gcs_path):
+        print('{} is already stored.'.format(figure_gcs_path))
+        return
+    with span('ring_fit_adventure.store', path=figure_gcs_path), transport.stream('GET', url) as res:
+        output.store_stream(
+            res,
+            figure_gcs_path,
+            res.headers.get('Content-Type', 'application/octet-stream'),
+            strict=strict,
+            unit=unit
+        )
 
 
 if __name__ == '__main__':
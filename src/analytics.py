@@ -0,0 +1,245 @@
+import datetime
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.compaction import DATASETS, compact, partition_path
+
+# Health Planetのタグと列名の対応
+BODY_TYPE_COLUMNS = {'weight': 'weight', 'fat': 'body_fat'}
+
+
+def _validate_date(name: str, value: str) -> datetime.date:
+    '''日付の引数を確認しdateへ変換する
+    '''
+    if type(value) != str:
+        raise TypeError('"{}" type must be str.'.format(name))
+    if not re.search(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$', value):
+        raise ValueError('"{}" must be yyyy-mm-dd.'.format(name))
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _months(from_date: datetime.date, to_date: datetime.date) -> List[str]:
+    '''期間に含まれる月("yyyy-mm")を列挙する
+    '''
+    months = []
+    year, month = from_date.year, from_date.month
+    while (year, month) <= (to_date.year, to_date.month):
+        months.append('{:04d}-{:02d}'.format(year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class HealthHistory:
+    '''保存済みの健康データを列指向のDataFrameとして読み込み, 時系列の指標をベクトル演算で求める
+
+    compactionで月ごとにまとめたparquetファイルを読み込み, 読み込んだ月と期間はファイルが更新されるまで保持する
+    期間はmax_cached_ranges件まで保持し, 超えた場合は最も長く参照していないものから破棄する
+    '''
+
+    def __init__(
+        self,
+        root: str = 'data',
+        compacted_dir: Optional[str] = None,
+        auto_compact: bool = False,
+        max_cached_ranges: int = 32
+    ) -> None:
+        '''
+        Args:
+            root (str, optional): バケットと同じ構成のディレクトリ. Defaults to 'data'.
+            compacted_dir (Optional[str], optional): parquetファイルのディレクトリ, Noneならばroot/compactedとする. Defaults to None.
+            auto_compact (bool, optional): Trueならば読み込む前に日次のjsonファイルをparquetファイルにまとめる. Defaults to False.
+            max_cached_ranges (int, optional): 読み込み結果を保持する期間の数の上限. Defaults to 32.
+        '''
+        # 引数max_cached_rangesの値確認
+        if type(max_cached_ranges) != int:
+            raise TypeError('"max_cached_ranges" type must be int.')
+        if max_cached_ranges < 1:
+            raise ValueError('"max_cached_ranges" must be over 1.')
+        self.root = root
+        self.compacted_dir = compacted_dir if compacted_dir is not None else os.path.join(root, 'compacted')
+        self.auto_compact = auto_compact
+        self.max_cached_ranges = max_cached_ranges
+        self._lock = threading.Lock()
+        self._month_cache: Dict[Tuple[str, str], Tuple[int, pd.DataFrame]] = {}
+        self._range_cache: 'OrderedDict[Tuple[str, datetime.date, datetime.date], Tuple[Tuple[int, ...], pd.DataFrame]]' = OrderedDict()
+
+    def _read_month(self, dataset_name: str, month: str) -> Tuple[int, Optional[pd.DataFrame]]:
+        '''1ヶ月分のparquetファイルを読み込む, ファイルが更新されていなければ保持しているものを返す
+
+        Returns:
+            Tuple[int, Optional[pd.DataFrame]]: ファイルの更新時刻(存在しなければ0)と読み込んだデータ
+        '''
+        import pyarrow.parquet as pq
+
+        dataset = next(d for d in DATASETS if d.name == dataset_name)
+        path = os.path.join(self.compacted_dir, partition_path(dataset, month))
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return 0, None
+        cached = self._month_cache.get((dataset_name, month))
+        if cached is not None and cached[0] == mtime:
+            return cached
+        frame = pq.read_table(path).to_pandas()
+        frame['date'] = pd.to_datetime(frame['date'])
+        self._month_cache[(dataset_name, month)] = (mtime, frame)
+        return mtime, frame
+
+    def load(self, dataset_name: str, from_date: str, to_date: str) -> pd.DataFrame:
+        '''期間内のデータを読み込む
+
+        Args:
+            dataset_name (str): "health_planet", "fitbit_activities", "fitbit_foods", "fitbit_sleep"などsrc.compaction.DATASETSのnameのいずれか
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            pd.DataFrame: 期間内のデータ, date列は日付(datetime64). 保持しているものの複製のため変更してもよい
+        '''
+        # 引数の値確認
+        if dataset_name not in [d.name for d in DATASETS]:
+            raise ValueError('"dataset_name" must be in {}.'.format([d.name for d in DATASETS]))
+        start = _validate_date('from_date', from_date)
+        end = _validate_date('to_date', to_date)
+        if start > end:
+            raise ValueError('"to_date" is greater than "from_date".')
+
+        if self.auto_compact:
+            compact(self.root, self.compacted_dir, sources=[dataset_name])
+
+        with self._lock:
+            months = [self._read_month(dataset_name, m) for m in _months(start, end)]
+            signature = tuple(mtime for mtime, _ in months)
+            key = (dataset_name, start, end)
+            cached = self._range_cache.get(key)
+            if cached is not None and cached[0] == signature:
+                self._range_cache.move_to_end(key)
+                return cached[1].copy()
+
+            frames = [f for _, f in months if f is not None]
+            if len(frames) == 0:
+                frame = pd.DataFrame({'date': pd.Series([], dtype='datetime64[ns]')})
+            else:
+                frame = pd.concat(frames, ignore_index=True)
+                mask = (frame['date'] >= pd.Timestamp(start)) & (frame['date'] <= pd.Timestamp(end))
+                frame = frame.loc[mask].sort_values('date', kind='stable').reset_index(drop=True)
+            self._range_cache[key] = (signature, frame)
+            self._range_cache.move_to_end(key)
+            while len(self._range_cache) > self.max_cached_ranges:
+                self._range_cache.popitem(last=False)
+            return frame.copy()
+
+    def clear_cache(self) -> None:
+        '''保持している読み込み結果を破棄する
+        '''
+        with self._lock:
+            self._month_cache.clear()
+            self._range_cache.clear()
+
+    def _daily_index(self, from_date: str, to_date: str) -> pd.DatetimeIndex:
+        return pd.date_range(from_date, to_date, freq='D', name='date')
+
+    def body_composition(self, from_date: str, to_date: str) -> pd.DataFrame:
+        '''日ごとの体重と体脂肪率を返す, 1日に複数回測定した場合は最後の測定値とする
+
+        Args:
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            pd.DataFrame: 日付をindexとし, weightとbody_fatを列とする(測定のない日はNaN)
+        '''
+        readings = self.load('health_planet', from_date, to_date)
+        index = self._daily_index(from_date, to_date)
+        if len(readings) == 0:
+            return pd.DataFrame(np.nan, index=index, columns=list(BODY_TYPE_COLUMNS.values()))
+        readings = readings.sort_values('measured_at', kind='stable')
+        daily = readings.pivot_table(index='date', columns='body_type', values='value', aggfunc='last')
+        daily = daily.rename(columns=BODY_TYPE_COLUMNS).reindex(columns=list(BODY_TYPE_COLUMNS.values()))
+        daily.columns.name = None
+        return daily.reindex(index)
+
+    def rolling_average(self, from_date: str, to_date: str, window: int = 7) -> pd.DataFrame:
+        '''体重と体脂肪率の移動平均を返す, 期間の開始日より前のwindow日分も計算に含める
+
+        Args:
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+            window (int, optional): 移動平均をとる日数. Defaults to 7.
+
+        Returns:
+            pd.DataFrame: 日付をindexとし, weightとbody_fatの移動平均を列とする
+        '''
+        # 引数windowの値確認
+        if type(window) != int:
+            raise TypeError('"window" type must be int.')
+        if window < 1:
+            raise ValueError('"window" must be over 1.')
+
+        start = _validate_date('from_date', from_date)
+        warmup_from = (start - datetime.timedelta(days=window - 1)).strftime('%Y-%m-%d')
+        daily = self.body_composition(warmup_from, to_date)
+        return daily.rolling(window, min_periods=1).mean().loc[from_date:]
+
+    def weekly_delta(self, from_date: str, to_date: str) -> pd.DataFrame:
+        '''体重と体脂肪率の週平均と前週からの差分を返す, 週は月曜日から日曜日とする
+
+        Args:
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            pd.DataFrame: 週の最終日をindexとし, weight, body_fat, weight_delta, body_fat_delta を列とする
+        '''
+        weekly = self.body_composition(from_date, to_date).resample('W-SUN').mean()
+        deltas = weekly.diff().add_suffix('_delta')
+        return pd.concat([weekly, deltas], axis=1)
+
+    def calorie_balance(self, from_date: str, to_date: str) -> pd.DataFrame:
+        '''日ごとの摂取カロリーと消費カロリーの収支(摂取 - 消費)を返す
+
+        Args:
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            pd.DataFrame: 日付をindexとし, calories_in, calories_out, balanceを列とする(いずれかが欠けた日はbalanceがNaN)
+        '''
+        index = self._daily_index(from_date, to_date)
+        foods = self.load('fitbit_foods', from_date, to_date)
+        activities = self.load('fitbit_activities', from_date, to_date)
+        calories_in = foods.set_index('date')['calories'] if len(foods) > 0 else pd.Series(dtype=float)
+        calories_out = activities.set_index('date')['calories_out'] if len(activities) > 0 else pd.Series(dtype=float)
+        balance = pd.DataFrame({
+            'calories_in': calories_in.astype(float).reindex(index),
+            'calories_out': calories_out.astype(float).reindex(index),
+        }, index=index)
+        balance['balance'] = balance['calories_in'] - balance['calories_out']
+        return balance
+
+    def sleep_efficiency(self, from_date: str, to_date: str) -> pd.DataFrame:
+        '''日ごとの睡眠時間, 就床時間と睡眠効率(睡眠時間 / 就床時間 * 100)を返す, 昼寝などを含む全ての睡眠記録を合計する
+
+        Args:
+            from_date (str): 期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            pd.DataFrame: 日付をindexとし, minutes_asleep, time_in_bed, efficiencyを列とする
+        '''
+        index = self._daily_index(from_date, to_date)
+        sleep = self.load('fitbit_sleep', from_date, to_date)
+        if len(sleep) == 0:
+            return pd.DataFrame(np.nan, index=index, columns=['minutes_asleep', 'time_in_bed', 'efficiency'])
+        totals = sleep.groupby('date')[['minutes_asleep', 'time_in_bed']].sum().astype(float).reindex(index)
+        in_bed = totals['time_in_bed'].to_numpy()
+        asleep = totals['minutes_asleep'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            totals['efficiency'] = np.where(in_bed > 0, asleep / in_bed * 100, np.nan)
+        return totals
@@ -0,0 +1,147 @@
+import datetime
+import json
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from src.dates import subtract_months
+
+# 各APIが遡って取得できる日数の上限
+HEALTH_PLANET_LOOKBACK_MONTHS = 3
+TWITTER_LOOKBACK_DAYS = 7
+FITBIT_CATEGORIES = ['activities', 'foods', 'sleep']
+
+
+class WorkUnit(NamedTuple):
+    '''バックフィルにおける1回の取得・転送の単位
+    '''
+    source: str
+    category: str
+    date: str
+
+    @property
+    def key(self) -> str:
+        '''チェックポイントに記録する際のキー
+        '''
+        return '{}/{}/{}'.format(self.source, self.category, self.date)
+
+
+class Checkpoint:
+    '''完了した作業単位をjsonファイルに記録し，中断したバックフィルを再開できるようにする
+    '''
+
+    def __init__(self, path: str) -> None:
+        '''
+        Args:
+            path (str): チェックポイントを保存するファイルのパス, 存在すれば完了済みの作業単位を読み込む
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        self._done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._done = set(json.load(f)['done'])
+
+    def is_done(self, unit: WorkUnit) -> bool:
+        '''作業単位が完了済みか確認する
+
+        Args:
+            unit (WorkUnit): 作業単位
+
+        Returns:
+            bool: 完了済みであればTrue
+        '''
+        return unit.key in self._done
+
+    def mark_done(self, unit: WorkUnit) -> None:
+        '''作業単位を完了済みとして記録する
+
+        Args:
+            unit (WorkUnit): 作業単位
+        '''
+        with self._lock:
+            self._done.add(unit.key)
+            # NOTE: 書き込み途中で中断してもファイルが壊れないよう一時ファイルから置き換える
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'done': sorted(self._done)}, f)
+            os.replace(tmp_path, self.path)
+
+
+def plan_work_units(
+    from_date: str,
+    to_date: str,
+    today: datetime.date,
+    sources: Optional[List[str]] = None
+) -> List[WorkUnit]:
+    '''期間内の作業単位を各APIが遡れる上限の範囲で列挙する
+
+    Args:
+        from_date (str): バックフィルの開始日, "yyyy-mm-dd"形式で入力
+        to_date (str): バックフィルの終了日, "yyyy-mm-dd"形式で入力
+        today (datetime.date): 実行日(Asia/Tokyo)
+        sources (Optional[List[str]], optional): 対象とするデータソース, Noneならば全て. Defaults to None.
+
+    Returns:
+        List[WorkUnit]: 日付順に並べた作業単位
+    '''
+    # 引数の型確認とフォーマット確認
+    for name, value in [('from_date', from_date), ('to_date', to_date)]:
+        if type(value) != str:
+            raise TypeError('"{}" type must be str.'.format(name))
+        if not re.search(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$', value):
+            raise ValueError('"{}" must be yyyy-mm-dd.'.format(name))
+    start = datetime.date.fromisoformat(from_date)
+    end = datetime.date.fromisoformat(to_date)
+    if start > end:
+        raise ValueError('"to_date" is greater than "from_date".')
+    if end >= today:
+        raise ValueError('"to_date" must be before today.')
+    if sources is None:
+        sources = ['health_planet', 'fitbit', 'ring_fit_adventure']
+
+    # 各APIが遡れる上限の日付
+    hp_limit = subtract_months(today, HEALTH_PLANET_LOOKBACK_MONTHS)
+    tw_limit = today - datetime.timedelta(days=TWITTER_LOOKBACK_DAYS)
+
+    units = []
+    d = start
+    while d <= end:
+        d_str = d.isoformat()
+        if 'health_planet' in sources and d > hp_limit:
+            units.append(WorkUnit('health_planet', 'body_composition', d_str))
+        if 'fitbit' in sources:
+            units.extend(WorkUnit('fitbit', c, d_str) for c in FITBIT_CATEGORIES)
+        if 'ring_fit_adventure' in sources and d > tw_limit:
+            units.append(WorkUnit('ring_fit_adventure', 'figure', d_str))
+        d += datetime.timedelta(days=1)
+    return units
+
+
+def batch_work_units(units: List[WorkUnit], max_days: Dict[str, int]) -> List[List[WorkUnit]]:
+    '''期間を指定して取得できるデータソースの作業単位を, 連続した日付ごとにまとめる
+
+    Args:
+        units (List[WorkUnit]): 作業単位
+        max_days (Dict[str, int]): まとめるデータソースと, 1回で取得できる日数の上限
+
+    Returns:
+        List[List[WorkUnit]]: 1回で取得する作業単位の一覧, max_daysにないデータソースは1件ずつとする
+    '''
+    batches: List[List[WorkUnit]] = []
+    runs: Dict[Tuple[str, str], List[WorkUnit]] = {}
+    for unit in sorted(units, key=lambda u: (u.source, u.category, u.date)):
+        if unit.source not in max_days:
+            batches.append([unit])
+            continue
+        key = (unit.source, unit.category)
+        run = runs.get(key)
+        if run is not None:
+            last = datetime.date.fromisoformat(run[-1].date)
+            if datetime.date.fromisoformat(unit.date) == last + datetime.timedelta(days=1) and len(run) < max_days[unit.source]:
+                run.append(unit)
+                continue
+        runs[key] = [unit]
+        batches.append(runs[key])
+    return batches
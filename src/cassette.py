@@ -0,0 +1,347 @@
+import base64
+import contextlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from src.codec import compress, load_file
+from src.transport import HttpTransport
+
+# 伏せた値の代わりに記録する文字列
+REDACTED = 'REDACTED'
+
+# 値を伏せるクエリパラメータとjsonのキー(認証情報)
+_SECRET_KEYS = frozenset(['access_token', 'refresh_token', 'client_secret', 'code', 'token', 'id_token'])
+
+# 記録しないレスポンスヘッダ(接続ごとの値や再生に不要なもの)
+_DROPPED_HEADERS = frozenset(['set-cookie', 'date', 'connection', 'keep-alive', 'transfer-encoding', 'server'])
+
+# cassetteの形式のバージョン
+CASSETTE_VERSION = 1
+
+
+class CassetteMissError(LookupError):
+    '''再生するリクエストがcassetteに記録されていない
+    '''
+
+
+def redact_url(url: str) -> str:
+    '''urlのクエリのうち認証情報の値を伏せる
+
+    Args:
+        url (str): リクエストしたurl
+
+    Returns:
+        str: 認証情報をREDACTEDに置き換えたurl, 記録と再生で同じurlとなる
+    '''
+    parsed = urllib.parse.urlsplit(url)
+    if not parsed.query:
+        return url
+    params = [
+        (k, REDACTED if k.lower() in _SECRET_KEYS else v)
+        for k, v in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+    ]
+    query = urllib.parse.urlencode(params, safe='', quote_via=urllib.parse.quote)
+    return urllib.parse.urlunsplit((parsed.scheme, parsed.netloc, parsed.path, query, parsed.fragment))
+
+
+def redact_body(body: bytes) -> bytes:
+    '''jsonのレスポンスボディのうち認証情報(トークンのエンドポイントの応答など)の値を伏せる
+
+    Args:
+        body (bytes): レスポンスボディ
+
+    Returns:
+        bytes: 認証情報をREDACTEDに置き換えたボディ, jsonのオブジェクトでなければそのまま返す
+    '''
+    if not body.lstrip().startswith(b'{'):
+        return body
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except ValueError:
+        return body
+    secret_keys = [k for k in payload if k.lower() in _SECRET_KEYS]
+    if not secret_keys:
+        return body
+    for k in secret_keys:
+        payload[k] = REDACTED
+    return json.dumps(payload).encode('utf-8')
+
+
+@dataclass
+class Interaction:
+    '''記録したリクエスト1回分のレスポンス
+
+    Attributes:
+        method (str): HTTPメソッド
+        url (str): 認証情報を伏せたリクエストしたurl
+        status (int): ステータスコード
+        headers (List[Tuple[str, str]]): レスポンスヘッダ
+        body (bytes): 認証情報を伏せたレスポンスボディ
+        elapsed (float): リクエストしてからボディを読み終えるまでの時間(秒)
+        final_url (Optional[str]): リダイレクトした場合のリダイレクト先のurl
+    '''
+    method: str
+    url: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    elapsed: float = 0.0
+    final_url: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''jsonに変換できる形式にする, ボディはutf-8で表せればそのまま, そうでなければbase64で記録する
+        '''
+        record: Dict[str, Any] = {
+            'method': self.method,
+            'url': self.url,
+            'status': self.status,
+            'headers': [list(h) for h in self.headers],
+            'elapsed': round(self.elapsed, 6),
+        }
+        if self.final_url is not None:
+            record['final_url'] = self.final_url
+        try:
+            record['text'] = self.body.decode('utf-8')
+        except UnicodeDecodeError:
+            record['base64'] = base64.b64encode(self.body).decode('ascii')
+        return record
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> 'Interaction':
+        '''to_dictで変換したものから復元する
+        '''
+        if 'text' in record:
+            body = record['text'].encode('utf-8')
+        else:
+            body = base64.b64decode(record['base64'])
+        return cls(
+            record['method'],
+            record['url'],
+            record['status'],
+            [(k, v) for k, v in record['headers']],
+            body,
+            record.get('elapsed', 0.0),
+            record.get('final_url')
+        )
+
+    def message(self) -> http.client.HTTPMessage:
+        '''レスポンスヘッダをhttp.client.HTTPMessageとして返す
+        '''
+        message = http.client.HTTPMessage()
+        for k, v in self.headers:
+            message[k] = v
+        return message
+
+
+class CassetteResponse(io.BytesIO):
+    '''cassetteから再生(もしくは記録時に読み込み済み)のレスポンス, http.client.HTTPResponseと同様に読み込める
+    '''
+
+    def __init__(self, url: str, status: int, headers: http.client.HTTPMessage, body: bytes) -> None:
+        super().__init__(body)
+        self.url = url
+        self.status = status
+        self.headers = headers
+
+
+@dataclass
+class Cassette:
+    '''リクエストとレスポンスの組をgzipで圧縮したjsonとして保存する
+
+    再生時は(メソッド, url)ごとに記録した順に返し, 全て返した後は最後のレスポンスを繰り返す
+
+    Attributes:
+        path (str): 保存先のファイルのパス
+        meta (Dict[str, Any]): 記録した日付などの付加情報
+        interactions (List[Interaction]): 記録したレスポンス
+    '''
+    path: str
+    meta: Dict[str, Any] = field(default_factory=dict)
+    interactions: List[Interaction] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+        self._queues: Optional[Dict[Tuple[str, str], Deque[Interaction]]] = None
+
+    def load(self) -> 'Cassette':
+        '''保存したファイルを読み込む
+
+        Returns:
+            Cassette: 読み込んだcassette(自身)
+        '''
+        payload = load_file(self.path)
+        if payload.get('version') != CASSETTE_VERSION:
+            raise ValueError('unsupported cassette version: {}'.format(payload.get('version')))
+        with self._lock:
+            self.meta = payload.get('meta', {})
+            self.interactions = [Interaction.from_dict(r) for r in payload['interactions']]
+            self._queues = None
+        return self
+
+    def save(self) -> None:
+        '''記録したレスポンスをファイルに保存する
+        '''
+        with self._lock:
+            payload = {
+                'version': CASSETTE_VERSION,
+                'meta': self.meta,
+                'interactions': [i.to_dict() for i in self.interactions],
+            }
+        data, _ = compress(json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'gzip')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def record(self, interaction: Interaction) -> None:
+        '''レスポンスを記録する
+
+        Args:
+            interaction (Interaction): 記録するレスポンス
+        '''
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def play(self, method: str, url: str) -> Interaction:
+        '''リクエストに対応する記録したレスポンスを返す
+
+        Args:
+            method (str): HTTPメソッド
+            url (str): リクエストするurl(認証情報を含んでもよい)
+
+        Returns:
+            Interaction: 記録したレスポンス
+        '''
+        key = (method, redact_url(url))
+        with self._lock:
+            if self._queues is None:
+                self._queues = {}
+                for i in self.interactions:
+                    self._queues.setdefault((i.method, i.url), deque()).append(i)
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMissError('{} {} is not recorded in {}'.format(method, key[1], self.path))
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+
+class RecordingTransport(HttpTransport):
+    '''実際に送信したリクエストとレスポンスを, 認証情報を伏せてcassetteに記録するHttpTransport
+
+    レスポンスボディは記録するため読み込んでから返す(再送した場合は失敗したレスポンスも順に記録する)
+    '''
+
+    def __init__(self, cassette: Cassette, **kwargs: Any) -> None:
+        '''
+        Args:
+            cassette (Cassette): 記録先のcassette
+            **kwargs: HttpTransportの引数
+        '''
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    @contextlib.contextmanager
+    def _follow(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes],
+        max_redirects: int
+    ) -> Iterator[CassetteResponse]:
+        started = time.perf_counter()
+        try:
+            with super()._follow(method, url, headers, data, max_redirects) as res:
+                body = res.read()
+                response = CassetteResponse(res.url, res.status, res.headers, body)
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            self._record(method, url, e.code, e.headers, body, started, None)
+            raise urllib.error.HTTPError(e.url, e.code, e.msg, e.headers, io.BytesIO(body))
+        self._record(method, url, res.status, res.headers, body, started, res.url)
+        yield response
+
+    def _record(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        headers: http.client.HTTPMessage,
+        body: bytes,
+        started: float,
+        final_url: Optional[str]
+    ) -> None:
+        '''認証情報を伏せてcassetteに記録する
+        '''
+        self.cassette.record(Interaction(
+            method,
+            redact_url(url),
+            status,
+            [(k, v) for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS],
+            redact_body(body),
+            time.perf_counter() - started,
+            redact_url(final_url) if final_url is not None and final_url != url else None
+        ))
+
+
+class ReplayTransport(HttpTransport):
+    '''cassetteに記録したレスポンスを送信せずに返すHttpTransport
+
+    記録したステータスコードが400以上であればHttpTransportと同様にurllib.error.HTTPErrorを送出する
+    '''
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        latency: float = 0.0,
+        latency_scale: float = 0.0,
+        **kwargs: Any
+    ) -> None:
+        '''
+        Args:
+            cassette (Cassette): 再生するcassette
+            latency (float, optional): 各レスポンスを返すまでに待機する時間(秒). Defaults to 0.0.
+            latency_scale (float, optional): 記録した時間にこの値を掛けた時間をlatencyに加えて待機する,
+                1.0ならば記録した時と同じ時間となる. Defaults to 0.0.
+            **kwargs: HttpTransportの引数
+        '''
+        for name, value in [('latency', latency), ('latency_scale', latency_scale)]:
+            if type(value) not in (int, float):
+                raise TypeError('"{}" type must be float.'.format(name))
+            if value < 0:
+                raise ValueError('"{}" must be over 0.'.format(name))
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.latency = latency
+        self.latency_scale = latency_scale
+
+    @contextlib.contextmanager
+    def _follow(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes],
+        max_redirects: int
+    ) -> Iterator[CassetteResponse]:
+        interaction = self.cassette.play(method, url)
+        delay = self.latency + self.latency_scale * interaction.elapsed
+        if delay > 0:
+            time.sleep(delay)
+        message = interaction.message()
+        if interaction.status >= 400:
+            raise urllib.error.HTTPError(
+                url, interaction.status, http.client.responses.get(interaction.status, ''), message, io.BytesIO(interaction.body)
+            )
+        yield CassetteResponse(interaction.final_url or url, interaction.status, message, interaction.body)
@@ -0,0 +1,140 @@
+import gzip
+import json
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+from src.gcp import get_storage_client
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+# 保存するデータの圧縮形式, Noneは圧縮しない
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+# 圧縮形式ごとのデータの先頭のバイト列
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def validate_compression(compression: Optional[str]) -> None:
+    '''圧縮形式がCOMPRESSIONSのいずれかであるか確認する
+
+    Args:
+        compression (Optional[str]): 圧縮形式
+    '''
+    if compression is not None and type(compression) != str:
+        raise TypeError('"compression" type must be str.')
+    if compression not in COMPRESSIONS:
+        raise ValueError('"compression" must be in {}.'.format(list(COMPRESSIONS)))
+
+
+def compress(data: bytes, compression: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    '''データを圧縮し, gcsのオブジェクトに設定するContent-Encodingとともに返す
+
+    同じデータからは常に同じバイト列を生成するため, 圧縮後のmd5で格納済みのオブジェクトと比較できる
+
+    Args:
+        data (bytes): 圧縮するデータ
+        compression (Optional[str], optional): "gzip", "zstd"のいずれか, Noneならば圧縮しない. Defaults to None.
+
+    Returns:
+        Tuple[bytes, Optional[str]]: 圧縮したデータとContent-Encoding(圧縮しない場合はNone)
+    '''
+    validate_compression(compression)
+    if compression == 'gzip':
+        # NOTE: ヘッダに圧縮した時刻を含めないようmtimeを固定する
+        return gzip.compress(data, compresslevel=6, mtime=0), 'gzip'
+    if compression == 'zstd':
+        # NOTE: zstandardは任意の依存パッケージのため, 使用する時に読み込む
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=10).compress(data), 'zstd'
+    return data, None
+
+
+def decompress(data: bytes, content_encoding: Optional[str] = None) -> bytes:
+    '''compressで圧縮したデータを展開する, 圧縮していないデータはそのまま返す
+
+    Args:
+        data (bytes): 展開するデータ
+        content_encoding (Optional[str], optional): オブジェクトのContent-Encoding, Noneならばデータの先頭から判別する.
+            Defaults to None.
+
+    Returns:
+        bytes: 展開したデータ
+    '''
+    if content_encoding is None:
+        if data.startswith(_GZIP_MAGIC):
+            content_encoding = 'gzip'
+        elif data.startswith(_ZSTD_MAGIC):
+            content_encoding = 'zstd'
+    if content_encoding == 'gzip':
+        return gzip.decompress(data)
+    if content_encoding == 'zstd':
+        import zstandard
+
+        # NOTE: compressは展開後のサイズをフレームに記録するため, max_output_sizeは不要
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def dumps(payload: Any, compression: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    '''データをjsonに変換し圧縮する
+
+    Args:
+        payload (Any): jsonに変換するデータ
+        compression (Optional[str], optional): "gzip", "zstd"のいずれか, Noneならば圧縮しない. Defaults to None.
+
+    Returns:
+        Tuple[bytes, Optional[str]]: 圧縮したjsonとContent-Encoding(圧縮しない場合はNone)
+    '''
+    return compress(json.dumps(payload).encode('utf-8'), compression)
+
+
+def loads(data: bytes, content_encoding: Optional[str] = None) -> Any:
+    '''dumpsで保存したデータを圧縮形式によらず読み込む
+
+    Args:
+        data (bytes): 読み込むデータ
+        content_encoding (Optional[str], optional): オブジェクトのContent-Encoding, Noneならばデータの先頭から判別する.
+            Defaults to None.
+
+    Returns:
+        Any: jsonから変換したデータ
+    '''
+    return json.loads(decompress(data, content_encoding).decode('utf-8'))
+
+
+def load_file(path: str) -> Any:
+    '''ローカルに保存したjsonファイルを圧縮形式によらず読み込む
+
+    Args:
+        path (str): ファイルのパス
+
+    Returns:
+        Any: jsonから変換したデータ
+    '''
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def load_gcs(
+    path: str,
+    bucket_name: str = 'export_from_devices',
+    client: Optional['storage.Client'] = None
+) -> Any:
+    '''gcsに保存したjsonを圧縮形式によらず読み込む
+
+    Args:
+        path (str): オブジェクトのパス
+        bucket_name (str, optional): バケット名. Defaults to 'export_from_devices'.
+        client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+
+    Returns:
+        Any: jsonから変換したデータ
+    '''
+    storage_client = client if client is not None else get_storage_client()
+    blob = storage_client.bucket(bucket_name).get_blob(path)
+    if blob is None:
+        raise FileNotFoundError(path)
+    # NOTE: Content-Encoding: gzipのオブジェクトはgcsが展開して返す場合があるため, 保存したままのデータを取得して展開する
+    return loads(blob.download_as_bytes(raw_download=True), blob.content_encoding)
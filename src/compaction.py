@@ -0,0 +1,280 @@
+import datetime
+import json
+import os
+import re
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from src.codec import load_file
+from src.dates import parse_jst
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# 日次のjsonファイル名の形式
+_DAILY_FILE_PATTERN = re.compile(r'^(20[0-9]{2}-[0-1][0-9])-[0-3][0-9]\.json$')
+
+# 圧縮済みのパーティションと入力ファイルの状態を記録するファイル名
+STATE_FILE_NAME = '_state.json'
+
+
+class Dataset(NamedTuple):
+    '''圧縮の対象となる日次データの種類
+
+    Attributes:
+        name (str): パーティションのsourceとする名前
+        input_dir (str): 日次のjsonファイルを格納したディレクトリ(バケットのルートからの相対パス)
+        columns (List[Tuple[str, str]]): 列名と型("date", "timestamp", "timestamp_jst", "string", "int", "float", "bool")
+        flatten (Callable[[Dict[str, Any], str], List[Dict[str, Any]]]): 日次のデータと日付から行の一覧を生成する関数
+    '''
+    name: str
+    input_dir: str
+    columns: List[Tuple[str, str]]
+    flatten: Callable[[Dict[str, Any], str], List[Dict[str, Any]]]
+
+
+def _to_date(date: str) -> datetime.date:
+    return datetime.datetime.strptime(date, '%Y-%m-%d').date()
+
+
+def _to_local_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    '''Fitbitの現地時刻("yyyy-mm-ddTHH:MM:SS.fff")をdatetimeへ変換する
+    '''
+    return None if value is None else datetime.datetime.fromisoformat(value)
+
+
+def _flatten_health_planet(payload: Dict[str, Any], date: str) -> List[Dict[str, Any]]:
+    '''Health Planetの体組成データを測定1件ごとの行にする
+    '''
+    return [
+        {
+            'date': _to_date(date),
+            'measured_at': parse_jst(r['date'], '%Y%m%d%H%M'),
+            'tag': r['tag'],
+            'body_type': 'weight' if r['tag'] == '6021' else 'fat',
+            'value': float(r['keydata']),
+            'model': r.get('model'),
+        }
+        for r in payload.get('data', [])
+    ]
+
+
+def _flatten_fitbit_activities(payload: Dict[str, Any], date: str) -> List[Dict[str, Any]]:
+    '''Fitbitの運動データを1日1行の集計にする
+    '''
+    summary = payload.get('summary', {})
+    distances = {d.get('activity'): d.get('distance') for d in summary.get('distances', [])}
+    return [{
+        'date': _to_date(date),
+        'steps': summary.get('steps'),
+        'calories_out': summary.get('caloriesOut'),
+        'activity_calories': summary.get('activityCalories'),
+        'calories_bmr': summary.get('caloriesBMR'),
+        'sedentary_minutes': summary.get('sedentaryMinutes'),
+        'lightly_active_minutes': summary.get('lightlyActiveMinutes'),
+        'fairly_active_minutes': summary.get('fairlyActiveMinutes'),
+        'very_active_minutes': summary.get('veryActiveMinutes'),
+        'distance_total': distances.get('total'),
+        'floors': summary.get('floors'),
+        'resting_heart_rate': summary.get('restingHeartRate'),
+    }]
+
+
+def _flatten_fitbit_foods(payload: Dict[str, Any], date: str) -> List[Dict[str, Any]]:
+    '''Fitbitの食事データを1日1行の集計にする
+    '''
+    summary = payload.get('summary', {})
+    return [{
+        'date': _to_date(date),
+        'calories': summary.get('calories'),
+        'carbs': summary.get('carbs'),
+        'fat': summary.get('fat'),
+        'fiber': summary.get('fiber'),
+        'protein': summary.get('protein'),
+        'sodium': summary.get('sodium'),
+        'water': summary.get('water'),
+        'food_count': len(payload.get('foods', [])),
+    }]
+
+
+def _flatten_fitbit_sleep(payload: Dict[str, Any], date: str) -> List[Dict[str, Any]]:
+    '''Fitbitの睡眠データを睡眠記録1件ごとの行にする
+    '''
+    return [
+        {
+            'date': _to_date(date),
+            'log_id': s.get('logId'),
+            'start_time': _to_local_datetime(s.get('startTime')),
+            'end_time': _to_local_datetime(s.get('endTime')),
+            'duration_ms': s.get('duration'),
+            'efficiency': s.get('efficiency'),
+            'minutes_asleep': s.get('minutesAsleep'),
+            'minutes_awake': s.get('minutesAwake'),
+            'minutes_to_fall_asleep': s.get('minutesToFallAsleep'),
+            'minutes_after_wakeup': s.get('minutesAfterWakeup'),
+            'time_in_bed': s.get('timeInBed'),
+            'is_main_sleep': s.get('isMainSleep'),
+            'type': s.get('type'),
+        }
+        for s in payload.get('sleep', [])
+    ]
+
+
+DATASETS = [
+    Dataset('health_planet', 'health_planet', [
+        ('date', 'date'), ('measured_at', 'timestamp_jst'), ('tag', 'string'), ('body_type', 'string'),
+        ('value', 'float'), ('model', 'string'),
+    ], _flatten_health_planet),
+    Dataset('fitbit_activities', 'fitbit/activities', [
+        ('date', 'date'), ('steps', 'int'), ('calories_out', 'int'), ('activity_calories', 'int'), ('calories_bmr', 'int'),
+        ('sedentary_minutes', 'int'), ('lightly_active_minutes', 'int'), ('fairly_active_minutes', 'int'),
+        ('very_active_minutes', 'int'), ('distance_total', 'float'), ('floors', 'int'), ('resting_heart_rate', 'int'),
+    ], _flatten_fitbit_activities),
+    Dataset('fitbit_foods', 'fitbit/foods', [
+        ('date', 'date'), ('calories', 'float'), ('carbs', 'float'), ('fat', 'float'), ('fiber', 'float'),
+        ('protein', 'float'), ('sodium', 'float'), ('water', 'float'), ('food_count', 'int'),
+    ], _flatten_fitbit_foods),
+    Dataset('fitbit_sleep', 'fitbit/sleep', [
+        ('date', 'date'), ('log_id', 'int'), ('start_time', 'timestamp'), ('end_time', 'timestamp'), ('duration_ms', 'int'),
+        ('efficiency', 'int'), ('minutes_asleep', 'int'), ('minutes_awake', 'int'), ('minutes_to_fall_asleep', 'int'),
+        ('minutes_after_wakeup', 'int'), ('time_in_bed', 'int'), ('is_main_sleep', 'bool'), ('type', 'string'),
+    ], _flatten_fitbit_sleep),
+    # NOTE: backfill(fitbit_range=True)で期間を指定して取得したデータはsummaryの主な項目のみのため, 含む列のみの別のsourceとする
+    Dataset('fitbit_range_activities', 'fitbit_range/activities', [
+        ('date', 'date'), ('steps', 'int'), ('calories_out', 'int'), ('activity_calories', 'int'), ('calories_bmr', 'int'),
+        ('sedentary_minutes', 'int'), ('lightly_active_minutes', 'int'), ('fairly_active_minutes', 'int'),
+        ('very_active_minutes', 'int'), ('distance_total', 'float'), ('floors', 'int'),
+    ], _flatten_fitbit_activities),
+    Dataset('fitbit_range_foods', 'fitbit_range/foods', [
+        ('date', 'date'), ('calories', 'float'), ('water', 'float'),
+    ], _flatten_fitbit_foods),
+    Dataset('fitbit_range_sleep', 'fitbit_range/sleep', [
+        ('date', 'date'), ('log_id', 'int'), ('start_time', 'timestamp'), ('end_time', 'timestamp'), ('duration_ms', 'int'),
+        ('efficiency', 'int'), ('minutes_asleep', 'int'), ('minutes_awake', 'int'), ('minutes_to_fall_asleep', 'int'),
+        ('minutes_after_wakeup', 'int'), ('time_in_bed', 'int'), ('is_main_sleep', 'bool'), ('type', 'string'),
+    ], _flatten_fitbit_sleep),
+]
+
+
+def _schema(columns: List[Tuple[str, str]]) -> 'pa.Schema':
+    '''列名と型からparquetのスキーマを生成する
+    '''
+    import pyarrow as pa
+
+    types = {
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('ms'),
+        'timestamp_jst': pa.timestamp('s', tz='Asia/Tokyo'),
+        'string': pa.string(),
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+    }
+    return pa.schema([(name, types[t]) for name, t in columns])
+
+
+def partition_path(dataset: Dataset, month: str) -> str:
+    '''パーティションの相対パスを返す, sourceと月(yyyy-mm)でhive形式に分割する
+
+    Args:
+        dataset (Dataset): 日次データの種類
+        month (str): 対象の月, "yyyy-mm"
+
+    Returns:
+        str: 出力先ディレクトリからの相対パス
+    '''
+    return 'source={}/month={}/data.parquet'.format(dataset.name, month)
+
+
+def _list_daily_files(root: str, dataset: Dataset) -> Dict[str, Dict[str, List[int]]]:
+    '''日次のjsonファイルを月ごとに列挙し, ファイルのサイズと更新時刻を返す
+
+    Returns:
+        Dict[str, Dict[str, List[int]]]: 月ごとの{ファイル名: [サイズ, 更新時刻(ns)]}
+    '''
+    input_dir = os.path.join(root, dataset.input_dir)
+    months: Dict[str, Dict[str, List[int]]] = {}
+    if not os.path.isdir(input_dir):
+        return months
+    with os.scandir(input_dir) as it:
+        for entry in it:
+            m = _DAILY_FILE_PATTERN.match(entry.name)
+            if m is None or not entry.is_file():
+                continue
+            stat = entry.stat()
+            months.setdefault(m.group(1), {})[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return months
+
+
+def _write_partition(root: str, dataset: Dataset, file_names: List[str], path: str) -> int:
+    '''1ヶ月分の日次のjsonファイルを1つのparquetファイルにまとめる
+
+    Returns:
+        int: 書き込んだ行数
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows: List[Dict[str, Any]] = []
+    for file_name in sorted(file_names):
+        # NOTE: 圧縮して保存したファイルも同じ名前(.json)のため, 圧縮形式によらず読み込む
+        payload = load_file(os.path.join(root, dataset.input_dir, file_name))
+        rows.extend(dataset.flatten(payload, file_name[:-len('.json')]))
+    schema = _schema(dataset.columns)
+    table = pa.Table.from_pydict({name: [r.get(name) for r in rows] for name in schema.names}, schema=schema)
+
+    # NOTE: 書き込み途中のファイルを読み込まれないよう, 一時ファイルに書き込んでから置き換える
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def compact(root: str = 'data', out_dir: Optional[str] = None, sources: Optional[List[str]] = None) -> List[str]:
+    '''バケットと同じ構成のディレクトリにある日次のjsonファイルを, sourceと月ごとのparquetファイルにまとめる
+
+    前回の実行から日次のファイルが追加・更新されたパーティションのみを書き直す
+
+    Args:
+        root (str, optional): バケットと同じ構成のディレクトリ. Defaults to 'data'.
+        out_dir (Optional[str], optional): parquetファイルの出力先, Noneならばroot/compactedとする. Defaults to None.
+        sources (Optional[List[str]], optional): DATASETSのnameから対象を選択, Noneならば全て. Defaults to None.
+
+    Returns:
+        List[str]: 書き直したparquetファイルのパス
+    '''
+    # 引数sourcesの値確認
+    names = [d.name for d in DATASETS]
+    if sources is not None:
+        if type(sources) != list:
+            raise TypeError('"sources" type must be list.')
+        if not set(sources) <= set(names):
+            raise ValueError('"sources" must be in {}.'.format(names))
+
+    out_dir = out_dir if out_dir is not None else os.path.join(root, 'compacted')
+    state_path = os.path.join(out_dir, STATE_FILE_NAME)
+    state: Dict[str, Dict[str, List[int]]] = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+
+    written = []
+    for dataset in DATASETS:
+        if sources is not None and dataset.name not in sources:
+            continue
+        for month, files in sorted(_list_daily_files(root, dataset).items()):
+            key = partition_path(dataset, month)
+            if state.get(key) == files:
+                continue
+            path = os.path.join(out_dir, key)
+            rows = _write_partition(root, dataset, list(files), path)
+            print('compacted {} files ({} rows) into {}'.format(len(files), rows, path))
+            written.append(path)
+
+            # NOTE: 中断しても書き込んだパーティションを再度書き直さないよう, パーティションごとに状態を記録する
+            state[key] = files
+            os.makedirs(out_dir, exist_ok=True)
+            with open(state_path + '.tmp', 'w') as f:
+                json.dump(state, f, sort_keys=True)
+            os.replace(state_path + '.tmp', state_path)
+    return written
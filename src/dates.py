@@ -0,0 +1,79 @@
+import datetime
+from typing import TypeVar
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # python3.8
+    ZoneInfo = None
+
+# NOTE: 日本は夏時間がないため, zoneinfoやtzdataが利用できない環境では固定のUTC+9とする
+if ZoneInfo is not None:
+    try:
+        JST: datetime.tzinfo = ZoneInfo('Asia/Tokyo')
+    except ZoneInfoNotFoundError:
+        JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+else:
+    JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+
+DateLike = TypeVar('DateLike', datetime.date, datetime.datetime)
+
+
+def now_jst() -> datetime.datetime:
+    '''現在時刻をAsia/Tokyoで返す
+
+    Returns:
+        datetime.datetime: タイムゾーン付きの現在時刻
+    '''
+    return datetime.datetime.now(tz=JST)
+
+
+def today_jst() -> datetime.date:
+    '''今日の日付をAsia/Tokyoで返す
+
+    Returns:
+        datetime.date: 今日の日付
+    '''
+    return now_jst().date()
+
+
+def yesterday_str() -> str:
+    '''昨日の日付をAsia/Tokyoで"yyyy-mm-dd"形式の文字列として返す
+
+    Returns:
+        str: 昨日の日付
+    '''
+    return (today_jst() - datetime.timedelta(days=1)).isoformat()
+
+
+def parse_jst(value: str, fmt: str) -> datetime.datetime:
+    '''文字列をAsia/Tokyoの時刻として解釈する
+
+    Args:
+        value (str): 時刻を表す文字列
+        fmt (str): valueの書式(datetime.strptimeの書式)
+
+    Returns:
+        datetime.datetime: タイムゾーン付きの時刻
+    '''
+    return datetime.datetime.strptime(value, fmt).replace(tzinfo=JST)
+
+
+def subtract_months(d: DateLike, months: int) -> DateLike:
+    '''日付からmonthsヶ月前の日付を求める, 該当する日が存在しない場合は月末とする
+
+    Args:
+        d (DateLike): 基準となる日付もしくは時刻
+        months (int): 遡る月数
+
+    Returns:
+        DateLike: monthsヶ月前の日付もしくは時刻
+    '''
+    month_index = d.year * 12 + d.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    for day in range(d.day, 0, -1):
+        try:
+            return d.replace(year=year, month=month, day=day)
+        except ValueError:
+            continue
+    raise ValueError('invalid date.')
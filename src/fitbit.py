@@ -1,12 +1,136 @@
 import base64
+import datetime
 import json
 import re
 import sys
+import threading
+import time
+import urllib.error
 import urllib.parse
-import urllib.request
 import webbrowser
-from dataclasses import dataclass
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from src.response_cache import ResponseCache
+from src.tracing import propagate, span
+from src.transport import HttpResponse, HttpTransport, default_transport
+
+# 期間を指定して取得する場合の日数の上限(睡眠のエンドポイントの上限に合わせる)
+RANGE_MAX_DAYS = 100
+
+# 運動の時系列のリソースと, 日ごとのデータ(summary)のキーおよび値の型
+ACTIVITY_TIME_SERIES = {
+    'steps': ('steps', int),
+    'calories': ('caloriesOut', int),
+    'caloriesBMR': ('caloriesBMR', int),
+    'activityCalories': ('activityCalories', int),
+    'distance': ('distances', float),
+    'floors': ('floors', int),
+    'minutesSedentary': ('sedentaryMinutes', int),
+    'minutesLightlyActive': ('lightlyActiveMinutes', int),
+    'minutesFairlyActive': ('fairlyActiveMinutes', int),
+    'minutesVeryActive': ('veryActiveMinutes', int),
+}
+
+# 食事の時系列のリソースと, 日ごとのデータ(summary)のキーおよび値の型
+FOOD_TIME_SERIES = {
+    'caloriesIn': ('calories', int),
+    'water': ('water', float),
+}
+
+# 体組成の記録を期間を指定して取得する場合の日数の上限
+BODY_LOG_MAX_DAYS = 31
+
+
+class BodyLogEntry(NamedTuple):
+    '''Fitbitに記録する体組成の値
+
+    Attributes:
+        body_type (str): "weight"または"fat"
+        value (float): 体組成の値
+        date (str): 測定日, "yyyy-mm-dd"
+        time (str): 測定時刻, "HH:mm:ss"
+    '''
+    body_type: str
+    value: float
+    date: str
+    time: str
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        '''記録済みか判定するためのキー, 同じ種類で同じ日時(分単位)の記録は同一とみなす
+        '''
+        return (self.body_type, self.date, self.time[:5])
+
+
+@dataclass
+class BodyLogSyncResult:
+    '''体組成の記録の同期結果
+
+    Attributes:
+        created (List[BodyLogEntry]): 新たに記録した値
+        skipped (List[BodyLogEntry]): 記録済みのため記録しなかった値
+        failed (List[Tuple[BodyLogEntry, Exception]]): 記録に失敗した値と例外
+    '''
+    created: List[BodyLogEntry] = field(default_factory=list)
+    skipped: List[BodyLogEntry] = field(default_factory=list)
+    failed: List[Tuple[BodyLogEntry, Exception]] = field(default_factory=list)
+
+
+@dataclass
+class RateLimitBudget:
+    '''レスポンスヘッダから把握したFitbit APIのレート制限の残量
+
+    Attributes:
+        limit (Optional[int]): 1時間あたりのリクエスト数の上限, 未取得ならばNone
+        remaining (Optional[int]): 残りのリクエスト数, 未取得ならばNone
+        reset_at (Optional[float]): 残量が回復する時刻(UNIX時間), 未取得ならばNone
+        reserve (int): 他の処理のために残しておくリクエスト数, 残量がこの値以下になると回復まで待機する
+    '''
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    reset_at: Optional[float] = None
+    reserve: int = 0
+    clock: Callable[[], float] = field(default=time.time, repr=False, compare=False)
+    sleep: Callable[[float], None] = field(default=time.sleep, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def update(self, headers: Optional[Mapping[str, str]]) -> None:
+        '''レスポンスヘッダからレート制限の残量を更新する
+
+        Args:
+            headers (Optional[Mapping[str, str]]): レスポンスヘッダ
+        '''
+        if headers is None or headers.get('Fitbit-Rate-Limit-Remaining') is None:
+            return
+        with self._lock:
+            if headers.get('Fitbit-Rate-Limit-Limit') is not None:
+                self.limit = int(headers['Fitbit-Rate-Limit-Limit'])
+            self.remaining = int(headers['Fitbit-Rate-Limit-Remaining'])
+            if headers.get('Fitbit-Rate-Limit-Reset') is not None:
+                self.reset_at = self.clock() + int(headers['Fitbit-Rate-Limit-Reset'])
+
+    def acquire(self) -> None:
+        '''リクエスト1回分の残量を確保する, 残量がなければ回復する時刻まで待機する
+        '''
+        while True:
+            with self._lock:
+                now = self.clock()
+                if self.reset_at is not None and now >= self.reset_at:
+                    # 回復時刻を過ぎていれば上限まで回復したとみなす
+                    self.remaining = self.limit
+                    self.reset_at = None
+                if self.remaining is None or self.remaining > self.reserve:
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    return
+                if self.reset_at is None:
+                    # 回復時刻が不明な場合は待機せずにリクエストし, レスポンスヘッダから再取得する
+                    return
+                wait_seconds = self.reset_at - now
+            print('Fitbit rate limit is exhausted. wait {:.0f} seconds.'.format(wait_seconds))
+            self.sleep(wait_seconds)
 
 
 @dataclass
@@ -16,6 +140,117 @@ class Fitbit:
     auth_code: str = ''
     access_token: str = ''
     refresh_token: str = ''
+    api_base: str = 'https://api.fitbit.com'
+    rate_limit: RateLimitBudget = field(default_factory=RateLimitBudget)
+    transport: Optional[HttpTransport] = None
+    response_cache: Optional[ResponseCache] = None
+    expires_at: Optional[float] = None
+    refresh_margin: float = 300.0
+    on_token_refresh: Optional[Callable[['Fitbit'], None]] = field(default=None, repr=False, compare=False)
+    _token_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def _transport(self) -> HttpTransport:
+        '''リクエストに使用するHttpTransportを返す, 与えられていなければプロセス内で共有するものを使用する
+        '''
+        return self.transport if self.transport is not None else default_transport()
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        data: Optional[bytes] = None
+    ) -> bytes:
+        '''access_tokenを付与してリクエストする
+
+        有効期限が近ければ事前にaccess_tokenを更新し, 期限切れ(401)で失敗した場合は1度だけ更新して再送する
+
+        Args:
+            method (str): HTTPメソッド
+            url (str): リクエスト先のurl
+            data (Optional[bytes], optional): リクエストボディ. Defaults to None.
+
+        Returns:
+            bytes: レスポンスボディ
+        '''
+        return self._request_response(method, url, data=data).body
+
+    def _request_response(
+        self,
+        method: str,
+        url: str,
+        data: Optional[bytes] = None,
+        headers: Optional[Mapping[str, str]] = None
+    ) -> HttpResponse:
+        '''_requestと同様にリクエストし, ステータスコードとレスポンスヘッダを含むレスポンスを返す
+
+        Args:
+            method (str): HTTPメソッド
+            url (str): リクエスト先のurl
+            data (Optional[bytes], optional): リクエストボディ. Defaults to None.
+            headers (Optional[Mapping[str, str]], optional): 追加するリクエストヘッダ(条件付きリクエストなど). Defaults to None.
+
+        Returns:
+            HttpResponse: レスポンス
+        '''
+        self.ensure_access_token()
+        access_token = self.access_token
+        try:
+            return self._send(method, url, access_token, data, headers)
+        except urllib.error.HTTPError as e:
+            if e.code != 401 or self.refresh_token == '':
+                raise e
+        print('execute method "refresh_access_token"')
+        self.refresh_access_token(stale_access_token=access_token)
+        return self._send(method, url, self.access_token, data, headers)
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        access_token: str,
+        data: Optional[bytes] = None,
+        extra_headers: Optional[Mapping[str, str]] = None
+    ) -> HttpResponse:
+        '''レート制限の残量を確保してリクエストし, レスポンスヘッダから残量を更新する
+
+        HttpTransportが再送する場合も, 再送ごとに残量を確保する
+        '''
+        headers = dict(extra_headers or {})
+        headers['Authorization'] = 'Bearer ' + access_token
+        self.rate_limit.acquire()
+        try:
+            res = self._transport().request(method, url, headers=headers, data=data, before_retry=self._before_retry)
+            self.rate_limit.update(res.headers)
+            return res
+        except urllib.error.HTTPError as e:
+            self.rate_limit.update(e.headers)
+            if e.code == 429:
+                print('Fitbit rate limit is exceeded. Retry after {} seconds.'.format(e.headers.get('Retry-After')))
+            raise e
+
+    def _before_retry(self, error: urllib.error.URLError) -> None:
+        '''失敗したレスポンスヘッダから残量を更新し, 再送する1回分の残量を確保する
+        '''
+        if isinstance(error, urllib.error.HTTPError):
+            self.rate_limit.update(error.headers)
+        self.rate_limit.acquire()
+
+    def ensure_access_token(self) -> None:
+        '''access_tokenの有効期限までrefresh_margin秒を切っていれば事前に更新する
+        '''
+        if self.expires_at is None or self.refresh_token == '':
+            return
+        if time.time() >= self.expires_at - self.refresh_margin:
+            self.refresh_access_token(stale_access_token=self.access_token)
+
+    def _set_tokens(self, body: bytes) -> None:
+        '''トークンのレスポンスからaccess_token, refresh_tokenと有効期限を更新する
+        '''
+        res_dict = json.loads(body.decode('utf-8'))
+        self.access_token = res_dict['access_token']
+        self.refresh_token = res_dict['refresh_token']
+        if 'expires_in' in res_dict:
+            self.expires_at = time.time() + float(res_dict['expires_in'])
 
     def fetch_trace_data(
         self,
@@ -24,6 +259,8 @@ class Fitbit:
     ) -> Dict[Any, Any]:
         '''fitbitからトレースデータを取得し辞書型で出力
 
+        response_cacheが与えられていれば, 確定期間より前の日付かつ確定期間を過ぎてからキャッシュしたものはキャッシュから返し, それ以外は条件付きリクエストで再検証する
+
         Args:
             category (str): "activities", "foods", "sleep"のいずれかを入力
             date (str): 取得したいデータの日付, "yyyy-mm-dd"形式で入力
@@ -54,21 +291,138 @@ class Fitbit:
             raise ValueError('"date" must be yyyy-mm-dd.')
 
         # 該当データを取得
-        headers = {'Authorization': 'Bearer ' + self.access_token}
-        url = 'https://api.fitbit.com/1.2/user/-/{category}/date/{date}.json'.format(
-            category=uri_category, date=date
+        url = '{api_base}/1.2/user/-/{category}/date/{date}.json'.format(
+            api_base=self.api_base, category=uri_category, date=date
         )
-        req = urllib.request.Request(url, headers=headers)
+        cache = self.response_cache
+        cached = cache.get(category, date) if cache is not None else None
+        if cached is not None and cache.is_settled(date, cached.stored_at):
+            cache.record_hit()
+            return json.loads(cached.body.decode('utf-8'))
         try:
-            with urllib.request.urlopen(req) as res:
-                body = res.read()
+            res = self._request_response('GET', url, headers=cached.conditional_headers() if cached is not None else None)
         except urllib.error.HTTPError as e:
             print('Isnt the access token expired?  Try method "refresh_access_token".')
             raise e
+        if cached is not None and res.status == 304:
+            cache.touch(category, date, cached)
+            cache.record_hit(revalidated=True)
+            body = cached.body
+        else:
+            body = res.body
+            if cache is not None:
+                cache.put(category, date, body, res.headers)
 
         # 辞書型で出力
         return json.loads(body.decode('utf-8'))
 
+    def fetch_trace_data_range(
+        self,
+        category: str,
+        from_date: str,
+        to_date: str
+    ) -> Dict[str, Dict[Any, Any]]:
+        '''期間を指定するエンドポイントでトレースデータを取得し, 日ごとのデータに分割する
+
+        運動と食事は時系列のエンドポイント(リソースごとに1回)から日ごとのsummaryを組み立てるため,
+        1日分のエンドポイントのsummaryのうちACTIVITY_TIME_SERIES, FOOD_TIME_SERIESの項目のみを含み, 個々の記録は含まない
+        response_cacheが与えられていれば, 期間の全ての日付が確定期間より前かつ確定期間を過ぎてからキャッシュ済みの場合はリクエストしない
+
+        Args:
+            category (str): "activities", "foods", "sleep"のいずれかを入力
+            from_date (str): 取得したい期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 取得したい期間の終了日, "yyyy-mm-dd"形式で入力, 開始日からRANGE_MAX_DAYS日以内
+
+        Returns:
+            Dict[str, Dict[Any, Any]]: 日付("yyyy-mm-dd")ごとの取得データ, 記録のない日も含む
+        '''
+        # 引数categoryの値確認
+        if type(category) != str:
+            raise TypeError('"category" type must be str.')
+        if category not in ['activities', 'foods', 'sleep']:
+            raise ValueError('Please input "activities" or "foods" or "sleep"')
+
+        # 引数from_date, to_dateの値確認
+        for name, value in [('from_date', from_date), ('to_date', to_date)]:
+            if type(value) != str:
+                raise TypeError('"{}" type must be str.'.format(name))
+            if not re.search(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$', value):
+                raise ValueError('"{}" must be yyyy-mm-dd.'.format(name))
+        start = datetime.datetime.strptime(from_date, '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(to_date, '%Y-%m-%d').date()
+        if start > end:
+            raise ValueError('"to_date" is greater than "from_date".')
+        if (end - start).days >= RANGE_MAX_DAYS:
+            raise ValueError('"to_date" must be within {} days from "from_date".'.format(RANGE_MAX_DAYS))
+        dates = [(start + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+        # NOTE: 1日分のエンドポイントとはデータの内容が異なるため, キャッシュは別のエンドポイントとして扱う
+        cache_endpoint = category + '-range'
+        if self.response_cache is not None and all(self.response_cache.is_settled(d) for d in dates):
+            cached = [self.response_cache.get(cache_endpoint, d) for d in dates]
+            if all(c is not None and self.response_cache.is_settled(d, c.stored_at) for d, c in zip(dates, cached)):
+                self.response_cache.record_hit()
+                return {d: json.loads(c.body.decode('utf-8')) for d, c in zip(dates, cached)}
+        result = self._fetch_trace_data_range(category, from_date, to_date, dates)
+        if self.response_cache is not None:
+            for d, payload in result.items():
+                self.response_cache.put(cache_endpoint, d, json.dumps(payload).encode('utf-8'))
+        return result
+
+    def _fetch_trace_data_range(
+        self,
+        category: str,
+        from_date: str,
+        to_date: str,
+        dates: List[str]
+    ) -> Dict[str, Dict[Any, Any]]:
+        '''期間を指定するエンドポイントでトレースデータを取得し, 日ごとのデータに分割する
+        '''
+        if category == 'sleep':
+            url = '{}/1.2/user/-/sleep/date/{}/{}.json'.format(self.api_base, from_date, to_date)
+            records: Dict[str, List[Dict[Any, Any]]] = {d: [] for d in dates}
+            for s in self._request_json(url).get('sleep', []):
+                records.setdefault(s['dateOfSleep'], []).append(s)
+            return {
+                d: {
+                    'sleep': records[d],
+                    'summary': {
+                        'totalMinutesAsleep': sum(s.get('minutesAsleep', 0) for s in records[d]),
+                        'totalSleepRecords': len(records[d]),
+                        'totalTimeInBed': sum(s.get('timeInBed', 0) for s in records[d]),
+                    }
+                }
+                for d in dates
+            }
+
+        if category == 'activities':
+            path, series = 'activities', ACTIVITY_TIME_SERIES
+        else:
+            path, series = 'foods/log', FOOD_TIME_SERIES
+        summaries: Dict[str, Dict[str, Any]] = {d: {} for d in dates}
+        for resource, (key, value_type) in series.items():
+            url = '{}/1/user/-/{}/{}/date/{}/{}.json'.format(self.api_base, path, resource, from_date, to_date)
+            response_key = '{}-{}'.format(path.replace('/', '-'), resource)
+            for point in self._request_json(url).get(response_key, []):
+                if point['dateTime'] not in summaries:
+                    continue
+                value = value_type(point['value'])
+                if key == 'distances':
+                    summaries[point['dateTime']][key] = [{'activity': 'total', 'distance': value}]
+                else:
+                    summaries[point['dateTime']][key] = value
+        return {d: {'summary': summaries[d]} for d in dates}
+
+    def _request_json(self, url: str) -> Dict[Any, Any]:
+        '''GETでリクエストし辞書型で出力する
+        '''
+        try:
+            body = self._request('GET', url)
+        except urllib.error.HTTPError as e:
+            print('Isnt the access token expired?  Try method "refresh_access_token".')
+            raise e
+        return json.loads(body.decode('utf-8'))
+
     def create_body_log(
         self,
         body_type: str,
@@ -118,17 +472,14 @@ class Fitbit:
             raise ValueError('"created_time" must be HH:mm:ss.')
 
         # 該当データを記録
-        headers = {'authorization': 'Bearer ' + self.access_token}
         data = {
             body_type: value,
             'date': created_date,
             'time': created_time
         }
-        url = 'https://api.fitbit.com/1/user/-/body/log/{}.json'.format(body_type)
-        req = urllib.request.Request(url, headers=headers, data=urllib.parse.urlencode(data).encode())
+        url = '{}/1/user/-/body/log/{}.json'.format(self.api_base, body_type)
         try:
-            with urllib.request.urlopen(req) as res:
-                body = res.read()
+            body = self._request('POST', url, data=urllib.parse.urlencode(data).encode())
         except urllib.error.HTTPError as e:
             print('Isnt the access token expired?  Try method "refresh_access_token".')
             raise e
@@ -136,11 +487,126 @@ class Fitbit:
         # 辞書型で出力
         return json.loads(body.decode('utf-8'))
 
-    def refresh_access_token(self) -> None:
+    def fetch_body_logs(self, body_type: str, from_date: str, to_date: str) -> List[Dict[Any, Any]]:
+        '''期間内の体組成の記録を取得する, BODY_LOG_MAX_DAYS日ごとに分けてリクエストする
+
+        Args:
+            body_type (str): "weight"または"fat"のいずれかを入力
+            from_date (str): 取得したい期間の開始日, "yyyy-mm-dd"形式で入力
+            to_date (str): 取得したい期間の終了日, "yyyy-mm-dd"形式で入力
+
+        Returns:
+            List[Dict[Any, Any]]: 記録の一覧("date", "time", body_typeの値などを含む)
+        '''
+        # 引数body_typeの値確認
+        if type(body_type) == str:
+            if body_type not in ['weight', 'fat']:
+                raise ValueError('Please input "weight" or "fat".')
+        else:
+            raise TypeError('"body_type" type must be str.')
+
+        # 引数from_date, to_dateの値確認
+        for name, value in [('from_date', from_date), ('to_date', to_date)]:
+            if type(value) != str:
+                raise TypeError('"{}" type must be str.'.format(name))
+            if not re.search(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$', value):
+                raise ValueError('"{}" must be yyyy-mm-dd.'.format(name))
+        start = datetime.datetime.strptime(from_date, '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(to_date, '%Y-%m-%d').date()
+        if start > end:
+            raise ValueError('"to_date" is greater than "from_date".')
+
+        # 該当データを取得
+        logs = []
+        while start <= end:
+            chunk_end = min(end, start + datetime.timedelta(days=BODY_LOG_MAX_DAYS - 1))
+            url = '{}/1/user/-/body/log/{}/date/{}/{}.json'.format(
+                self.api_base, body_type, start.isoformat(), chunk_end.isoformat()
+            )
+            logs.extend(self._request_json(url).get(body_type, []))
+            start = chunk_end + datetime.timedelta(days=1)
+        return logs
+
+    def sync_body_logs(self, entries: List[BodyLogEntry], max_workers: int = 4) -> BodyLogSyncResult:
+        '''体組成の値のうちFitbitに記録されていないものだけを並行して記録する
+
+        期間内の記録を種類ごとに1度だけ取得して突き合わせるため, 再実行しても重複して記録しない
+
+        Args:
+            entries (List[BodyLogEntry]): 記録したい体組成の値
+            max_workers (int, optional): 並行して記録する数, レート制限の残量が少なければ回復まで待機する. Defaults to 4.
+
+        Returns:
+            BodyLogSyncResult: 同期結果
+        '''
+        # 引数max_workersの値確認
+        if type(max_workers) != int:
+            raise TypeError('"max_workers" type must be int.')
+        if max_workers < 1:
+            raise ValueError('"max_workers" must be over 1.')
+
+        result = BodyLogSyncResult()
+        if len(entries) == 0:
+            return result
+
+        # 記録済みの値を種類ごとにまとめて取得し突き合わせる
+        from_date = min(e.date for e in entries)
+        to_date = max(e.date for e in entries)
+        existing: Set[Tuple[str, str, str]] = set()
+        for body_type in sorted({e.body_type for e in entries}):
+            for log in self.fetch_body_logs(body_type, from_date, to_date):
+                existing.add((body_type, log['date'], log['time'][:5]))
+        missing = []
+        for e in entries:
+            if e.key in existing:
+                result.skipped.append(e)
+            else:
+                # NOTE: 入力内の重複も1件だけ記録する
+                existing.add(e.key)
+                missing.append(e)
+
+        def create(entry: BodyLogEntry) -> Optional[Exception]:
+            try:
+                self.create_body_log(entry.body_type, entry.value, entry.date, entry.time)
+            except Exception as e:
+                return e
+            return None
+
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+                for entry, error in zip(missing, executor.map(propagate(create), missing)):
+                    if error is None:
+                        result.created.append(entry)
+                    else:
+                        result.failed.append((entry, error))
+        return result
+
+    def refresh_access_token(self, stale_access_token: Optional[str] = None) -> None:
         '''refresh_token経由でaccess_tokenとrefresh_tokenを更新する
+
+        refresh_tokenは1度しか使用できないため, 同時に呼ばれた場合は1回のリクエストにまとめる
+        on_token_refreshで発生した例外は出力するのみとし, 送出しない
+
+        Args:
+            stale_access_token (Optional[str], optional): 更新が必要と判断したaccess_token,
+                既に他の処理で更新済み(access_tokenが異なる)であればリクエストしない. Defaults to None.
+        '''
+        with self._token_lock:
+            if stale_access_token is not None and self.access_token != stale_access_token:
+                return
+            self._refresh_access_token()
+            if self.on_token_refresh is not None:
+                # NOTE: トークンは更新済みのため, 保存に失敗しても更新を契機としたリクエストは失敗させない
+                try:
+                    self.on_token_refresh(self)
+                except Exception as e:
+                    print('failed to save refreshed tokens: {!r}'.format(e))
+
+    def _refresh_access_token(self) -> None:
+        '''トークンのエンドポイントにrefresh_tokenを送信しトークンを更新する
         '''
         basic_user_and_pasword = base64.b64encode('{}:{}'.format(self.client_id, self.client_secret).encode('utf-8'))
-        url = 'https://api.fitbit.com/oauth2/token'
+        url = self.api_base + '/oauth2/token'
         data = {
             'grant_type': 'refresh_token',
             'refresh_token': self.refresh_token
@@ -149,16 +615,13 @@ class Fitbit:
             'Authorization': 'Basic ' + basic_user_and_pasword.decode('utf-8'),
             'Content-Type': 'application/x-www-form-urlencoded',
         }
-        req = urllib.request.Request(url, data=urllib.parse.urlencode(data).encode(), headers=headers)
-        try:
-            with urllib.request.urlopen(req) as res:
-                body = res.read()
-        except urllib.error.HTTPError as e:
-            print('Isnt the refresh token expired? Try method "fetch_authorization_code" & "fetch_tokens".')
-            raise e
-        res_dict = eval(body.decode('utf-8'))
-        self.access_token = res_dict['access_token']
-        self.refresh_token = res_dict['refresh_token']
+        with span('fitbit.refresh_token'):
+            try:
+                body = self._transport().request('POST', url, headers=headers, data=urllib.parse.urlencode(data).encode()).body
+            except urllib.error.HTTPError as e:
+                print('Isnt the refresh token expired? Try method "fetch_authorization_code" & "fetch_tokens".')
+                raise e
+            self._set_tokens(body)
 
     def fetch_tokens(
         self,
@@ -179,7 +642,7 @@ class Fitbit:
 
         # access_tokenとrefresh_tokenの取得
         basic_user_and_pasword = base64.b64encode('{}:{}'.format(self.client_id, self.client_secret).encode('utf-8'))
-        url = 'https://api.fitbit.com/oauth2/token'
+        url = self.api_base + '/oauth2/token'
         data = {
             'clientId': self.client_id,
             'grant_type': 'authorization_code',
@@ -190,16 +653,12 @@ class Fitbit:
             'Authorization': 'Basic ' + basic_user_and_pasword.decode('utf-8'),
             'Content-Type': 'application/x-www-form-urlencoded',
         }
-        req = urllib.request.Request(url, data=urllib.parse.urlencode(data).encode(), headers=headers)
         try:
-            with urllib.request.urlopen(req) as res:
-                body = res.read()
+            body = self._transport().request('POST', url, headers=headers, data=urllib.parse.urlencode(data).encode()).body
         except urllib.error.HTTPError as e:
             print('Isnt the authorization code expired? Try method "fetch_authorization_code".')
             raise e
-        res_dict = eval(body.decode('utf-8'))
-        self.access_token = res_dict['access_token']
-        self.refresh_token = res_dict['refresh_token']
+        self._set_tokens(body)
 
     def fetch_authorization_code(
         self,
@@ -1,24 +1,311 @@
-from google.cloud import storage
+import base64
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from src.retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+_storage_client: Optional['storage.Client'] = None
+_storage_client_lock = threading.Lock()
+
+# チェックサムを求める際に1度に読み込むサイズ
+_CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+
+class _SequentialReader:
+    '''先頭から順に読み込むだけのストリームを, resumable uploadで扱えるようにする
+
+    直前に読み込んだ範囲のみを保持し, その範囲内であればtell/seekできるようにする(chunkの再送用)
+    '''
+
+    def __init__(self, raw: IO[bytes]) -> None:
+        self._raw = raw
+        self._pos = 0
+        self._buffer_start = 0
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        buffer_end = self._buffer_start + len(self._buffer)
+        head = b''
+        if self._pos < buffer_end:
+            # seekで戻った範囲は保持しているデータから返す
+            offset = self._pos - self._buffer_start
+            head = self._buffer[offset:] if size < 0 else self._buffer[offset:offset + size]
+        rest_size = -1 if size < 0 else size - len(head)
+        tail = self._raw.read(rest_size) if rest_size != 0 else b''
+        data = head + (tail or b'')
+        self._buffer_start, self._buffer = self._pos, data
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence != io.SEEK_SET or not (self._buffer_start <= offset <= self._buffer_start + len(self._buffer)):
+            raise io.UnsupportedOperation('can only seek within the last chunk.')
+        self._pos = offset
+        return self._pos
+
+
+@dataclass
+class UploadResult:
+    '''gcsへの転送結果
+
+    Attributes:
+        to_path (str): 転送先のパス
+        status (str): "uploaded", "skipped"(同一のデータが格納済み)または"failed"
+        error (Optional[Exception]): 転送に失敗した場合の例外
+    '''
+    to_path: str
+    status: str
+    error: Optional[Exception] = None
+
+
+def md5_base64(data: bytes) -> str:
+    '''gcsのmd5_hashと同じ形式(base64)でmd5を求める
+
+    Args:
+        data (bytes): 対象のデータ
+
+    Returns:
+        str: base64で表したmd5
+    '''
+    return base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+
+
+def _checksums(stream: IO[bytes]) -> Tuple[int, str, str]:
+    '''ストリームを読み込み, gcsのメタデータと同じ形式(base64)のmd5とcrc32cを求める
+
+    Args:
+        stream (IO[bytes]): 対象のストリーム
+
+    Returns:
+        Tuple[int, str, str]: サイズ, md5, crc32c
+    '''
+    # NOTE: google-crc32cはgcsのSDKの依存パッケージのため, SDKと同じく使用する時に読み込む
+    import google_crc32c
+
+    size = 0
+    md5 = hashlib.md5()
+    crc32c = google_crc32c.Checksum()
+    while True:
+        chunk = stream.read(_CHECKSUM_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        md5.update(chunk)
+        crc32c.update(chunk)
+    return size, base64.b64encode(md5.digest()).decode('utf-8'), base64.b64encode(crc32c.digest()).decode('utf-8')
+
+
+def _is_identical(bucket: 'storage.Bucket', to_path: str, stream: IO[bytes]) -> bool:
+    '''格納済みのオブジェクトのメタデータとストリームのチェックサムを比較する
+
+    md5を持たないオブジェクト(composite objectなど)はcrc32cで比較する
+
+    Args:
+        bucket (storage.Bucket): バケット
+        to_path (str): 比較するオブジェクトのパス
+        stream (IO[bytes]): 比較するデータのストリーム
+
+    Returns:
+        bool: 同一のデータが格納済みであればTrue
+    '''
+    blob = bucket.get_blob(to_path)
+    if blob is None:
+        return False
+    size, md5, crc32c = _checksums(stream)
+    if blob.size != size:
+        return False
+    if blob.md5_hash is not None:
+        return blob.md5_hash == md5
+    return blob.crc32c is not None and blob.crc32c == crc32c
+
+
+def _retry_kwargs(retry_policy: Optional[RetryPolicy]) -> Dict[str, Any]:
+    '''転送時に与える再送の方針, Noneならばgcsのクライアントの既定に従う
+    '''
+    return {} if retry_policy is None else {'retry': retry_policy.gcs_retry()}
+
+
+def get_storage_client() -> 'storage.Client':
+    '''プロセス内で共有するgcsのクライアントを返す, 初回のみ生成する
+
+    Returns:
+        storage.Client: gcsのクライアント
+    '''
+    global _storage_client
+    with _storage_client_lock:
+        if _storage_client is None:
+            # NOTE: 起動時間を短縮するため, gcsのSDKは初めて使用する時に読み込む
+            from google.cloud import storage
+
+            # If you don't specify credentials when constructing the client, the
+            # client library will look for credentials in the environment.
+            # Error: google.auth.exceptions.DefaultCredentialsError
+            _storage_client = storage.Client()
+        return _storage_client
 
 
 def store_gcs(
     from_path: str,
     to_path: str,
-    bucket_name: str = 'export_from_devices'
-) -> None:
+    bucket_name: str = 'export_from_devices',
+    client: Optional['storage.Client'] = None,
+    skip_if_identical: bool = False,
+    retry_policy: Optional[RetryPolicy] = None
+) -> UploadResult:
     '''from_pathのデータをGCS上の指定したバケットのto_pathへ格納する
 
     Args:
         from_path (str): 転送元のデータのパス
         to_path (str): 転送先のパス
         bucket_name (str, optional): バケット名. Defaults to 'exported_from_api'.
+        client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+        skip_if_identical (bool, optional): Trueならば同一のデータが格納済みの場合は転送しない. Defaults to False.
+        retry_policy (Optional[RetryPolicy], optional): 一時的な失敗を再送する方針, Noneならばクライアントの既定に従う. Defaults to None.
+
+    Returns:
+        UploadResult: 転送結果, 転送に失敗した場合は例外を送出する
+    '''
+    storage_client = client if client is not None else get_storage_client()
+
+    bucket = storage_client.bucket(bucket_name)
+    if skip_if_identical:
+        with open(from_path, 'rb') as f:
+            if _is_identical(bucket, to_path, f):
+                return UploadResult(to_path, 'skipped')
+    blob = bucket.blob(to_path)
+
+    blob.upload_from_filename(from_path, **_retry_kwargs(retry_policy))
+    return UploadResult(to_path, 'uploaded')
+
+
+def store_gcs_data(
+    data: Union[bytes, IO[bytes]],
+    to_path: str,
+    bucket_name: str = 'export_from_devices',
+    content_type: str = 'application/octet-stream',
+    client: Optional['storage.Client'] = None,
+    chunk_size: Optional[int] = None,
+    skip_if_identical: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    content_encoding: Optional[str] = None
+) -> UploadResult:
+    '''メモリ上のデータをファイルを経由せずにGCS上の指定したバケットのto_pathへ格納する
+
+    Args:
+        data (Union[bytes, IO[bytes]]): 転送するデータ, bytesもしくはバイナリモードのファイルオブジェクト
+        to_path (str): 転送先のパス
+        bucket_name (str, optional): バケット名. Defaults to 'export_from_devices'.
+        content_type (str, optional): 転送するデータのContent-Type. Defaults to 'application/octet-stream'.
+        client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+        chunk_size (Optional[int], optional): 指定した場合はファイルオブジェクトをchunk_sizeずつ読み込みながら転送する,
+            256KBの倍数で入力. Defaults to None.
+        skip_if_identical (bool, optional): Trueならば同一のデータが格納済みの場合は転送しない,
+            ファイルオブジェクトはseek可能なものに限る. Defaults to False.
+        retry_policy (Optional[RetryPolicy], optional): 一時的な失敗を再送する方針, Noneならばクライアントの既定に従う. Defaults to None.
+        content_encoding (Optional[str], optional): 圧縮したデータのContent-Encoding("gzip"など). Defaults to None.
+
+    Returns:
+        UploadResult: 転送結果, 転送に失敗した場合は例外を送出する
     '''
-    # If you don't specify credentials when constructing the client, the
-    # client library will look for credentials in the environment.
-    # Error: google.auth.exceptions.DefaultCredentialsError
-    storage_client = storage.Client()
+    # 引数chunk_sizeの値確認
+    if chunk_size is not None:
+        if type(chunk_size) != int:
+            raise TypeError('"chunk_size" type must be int.')
+        if chunk_size <= 0 or chunk_size % (256 * 1024) != 0:
+            raise ValueError('"chunk_size" must be a multiple of 256KB.')
+    # 引数skip_if_identicalの値確認
+    # NOTE: チェックサムを求めるために読み込んだ後, 先頭に戻して転送する
+    if skip_if_identical and not isinstance(data, bytes) and not getattr(data, 'seekable', lambda: False)():
+        raise ValueError('"skip_if_identical" requires bytes or a seekable file object.')
+
+    storage_client = client if client is not None else get_storage_client()
 
     bucket = storage_client.bucket(bucket_name)
+    if skip_if_identical:
+        stream = io.BytesIO(data) if isinstance(data, bytes) else data
+        start = stream.tell()
+        if _is_identical(bucket, to_path, stream):
+            return UploadResult(to_path, 'skipped')
+        stream.seek(start)
     blob = bucket.blob(to_path)
+    if content_encoding is not None:
+        blob.content_encoding = content_encoding
+
+    retry_kwargs = _retry_kwargs(retry_policy)
+    if isinstance(data, bytes):
+        blob.upload_from_string(data, content_type=content_type, **retry_kwargs)
+    elif chunk_size is not None:
+        # NOTE: sizeを与えるとmultipart uploadとなり全体を読み込むため, sizeを与えずresumable uploadとする
+        # NOTE: 再送はchunkごとに行われ, _SequentialReaderは直前のchunkの範囲でseekできる
+        blob.chunk_size = chunk_size
+        blob.upload_from_file(_SequentialReader(data), content_type=content_type, **retry_kwargs)
+    else:
+        blob.upload_from_file(data, content_type=content_type, **retry_kwargs)
+    return UploadResult(to_path, 'uploaded')
+
+
+def store_gcs_batch(
+    items: Sequence[Tuple[Union[str, bytes], str]],
+    bucket_name: str = 'export_from_devices',
+    max_workers: int = 8,
+    client: Optional['storage.Client'] = None,
+    skip_if_identical: bool = False,
+    retry_policy: Optional[RetryPolicy] = None
+) -> List[UploadResult]:
+    '''複数のデータを1つのクライアントで並行してGCSへ格納する, 一部の転送に失敗しても残りの転送は継続する
+
+    Args:
+        items (Sequence[Tuple[Union[str, bytes], str]]): (転送元のデータのパスもしくはbytes, 転送先のパス)の一覧
+        bucket_name (str, optional): バケット名. Defaults to 'export_from_devices'.
+        max_workers (int, optional): 並行して転送する数. Defaults to 8.
+        client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+        skip_if_identical (bool, optional): Trueならば同一のデータが格納済みの場合は転送しない. Defaults to False.
+        retry_policy (Optional[RetryPolicy], optional): 一時的な失敗を再送する方針, Noneならばクライアントの既定に従う. Defaults to None.
+
+    Returns:
+        List[UploadResult]: itemsと同じ順序の転送結果
+    '''
+    # 引数max_workersの値確認
+    if type(max_workers) != int:
+        raise TypeError('"max_workers" type must be int.')
+    if max_workers < 1:
+        raise ValueError('"max_workers" must be over 1.')
+
+    storage_client = client if client is not None else get_storage_client()
+    bucket = storage_client.bucket(bucket_name)
+    retry_kwargs = _retry_kwargs(retry_policy)
+
+    def upload(item: Tuple[Union[str, bytes], str]) -> UploadResult:
+        source, to_path = item
+        try:
+            if skip_if_identical:
+                if isinstance(source, bytes):
+                    identical = _is_identical(bucket, to_path, io.BytesIO(source))
+                else:
+                    with open(source, 'rb') as f:
+                        identical = _is_identical(bucket, to_path, f)
+                if identical:
+                    return UploadResult(to_path, 'skipped')
+            blob = bucket.blob(to_path)
+            if isinstance(source, bytes):
+                blob.upload_from_string(source, **retry_kwargs)
+            else:
+                blob.upload_from_filename(source, **retry_kwargs)
+        except Exception as e:
+            return UploadResult(to_path, 'failed', e)
+        return UploadResult(to_path, 'uploaded')
 
-    blob.upload_from_filename(from_path)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(upload, items))
@@ -1,17 +1,24 @@
+import datetime
 import json
 import re
 import urllib.parse
-import urllib.request
 from dataclasses import dataclass
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
-import pandas as pd
-from pandas.tseries.offsets import DateOffset
+from src.dates import now_jst, parse_jst, subtract_months
+from src.transport import HttpTransport, default_transport
+
+# 1回のリクエストでまとめて取得する日数の上限(APIの上限である3ヶ月のうち最も短い場合の日数)
+RANGE_MAX_DAYS = 89
 
 
 @dataclass
 class HealthPlanet:
     access_token: str
+    transport: Optional[HttpTransport] = None
+    api_base: str = 'https://www.healthplanet.jp'
+    # NOTE: 取得できる期間の確認に使用する現在時刻, cassetteの再生では記録した時刻とする
+    now: Callable[[], datetime.datetime] = now_jst
 
     def fetch_body_composition_data(self, from_date: str, to_date: str) -> Dict[str, Any]:
         '''体重と体脂肪率を取得し辞書型で取得する
@@ -42,11 +49,11 @@ class HealthPlanet:
         # 日付の前処理
         from_dt = from_date.replace('-', '') + '000000'
         to_dt = to_date.replace('-', '') + '235959'
-        from_datetime = pd.to_datetime(from_dt).tz_localize('Asia/Tokyo')
-        to_datetime = pd.to_datetime(to_dt).tz_localize('Asia/Tokyo')
+        from_datetime = parse_jst(from_dt, '%Y%m%d%H%M%S')
+        to_datetime = parse_jst(to_dt, '%Y%m%d%H%M%S')
         if from_datetime > to_datetime:
             raise ValueError('"to_date" is greater than "from_date".')
-        limit_datetime = pd.Timestamp.today(tz='Asia/Tokyo') - DateOffset(months=3)
+        limit_datetime = subtract_months(self.now(), 3)
         if from_datetime < limit_datetime:
             raise ValueError('"from_date" is over 3 month ago.')
 
@@ -59,11 +66,37 @@ class HealthPlanet:
             'tag': '6021,6022'
         }
         p = urllib.parse.urlencode(params)
-        url = 'https://www.healthplanet.jp/status/innerscan.json/?' + p
-        with urllib.request.urlopen(url) as res:
-            result = res.read()
+        url = self.api_base + '/status/innerscan.json/?' + p
+        transport = self.transport if self.transport is not None else default_transport()
+        result = transport.request('GET', url).body
         return json.loads(result)
 
+    def fetch_body_composition_data_by_date(self, from_date: str, to_date: str) -> Dict[str, Dict[str, Any]]:
+        '''期間の体組成データを1回のリクエストで取得し, 測定日(Asia/Tokyo)ごとに分割する
+
+        Args:
+            from_date (str): データを取得したい期間の開始日、"yyyy-mm-dd"形式で入力
+            to_date (str): データを取得したい期間の終了日、"yyyy-mm-dd"形式で入力
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 日付("yyyy-mm-dd")ごとの体組成データ, 測定のない日もdataを空として含む
+        '''
+        body_compositions = self.fetch_body_composition_data(from_date, to_date)
+
+        # 測定日ごとに分割
+        # NOTE: 測定日時("yyyymmddHHMM")はAsia/Tokyoの時刻のため, 先頭8桁を測定日とする
+        start = datetime.date.fromisoformat(from_date)
+        end = datetime.date.fromisoformat(to_date)
+        records: Dict[str, List[Dict[str, str]]] = {
+            (start + datetime.timedelta(days=i)).isoformat(): [] for i in range((end - start).days + 1)
+        }
+        for r in body_compositions.get('data', []):
+            day_str = '{}-{}-{}'.format(r['date'][:4], r['date'][4:6], r['date'][6:8])
+            if day_str in records:
+                records[day_str].append(r)
+        header = {k: v for k, v in body_compositions.items() if k != 'data'}
+        return {day_str: dict(header, data=data) for day_str, data in records.items()}
+
 
 if __name__ == '__main__':
     # 以下，ローカル環境で動作検証時に使用
@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import json
+import threading
+from typing import IO, TYPE_CHECKING, Any, Dict, Optional, Set
+
+from src.backfill import WorkUnit
+from src.storage import GcsBackend, PreconditionError, StorageBackend
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+
+class HashingReader:
+    '''読み込んだデータのサイズとmd5を求めながらストリームを読み込む
+    '''
+
+    def __init__(self, raw: IO[bytes]) -> None:
+        '''
+        Args:
+            raw (IO[bytes]): 読み込むストリーム
+        '''
+        self._raw = raw
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        # NOTE: http.client.HTTPResponseはread(-1)を全体の読み込みとして扱わないため, 未指定はNoneのまま渡す
+        chunk = self._raw.read() if size is None or size < 0 else self._raw.read(size)
+        self._md5.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    @property
+    def md5(self) -> str:
+        '''これまでに読み込んだデータのmd5(base64)
+        '''
+        return base64.b64encode(self._md5.digest()).decode('utf-8')
+
+
+class Manifest:
+    '''gcs(もしくはstorageで指定した保存先)に保存済みのデータを(source, category, date)ごとに索引したjsonを, 保存先で管理する
+
+    jsonの形式は{"version": 1, "units": {"source/category/date": {"保存先のパス": {"size": int, "md5": str}}}}とする
+    '''
+
+    def __init__(
+        self,
+        bucket_name: str = 'export_from_devices',
+        path: str = 'manifest.json',
+        client: Optional['storage.Client'] = None,
+        storage: Optional[StorageBackend] = None
+    ) -> None:
+        '''
+        Args:
+            bucket_name (str, optional): バケット名. Defaults to 'export_from_devices'.
+            path (str, optional): バケット上のmanifestのパス. Defaults to 'manifest.json'.
+            client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+            storage (Optional[StorageBackend], optional): manifestの保存先, Noneならばbucket_nameのバケットとする. Defaults to None.
+        '''
+        self.bucket_name = bucket_name
+        self.path = path
+        self.storage = storage if storage is not None else GcsBackend(bucket_name, client)
+        self._lock = threading.Lock()
+        self._units: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._objects: Set[str] = set()
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._generation = 0
+
+    def load(self) -> 'Manifest':
+        '''バケット上のmanifestを読み込む, 存在しなければ空とする
+
+        Returns:
+            Manifest: 読み込んだmanifest自身
+        '''
+        info = self.storage.stat(self.path)
+        if info is None:
+            units, generation = {}, 0
+        else:
+            # NOTE: 読み込んだデータがgenerationより新しい場合も, commitの条件が一致せず読み込み直すため更新は失われない
+            generation = info.generation
+            units = json.loads(self.storage.get(self.path))['units']
+        with self._lock:
+            self._generation = generation
+            self._units = units
+            for key, objects in self._pending.items():
+                self._units.setdefault(key, {}).update(objects)
+            self._objects = {p for objects in self._units.values() for p in objects}
+        return self
+
+    def contains(self, unit: WorkUnit) -> bool:
+        '''作業単位のデータが保存済みか確認する
+
+        Args:
+            unit (WorkUnit): 作業単位
+
+        Returns:
+            bool: 保存済みであればTrue
+        '''
+        return unit.key in self._units
+
+    def contains_object(self, path: str) -> bool:
+        '''保存先のパスにデータが保存済みか確認する
+
+        Args:
+            path (str): バケット上のパス
+
+        Returns:
+            bool: 保存済みであればTrue
+        '''
+        return path in self._objects
+
+    def get(self, unit: WorkUnit) -> Dict[str, Dict[str, Any]]:
+        '''作業単位で保存したデータのパスとサイズ, md5を返す
+
+        Args:
+            unit (WorkUnit): 作業単位
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 保存先のパスと{"size": int, "md5": str}の辞書
+        '''
+        return dict(self._units.get(unit.key, {}))
+
+    def record(self, unit: WorkUnit, path: str, size: int, md5: str) -> None:
+        '''保存したデータを記録する, バケットへの反映はcommitで行う
+
+        Args:
+            unit (WorkUnit): 作業単位
+            path (str): バケット上のパス
+            size (int): データのサイズ(バイト)
+            md5 (str): base64で表したデータのmd5
+        '''
+        entry = {'size': size, 'md5': md5}
+        with self._lock:
+            self._units.setdefault(unit.key, {})[path] = entry
+            self._pending.setdefault(unit.key, {})[path] = entry
+            self._objects.add(path)
+
+    def commit(self, max_attempts: int = 5) -> bool:
+        '''記録したデータをバケット上のmanifestに反映する
+
+        読み込んだ時点のgenerationを条件に書き込み, 他の実行が先に更新していれば読み込み直して再度書き込む
+
+        Args:
+            max_attempts (int, optional): 書き込みを試みる回数の上限. Defaults to 5.
+
+        Returns:
+            bool: 反映できた(もしくは反映するものがなかった)ならばTrue
+        '''
+        for _ in range(max_attempts):
+            with self._lock:
+                if len(self._pending) == 0:
+                    return True
+                data = json.dumps({'version': 1, 'units': self._units}, sort_keys=True).encode('utf-8')
+                generation = self._generation
+                committed = {k: dict(v) for k, v in self._pending.items()}
+            try:
+                self.storage.put(data, self.path, content_type='application/json', if_generation_match=generation)
+            except PreconditionError:
+                self.load()
+                continue
+            with self._lock:
+                for key, objects in committed.items():
+                    for p in objects:
+                        if self._pending.get(key, {}).get(p) == objects[p]:
+                            del self._pending[key][p]
+                    if key in self._pending and len(self._pending[key]) == 0:
+                        del self._pending[key]
+            # 書き込んだ後のgenerationを取得する
+            self.load()
+        return len(self._pending) == 0
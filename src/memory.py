@@ -0,0 +1,276 @@
+import ctypes
+import functools
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+# cloud functions(第1世代)が関数に割り当てたメモリ(MB)を設定する環境変数
+_LIMIT_ENVS = ('DIETER_MEMORY_LIMIT_MB', 'FUNCTION_MEMORY_MB')
+
+
+def current_rss() -> Optional[int]:
+    '''現在のプロセスのRSSを/proc/self/statmから返す
+
+    Returns:
+        Optional[int]: RSS(バイト), /procの無い環境ではNone
+    '''
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss() -> Optional[int]:
+    '''プロセスを開始してからのRSSの最大値を返す
+
+    Returns:
+        Optional[int]: RSSの最大値(バイト), resourceモジュールの無い環境ではNone
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: ru_maxrssはLinuxではKB, macOSではバイトで返る
+    return value if sys.platform == 'darwin' else value * 1024
+
+
+def memory_limit() -> Optional[int]:
+    '''実行環境のメモリの上限を環境変数DIETER_MEMORY_LIMIT_MBもしくはFUNCTION_MEMORY_MBから返す
+
+    Returns:
+        Optional[int]: メモリの上限(バイト), 環境変数が無ければNone
+    '''
+    for name in _LIMIT_ENVS:
+        value = os.getenv(name)
+        if value:
+            return int(value) * 1024 * 1024
+    return None
+
+
+def release_memory() -> None:
+    '''解放したオブジェクトのメモリをOSへ返す
+
+    循環参照を回収した上で, glibcのmalloc_trimでヒープの空き領域を返却しRSSを減らす(glibc以外では回収のみ)
+    '''
+    gc.collect()
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        # NOTE: CDLL(None)はプロセスに読み込み済みのlibcのシンボルを参照する
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class PayloadLimiter:
+    '''取得したデータを保持する処理(取得から転送まで)を同時にmax_in_flight件までに制限する
+
+    処理を終えるたびにrelease_memoryで解放したメモリをOSへ返し, 次の処理を開始する前のRSSを抑える
+    '''
+
+    def __init__(self, max_in_flight: int = 1, release: Callable[[], None] = release_memory) -> None:
+        '''
+        Args:
+            max_in_flight (int, optional): 同時に実行する処理の上限. Defaults to 1.
+            release (Callable[[], None], optional): 処理を終えるたびに呼ぶ関数. Defaults to release_memory.
+        '''
+        if type(max_in_flight) != int:
+            raise TypeError('"max_in_flight" type must be int.')
+        if max_in_flight < 1:
+            raise ValueError('"max_in_flight" must be over 1.')
+        self.max_in_flight = max_in_flight
+        self.release = release
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+
+    def wrap(self, fn: Callable[..., T]) -> Callable[..., T]:
+        '''fnを上限の範囲で実行し, 終えたらメモリを解放する関数を返す
+
+        Args:
+            fn (Callable[..., T]): 取得したデータを保持する処理
+
+        Returns:
+            Callable[..., T]: 上限を超える場合は他の処理が終わるまで待ってからfnを実行する関数
+        '''
+        @functools.wraps(fn)
+        def wrapped(*args: Any, **kwargs: Any) -> T:
+            with self._semaphore:
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.release()
+
+        return wrapped
+
+
+# NOTE: 実行中の区間は同じ値でも別のものとして扱うため, 値で比較しない
+@dataclass(eq=False)
+class MemoryUsage:
+    '''begin(スパンの開始)からのメモリ使用量
+
+    Attributes:
+        rss_start (Optional[int]): 開始時のRSS(バイト)
+        rss_peak (Optional[int]): 開始から計測したRSSの最大値(バイト)
+        alloc_start (Optional[int]): 開始時にtracemallocで追跡していたメモリ(バイト)
+        alloc_peak (Optional[int]): 開始から計測したtracemallocで追跡していたメモリの最大値(バイト)
+    '''
+    rss_start: Optional[int] = None
+    rss_peak: Optional[int] = None
+    alloc_start: Optional[int] = None
+    alloc_peak: Optional[int] = None
+
+    def update(self, now: 'MemoryUsage') -> None:
+        '''計測した使用量で最大値を更新する
+        '''
+        if now.rss_peak is not None:
+            self.rss_peak = now.rss_peak if self.rss_peak is None else max(self.rss_peak, now.rss_peak)
+        if now.alloc_peak is not None:
+            self.alloc_peak = now.alloc_peak if self.alloc_peak is None else max(self.alloc_peak, now.alloc_peak)
+
+    def to_attributes(self) -> Dict[str, int]:
+        '''スパンに追加する属性に変換する, 計測していない値は含めない
+        '''
+        attributes = {}
+        if self.rss_start is not None:
+            attributes['rss_start_bytes'] = self.rss_start
+            attributes['rss_peak_bytes'] = self.rss_peak
+        if self.alloc_start is not None:
+            attributes['alloc_peak_bytes'] = self.alloc_peak - self.alloc_start
+        return attributes
+
+
+class MemoryMonitor:
+    '''一定間隔でRSS(use_tracemallocならばpythonのオブジェクトに割り当てたメモリも)を計測し, 区間ごとの最大値を求める
+
+    並行して実行している区間はそれぞれの開始からの最大値とするため, 他の区間で使用したメモリも含む
+    '''
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        use_tracemalloc: bool = False,
+        rss: Callable[[], Optional[int]] = current_rss
+    ) -> None:
+        '''
+        Args:
+            interval (float, optional): 計測する間隔(秒). Defaults to 0.05.
+            use_tracemalloc (bool, optional): tracemallocでpythonのオブジェクトに割り当てたメモリも計測するか,
+                割り当てのたびに記録するため処理が遅くなる. Defaults to False.
+            rss (Callable[[], Optional[int]], optional): 現在のRSSを返す関数. Defaults to current_rss.
+        '''
+        if type(interval) not in (int, float):
+            raise TypeError('"interval" type must be float.')
+        if interval <= 0:
+            raise ValueError('"interval" must be over 0.')
+        self.interval = interval
+        self.use_tracemalloc = use_tracemalloc
+        self.rss = rss
+        self.total = MemoryUsage()
+        self._active: List[MemoryUsage] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> 'MemoryMonitor':
+        self.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        '''計測するスレッドを開始する
+        '''
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='memory-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''計測するスレッドを停止する, startで開始したtracemallocも停止する
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sample()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def _measure(self) -> MemoryUsage:
+        '''現在のRSSとtracemallocで追跡しているメモリを計測する
+        '''
+        rss = self.rss()
+        alloc = tracemalloc.get_traced_memory()[0] if self.use_tracemalloc and tracemalloc.is_tracing() else None
+        return MemoryUsage(rss, rss, alloc, alloc)
+
+    def sample(self) -> None:
+        '''現在の使用量を計測し, 全体と実行中の区間の最大値を更新する
+        '''
+        now = self._measure()
+        with self._lock:
+            for usage in [self.total] + self._active:
+                usage.update(now)
+
+    def begin(self) -> MemoryUsage:
+        '''区間を開始する
+
+        Returns:
+            MemoryUsage: endに渡す区間の使用量
+        '''
+        usage = self._measure()
+        with self._lock:
+            self._active.append(usage)
+        return usage
+
+    def end(self, usage: MemoryUsage) -> MemoryUsage:
+        '''区間を終了し, 開始からの最大値を返す
+
+        Args:
+            usage (MemoryUsage): beginが返した区間の使用量
+
+        Returns:
+            MemoryUsage: 区間の開始時と最大の使用量
+        '''
+        self.sample()
+        with self._lock:
+            self._active.remove(usage)
+        return usage
+
+    def summary(self, limit: Optional[int] = None) -> Dict[str, Optional[int]]:
+        '''実行全体の最大の使用量と, メモリの上限までの余裕を返す
+
+        Args:
+            limit (Optional[int], optional): メモリの上限(バイト), Noneならば環境変数から取得する. Defaults to None.
+
+        Returns:
+            Dict[str, Optional[int]]: 計測したRSSの最大値, プロセスのRSSの最大値, 上限, 上限までの余裕(上限が不明ならばNone)
+        '''
+        limit = limit if limit is not None else memory_limit()
+        peak = max_rss()
+        if peak is None or (self.total.rss_peak is not None and self.total.rss_peak > peak):
+            peak = self.total.rss_peak
+        summary = {
+            'peak_rss_bytes': self.total.rss_peak,
+            'max_rss_bytes': peak,
+            'limit_bytes': limit,
+            'headroom_bytes': limit - peak if limit is not None and peak is not None else None,
+        }
+        if self.total.alloc_peak is not None:
+            summary['peak_alloc_bytes'] = self.total.alloc_peak
+        return summary
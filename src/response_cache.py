@@ -0,0 +1,193 @@
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from typing import Callable, List, Mapping, NamedTuple, Optional, Tuple
+
+from src.dates import JST, today_jst
+
+# 日付の形式
+_DATE_PATTERN = re.compile(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$')
+
+
+class CachedResponse(NamedTuple):
+    '''キャッシュしたレスポンス
+
+    Attributes:
+        body (bytes): レスポンスボディ
+        etag (Optional[str]): レスポンスのETag, 条件付きリクエストのIf-None-Matchに使用する
+        last_modified (Optional[str]): レスポンスのLast-Modified, 条件付きリクエストのIf-Modified-Sinceに使用する
+        stored_at (float): 保存(もしくは再検証)した時刻(UNIX時間)
+    '''
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+    def conditional_headers(self) -> dict:
+        '''再検証する条件付きリクエストのヘッダを返す, APIがETag, Last-Modifiedを返さなければ空とする
+        '''
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    '''APIのレスポンスを(エンドポイント, 日付)ごとにローカルのファイルへ保存する
+
+    日付が確定期間(settle_days)より前のデータのうち, 確定期間を過ぎてから保存したものは変更されないものとして再検証せずに使用し,
+    それ以降のデータは条件付きリクエストで再検証する. evictで保存期間と合計サイズの上限を超えたものを削除する
+    '''
+
+    def __init__(
+        self,
+        directory: str = '.cache/responses',
+        settle_days: int = 7,
+        max_age_days: int = 400,
+        max_bytes: int = 256 * 1024 * 1024,
+        today: Callable[[], datetime.date] = today_jst,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        '''
+        Args:
+            directory (str, optional): キャッシュを保存するディレクトリ. Defaults to '.cache/responses'.
+            settle_days (int, optional): この日数より前の日付のデータは確定したものとして再検証しない. Defaults to 7.
+            max_age_days (int, optional): 保存してからこの日数を超えたものをevictで削除する. Defaults to 400.
+            max_bytes (int, optional): evictで保存した時刻の古いものから削除し合計サイズをこの値以下にする. Defaults to 256MiB.
+            today (Callable[[], datetime.date], optional): 今日の日付を返す関数. Defaults to today_jst.
+            clock (Callable[[], float], optional): 現在時刻(UNIX時間)を返す関数. Defaults to time.time.
+        '''
+        for name, value in [('settle_days', settle_days), ('max_age_days', max_age_days), ('max_bytes', max_bytes)]:
+            if type(value) != int:
+                raise TypeError('"{}" type must be int.'.format(name))
+            if value < 0:
+                raise ValueError('"{}" must be over 0.'.format(name))
+        self.directory = directory
+        self.settle_days = settle_days
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.today = today
+        self.clock = clock
+        self.hits = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+
+    def _path(self, endpoint: str, date: str) -> str:
+        '''エンドポイントと日付からファイルのパスを返す
+        '''
+        if not _DATE_PATTERN.search(date):
+            raise ValueError('"date" must be yyyy-mm-dd.')
+        return os.path.join(self.directory, urllib.parse.quote(endpoint, safe=''), date + '.cache')
+
+    def is_settled(self, date: str, stored_at: Optional[float] = None) -> bool:
+        '''日付が確定期間より前であり, データが変更されないとみなせるか返す
+
+        stored_atを与えた場合は, 確定期間を過ぎてから保存(もしくは再検証)したレスポンスのみ変更されないとみなす
+        (確定する前に保存したレスポンスは, 後から同期された記録を含まない可能性がある)
+
+        Args:
+            date (str): データの日付, "yyyy-mm-dd"形式
+            stored_at (Optional[float], optional): レスポンスを保存した時刻(UNIX時間). Defaults to None.
+
+        Returns:
+            bool: 確定期間より前(stored_atを与えた場合は確定期間を過ぎてから保存したもの)ならばTrue
+        '''
+        settled_from = datetime.datetime.strptime(date, '%Y-%m-%d').date() + datetime.timedelta(days=self.settle_days)
+        if settled_from >= self.today():
+            return False
+        return stored_at is None or datetime.datetime.fromtimestamp(stored_at, tz=JST).date() >= settled_from
+
+    def get(self, endpoint: str, date: str) -> Optional[CachedResponse]:
+        '''キャッシュしたレスポンスを返す
+
+        Args:
+            endpoint (str): エンドポイントの名前
+            date (str): データの日付, "yyyy-mm-dd"形式
+
+        Returns:
+            Optional[CachedResponse]: キャッシュしたレスポンス, 存在しないか保存期間を過ぎていればNone
+        '''
+        path = self._path(endpoint, date)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if self.clock() - meta['stored_at'] > self.max_age_days * 86400:
+            return None
+        return CachedResponse(body, meta.get('etag'), meta.get('last_modified'), meta['stored_at'])
+
+    def put(self, endpoint: str, date: str, body: bytes, headers: Optional[Mapping[str, str]] = None) -> None:
+        '''レスポンスを保存する
+
+        Args:
+            endpoint (str): エンドポイントの名前
+            date (str): データの日付, "yyyy-mm-dd"形式
+            body (bytes): レスポンスボディ
+            headers (Optional[Mapping[str, str]], optional): レスポンスヘッダ, ETagとLast-Modifiedを保存する. Defaults to None.
+        '''
+        path = self._path(endpoint, date)
+        meta = {
+            'stored_at': self.clock(),
+            'etag': headers.get('ETag') if headers is not None else None,
+            'last_modified': headers.get('Last-Modified') if headers is not None else None,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # NOTE: 並行して書き込んでも壊れたファイルを読み込まないよう, スレッドごとの一時ファイルから置き換える
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            f.write(body)
+        os.replace(tmp_path, path)
+        # NOTE: evictは更新時刻で判断するため, 保存した時刻に揃える
+        os.utime(path, (meta['stored_at'], meta['stored_at']))
+
+    def touch(self, endpoint: str, date: str, cached: CachedResponse) -> None:
+        '''再検証でデータが変更されていなかったレスポンスの保存時刻を更新する
+        '''
+        self.put(endpoint, date, cached.body, {
+            k: v for k, v in [('ETag', cached.etag), ('Last-Modified', cached.last_modified)] if v is not None
+        })
+
+    def record_hit(self, revalidated: bool = False) -> None:
+        '''キャッシュを使用した件数を記録する
+        '''
+        with self._lock:
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.hits += 1
+
+    def evict(self) -> List[str]:
+        '''保存期間を過ぎたものと, 合計サイズの上限を超えた分を保存した時刻の古いものから削除する
+
+        Returns:
+            List[str]: 削除したファイルのパス
+        '''
+        entries: List[Tuple[float, int, str]] = []
+        if os.path.isdir(self.directory):
+            for endpoint_dir in os.scandir(self.directory):
+                if not endpoint_dir.is_dir():
+                    continue
+                for entry in os.scandir(endpoint_dir.path):
+                    if entry.is_file() and entry.name.endswith('.cache'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        removed = []
+        expires_at = self.clock() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if mtime >= expires_at and total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed.append(path)
+        return removed
@@ -0,0 +1,173 @@
+import email.utils
+import random
+import threading
+import time
+import urllib.error
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+# 冪等なHTTPメソッド, これ以外はリクエストが処理されていないことが明らかな場合のみ再送する
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class CircuitOpenError(urllib.error.URLError):
+    '''接続先の障害が続いているため, リクエストを送信せずに失敗させたことを表す例外
+    '''
+
+    def __init__(self, host: str, retry_at: float) -> None:
+        super().__init__('circuit breaker is open for {}'.format(host))
+        self.host = host
+        self.retry_at = retry_at
+
+
+@dataclass
+class RetryPolicy:
+    '''一時的な失敗(5xx, 429, 接続エラー)を指数バックオフとジッタで再送する方針
+
+    Attributes:
+        max_attempts (int): 最初の送信を含めた送信回数の上限
+        base_delay (float): 1回目の再送までの待機時間の基準(秒), 再送ごとに2倍にする
+        max_delay (float): 待機時間の上限(秒)
+        max_retry_after (float): Retry-Afterに従って待機する上限(秒), 超える場合は再送せずに失敗させる
+        retry_statuses (Tuple[int, ...]): 冪等なメソッドで再送するステータスコード
+        non_idempotent_retry_statuses (Tuple[int, ...]): 冪等でないメソッドでも再送するステータスコード(処理されていないことが明らかなもの)
+    '''
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    max_retry_after: float = 60.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+    non_idempotent_retry_statuses: Tuple[int, ...] = (429,)
+    random: Callable[[], float] = field(default=random.random, repr=False, compare=False)
+    clock: Callable[[], float] = field(default=time.time, repr=False, compare=False)
+    sleep: Callable[[float], None] = field(default=time.sleep, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if type(self.max_attempts) != int:
+            raise TypeError('"max_attempts" type must be int.')
+        if self.max_attempts < 1:
+            raise ValueError('"max_attempts" must be over 1.')
+
+    def backoff(self, attempt: int) -> float:
+        '''再送までの待機時間を返す(full jitter)
+
+        Args:
+            attempt (int): 失敗した送信の回数(1以上)
+
+        Returns:
+            float: 0以上min(max_delay, base_delay * 2 ** (attempt - 1))未満の待機時間(秒)
+        '''
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+    def retry_delay(self, method: str, attempt: int, error: Exception) -> Optional[float]:
+        '''失敗したリクエストを再送するか判断し, 再送するまでの待機時間を返す
+
+        Args:
+            method (str): HTTPメソッド
+            attempt (int): 失敗した送信の回数(1以上)
+            error (Exception): 送信時に発生した例外
+
+        Returns:
+            Optional[float]: 再送までの待機時間(秒), 再送しない場合はNone
+        '''
+        if attempt >= self.max_attempts or isinstance(error, CircuitOpenError):
+            return None
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        if isinstance(error, urllib.error.HTTPError):
+            statuses = self.retry_statuses if idempotent else self.non_idempotent_retry_statuses
+            if error.code not in statuses:
+                return None
+            retry_after = self._retry_after(error.headers)
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_retry_after else None
+        elif isinstance(error, urllib.error.URLError):
+            # NOTE: 送信後に接続が切れた場合は処理されたか分からないため, 冪等なメソッドのみ再送する
+            if not idempotent:
+                return None
+        else:
+            return None
+        return self.backoff(attempt)
+
+    def _retry_after(self, headers: Optional[Mapping[str, str]]) -> Optional[float]:
+        '''Retry-Afterヘッダ(秒数もしくはHTTP-date)から待機時間を求める
+        '''
+        value = headers.get('Retry-After') if headers is not None else None
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - self.clock())
+        except (TypeError, ValueError):
+            return None
+
+    def gcs_retry(self) -> Any:
+        '''同じ方針のgoogle-cloud-storageのRetryを返す
+
+        Returns:
+            google.api_core.retry.Retry: gcsのSDKに与えるRetry
+        '''
+        # NOTE: 起動時間を短縮するため, SDKは使用する時に読み込む
+        from google.cloud.storage.retry import DEFAULT_RETRY
+
+        deadline = sum(min(self.max_delay, self.base_delay * 2 ** i) for i in range(self.max_attempts - 1))
+        # NOTE: 再試行するエラーの判定はSDKの既定のRetryのものをそのまま使用する
+        return DEFAULT_RETRY.with_delay(initial=self.base_delay, maximum=self.max_delay, multiplier=2.0).with_deadline(deadline)
+
+
+@dataclass
+class CircuitBreaker:
+    '''接続先ごとに連続した失敗を数え, 閾値を超えたら一定時間リクエストを送信せずに失敗させる
+
+    一定時間が経過した後は1件だけ試しに送信し(half-open), 成功すれば元に戻し失敗すれば再び遮断する
+
+    Attributes:
+        failure_threshold (int): 遮断するまでの連続した失敗の回数
+        reset_timeout (float): 遮断してから試しに送信するまでの時間(秒)
+    '''
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    _failures: Dict[str, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _opened_at: Dict[str, float] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _trial: Dict[str, bool] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def before_request(self, host: str) -> None:
+        '''リクエストを送信する前に呼び, 遮断中であればCircuitOpenErrorを送出する
+
+        Args:
+            host (str): 接続先
+        '''
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return
+            retry_at = opened_at + self.reset_timeout
+            if self.clock() < retry_at or self._trial.get(host, False):
+                raise CircuitOpenError(host, retry_at)
+            self._trial[host] = True
+
+    def record_success(self, host: str) -> None:
+        '''リクエストの成功を記録し, 遮断を解除する
+        '''
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trial.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        '''接続先の障害と考えられる失敗(5xx, 接続エラー)を記録する
+        '''
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._trial.pop(host, False) or self._failures[host] >= self.failure_threshold:
+                self._opened_at[host] = self.clock()
+
+    def is_open(self, host: str) -> bool:
+        '''遮断中であるか返す
+        '''
+        with self._lock:
+            return host in self._opened_at
@@ -0,0 +1,236 @@
+import configparser
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+# 各APIの接続情報のキーと, local.iniにおける(セクション, オプション)の対応
+INI_OPTIONS: Dict[str, Tuple[str, str]] = {
+    'hp-access-token': ('HEALTH PLANET', 'access-token'),
+    'fb-client-id': ('FITBIT', 'client-id'),
+    'fb-client-secret': ('FITBIT', 'client-secret'),
+    'fb-access-token': ('FITBIT', 'access-token'),
+    'fb-refresh-token': ('FITBIT', 'refresh-token'),
+    'fb-expires-at': ('FITBIT', 'expires-at'),
+    'tw-user-id': ('TWITTER', 'user-id'),
+    'tw-beare-token': ('TWITTER', 'escaped-bearer-token')
+}
+# 未設定でもよいキー, 取得元に値が存在しなければ空文字列を返す
+OPTIONAL_KEYS: Tuple[str, ...] = ('fb-expires-at',)
+
+
+class SecretProvider(ABC):
+    '''接続情報を取得・更新し, 取得した値をプロセス内でttl秒間保持する
+
+    取得元ごとの処理はサブクラスの_fetchと_storeで実装する
+    '''
+
+    def __init__(self, ttl: float = 600.0, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        Args:
+            ttl (float, optional): 取得した値を保持する秒数. Defaults to 600.0.
+            clock (Callable[[], float], optional): 現在時刻を返す関数. Defaults to time.monotonic.
+        '''
+        if type(ttl) not in (int, float):
+            raise TypeError('"ttl" type must be int or float.')
+        if ttl < 0:
+            raise ValueError('"ttl" must be over 0.')
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[str, float]] = {}
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        '''複数の値をまとめて取得する, 保持期間内の値は取得元に問い合わせない
+
+        Args:
+            keys (Sequence[str]): 取得するキーの一覧
+
+        Returns:
+            Dict[str, str]: キーと値の辞書
+        '''
+        now = self._clock()
+        with self._lock:
+            values = {k: self._cache[k][0] for k in keys if k in self._cache and self._cache[k][1] > now}
+        missing_keys = [k for k in keys if k not in values]
+        if len(missing_keys) > 0:
+            fetched = self._fetch(missing_keys)
+            expires_at = self._clock() + self.ttl
+            with self._lock:
+                for k, v in fetched.items():
+                    self._cache[k] = (v, expires_at)
+            values.update(fetched)
+        return {k: values[k] for k in keys}
+
+    def get(self, key: str) -> str:
+        '''値を1つ取得する
+
+        Args:
+            key (str): 取得するキー
+
+        Returns:
+            str: 値
+        '''
+        return self.get_many([key])[key]
+
+    def update(self, values: Dict[str, str]) -> None:
+        '''値を取得元に書き込み, 保持している値を無効にする
+
+        Args:
+            values (Dict[str, str]): 書き込むキーと値の辞書
+        '''
+        self._store(values)
+        self.invalidate(values.keys())
+
+    def invalidate(self, keys: Optional[Iterable[str]] = None) -> None:
+        '''保持している値を無効にする
+
+        Args:
+            keys (Optional[Iterable[str]], optional): 無効にするキー, Noneならば全て. Defaults to None.
+        '''
+        with self._lock:
+            if keys is None:
+                self._cache.clear()
+            else:
+                for k in keys:
+                    self._cache.pop(k, None)
+
+    @abstractmethod
+    def _fetch(self, keys: Sequence[str]) -> Dict[str, str]:
+        '''取得元から値を取得する
+        '''
+
+    @abstractmethod
+    def _store(self, values: Dict[str, str]) -> None:
+        '''取得元に値を書き込む
+        '''
+
+
+class IniSecretProvider(SecretProvider):
+    '''ローカル環境のiniファイルから接続情報を取得・更新する
+    '''
+
+    def __init__(self, path: str = './local.ini', ttl: float = 600.0, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        Args:
+            path (str, optional): iniファイルのパス. Defaults to './local.ini'.
+            ttl (float, optional): 取得した値を保持する秒数. Defaults to 600.0.
+            clock (Callable[[], float], optional): 現在時刻を返す関数. Defaults to time.monotonic.
+        '''
+        super().__init__(ttl, clock)
+        self.path = path
+
+    def _read(self) -> configparser.ConfigParser:
+        config_ini = configparser.ConfigParser()
+        config_ini.read(self.path, encoding='utf-8')
+        return config_ini
+
+    def _fetch(self, keys: Sequence[str]) -> Dict[str, str]:
+        config_ini = self._read()
+        return {
+            k: config_ini.get(*INI_OPTIONS[k], fallback='') if k in OPTIONAL_KEYS else config_ini.get(*INI_OPTIONS[k])
+            for k in keys
+        }
+
+    def _store(self, values: Dict[str, str]) -> None:
+        config_ini = self._read()
+        for k, v in values.items():
+            config_ini.set(*INI_OPTIONS[k], v)
+        with open(self.path, 'w') as f:
+            config_ini.write(f)
+
+
+class SecretManagerProvider(SecretProvider):
+    '''GCPのsecret managerから接続情報を取得・更新する
+
+    bundle_secretを指定した場合は, 全ての値をjsonとして格納した1つのsecretから取得する
+    '''
+
+    def __init__(
+        self,
+        project: str,
+        ttl: float = 600.0,
+        max_workers: int = 8,
+        bundle_secret: Optional[str] = None,
+        client: Optional[Any] = None,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        '''
+        Args:
+            project (str): GCPのプロジェクトID
+            ttl (float, optional): 取得した値を保持する秒数. Defaults to 600.0.
+            max_workers (int, optional): 並行して取得するsecretの数. Defaults to 8.
+            bundle_secret (Optional[str], optional): 全ての値をjsonとして格納したsecretの名前. Defaults to None.
+            client (Optional[Any], optional): secret managerのクライアント, Noneならば初めて使用する時に生成する. Defaults to None.
+            clock (Callable[[], float], optional): 現在時刻を返す関数. Defaults to time.monotonic.
+        '''
+        super().__init__(ttl, clock)
+        if type(max_workers) != int:
+            raise TypeError('"max_workers" type must be int.')
+        if max_workers < 1:
+            raise ValueError('"max_workers" must be over 1.')
+        self.project = project
+        self.max_workers = max_workers
+        self.bundle_secret = bundle_secret
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        '''secret managerのクライアント
+        '''
+        if self._client is None:
+            # NOTE: 起動時間を短縮するため, secret managerのSDKは使用する時に読み込む
+            from google.cloud import secretmanager
+            self._client = secretmanager.SecretManagerServiceClient()
+        return self._client
+
+    def _access(self, secret: str) -> str:
+        name = self.client.secret_version_path(self.project, secret, 'latest')
+        response = self.client.access_secret_version(request={'name': name})
+        return response.payload.data.decode('utf-8')
+
+    def _access_optional(self, secret: str) -> str:
+        from google.api_core.exceptions import NotFound
+        try:
+            return self._access(secret)
+        except NotFound:
+            return ''
+
+    def _add_version(self, secret: str, value: str) -> None:
+        # NOTE: 現時点の最新versionを停止した後に新たなversionを追加する
+        from google.api_core.exceptions import NotFound
+        name = self.client.secret_version_path(self.project, secret, 'latest')
+        parent = self.client.secret_path(self.project, secret)
+        try:
+            v_response = self.client.get_secret_version(request={'name': name})
+        except NotFound:
+            # NOTE: 未設定でもよいキーはversionのないsecretを事前に作成しておく, secret自体がなければadd_secret_versionで失敗する
+            if secret not in OPTIONAL_KEYS:
+                raise
+        else:
+            self.client.disable_secret_version(request={'name': v_response.name})
+        self.client.add_secret_version(
+            request={'parent': parent, 'payload': {'data': value.encode('utf-8')}}
+        )
+
+    def _fetch(self, keys: Sequence[str]) -> Dict[str, str]:
+        if self.bundle_secret is not None:
+            bundle = json.loads(self._access(self.bundle_secret))
+            return {k: bundle.get(k, '') if k in OPTIONAL_KEYS else bundle[k] for k in keys}
+
+        def access(secret: str) -> str:
+            return self._access_optional(secret) if secret in OPTIONAL_KEYS else self._access(secret)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(keys))) as executor:
+            return dict(zip(keys, executor.map(access, keys)))
+
+    def _store(self, values: Dict[str, str]) -> None:
+        if self.bundle_secret is not None:
+            bundle = json.loads(self._access(self.bundle_secret))
+            bundle.update(values)
+            self._add_version(self.bundle_secret, json.dumps(bundle))
+            return
+        for k, v in values.items():
+            self._add_version(k, v)
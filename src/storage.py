@@ -0,0 +1,507 @@
+import hashlib
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from src.gcp import UploadResult, get_storage_client, store_gcs_batch, store_gcs_data
+from src.retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+# ストリームを保存する際に1度に読み込むサイズの既定値
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class PreconditionError(Exception):
+    '''if_generation_matchを指定した書き込みで, 保存先のgenerationが一致しない(他の実行が先に更新した)
+    '''
+
+
+@dataclass
+class ObjectInfo:
+    '''保存先のオブジェクトのメタデータ
+
+    Attributes:
+        path (str): オブジェクトのパス
+        size (int): サイズ(バイト)
+        generation (int): 書き込むたびに変わる値, if_generation_matchで条件付きの書き込みに使用する
+        content_encoding (Optional[str]): 圧縮したデータのContent-Encoding, 記録しない保存先ではNone
+    '''
+    path: str
+    size: int
+    generation: int
+    content_encoding: Optional[str] = None
+
+
+def _read_all(data: Union[bytes, IO[bytes]]) -> bytes:
+    '''bytesもしくはファイルオブジェクトのデータを全て読み込む
+    '''
+    return data if isinstance(data, bytes) else data.read()
+
+
+def _md5_of(stream: IO[bytes]) -> str:
+    '''ストリームを読み込みmd5(16進数)を求める
+    '''
+    md5 = hashlib.md5()
+    while True:
+        chunk = stream.read(_COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _file_generation(st: os.stat_result) -> int:
+    '''ファイルのgenerationを求める, 存在しないパスの0とは異なる正の値とする
+
+    NOTE: 一時ファイルを置き換えて書き込むためinodeは書き込むたびに変わり, 更新時刻の分解能が粗くても区別できる
+    '''
+    return (hash((st.st_ino, st.st_mtime_ns)) & ((1 << 62) - 1)) + 1
+
+
+class StorageBackend(ABC):
+    '''取得したデータの保存先, パスは"fitbit/sleep/2021-11-24.json"のように"/"で区切る
+
+    保存先ごとの処理はサブクラスのput, get, stat, list, deleteで実装する
+    '''
+
+    @abstractmethod
+    def put(
+        self,
+        data: Union[bytes, IO[bytes]],
+        path: str,
+        content_type: str = 'application/octet-stream',
+        content_encoding: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        skip_if_identical: bool = False,
+        if_generation_match: Optional[int] = None
+    ) -> UploadResult:
+        '''データを保存する
+
+        Args:
+            data (Union[bytes, IO[bytes]]): 保存するデータ, bytesもしくはバイナリモードのファイルオブジェクト
+            path (str): 保存先のパス
+            content_type (str, optional): 保存するデータのContent-Type. Defaults to 'application/octet-stream'.
+            content_encoding (Optional[str], optional): 圧縮したデータのContent-Encoding("gzip"など). Defaults to None.
+            chunk_size (Optional[int], optional): 指定した場合はファイルオブジェクトをchunk_sizeずつ読み込みながら保存する. Defaults to None.
+            skip_if_identical (bool, optional): Trueならば同一のデータが保存済みの場合は保存しない,
+                ファイルオブジェクトはseek可能なものに限る. Defaults to False.
+            if_generation_match (Optional[int], optional): 指定した場合は保存先のgenerationが一致する場合のみ保存し,
+                一致しなければPreconditionErrorを送出する. 存在しないパスのgenerationは0とする. Defaults to None.
+
+        Returns:
+            UploadResult: 保存結果, 保存に失敗した場合は例外を送出する
+        '''
+
+    @abstractmethod
+    def get(self, path: str) -> bytes:
+        '''保存したままのデータ(圧縮したものは圧縮したまま)を返す
+
+        Args:
+            path (str): オブジェクトのパス
+
+        Returns:
+            bytes: 保存したデータ, 存在しなければFileNotFoundErrorを送出する
+        '''
+
+    @abstractmethod
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        '''オブジェクトのメタデータを返す
+
+        Args:
+            path (str): オブジェクトのパス
+
+        Returns:
+            Optional[ObjectInfo]: メタデータ, 存在しなければNone
+        '''
+
+    def exists(self, path: str) -> bool:
+        '''オブジェクトが存在するか確認する
+
+        Args:
+            path (str): オブジェクトのパス
+
+        Returns:
+            bool: 存在すればTrue
+        '''
+        return self.stat(path) is not None
+
+    @abstractmethod
+    def list(self, prefix: str = '') -> List[str]:
+        '''prefixから始まるオブジェクトのパスを返す
+
+        Args:
+            prefix (str, optional): パスの先頭. Defaults to ''.
+
+        Returns:
+            List[str]: パスの一覧(昇順)
+        '''
+
+    @abstractmethod
+    def delete(self, path: str) -> None:
+        '''オブジェクトを削除する, 存在しなければFileNotFoundErrorを送出する
+
+        Args:
+            path (str): オブジェクトのパス
+        '''
+
+    def put_batch(
+        self,
+        items: Sequence[Tuple[Union[str, bytes], str]],
+        max_workers: int = 8,
+        skip_if_identical: bool = False
+    ) -> List[UploadResult]:
+        '''複数のデータを並行して保存する, 一部の保存に失敗しても残りの保存は継続する
+
+        Args:
+            items (Sequence[Tuple[Union[str, bytes], str]]): (保存するデータのファイルパスもしくはbytes, 保存先のパス)の一覧
+            max_workers (int, optional): 並行して保存する数. Defaults to 8.
+            skip_if_identical (bool, optional): Trueならば同一のデータが保存済みの場合は保存しない. Defaults to False.
+
+        Returns:
+            List[UploadResult]: itemsと同じ順序の保存結果
+        '''
+        # 引数max_workersの値確認
+        if type(max_workers) != int:
+            raise TypeError('"max_workers" type must be int.')
+        if max_workers < 1:
+            raise ValueError('"max_workers" must be over 1.')
+
+        def put(item: Tuple[Union[str, bytes], str]) -> UploadResult:
+            source, path = item
+            try:
+                if isinstance(source, bytes):
+                    return self.put(source, path, skip_if_identical=skip_if_identical)
+                with open(source, 'rb') as f:
+                    return self.put(f, path, skip_if_identical=skip_if_identical)
+            except Exception as e:
+                return UploadResult(path, 'failed', e)
+
+        if len(items) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(put, items))
+
+
+class GcsBackend(StorageBackend):
+    '''gcsのバケットへ保存する, 転送はsrc.gcpのstore_gcs_data・store_gcs_batchで行う
+    '''
+
+    def __init__(
+        self,
+        bucket_name: str = 'export_from_devices',
+        client: Optional['storage.Client'] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ) -> None:
+        '''
+        Args:
+            bucket_name (str, optional): バケット名. Defaults to 'export_from_devices'.
+            client (Optional[storage.Client], optional): gcsのクライアント, Noneならば共有のクライアントを使用する. Defaults to None.
+            retry_policy (Optional[RetryPolicy], optional): 一時的な失敗を再送する方針, Noneならばクライアントの既定に従う. Defaults to None.
+        '''
+        self.bucket_name = bucket_name
+        self.client = client
+        self.retry_policy = retry_policy
+
+    def _bucket(self) -> 'storage.Bucket':
+        client = self.client if self.client is not None else get_storage_client()
+        return client.bucket(self.bucket_name)
+
+    def put(
+        self,
+        data: Union[bytes, IO[bytes]],
+        path: str,
+        content_type: str = 'application/octet-stream',
+        content_encoding: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        skip_if_identical: bool = False,
+        if_generation_match: Optional[int] = None
+    ) -> UploadResult:
+        if if_generation_match is None:
+            return store_gcs_data(
+                data,
+                path,
+                bucket_name=self.bucket_name,
+                content_type=content_type,
+                client=self.client,
+                chunk_size=chunk_size,
+                skip_if_identical=skip_if_identical,
+                retry_policy=self.retry_policy,
+                content_encoding=content_encoding
+            )
+
+        # NOTE: 条件付きの書き込み(manifestの更新)はクライアントの既定の再送に従う, 既定では条件付きの書き込みのみ再送する
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self._bucket().blob(path)
+        if content_encoding is not None:
+            blob.content_encoding = content_encoding
+        try:
+            blob.upload_from_string(_read_all(data), content_type=content_type, if_generation_match=if_generation_match)
+        except PreconditionFailed as e:
+            raise PreconditionError(path) from e
+        return UploadResult(path, 'uploaded')
+
+    def get(self, path: str) -> bytes:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            # NOTE: Content-Encoding: gzipのオブジェクトはgcsが展開して返す場合があるため, 保存したままのデータを取得する
+            return self._bucket().blob(path).download_as_bytes(raw_download=True)
+        except NotFound as e:
+            raise FileNotFoundError(path) from e
+
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        blob = self._bucket().get_blob(path)
+        if blob is None:
+            return None
+        return ObjectInfo(path, blob.size, blob.generation, blob.content_encoding)
+
+    def exists(self, path: str) -> bool:
+        return self._bucket().blob(path).exists()
+
+    def list(self, prefix: str = '') -> List[str]:
+        return sorted(b.name for b in self._bucket().list_blobs(prefix=prefix))
+
+    def delete(self, path: str) -> None:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self._bucket().blob(path).delete()
+        except NotFound as e:
+            raise FileNotFoundError(path) from e
+
+    def put_batch(
+        self,
+        items: Sequence[Tuple[Union[str, bytes], str]],
+        max_workers: int = 8,
+        skip_if_identical: bool = False
+    ) -> List[UploadResult]:
+        return store_gcs_batch(
+            items,
+            bucket_name=self.bucket_name,
+            max_workers=max_workers,
+            client=self.client,
+            skip_if_identical=skip_if_identical,
+            retry_policy=self.retry_policy
+        )
+
+
+class LocalBackend(StorageBackend):
+    '''ローカルのディレクトリへバケットと同じ構成で保存する
+
+    Content-TypeとContent-Encodingは記録しない(圧縮したjsonはsrc.codecのload_fileで圧縮形式によらず読み込める)
+    generationはファイルのinodeと更新時刻から求め, 条件付きの書き込みは同じプロセス内でのみ排他する
+    '''
+
+    def __init__(self, root: str = 'data') -> None:
+        '''
+        Args:
+            root (str, optional): 保存先のディレクトリ. Defaults to 'data'.
+        '''
+        self.root = root
+        self._lock = threading.Lock()
+
+    def local_path(self, path: str) -> str:
+        '''オブジェクトのパスをローカルのファイルパスに変換する
+
+        Args:
+            path (str): オブジェクトのパス
+
+        Returns:
+            str: rootからの相対パスとしたファイルパス
+        '''
+        return os.path.join(self.root, *path.split('/'))
+
+    def open(self, path: str) -> IO[bytes]:
+        '''保存したデータをファイルオブジェクトとして開く, 存在しなければFileNotFoundErrorを送出する
+
+        Args:
+            path (str): オブジェクトのパス
+
+        Returns:
+            IO[bytes]: バイナリモードで開いたファイルオブジェクト
+        '''
+        return open(self.local_path(path), 'rb')
+
+    def _generation(self, local_path: str) -> int:
+        try:
+            return _file_generation(os.stat(local_path))
+        except FileNotFoundError:
+            return 0
+
+    def _is_identical(self, local_path: str, data: Union[bytes, IO[bytes]]) -> bool:
+        '''保存済みのファイルとデータのmd5を比較する, ファイルオブジェクトは比較した後に先頭へ戻す
+        '''
+        if not os.path.exists(local_path):
+            return False
+        if isinstance(data, bytes):
+            md5 = hashlib.md5(data).hexdigest()
+        else:
+            start = data.tell()
+            md5 = _md5_of(data)
+            data.seek(start)
+        with open(local_path, 'rb') as f:
+            return _md5_of(f) == md5
+
+    def put(
+        self,
+        data: Union[bytes, IO[bytes]],
+        path: str,
+        content_type: str = 'application/octet-stream',
+        content_encoding: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        skip_if_identical: bool = False,
+        if_generation_match: Optional[int] = None
+    ) -> UploadResult:
+        # 引数skip_if_identicalの値確認
+        if skip_if_identical and not isinstance(data, bytes) and not getattr(data, 'seekable', lambda: False)():
+            raise ValueError('"skip_if_identical" requires bytes or a seekable file object.')
+
+        local_path = self.local_path(path)
+        if skip_if_identical and self._is_identical(local_path, data):
+            return UploadResult(path, 'skipped')
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+
+        # NOTE: 書き込み中のファイルを読み込まないよう, 一時ファイルに書き込んでから置き換える
+        tmp_path = '{}.{}.tmp'.format(local_path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f, chunk_size or _COPY_CHUNK_SIZE)
+        if if_generation_match is None:
+            os.replace(tmp_path, local_path)
+            return UploadResult(path, 'uploaded')
+        with self._lock:
+            if self._generation(local_path) != if_generation_match:
+                os.remove(tmp_path)
+                raise PreconditionError(path)
+            os.replace(tmp_path, local_path)
+        return UploadResult(path, 'uploaded')
+
+    def get(self, path: str) -> bytes:
+        with self.open(path) as f:
+            return f.read()
+
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        try:
+            st = os.stat(self.local_path(path))
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(path, st.st_size, _file_generation(st))
+
+    def list(self, prefix: str = '') -> List[str]:
+        paths = []
+        for directory, _, filenames in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = filename if relative == '.' else '/'.join(relative.split(os.sep) + [filename])
+                if path.startswith(prefix):
+                    paths.append(path)
+        return sorted(paths)
+
+    def delete(self, path: str) -> None:
+        os.remove(self.local_path(path))
+
+
+@dataclass
+class _MemoryObject:
+    data: bytes
+    content_type: str
+    content_encoding: Optional[str]
+    generation: int
+
+
+class MemoryBackend(StorageBackend):
+    '''プロセスのメモリ上に保存する, ベンチマークや負荷試験で保存先の遅延を除いて計測する場合に使用する
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._objects: Dict[str, _MemoryObject] = {}
+        self._next_generation = 1
+
+    def put(
+        self,
+        data: Union[bytes, IO[bytes]],
+        path: str,
+        content_type: str = 'application/octet-stream',
+        content_encoding: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        skip_if_identical: bool = False,
+        if_generation_match: Optional[int] = None
+    ) -> UploadResult:
+        data = _read_all(data)
+        with self._lock:
+            stored = self._objects.get(path)
+            if if_generation_match is not None and (0 if stored is None else stored.generation) != if_generation_match:
+                raise PreconditionError(path)
+            if skip_if_identical and stored is not None and stored.data == data:
+                return UploadResult(path, 'skipped')
+            self._objects[path] = _MemoryObject(data, content_type, content_encoding, self._next_generation)
+            self._next_generation += 1
+        return UploadResult(path, 'uploaded')
+
+    def get(self, path: str) -> bytes:
+        with self._lock:
+            stored = self._objects.get(path)
+        if stored is None:
+            raise FileNotFoundError(path)
+        return stored.data
+
+    def stat(self, path: str) -> Optional[ObjectInfo]:
+        with self._lock:
+            stored = self._objects.get(path)
+        if stored is None:
+            return None
+        return ObjectInfo(path, len(stored.data), stored.generation, stored.content_encoding)
+
+    def content_type(self, path: str) -> str:
+        '''保存したデータのContent-Typeを返す, 存在しなければFileNotFoundErrorを送出する
+        '''
+        with self._lock:
+            stored = self._objects.get(path)
+        if stored is None:
+            raise FileNotFoundError(path)
+        return stored.content_type
+
+    def list(self, prefix: str = '') -> List[str]:
+        with self._lock:
+            return sorted(p for p in self._objects if p.startswith(prefix))
+
+    def delete(self, path: str) -> None:
+        with self._lock:
+            if self._objects.pop(path, None) is None:
+                raise FileNotFoundError(path)
+
+
+def open_storage(url: str, **kwargs: Any) -> StorageBackend:
+    '''urlに応じた保存先を返す
+
+    Args:
+        url (str): "gs://バケット名", "file://ディレクトリ"(もしくはディレクトリのパス), "memory://"のいずれか
+        **kwargs: GcsBackendに与えるclient, retry_policy
+
+    Returns:
+        StorageBackend: 保存先
+    '''
+    if url.startswith('gs://'):
+        bucket_name = url[len('gs://'):].strip('/')
+        if bucket_name == '':
+            raise ValueError('"url" must include the bucket name.')
+        return GcsBackend(bucket_name, **kwargs)
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    if url == '':
+        raise ValueError('"url" must include the directory.')
+    return LocalBackend(url)
@@ -0,0 +1,309 @@
+import contextlib
+import contextvars
+import functools
+import json
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    from src.memory import MemoryMonitor
+    from src.transport import HttpTransport
+
+T = TypeVar('T')
+
+# 実行中のスパンと, それを記録するTracer
+_current: 'contextvars.ContextVar[Optional[Tuple[Tracer, Span]]]' = contextvars.ContextVar('dieter_span', default=None)
+
+# 上限までの余裕がこの割合を下回ればログのレベルをWARNINGとする
+_MEMORY_HEADROOM_WARNING = 0.1
+
+# OTLPのspan kind
+_OTLP_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+
+@dataclass
+class Span:
+    '''処理の段階や外部へのリクエスト1回分の計測結果
+
+    Attributes:
+        name (str): スパンの名前
+        span_id (str): スパンのID(16桁の16進数)
+        parent_id (Optional[str]): 親のスパンのID, 最上位のスパンはNone
+        start (float): 開始時刻(UNIX時間)
+        kind (str): "internal"もしくは外部へのリクエストを表す"client"
+        attributes (Dict[str, Any]): 転送したバイト数や結果などの属性
+        duration (Optional[float]): 処理時間(秒), 終了していなければNone
+        status (str): 例外が送出されずに終了すれば"ok", そうでなければ"error"
+        error (Optional[str]): 送出された例外
+    '''
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    kind: str = 'internal'
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    duration: Optional[float] = None
+    status: str = 'ok'
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        '''属性を追加する
+        '''
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    '''1回の実行で計測したスパンを記録する
+
+    spanで開始したスパンの中で(propagateで渡したスレッドを含め)開始したスパンを子として記録する
+    '''
+
+    def __init__(
+        self,
+        max_spans: int = 10000,
+        memory: Optional['MemoryMonitor'] = None,
+        clock: Callable[[], float] = time.time,
+        perf_counter: Callable[[], float] = time.perf_counter
+    ) -> None:
+        '''
+        Args:
+            max_spans (int, optional): 記録するスパンの上限, 超えた分は件数のみ記録する. Defaults to 10000.
+            memory (Optional[MemoryMonitor], optional): スパンごとのメモリ使用量を計測するMemoryMonitor,
+                Noneならば計測しない. Defaults to None.
+            clock (Callable[[], float], optional): 現在時刻(UNIX時間)を返す関数. Defaults to time.time.
+            perf_counter (Callable[[], float], optional): 処理時間の計測に使用する関数. Defaults to time.perf_counter.
+        '''
+        if type(max_spans) != int:
+            raise TypeError('"max_spans" type must be int.')
+        if max_spans < 1:
+            raise ValueError('"max_spans" must be over 1.')
+        self.trace_id = secrets.token_hex(16)
+        self.max_spans = max_spans
+        self.memory = memory
+        self.clock = clock
+        self.perf_counter = perf_counter
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: str = 'internal', **attributes: Any) -> Iterator[Span]:
+        '''スパンを開始し, 抜ける際に処理時間と例外の有無を記録する
+
+        Args:
+            name (str): スパンの名前
+            kind (str, optional): "internal"もしくは外部へのリクエストを表す"client". Defaults to 'internal'.
+            **attributes: スパンの属性
+
+        Yields:
+            Span: 開始したスパン, setで属性を追加できる
+        '''
+        current = _current.get()
+        parent_id = current[1].span_id if current is not None and current[0] is self else None
+        span = Span(name, secrets.token_hex(8), parent_id, self.clock(), kind, dict(attributes))
+        token = _current.set((self, span))
+        usage = self.memory.begin() if self.memory is not None else None
+        started = self.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.error = repr(e)[:200]
+            raise
+        finally:
+            span.duration = self.perf_counter() - started
+            if usage is not None:
+                span.set(**self.memory.end(usage).to_attributes())
+            _current.reset(token)
+            with self._lock:
+                if len(self.spans) < self.max_spans:
+                    self.spans.append(span)
+                else:
+                    self.dropped += 1
+
+    def snapshot(self) -> Tuple[List[Span], int]:
+        '''終了したスパンを開始時刻の順に返す
+
+        Returns:
+            Tuple[List[Span], int]: 記録したスパンと, 上限を超えて記録しなかったスパンの件数
+        '''
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s.start), self.dropped
+
+    def to_record(self) -> Dict[str, Any]:
+        '''記録したスパンを1件の構造化ログとして出力する形式に変換する
+
+        cloud functionsでは標準出力に書き出したjsonのseverity, messageがログのレベルと本文となる
+
+        Returns:
+            Dict[str, Any]: 最初のスパンの開始からの時刻(ミリ秒)で並べたスパンを含むログ,
+                memoryを与えた場合はメモリの上限までの余裕が少なければWARNINGとする
+        '''
+        spans, dropped = self.snapshot()
+        origin = spans[0].start if spans else 0.0
+        roots = [s for s in spans if s.parent_id is None]
+        errors = sum(1 for s in spans if s.status == 'error')
+        memory = self.memory.summary() if self.memory is not None else None
+        low_headroom = (
+            memory is not None and memory['headroom_bytes'] is not None
+            and memory['headroom_bytes'] < memory['limit_bytes'] * _MEMORY_HEADROOM_WARNING
+        )
+        record = {
+            'severity': 'WARNING' if errors > 0 or low_headroom else 'INFO',
+            'message': 'trace {}'.format(roots[0].name if roots else ''),
+            'trace_id': self.trace_id,
+            'duration_ms': round(max((s.duration or 0.0) for s in roots) * 1000, 3) if roots else 0.0,
+            'errors': errors,
+            'dropped_spans': dropped,
+            'spans': [
+                {
+                    'name': s.name,
+                    'span_id': s.span_id,
+                    'parent_id': s.parent_id,
+                    'start_ms': round((s.start - origin) * 1000, 3),
+                    'duration_ms': round((s.duration or 0.0) * 1000, 3),
+                    'status': s.status,
+                    'error': s.error,
+                    'attributes': s.attributes,
+                }
+                for s in spans
+            ],
+        }
+        if memory is not None:
+            record['memory'] = memory
+        return record
+
+    def log(self) -> None:
+        '''記録したスパンを1行のjsonとして標準出力に書き出す
+        '''
+        print(json.dumps(self.to_record(), ensure_ascii=False, default=str))
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = 'internal', **attributes: Any) -> Iterator[Span]:
+    '''実行中のTracerでスパンを開始する, Tracerが無ければ記録しない
+
+    Args:
+        name (str): スパンの名前
+        kind (str, optional): "internal"もしくは外部へのリクエストを表す"client". Defaults to 'internal'.
+        **attributes: スパンの属性
+
+    Yields:
+        Span: 開始したスパン, 記録しない場合も属性を追加できる
+    '''
+    current = _current.get()
+    if current is None:
+        yield Span(name, '', None, 0.0, kind, dict(attributes))
+        return
+    with current[0].span(name, kind, **attributes) as s:
+        yield s
+
+
+def annotate(**attributes: Any) -> None:
+    '''実行中のスパンに属性を追加する, スパンが無ければ何もしない
+    '''
+    current = _current.get()
+    if current is not None:
+        current[1].set(**attributes)
+
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    '''呼び出した時点のスパンを親として, 他のスレッドでfnを実行する関数を返す
+
+    ThreadPoolExecutorに渡す関数はスレッドが異なるためスパンを引き継がない, submitする前にこの関数で包む
+
+    Args:
+        fn (Callable[..., T]): 他のスレッドで実行する関数
+
+    Returns:
+        Callable[..., T]: 実行中のスパンを引き継いでfnを実行する関数
+    '''
+    current = _current.get()
+
+    @functools.wraps(fn)
+    def wrapped(*args: Any, **kwargs: Any) -> T:
+        token = _current.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return wrapped
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    '''属性の値をOTLPのAnyValueに変換する
+    '''
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # NOTE: OTLP/JSONでは64bit整数を文字列で表す
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+@dataclass
+class OtlpExporter:
+    '''記録したスパンをOpenTelemetryのcollectorへOTLP/HTTP(json)で送信する
+
+    Attributes:
+        endpoint (str): collectorのトレースのエンドポイント(例: "http://localhost:4318/v1/traces")
+        service_name (str): リソースの属性service.nameとする名前
+        headers (Mapping[str, str]): 認証などのために追加するリクエストヘッダ
+        transport (Optional[HttpTransport]): 送信に使用するHttpTransport, Noneならばプロセス内で共有するものを使用する
+    '''
+    endpoint: str
+    service_name: str = 'dieter'
+    headers: Mapping[str, str] = field(default_factory=dict)
+    transport: Optional['HttpTransport'] = None
+
+    def to_payload(self, tracer: Tracer) -> Dict[str, Any]:
+        '''記録したスパンをOTLPのExportTraceServiceRequest(json)に変換する
+
+        Args:
+            tracer (Tracer): スパンを記録したTracer
+
+        Returns:
+            Dict[str, Any]: 送信するリクエストボディ
+        '''
+        otlp_spans = []
+        for s in tracer.snapshot()[0]:
+            start_ns = int(s.start * 1e9)
+            otlp_span = {
+                'traceId': tracer.trace_id,
+                'spanId': s.span_id,
+                'name': s.name,
+                'kind': _OTLP_KINDS.get(s.kind, 1),
+                'startTimeUnixNano': str(start_ns),
+                'endTimeUnixNano': str(start_ns + int((s.duration or 0.0) * 1e9)),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+                'status': {'code': 2, 'message': s.error or ''} if s.status == 'error' else {'code': 1},
+            }
+            if s.parent_id is not None:
+                otlp_span['parentSpanId'] = s.parent_id
+            otlp_spans.append(otlp_span)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+                'scopeSpans': [{'scope': {'name': 'dieter'}, 'spans': otlp_spans}],
+            }]
+        }
+
+    def export(self, tracer: Tracer) -> None:
+        '''記録したスパンをcollectorへ送信する, 失敗した場合はurllib.error.URLErrorを送出する
+
+        Args:
+            tracer (Tracer): スパンを記録したTracer
+        '''
+        # NOTE: transportはスパンを記録するためこのモジュールを読み込む, 循環しないよう使用する時に読み込む
+        from src.transport import default_transport
+
+        transport = self.transport if self.transport is not None else default_transport()
+        headers = dict(self.headers)
+        headers['Content-Type'] = 'application/json'
+        transport.request('POST', self.endpoint, headers=headers, data=json.dumps(self.to_payload(tracer)).encode('utf-8'))
@@ -0,0 +1,320 @@
+import contextlib
+import http.client
+import io
+import threading
+import urllib.error
+import urllib.parse
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterator, Mapping, Optional, Tuple
+
+from src.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from src.tracing import annotate, span
+
+# 接続先ごとのキー(scheme, host, port)
+HostKey = Tuple[str, str, int]
+
+# 再利用した接続が既に切断されていた場合に発生する例外
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+@dataclass
+class HttpResponse:
+    '''HttpTransportから返すレスポンス
+
+    Attributes:
+        url (str): リクエストしたurl(リダイレクトした場合はリダイレクト先)
+        status (int): ステータスコード
+        headers (http.client.HTTPMessage): レスポンスヘッダ
+        body (bytes): レスポンスボディ
+    '''
+    url: str
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+
+class HttpTransport:
+    '''接続先ごとにkeep-aliveした接続を使い回すHTTPクライアント
+
+    各APIのクライアントで共有することで, 同じホストへの連続したリクエストでTCP/TLSのハンドシェイクを省略する
+    retry_policy, circuit_breakerを与えると, 共有する全てのクライアントで同じ方針で再送・遮断する
+    '''
+
+    def __init__(
+        self,
+        max_connections_per_host: int = 4,
+        timeout: float = 60.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        '''
+        Args:
+            max_connections_per_host (int, optional): 接続先ごとに同時に使用する接続数の上限. Defaults to 4.
+            timeout (float, optional): 接続・読み込みのタイムアウト(秒). Defaults to 60.0.
+            retry_policy (Optional[RetryPolicy], optional): 一時的な失敗を再送する方針, Noneならば再送しない. Defaults to None.
+            circuit_breaker (Optional[CircuitBreaker], optional): 接続先ごとの遮断器, Noneならば遮断しない. Defaults to None.
+        '''
+        if type(max_connections_per_host) != int:
+            raise TypeError('"max_connections_per_host" type must be int.')
+        if max_connections_per_host < 1:
+            raise ValueError('"max_connections_per_host" must be over 1.')
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self._lock = threading.Lock()
+        self._idle: Dict[HostKey, Deque[http.client.HTTPConnection]] = {}
+        self._semaphores: Dict[HostKey, threading.BoundedSemaphore] = {}
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Mapping[str, str]] = None,
+        data: Optional[bytes] = None,
+        max_redirects: int = 5,
+        before_retry: Optional[Callable[[urllib.error.URLError], None]] = None
+    ) -> HttpResponse:
+        '''リクエストを送信しレスポンスを返す, ステータスコードが400以上であればurllib.error.HTTPErrorを送出する
+
+        Args:
+            method (str): HTTPメソッド
+            url (str): リクエスト先のurl
+            headers (Optional[Mapping[str, str]], optional): リクエストヘッダ. Defaults to None.
+            data (Optional[bytes], optional): リクエストボディ. Defaults to None.
+            max_redirects (int, optional): リダイレクトを辿る回数の上限. Defaults to 5.
+            before_retry (Optional[Callable[[urllib.error.URLError], None]], optional): 再送する直前に失敗した例外を渡して呼ぶ関数. Defaults to None.
+
+        Returns:
+            HttpResponse: レスポンス
+        '''
+        with self.stream(method, url, headers=headers, data=data, max_redirects=max_redirects, before_retry=before_retry) as res:
+            body = res.read()
+            annotate(response_bytes=len(body))
+            return HttpResponse(res.url, res.status, res.headers, body)
+
+    @contextlib.contextmanager
+    def stream(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Mapping[str, str]] = None,
+        data: Optional[bytes] = None,
+        max_redirects: int = 5,
+        before_retry: Optional[Callable[[urllib.error.URLError], None]] = None
+    ) -> Iterator[http.client.HTTPResponse]:
+        '''リクエストを送信しレスポンスボディを読み込まずに返す, ステータスコードが400以上であればurllib.error.HTTPErrorを送出する
+
+        レスポンスボディを最後まで読み込んだ場合のみ接続を使い回し, 途中で抜けた場合は接続を閉じる
+        再送はレスポンスを返す前(ステータスコードの確認まで)の失敗のみを対象とする
+
+        Args:
+            method (str): HTTPメソッド
+            url (str): リクエスト先のurl
+            headers (Optional[Mapping[str, str]], optional): リクエストヘッダ. Defaults to None.
+            data (Optional[bytes], optional): リクエストボディ. Defaults to None.
+            max_redirects (int, optional): リダイレクトを辿る回数の上限. Defaults to 5.
+            before_retry (Optional[Callable[[urllib.error.URLError], None]], optional): 再送する直前に失敗した例外を渡して呼ぶ関数,
+                クライアントごとのレート制限の残量を再送でも消費する場合などに使用する. Defaults to None.
+
+        Yields:
+            http.client.HTTPResponse: ボディを読み込む前のレスポンス, urlにはリダイレクト後のurlを格納する
+        '''
+        headers = dict(headers or {})
+        if data is not None and not any(k.lower() == 'content-type' for k in headers):
+            # urllib.request.urlopenと同様にフォームデータとして送信する
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        key, path = self._split(url)
+        host = key[1]
+        # NOTE: クエリにはaccess_tokenを含む場合があるため, スパンにはパスのみ記録する
+        with span('http ' + method, kind='client', method=method, host=host, path=path.split('?', 1)[0],
+                  request_bytes=len(data) if data is not None else 0) as s:
+            attempt = 0
+            while True:
+                attempt += 1
+                s.set(attempts=attempt)
+                yielded = False
+                try:
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.before_request(host)
+                    with self._follow(method, url, headers, data, max_redirects) as res:
+                        if self.circuit_breaker is not None:
+                            self.circuit_breaker.record_success(host)
+                        s.set(status=res.status)
+                        if res.headers.get('Content-Length'):
+                            s.set(response_bytes=int(res.headers['Content-Length']))
+                        yielded = True
+                        yield res
+                        return
+                except urllib.error.URLError as e:
+                    if isinstance(e, urllib.error.HTTPError):
+                        s.set(status=e.code)
+                    if yielded:
+                        raise
+                    self._record_failure(host, e)
+                    delay = None if self.retry_policy is None else self.retry_policy.retry_delay(method, attempt, e)
+                    if delay is None:
+                        raise
+                    print('retry {} {}{} in {:.1f}s ({})'.format(method, host, path.split('?', 1)[0], delay, e))
+                    self.retry_policy.sleep(delay)
+                    if before_retry is not None:
+                        before_retry(e)
+
+    def _record_failure(self, host: str, error: urllib.error.URLError) -> None:
+        '''接続先の障害と考えられる失敗(5xx, 接続エラー)を遮断器に記録する
+        '''
+        if self.circuit_breaker is None or isinstance(error, CircuitOpenError):
+            return
+        if isinstance(error, urllib.error.HTTPError):
+            if error.code >= 500:
+                self.circuit_breaker.record_failure(host)
+            else:
+                # NOTE: 4xxは接続先が応答しているため成功とみなす
+                self.circuit_breaker.record_success(host)
+        else:
+            self.circuit_breaker.record_failure(host)
+
+    @contextlib.contextmanager
+    def _follow(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes],
+        max_redirects: int
+    ) -> Iterator[http.client.HTTPResponse]:
+        '''リダイレクトを辿りながらリクエストを1回送信する
+        '''
+        for _ in range(max_redirects + 1):
+            key, path = self._split(url)
+            with self._semaphore(key):
+                conn, res = self._open(key, method, path, headers, data)
+                try:
+                    if res.status in _REDIRECT_CODES and res.headers.get('Location'):
+                        res.read()
+                    elif res.status >= 400:
+                        body = res.read()
+                        raise urllib.error.HTTPError(
+                            url, res.status, http.client.responses.get(res.status, ''), res.headers, io.BytesIO(body)
+                        )
+                    else:
+                        res.url = url
+                        yield res
+                        return
+                finally:
+                    self._release(key, conn, res)
+            url = urllib.parse.urljoin(url, res.headers['Location'])
+            if res.status == 303 or (res.status in (301, 302) and method == 'POST'):
+                method, data = 'GET', None
+        raise urllib.error.URLError('too many redirects: {}'.format(url))
+
+    def close(self) -> None:
+        '''待機中の接続を全て閉じる
+        '''
+        with self._lock:
+            for connections in self._idle.values():
+                while connections:
+                    connections.pop().close()
+
+    def _split(self, url: str) -> Tuple[HostKey, str]:
+        '''urlを接続先のキーとパスに分割する
+        '''
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError('"url" scheme must be http or https.')
+        key = (parsed.scheme, parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        return key, path
+
+    def _open(
+        self,
+        key: HostKey,
+        method: str,
+        path: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes]
+    ) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        '''接続を借りてリクエストを1回送信し, ボディを読み込む前のレスポンスを返す
+        '''
+        conn, reused = self._checkout(key)
+        try:
+            try:
+                res = self._roundtrip(conn, method, path, headers, data)
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # keep-aliveの接続がサーバ側で切断されていれば新しい接続で再送する
+                conn.close()
+                conn = self._connect(key)
+                res = self._roundtrip(conn, method, path, headers, data)
+        except (OSError, http.client.HTTPException) as e:
+            # NOTE: 不正なステータス行などもURLErrorとして扱い, 再送と遮断器の対象にする
+            conn.close()
+            raise urllib.error.URLError(e)
+        except Exception:
+            conn.close()
+            raise
+        return conn, res
+
+    def _release(self, key: HostKey, conn: http.client.HTTPConnection, res: http.client.HTTPResponse) -> None:
+        '''レスポンスボディを読み終えていれば接続を返却し, そうでなければ閉じる
+        '''
+        if res.isclosed() and not res.will_close:
+            self._checkin(key, conn)
+        else:
+            conn.close()
+
+    def _roundtrip(
+        self,
+        conn: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes]
+    ) -> http.client.HTTPResponse:
+        conn.request(method, path, body=data, headers=dict(headers))
+        return conn.getresponse()
+
+    def _semaphore(self, key: HostKey) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._semaphores[key]
+
+    def _checkout(self, key: HostKey) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key: HostKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, deque()).append(conn)
+
+    def _connect(self, key: HostKey) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+
+_default_transport: Optional[HttpTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def default_transport() -> HttpTransport:
+    '''クライアントにtransportが与えられなかった場合に共有して使用するHttpTransportを返す
+
+    Returns:
+        HttpTransport: プロセス内で共有するHttpTransport
+    '''
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
@@ -1,24 +1,29 @@
+import datetime
 import json
 import re
 import urllib.parse
-import urllib.request
 from dataclasses import dataclass
-from typing import List
+from typing import Callable, List, Optional
 
-import pandas as pd
-from pandas.tseries.offsets import DateOffset
+from src.dates import now_jst, parse_jst
+from src.transport import HttpTransport, default_transport
 
 
 @dataclass
 class Twitter:
     user_id: str
     bearer_token: str
+    transport: Optional[HttpTransport] = None
+    api_base: str = 'https://api.twitter.com'
+    # NOTE: 取得できる期間の確認に使用する現在時刻, cassetteの再生では記録した時刻とする
+    now: Callable[[], datetime.datetime] = now_jst
 
-    def search_ringfitadventure_results(self, start_date: str) -> List[str]:
+    def search_ringfitadventure_results(self, start_date: str, end_date: Optional[str] = None) -> List[str]:
         '''リングフィット実績画像のurlをリストで返す
 
         Args:
             start_date (str): 検索する時に遡る日付, YYYY-mm-dd, 最大７日まで遡ることが可能
+            end_date (Optional[str], optional): 検索する期間の最終日, YYYY-mm-dd, Noneならば現時点まで. Defaults to None.
 
         Returns:
             List[str]: リングフィットの実績画像のurlをまとめたリスト
@@ -32,10 +37,20 @@ class Twitter:
             raise ValueError('"start_date" must be yyyy-mm-dd.')
 
         # 日付が現時点よりも７日以上前でないことを確認
-        datetime = pd.to_datetime(start_date).tz_localize('Asia/Tokyo')
-        if datetime < (pd.Timestamp.today(tz='Asia/Tokyo') - DateOffset(days=7)):
+        start_datetime = parse_jst(start_date, '%Y-%m-%d')
+        if start_datetime < (self.now() - datetime.timedelta(days=7)):
             raise ValueError('this method can search tweets from the last seven days')
 
+        # 引数end_dateの型確認とフォーマット確認
+        if end_date is not None:
+            if type(end_date) != str:
+                raise TypeError('"end_date" type must be str.')
+            if not re.search(r'^20[0-9]{2}-[0-1][0-9]-[0-3][0-9]$', end_date):
+                raise ValueError('"end_date" must be yyyy-mm-dd.')
+            end_datetime = parse_jst(end_date, '%Y-%m-%d') + datetime.timedelta(days=1)
+            if end_datetime <= start_datetime:
+                raise ValueError('"end_date" is greater than "start_date".')
+
         # #RingFitAdventureのタグがついたツイートを検索する
         headers = {
             'Authorization': 'Bearer ' + self.bearer_token
@@ -45,13 +60,14 @@ class Twitter:
             'query': query,
             'expansions': 'attachments.media_keys',
             'media.fields': 'url',
-            'start_time': datetime.tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+            'start_time': start_datetime.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
         }
+        if end_date is not None:
+            params['end_time'] = end_datetime.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
         p = urllib.parse.urlencode(params, safe='', quote_via=urllib.parse.quote)
-        url = 'https://api.twitter.com/2/tweets/search/recent?' + p
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as res:
-            body = res.read()
+        url = self.api_base + '/2/tweets/search/recent?' + p
+        transport = self.transport if self.transport is not None else default_transport()
+        body = transport.request('GET', url, headers=headers).body
 
         # リングフィットの実績画像のurlをリストにまとめて出力
         tweets = json.loads(body.decode('utf-8'))
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import threading
+from typing import IO, Any, Dict, List, Optional, Set
+
+import google_crc32c
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+class FakeBlob:
+    '''google.cloud.storage.Blobのうちテストで使用するメソッドのみを再現する
+    '''
+
+    def __init__(self, bucket: 'FakeBucket', name: str) -> None:
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size: Optional[int] = None
+        self._content_encoding: Optional[str] = None
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self.bucket.generations.get(self.name)
+
+    @property
+    def size(self) -> Optional[int]:
+        data = self.bucket.objects.get(self.name)
+        return None if data is None else len(data)
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        data = self.bucket.objects.get(self.name)
+        if data is None or self.name in self.bucket.composite_paths:
+            return None
+        return base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        data = self.bucket.objects.get(self.name)
+        return None if data is None else base64.b64encode(google_crc32c.Checksum(data).digest()).decode('utf-8')
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        return self._content_encoding if self._content_encoding is not None else self.bucket.content_encodings.get(self.name)
+
+    @content_encoding.setter
+    def content_encoding(self, value: Optional[str]) -> None:
+        self._content_encoding = value
+
+    def exists(self) -> bool:
+        return self.name in self.bucket.objects
+
+    def delete(self) -> None:
+        with self.bucket.lock:
+            if self.name not in self.bucket.objects:
+                raise NotFound(self.name)
+            for values in [self.bucket.objects, self.bucket.content_types, self.bucket.content_encodings, self.bucket.generations]:
+                values.pop(self.name, None)
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None, raw_download: bool = False) -> bytes:
+        with self.bucket.lock:
+            if self.name not in self.bucket.objects:
+                raise NotFound(self.name)
+            if if_generation_match is not None and self.bucket.generations[self.name] != if_generation_match:
+                raise PreconditionFailed(self.name)
+            return self.bucket.objects[self.name]
+
+    def upload_from_filename(self, filename: str, retry: Any = None) -> None:
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read(), retry=retry)
+
+    def upload_from_file(self, file_obj: IO[bytes], content_type: Optional[str] = None, retry: Any = None) -> None:
+        if self.chunk_size is None:
+            self.upload_from_string(file_obj.read(), content_type=content_type, retry=retry)
+            return
+        # resumable uploadと同様にchunk_sizeずつ読み込む
+        chunks = []
+        while True:
+            chunk = file_obj.read(self.chunk_size)
+            self.bucket.read_sizes.append(len(chunk))
+            chunks.append(chunk)
+            if len(chunk) < self.chunk_size:
+                break
+        self.upload_from_string(b''.join(chunks), content_type=content_type, retry=retry)
+
+    def upload_from_string(
+        self,
+        data: bytes,
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+        retry: Any = None
+    ) -> None:
+        self.bucket.retries.append(retry)
+        if self.name in self.bucket.fail_paths:
+            raise RuntimeError('fake upload error: {}'.format(self.name))
+        with self.bucket.lock:
+            if if_generation_match is not None and self.bucket.generations.get(self.name, 0) != if_generation_match:
+                raise PreconditionFailed(self.name)
+            self.bucket.objects[self.name] = data
+            self.bucket.content_types[self.name] = content_type
+            self.bucket.content_encodings[self.name] = self._content_encoding
+            self.bucket.generations[self.name] = self.bucket.next_generation
+            self.bucket.next_generation += 1
+            self.bucket.upload_count += 1
+
+
+class FakeBucket:
+    '''google.cloud.storage.Bucketのうちテストで使用するメソッドのみを再現する
+    '''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.objects: Dict[str, bytes] = {}
+        self.content_types: Dict[str, Optional[str]] = {}
+        self.content_encodings: Dict[str, Optional[str]] = {}
+        self.generations: Dict[str, int] = {}
+        # 転送ごとに与えられた再送の方針
+        self.retries: List[Any] = []
+        # md5を持たないオブジェクト(composite object)のパス
+        self.composite_paths: Set[str] = set()
+        self.next_generation = 1
+        self.fail_paths: List[str] = []
+        self.upload_count = 0
+        self.read_sizes: List[int] = []
+        self.lock = threading.Lock()
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[FakeBlob]:
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix: Optional[str] = None) -> List[FakeBlob]:
+        return [FakeBlob(self, n) for n in sorted(self.objects) if n.startswith(prefix or '')]
+
+
+class FakeClient:
+    '''google.cloud.storage.Clientのうちテストで使用するメソッドのみを再現する
+    '''
+
+    def __init__(self) -> None:
+        self.buckets: Dict[str, FakeBucket] = {}
+
+    def bucket(self, name: str, user_project: Optional[str] = None) -> FakeBucket:
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(name)
+        return self.buckets[name]
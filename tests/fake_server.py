@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# (ステータスコード, レスポンスヘッダ, レスポンスボディ)
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+class FakeServer:
+    '''テスト用にローカルで起動するHTTPサーバ
+
+    受け付けたリクエストは`requests`に(メソッド, パス, ヘッダ, ボディ)として, 接続元のポートは`client_ports`に記録する
+    '''
+
+    def __init__(self, handler: Callable[[str, str, Dict[str, str], bytes], Response]) -> None:
+        '''
+        Args:
+            handler (Callable): (メソッド, パス, ヘッダ, ボディ)を受け取りレスポンスを返す関数
+        '''
+        self.handler = handler
+        self.requests: List[Tuple[str, str, Dict[str, str], bytes]] = []
+        self.client_ports: Set[int] = set()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        '''サーバのベースURL
+        '''
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def __enter__(self) -> 'FakeServer':
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length > 0 else b''
+                headers = dict(self.headers.items())
+                fake.requests.append((self.command, self.path, headers, body))
+                fake.client_ports.add(self.client_address[1])
+                status, res_headers, res_body = fake.handler(self.command, self.path, headers, body)
+                self.send_response(status)
+                for k, v in res_headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(res_body)))
+                self.end_headers()
+                self.wfile.write(res_body)
+
+            do_GET = _handle
+            do_POST = _handle
+            do_PUT = _handle
+            do_DELETE = _handle
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,210 @@
+import datetime
+import json
+import math
+
+import pytest
+from src.analytics import HealthHistory
+from src.compaction import compact
+
+pytest.importorskip('pyarrow')
+
+
+def write_json(root, relative_path, data):
+    path = root / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data))
+
+
+def body_composition(date, weight, fat):
+    ymd = date.replace('-', '')
+    return {'data': [
+        {'date': ymd + '0700', 'keydata': str(weight + 1), 'model': '01000117', 'tag': '6021'},
+        {'date': ymd + '0710', 'keydata': str(weight), 'model': '01000117', 'tag': '6021'},
+        {'date': ymd + '0710', 'keydata': str(fat), 'model': '01000117', 'tag': '6022'},
+    ]}
+
+
+def cached_range(history, dataset_name, from_date, to_date):
+    '''保持している期間の読み込み結果を返す, 保持していなければNone
+    '''
+    key = (dataset_name, datetime.date.fromisoformat(from_date), datetime.date.fromisoformat(to_date))
+    cached = history._range_cache.get(key)
+    return None if cached is None else cached[1]
+
+
+class TestHealthHistory:
+    '''保存済みの健康データから時系列の指標を求められるか検証
+    - 異常系
+        - 存在しないデータの種類が与えられる
+        - from_dateが文字列であるが指定のフォーマットではない
+        - from_dateがto_dateよりも最近の値をとる
+        - windowに1未満の値が与えられる
+        - max_cached_rangesに1未満の値が与えられる
+    - 正常系
+        - 体組成は日ごとの最後の測定値となり, 測定のない日はNaNとなる
+        - 移動平均は期間の開始日より前のデータも含めて計算される
+        - 週平均と前週からの差分が求まる
+        - カロリー収支は摂取カロリーから消費カロリーを引いた値となる
+        - 睡眠効率は全ての睡眠記録の合計から求まる
+        - 読み込んだ期間はparquetファイルが更新されるまで保持される
+        - 保持する期間は上限までとし, 最も長く参照していない期間から破棄する
+        - 読み込んだデータを変更しても保持しているものは変わらない
+    '''
+    def setup_method(self, method):
+        '''データの読み込み先を初期化する
+        '''
+        self.history = None
+
+    def prepare(self, tmp_path):
+        '''2021-10-30から2021-11-12の日次データを準備しparquetファイルにまとめる
+        '''
+        for day in range(30, 32):
+            date = '2021-10-{:02d}'.format(day)
+            write_json(tmp_path, 'health_planet/{}.json'.format(date), body_composition(date, 72, 22))
+        for day in range(1, 13):
+            date = '2021-11-{:02d}'.format(day)
+            if day != 3:
+                write_json(tmp_path, 'health_planet/{}.json'.format(date), body_composition(date, 70 - day * 0.1, 20))
+            write_json(tmp_path, 'fitbit/foods/{}.json'.format(date), {'foods': [], 'summary': {'calories': 2000 + day}})
+            write_json(tmp_path, 'fitbit/activities/{}.json'.format(date), {'summary': {'caloriesOut': 2100}})
+        write_json(tmp_path, 'fitbit/sleep/2021-11-01.json', {'sleep': [
+            {'logId': 1, 'minutesAsleep': 360, 'timeInBed': 400, 'isMainSleep': True},
+            {'logId': 2, 'minutesAsleep': 40, 'timeInBed': 100, 'isMainSleep': False},
+        ]})
+        compact(str(tmp_path))
+        self.history = HealthHistory(str(tmp_path))
+
+    def test_invalid_dataset_name(self, tmp_path):
+        '''検証が正しくない: 存在しないデータの種類が与えられる
+        '''
+        with pytest.raises(ValueError, match='"dataset_name" must be in'):
+            HealthHistory(str(tmp_path)).load('twitter', '2021-11-01', '2021-11-02')
+
+    def test_invalid_from_date_not_abide_by_format(self, tmp_path):
+        '''検証が正しくない: from_dateが文字列であるが指定のフォーマットではない
+        '''
+        with pytest.raises(ValueError, match='"from_date" must be yyyy-mm-dd.'):
+            HealthHistory(str(tmp_path)).load('fitbit_sleep', '20211101', '2021-11-02')
+
+    def test_invalid_from_date_geq_to_date(self, tmp_path):
+        '''検証が正しくない: from_dateがto_dateよりも最近の値をとる
+        '''
+        with pytest.raises(ValueError, match='"to_date" is greater than "from_date".'):
+            HealthHistory(str(tmp_path)).load('fitbit_sleep', '2021-11-02', '2021-11-01')
+
+    def test_invalid_window_lt_one(self, tmp_path):
+        '''検証が正しくない: windowに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"window" must be over 1.'):
+            HealthHistory(str(tmp_path)).rolling_average('2021-11-01', '2021-11-02', window=0)
+
+    def test_invalid_max_cached_ranges_lt_one(self, tmp_path):
+        '''検証が正しくない: max_cached_rangesに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_cached_ranges" must be over 1.'):
+            HealthHistory(str(tmp_path), max_cached_ranges=0)
+
+    def test_valid_body_composition(self, tmp_path):
+        '''検証が正しい: 体組成は日ごとの最後の測定値となり, 測定のない日はNaNとなる
+        '''
+        self.prepare(tmp_path)
+        daily = self.history.body_composition('2021-11-01', '2021-11-04')
+        assert list(daily.columns) == ['weight', 'body_fat']
+        assert daily['weight'].iloc[0] == pytest.approx(69.9)
+        assert math.isnan(daily['weight'].iloc[2])
+        assert daily['body_fat'].iloc[1] == 20
+
+    def test_valid_rolling_average(self, tmp_path):
+        '''検証が正しい: 移動平均は期間の開始日より前のデータも含めて計算される
+        '''
+        self.prepare(tmp_path)
+        rolling = self.history.rolling_average('2021-11-01', '2021-11-02', window=3)
+        assert list(rolling.index.strftime('%Y-%m-%d')) == ['2021-11-01', '2021-11-02']
+        assert rolling['weight'].iloc[0] == pytest.approx((72 + 72 + 69.9) / 3)
+        assert rolling['weight'].iloc[1] == pytest.approx((72 + 69.9 + 69.8) / 3)
+
+    def test_valid_weekly_delta(self, tmp_path):
+        '''検証が正しい: 週平均と前週からの差分が求まる
+        '''
+        self.prepare(tmp_path)
+        weekly = self.history.weekly_delta('2021-11-01', '2021-11-14')
+        assert list(weekly.index.strftime('%Y-%m-%d')) == ['2021-11-07', '2021-11-14']
+        week1 = [70 - d * 0.1 for d in [1, 2, 4, 5, 6, 7]]
+        week2 = [70 - d * 0.1 for d in range(8, 13)]
+        assert weekly['weight'].iloc[0] == pytest.approx(sum(week1) / len(week1))
+        assert weekly['weight_delta'].iloc[1] == pytest.approx(sum(week2) / len(week2) - sum(week1) / len(week1))
+        assert math.isnan(weekly['weight_delta'].iloc[0])
+
+    def test_valid_calorie_balance(self, tmp_path):
+        '''検証が正しい: カロリー収支は摂取カロリーから消費カロリーを引いた値となる
+        '''
+        self.prepare(tmp_path)
+        balance = self.history.calorie_balance('2021-11-01', '2021-11-13')
+        assert balance['balance'].iloc[0] == -99
+        assert math.isnan(balance['balance'].iloc[-1])
+
+    def test_valid_sleep_efficiency(self, tmp_path):
+        '''検証が正しい: 睡眠効率は全ての睡眠記録の合計から求まる
+        '''
+        self.prepare(tmp_path)
+        sleep = self.history.sleep_efficiency('2021-11-01', '2021-11-02')
+        assert sleep['efficiency'].iloc[0] == pytest.approx(400 / 500 * 100)
+        assert math.isnan(sleep['efficiency'].iloc[1])
+
+    def test_valid_cache(self, tmp_path):
+        '''検証が正しい: 読み込んだ期間はparquetファイルが更新されるまで保持される
+        '''
+        self.prepare(tmp_path)
+        first = self.history.load('fitbit_foods', '2021-11-01', '2021-11-13')
+        cached = cached_range(self.history, 'fitbit_foods', '2021-11-01', '2021-11-13')
+        assert self.history.load('fitbit_foods', '2021-11-01', '2021-11-13').equals(first)
+        assert cached_range(self.history, 'fitbit_foods', '2021-11-01', '2021-11-13') is cached
+        assert len(first) == 12
+
+        write_json(tmp_path, 'fitbit/foods/2021-11-13.json', {'foods': [], 'summary': {'calories': 1800}})
+        compact(str(tmp_path))
+        reloaded = self.history.load('fitbit_foods', '2021-11-01', '2021-11-13')
+        assert cached_range(self.history, 'fitbit_foods', '2021-11-01', '2021-11-13') is not cached
+        assert len(reloaded) == 13
+
+    def test_valid_cache_limit(self, tmp_path):
+        '''検証が正しい: 保持する期間は上限までとし, 最も長く参照していない期間から破棄する
+        '''
+        # 準備
+        self.prepare(tmp_path)
+        history = HealthHistory(str(tmp_path), max_cached_ranges=2)
+
+        # 実行
+        history.load('fitbit_foods', '2021-11-01', '2021-11-02')
+        first = cached_range(history, 'fitbit_foods', '2021-11-01', '2021-11-02')
+        history.load('fitbit_foods', '2021-11-02', '2021-11-03')
+        history.load('fitbit_foods', '2021-11-01', '2021-11-02')
+        assert cached_range(history, 'fitbit_foods', '2021-11-01', '2021-11-02') is first
+        # NOTE: 直前に参照した2021-11-01からの期間は残り, 2021-11-02からの期間が破棄される
+        history.load('fitbit_foods', '2021-11-03', '2021-11-04')
+        assert cached_range(history, 'fitbit_foods', '2021-11-01', '2021-11-02') is first
+        assert cached_range(history, 'fitbit_foods', '2021-11-02', '2021-11-03') is None
+        for day in range(4, 10):
+            history.load('fitbit_foods', '2021-11-{:02d}'.format(day), '2021-11-{:02d}'.format(day + 1))
+
+        # 検証
+        assert len(history._range_cache) == 2
+        assert cached_range(history, 'fitbit_foods', '2021-11-01', '2021-11-02') is None
+
+    def test_valid_load_copy(self, tmp_path):
+        '''検証が正しい: 読み込んだデータを変更しても保持しているものは変わらない
+        '''
+        # 準備
+        self.prepare(tmp_path)
+        first = self.history.load('fitbit_foods', '2021-11-01', '2021-11-13')
+        expected = first.copy()
+
+        # 実行
+        first.loc[0, 'calories'] = 0
+        first.drop(columns=['calories'], inplace=True)
+        second = self.history.load('fitbit_foods', '2021-11-01', '2021-11-13')
+        second['calories'] += 1
+        third = self.history.load('fitbit_foods', '2021-11-01', '2021-11-13')
+
+        # 検証
+        assert third.equals(expected)
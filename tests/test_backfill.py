@@ -0,0 +1,129 @@
+import datetime
+
+import pytest
+from src.backfill import Checkpoint, WorkUnit, batch_work_units, plan_work_units
+
+
+class TestPlanWorkUnits:
+    '''期間内の作業単位を列挙できるか検証
+    - 異常系
+        - from_dateに文字列以外の型が与えられる
+        - from_dateが文字列であるが指定のフォーマットではない
+        - from_dateがto_dateよりも最近の値をとる
+        - to_dateに実行日以降の日付が与えられる
+    - 正常系
+        - 各APIが遡れる範囲の作業単位のみが列挙される
+        - sourcesで指定したデータソースのみが列挙される
+    '''
+    def setup_method(self, method):
+        '''実行日を固定する
+        '''
+        self.today = datetime.date(2021, 11, 25)
+
+    def test_invalid_from_date_not_string(self):
+        '''検証が正しくない: from_dateに文字列以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"from_date" type must be str.'):
+            plan_work_units(20211120, '2021-11-24', self.today)
+
+    def test_invalid_from_date_not_abide_by_format(self):
+        '''検証が正しくない: from_dateが文字列であるが指定のフォーマットではない
+        '''
+        with pytest.raises(ValueError, match='"from_date" must be yyyy-mm-dd.'):
+            plan_work_units('20211120', '2021-11-24', self.today)
+
+    def test_invalid_from_date_geq_to_date(self):
+        '''検証が正しくない: from_dateがto_dateよりも最近の値をとる
+        '''
+        with pytest.raises(ValueError, match='"to_date" is greater than "from_date".'):
+            plan_work_units('2021-11-24', '2021-11-20', self.today)
+
+    def test_invalid_to_date_geq_today(self):
+        '''検証が正しくない: to_dateに実行日以降の日付が与えられる
+        '''
+        with pytest.raises(ValueError, match='"to_date" must be before today.'):
+            plan_work_units('2021-11-20', '2021-11-25', self.today)
+
+    def test_valid_lookback_limit(self):
+        '''検証が正しい: 各APIが遡れる範囲の作業単位のみが列挙される
+        '''
+        # 実行
+        units = plan_work_units('2021-08-20', '2021-11-24', self.today)
+
+        # 検証
+        hp_dates = [u.date for u in units if u.source == 'health_planet']
+        fb_dates = [u.date for u in units if u.source == 'fitbit']
+        tw_dates = [u.date for u in units if u.source == 'ring_fit_adventure']
+        assert hp_dates[0] == '2021-08-26'
+        assert fb_dates[0] == '2021-08-20'
+        assert len(fb_dates) == 97 * 3
+        assert tw_dates == ['2021-11-19', '2021-11-20', '2021-11-21', '2021-11-22', '2021-11-23', '2021-11-24']
+
+    def test_valid_sources(self):
+        '''検証が正しい: sourcesで指定したデータソースのみが列挙される
+        '''
+        units = plan_work_units('2021-11-23', '2021-11-24', self.today, ['fitbit'])
+        assert units == [
+            WorkUnit('fitbit', 'activities', '2021-11-23'),
+            WorkUnit('fitbit', 'foods', '2021-11-23'),
+            WorkUnit('fitbit', 'sleep', '2021-11-23'),
+            WorkUnit('fitbit', 'activities', '2021-11-24'),
+            WorkUnit('fitbit', 'foods', '2021-11-24'),
+            WorkUnit('fitbit', 'sleep', '2021-11-24'),
+        ]
+
+
+class TestCheckpoint:
+    '''完了した作業単位を記録し再開時に読み込めるか検証
+    - 正常系
+        - 記録していない作業単位は未完了となる
+        - 記録した作業単位は別のインスタンスから読み込んでも完了済みとなる
+    '''
+    def test_valid_not_done(self, tmp_path):
+        '''検証が正しい: 記録していない作業単位は未完了となる
+        '''
+        checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+        assert not checkpoint.is_done(WorkUnit('fitbit', 'sleep', '2021-11-24'))
+
+    def test_valid_resume(self, tmp_path):
+        '''検証が正しい: 記録した作業単位は別のインスタンスから読み込んでも完了済みとなる
+        '''
+        # 準備
+        path = str(tmp_path / 'checkpoint.json')
+        unit = WorkUnit('fitbit', 'sleep', '2021-11-24')
+        Checkpoint(path).mark_done(unit)
+
+        # 実行・検証
+        checkpoint = Checkpoint(path)
+        assert checkpoint.is_done(unit)
+        assert not checkpoint.is_done(WorkUnit('fitbit', 'foods', '2021-11-24'))
+
+
+class TestBatchWorkUnits:
+    '''期間を指定して取得できる作業単位を連続した日付ごとにまとめられるか検証
+    - 正常系
+        - 同じデータソース・カテゴリの連続した日付がまとめられ, 日付が途切れると分割される
+        - 1回で取得できる日数の上限で分割される
+        - max_daysにないデータソースは1件ずつとなる
+    '''
+    def test_valid_contiguous(self):
+        '''検証が正しい: 同じデータソース・カテゴリの連続した日付がまとめられ, 日付が途切れると分割される
+        '''
+        units = [WorkUnit('fitbit', 'sleep', d) for d in ['2021-11-20', '2021-11-21', '2021-11-23']]
+        units.append(WorkUnit('fitbit', 'foods', '2021-11-20'))
+        batches = batch_work_units(units, {'fitbit': 100})
+        assert [[u.date for u in b] for b in batches] == [['2021-11-20'], ['2021-11-20', '2021-11-21'], ['2021-11-23']]
+        assert [b[0].category for b in batches] == ['foods', 'sleep', 'sleep']
+
+    def test_valid_max_days(self):
+        '''検証が正しい: 1回で取得できる日数の上限で分割される
+        '''
+        units = plan_work_units('2021-11-01', '2021-11-05', datetime.date(2021, 11, 25), ['fitbit'])
+        batches = batch_work_units([u for u in units if u.category == 'sleep'], {'fitbit': 2})
+        assert [len(b) for b in batches] == [2, 2, 1]
+
+    def test_valid_not_batched(self):
+        '''検証が正しい: max_daysにないデータソースは1件ずつとなる
+        '''
+        units = [WorkUnit('ring_fit_adventure', 'figure', d) for d in ['2021-11-20', '2021-11-21']]
+        assert batch_work_units(units, {'fitbit': 100}) == [[u] for u in units]
@@ -0,0 +1,81 @@
+import pytest
+from benchmarks.fake_providers import ProviderConfig
+from benchmarks.suite import BenchmarkConfig, compare, run_suite
+
+
+def result(median, max_rss):
+    return {'results': {'main.run': {'wall_seconds': {'median': median}, 'max_rss_bytes': max_rss}}}
+
+
+class TestBenchmarks:
+    '''ローカルのサーバに対してケースを計測し, 計測結果を比較できるか検証
+    - 異常系
+        - repeatに1未満の値が与えられる
+        - 存在しないケースが与えられる
+        - 対象外の保存先が与えられる
+    - 正常系
+        - main.runを計測し, 実行時間・メモリ使用量・サーバへのリクエスト数を記録する
+        - 保存先をメモリとしたmain.runはgcsのサーバへリクエストしない
+        - 実行時間の中央値もしくは最大RSSが閾値を超えて増えたケースを返す
+        - 閾値以内の増加や比較元にないケースは返さない
+    '''
+    def test_invalid_repeat_lt_one(self):
+        '''検証が正しくない: repeatに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"repeat" must be over 1.'):
+            run_suite(BenchmarkConfig(repeat=0))
+
+    def test_invalid_cases(self):
+        '''検証が正しくない: 存在しないケースが与えられる
+        '''
+        with pytest.raises(ValueError, match='"cases" must be in'):
+            run_suite(BenchmarkConfig(repeat=1), ['fitbit.unknown'])
+
+    def test_invalid_storage(self):
+        '''検証が正しくない: 対象外の保存先が与えられる
+        '''
+        with pytest.raises(ValueError, match='"storage" must be in'):
+            run_suite(BenchmarkConfig(repeat=1, storage='s3'), ['main.run'])
+
+    def test_valid_run_suite(self):
+        '''検証が正しい: main.runを計測し, 実行時間・メモリ使用量・サーバへのリクエスト数を記録する
+        '''
+        # 準備
+        config = BenchmarkConfig(ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=1, image_kb=1), repeat=1)
+
+        # 実行
+        output = run_suite(config, ['main.run'])
+
+        # 検証
+        assert list(output['results']) == ['main.run']
+        measured = output['results']['main.run']
+        assert measured['repeat'] == 1
+        assert measured['wall_seconds']['median'] > 0
+        assert measured['peak_alloc_bytes'] > 0
+        assert measured['max_rss_bytes'] > 0
+        assert measured['gcs_objects'] > 0
+        assert all(measured['requests'][name] > 0 for name in ['fitbit', 'health_planet', 'twitter', 'gcs'])
+        assert output['config']['provider']['latency_ms'] == 0.0
+
+    def test_valid_run_suite_memory(self):
+        '''検証が正しい: 保存先をメモリとしたmain.runはgcsのサーバへリクエストしない
+        '''
+        config = BenchmarkConfig(ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=1, image_kb=1), repeat=1, storage='memory')
+        measured = run_suite(config, ['main.run'])['results']['main.run']
+        assert measured['gcs_objects'] == 0
+        assert measured['requests'].get('gcs', 0) == 0
+        assert measured['requests']['fitbit'] > 0
+
+    def test_valid_compare_regression(self):
+        '''検証が正しい: 実行時間の中央値もしくは最大RSSが閾値を超えて増えたケースを返す
+        '''
+        regressions = compare(result(1.0, 100), result(1.5, 130), threshold=0.2)
+        assert len(regressions) == 2
+        assert regressions[0].startswith('main.run wall_seconds.median: 1 -> 1.5')
+        assert regressions[1].startswith('main.run max_rss_bytes: 100 -> 130')
+
+    def test_valid_compare_no_regression(self):
+        '''検証が正しい: 閾値以内の増加や比較元にないケースは返さない
+        '''
+        assert compare(result(1.0, 100), result(1.1, 90), threshold=0.2) == []
+        assert compare({'results': {}}, result(1.0, 100)) == []
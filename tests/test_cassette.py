@@ -0,0 +1,144 @@
+import gzip
+import json
+import time
+import urllib.error
+
+import pytest
+from src.cassette import (REDACTED, Cassette, CassetteMissError, RecordingTransport, ReplayTransport, redact_body,
+                          redact_url)
+from tests.fake_server import FakeServer
+
+
+def handler(method, path, headers, body):
+    '''トークンのエンドポイント, 画像, 存在しないパスを返す
+    '''
+    if path.startswith('/token'):
+        return 200, {'Content-Type': 'application/json'}, b'{"access_token": "new-access", "expires_in": 28800}'
+    if path.startswith('/image'):
+        return 200, {'Content-Type': 'image/jpeg'}, bytes(range(256))
+    return 404, {'Content-Type': 'application/json'}, b'{"errors": [{"message": "not found"}]}'
+
+
+class TestRedact:
+    '''認証情報の値を伏せられるか検証
+    - 正常系
+        - urlのクエリのうち認証情報の値のみを伏せ, クエリの無いurlはそのまま返す
+        - jsonのボディのうち認証情報の値のみを伏せ, json以外はそのまま返す
+    '''
+    def test_valid_url(self):
+        '''検証が正しい: urlのクエリのうち認証情報の値のみを伏せ, クエリの無いurlはそのまま返す
+        '''
+        assert redact_url('https://example.com/status?access_token=secret&date=20211123') == \
+            'https://example.com/status?access_token={}&date=20211123'.format(REDACTED)
+        assert redact_url('https://example.com/search?query=from%3A1%20%23tag') == 'https://example.com/search?query=from%3A1%20%23tag'
+        assert redact_url('https://example.com/image.jpg') == 'https://example.com/image.jpg'
+
+    def test_valid_body(self):
+        '''検証が正しい: jsonのボディのうち認証情報の値のみを伏せ, json以外はそのまま返す
+        '''
+        body = redact_body(b'{"access_token": "a", "refresh_token": "r", "expires_in": 28800}')
+        assert json.loads(body) == {'access_token': REDACTED, 'refresh_token': REDACTED, 'expires_in': 28800}
+        assert redact_body(b'{"data": []}') == b'{"data": []}'
+        assert redact_body(b'[1, 2]') == b'[1, 2]'
+        assert redact_body(b'\xff\xd8') == b'\xff\xd8'
+
+
+class TestCassette:
+    '''リクエストとレスポンスを記録し, 送信せずに再生できるか検証
+    - 異常系
+        - 記録していないリクエストを再生するとCassetteMissErrorが送出される
+        - latencyに数値以外の型が与えられる
+        - latencyに負の値が与えられる
+    - 正常系
+        - 認証情報を伏せて記録・保存し, 読み込んだcassetteから同じレスポンス(エラー, バイナリを含む)を再生する
+        - 同じリクエストは記録した順に返し, 全て返した後は最後のレスポンスを繰り返す
+        - 再生時に指定した時間だけ待機する
+    '''
+    def test_invalid_miss(self, tmp_path):
+        '''検証が正しくない: 記録していないリクエストを再生するとCassetteMissErrorが送出される
+        '''
+        transport = ReplayTransport(Cassette(str(tmp_path / 'cassette.json.gz')))
+        with pytest.raises(CassetteMissError, match='GET http://127.0.0.1/missing is not recorded'):
+            transport.request('GET', 'http://127.0.0.1/missing')
+
+    def test_invalid_latency_not_number(self, tmp_path):
+        '''検証が正しくない: latencyに数値以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"latency" type must be float.'):
+            ReplayTransport(Cassette(str(tmp_path / 'cassette.json.gz')), latency='0.1')
+
+    def test_invalid_latency_negative(self, tmp_path):
+        '''検証が正しくない: latencyに負の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"latency_scale" must be over 0.'):
+            ReplayTransport(Cassette(str(tmp_path / 'cassette.json.gz')), latency_scale=-1.0)
+
+    def test_valid(self, tmp_path):
+        '''検証が正しい: 認証情報を伏せて記録・保存し, 読み込んだcassetteから同じレスポンス(エラー, バイナリを含む)を再生する
+        '''
+        # 準備
+        path = str(tmp_path / 'cassettes' / 'cassette.json.gz')
+        recording = Cassette(path, meta={'day': '2021-11-23'})
+
+        # 実行
+        with FakeServer(handler) as server:
+            transport = RecordingTransport(recording)
+            token = transport.request('POST', server.url + '/token?code=secret-code', data=b'grant_type=authorization_code')
+            with transport.stream('GET', server.url + '/image.jpg') as res:
+                image = res.read()
+            with pytest.raises(urllib.error.HTTPError) as recorded_error:
+                transport.request('GET', server.url + '/missing')
+            recording.save()
+        replaying = Cassette(path).load()
+        replay = ReplayTransport(replaying)
+        replayed_token = replay.request('POST', server.url + '/token?code=other-code')
+        with replay.stream('GET', server.url + '/image.jpg') as res:
+            replayed_image = res.read()
+        with pytest.raises(urllib.error.HTTPError) as replayed_error:
+            replay.request('GET', server.url + '/missing')
+
+        # 検証
+        assert json.loads(token.body)['access_token'] == 'new-access'
+        assert json.loads(replayed_token.body) == {'access_token': REDACTED, 'expires_in': 28800}
+        assert replayed_image == image == bytes(range(256))
+        assert replayed_error.value.code == recorded_error.value.code == 404
+        assert replayed_error.value.read() == b'{"errors": [{"message": "not found"}]}'
+        assert replaying.meta == {'day': '2021-11-23'}
+        with open(path, 'rb') as f:
+            raw = gzip.decompress(f.read())
+        assert b'secret-code' not in raw
+        assert b'new-access' not in raw
+
+    def test_valid_order(self, tmp_path):
+        '''検証が正しい: 同じリクエストは記録した順に返し, 全て返した後は最後のレスポンスを繰り返す
+        '''
+        # 準備
+        counter = {'count': 0}
+
+        def counting(method, path, headers, body):
+            counter['count'] += 1
+            return 200, {}, str(counter['count']).encode('utf-8')
+
+        cassette = Cassette(str(tmp_path / 'cassette.json.gz'))
+        with FakeServer(counting) as server:
+            transport = RecordingTransport(cassette)
+            url = server.url + '/count'
+            recorded = [transport.request('GET', url).body for _ in range(2)]
+
+        # 実行
+        replay = ReplayTransport(cassette)
+        replayed = [replay.request('GET', url).body for _ in range(3)]
+
+        # 検証
+        assert recorded == [b'1', b'2']
+        assert replayed == [b'1', b'2', b'2']
+
+    def test_valid_latency(self, tmp_path):
+        '''検証が正しい: 再生時に指定した時間だけ待機する
+        '''
+        cassette = Cassette(str(tmp_path / 'cassette.json.gz'))
+        with FakeServer(handler) as server:
+            RecordingTransport(cassette).request('GET', server.url + '/image.jpg')
+        started = time.perf_counter()
+        ReplayTransport(cassette, latency=0.05).request('GET', server.url + '/image.jpg')
+        assert time.perf_counter() - started >= 0.05
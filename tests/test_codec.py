@@ -0,0 +1,85 @@
+import gzip
+
+import pytest
+from src.codec import compress, decompress, dumps, load_file, load_gcs, loads
+from tests.fake_gcs import FakeClient
+
+PAYLOAD = {'sleep': [{'logId': i, 'levels': {'data': [{'level': 'light', 'seconds': 60}] * 20}} for i in range(10)]}
+
+
+class TestCompress:
+    '''保存するデータを圧縮し, 圧縮形式によらず読み込めるか検証
+    - 異常系
+        - compressionにstr以外の型が与えられる
+        - compressionに対象外の文字列が与えられる
+    - 正常系
+        - 圧縮しない場合はそのまま返し, Content-EncodingはNoneとなる
+        - gzipで圧縮したデータは同じデータから常に同じバイト列となる
+        - zstdで圧縮したデータを展開できる
+        - Content-Encodingが不明でもデータの先頭から圧縮形式を判別して読み込める
+    '''
+    def test_invalid_compression_not_string(self):
+        '''検証が正しくない: compressionにstr以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"compression" type must be str.'):
+            compress(b'{}', 1)
+
+    def test_invalid_compression_bad_string(self):
+        '''検証が正しくない: compressionに対象外の文字列が与えられる
+        '''
+        with pytest.raises(ValueError, match='"compression" must be in'):
+            compress(b'{}', 'bz2')
+
+    def test_valid_identity(self):
+        '''検証が正しい: 圧縮しない場合はそのまま返し, Content-EncodingはNoneとなる
+        '''
+        assert compress(b'{}') == (b'{}', None)
+        assert decompress(b'{}') == b'{}'
+
+    def test_valid_gzip(self):
+        '''検証が正しい: gzipで圧縮したデータは同じデータから常に同じバイト列となる
+        '''
+        data, content_encoding = dumps(PAYLOAD, 'gzip')
+        assert content_encoding == 'gzip'
+        assert data == dumps(PAYLOAD, 'gzip')[0]
+        assert len(data) < len(dumps(PAYLOAD)[0]) / 10
+        assert gzip.decompress(data) == dumps(PAYLOAD)[0]
+        assert loads(data, 'gzip') == PAYLOAD
+
+    def test_valid_zstd(self):
+        '''検証が正しい: zstdで圧縮したデータを展開できる
+        '''
+        pytest.importorskip('zstandard')
+        data, content_encoding = dumps(PAYLOAD, 'zstd')
+        assert content_encoding == 'zstd'
+        assert loads(data, 'zstd') == PAYLOAD
+
+    def test_valid_detect(self, tmp_path):
+        '''検証が正しい: Content-Encodingが不明でもデータの先頭から圧縮形式を判別して読み込める
+        '''
+        path = tmp_path / '2021-11-24.json'
+        path.write_bytes(dumps(PAYLOAD, 'gzip')[0])
+        assert load_file(str(path)) == PAYLOAD
+        path.write_bytes(dumps(PAYLOAD)[0])
+        assert load_file(str(path)) == PAYLOAD
+
+
+class TestLoadGcs:
+    '''gcsに保存したjsonを圧縮形式によらず読み込めるか検証
+    - 異常系: 存在しないパスが与えられる
+    - 正常系: オブジェクトのContent-Encodingに従って展開する
+    '''
+    def test_invalid_not_found(self):
+        '''検証が正しくない: 存在しないパスが与えられる
+        '''
+        with pytest.raises(FileNotFoundError):
+            load_gcs('fitbit/sleep/2021-11-24.json', client=FakeClient())
+
+    def test_valid(self):
+        '''検証が正しい: オブジェクトのContent-Encodingに従って展開する
+        '''
+        client = FakeClient()
+        blob = client.bucket('export_from_devices').blob('fitbit/sleep/2021-11-24.json')
+        data, blob.content_encoding = dumps(PAYLOAD, 'gzip')
+        blob.upload_from_string(data, content_type='application/json')
+        assert load_gcs('fitbit/sleep/2021-11-24.json', client=client) == PAYLOAD
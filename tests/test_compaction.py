@@ -0,0 +1,164 @@
+import datetime
+import json
+import os
+
+import pytest
+from src.codec import dumps
+from src.compaction import STATE_FILE_NAME, compact
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+ACTIVITIES = {
+    'activities': [],
+    'summary': {
+        'steps': 8000, 'caloriesOut': 2300, 'activityCalories': 900, 'caloriesBMR': 1500,
+        'sedentaryMinutes': 600, 'lightlyActiveMinutes': 200, 'fairlyActiveMinutes': 20, 'veryActiveMinutes': 10,
+        'distances': [{'activity': 'total', 'distance': 5.5}], 'floors': 3,
+    },
+}
+SLEEP = {
+    'sleep': [{
+        'logId': 1, 'startTime': '2021-11-23T23:10:00.000', 'endTime': '2021-11-24T06:40:00.000', 'duration': 27000000,
+        'efficiency': 93, 'minutesAsleep': 420, 'minutesAwake': 30, 'minutesToFallAsleep': 0, 'minutesAfterWakeup': 0,
+        'timeInBed': 450, 'isMainSleep': True, 'type': 'stages',
+    }],
+    'summary': {},
+}
+HEALTH_PLANET = {
+    'data': [
+        {'date': '202111240712', 'keydata': '70.10', 'model': '01000117', 'tag': '6021'},
+        {'date': '202111240712', 'keydata': '20.50', 'model': '01000117', 'tag': '6022'},
+    ],
+}
+
+
+def write_json(root, relative_path, data):
+    path = root / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data))
+
+
+class TestCompact:
+    '''日次のjsonファイルをsourceと月ごとのparquetファイルにまとめられるか検証
+    - 異常系
+        - sourcesにlist以外の型が与えられる
+        - sourcesに存在しないデータソースが与えられる
+    - 正常系
+        - 月ごとのparquetファイルに型付きの列として書き出される
+        - 測定・睡眠記録ごとのデータは1件ずつ行になる
+        - 期間を指定して取得したFitbitのデータは含む列のみの別のsourceとして書き出される
+        - 日次のファイルが追加・更新されたパーティションのみ書き直される
+        - 日次のファイル名の形式に合わないファイルは無視される
+        - 圧縮して保存した日次のファイルも読み込める
+    '''
+    def test_invalid_sources_not_list(self, tmp_path):
+        '''検証が正しくない: sourcesにlist以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"sources" type must be list.'):
+            compact(str(tmp_path), sources='fitbit_sleep')
+
+    def test_invalid_sources_unknown(self, tmp_path):
+        '''検証が正しくない: sourcesに存在しないデータソースが与えられる
+        '''
+        with pytest.raises(ValueError, match='"sources" must be in'):
+            compact(str(tmp_path), sources=['twitter'])
+
+    def test_valid_monthly_partition(self, tmp_path):
+        '''検証が正しい: 月ごとのparquetファイルに型付きの列として書き出される
+        '''
+        # 準備
+        write_json(tmp_path, 'fitbit/activities/2021-10-31.json', ACTIVITIES)
+        write_json(tmp_path, 'fitbit/activities/2021-11-01.json', ACTIVITIES)
+        write_json(tmp_path, 'fitbit/activities/2021-11-02.json', {'summary': {'steps': 100}})
+
+        # 実行
+        written = compact(str(tmp_path))
+
+        # 検証
+        out_dir = tmp_path / 'compacted'
+        assert sorted(written) == [
+            str(out_dir / 'source=fitbit_activities/month=2021-10/data.parquet'),
+            str(out_dir / 'source=fitbit_activities/month=2021-11/data.parquet'),
+        ]
+        table = pq.read_table(str(out_dir / 'source=fitbit_activities/month=2021-11/data.parquet'))
+        assert str(table.schema.field('date').type) == 'date32[day]'
+        assert str(table.schema.field('steps').type) == 'int64'
+        assert table.column('date').to_pylist() == [datetime.date(2021, 11, 1), datetime.date(2021, 11, 2)]
+        assert table.column('steps').to_pylist() == [8000, 100]
+        assert table.column('distance_total').to_pylist() == [5.5, None]
+
+    def test_valid_record_rows(self, tmp_path):
+        '''検証が正しい: 測定・睡眠記録ごとのデータは1件ずつ行になる
+        '''
+        # 準備
+        write_json(tmp_path, 'health_planet/2021-11-24.json', HEALTH_PLANET)
+        write_json(tmp_path, 'fitbit/sleep/2021-11-24.json', SLEEP)
+
+        # 実行
+        compact(str(tmp_path))
+
+        # 検証
+        out_dir = tmp_path / 'compacted'
+        hp = pq.read_table(str(out_dir / 'source=health_planet/month=2021-11/data.parquet')).to_pylist()
+        assert [(r['body_type'], r['value']) for r in hp] == [('weight', 70.1), ('fat', 20.5)]
+        assert hp[0]['measured_at'].astimezone(datetime.timezone.utc) == datetime.datetime(2021, 11, 23, 22, 12, tzinfo=datetime.timezone.utc)
+        sleep = pq.read_table(str(out_dir / 'source=fitbit_sleep/month=2021-11/data.parquet')).to_pylist()
+        assert sleep[0]['start_time'] == datetime.datetime(2021, 11, 23, 23, 10)
+        assert sleep[0]['efficiency'] == 93
+        assert sleep[0]['is_main_sleep'] is True
+
+    def test_valid_fitbit_range(self, tmp_path):
+        '''検証が正しい: 期間を指定して取得したFitbitのデータは含む列のみの別のsourceとして書き出される
+        '''
+        # 準備
+        write_json(tmp_path, 'fitbit_range/foods/2021-11-24.json', {'summary': {'calories': 2000, 'water': 1500.0}})
+        write_json(tmp_path, 'fitbit_range/activities/2021-11-24.json', {'summary': {'steps': 8000}})
+
+        # 実行
+        written = compact(str(tmp_path))
+
+        # 検証
+        out_dir = tmp_path / 'compacted'
+        assert sorted(written) == [
+            str(out_dir / 'source=fitbit_range_activities/month=2021-11/data.parquet'),
+            str(out_dir / 'source=fitbit_range_foods/month=2021-11/data.parquet'),
+        ]
+        foods = pq.read_table(str(out_dir / 'source=fitbit_range_foods/month=2021-11/data.parquet'))
+        assert foods.schema.names == ['date', 'calories', 'water']
+        assert foods.to_pylist() == [{'date': datetime.date(2021, 11, 24), 'calories': 2000.0, 'water': 1500.0}]
+
+    def test_valid_incremental(self, tmp_path):
+        '''検証が正しい: 日次のファイルが追加・更新されたパーティションのみ書き直される
+        '''
+        # 準備
+        write_json(tmp_path, 'fitbit/activities/2021-10-31.json', ACTIVITIES)
+        write_json(tmp_path, 'fitbit/activities/2021-11-01.json', ACTIVITIES)
+        compact(str(tmp_path))
+
+        # 実行, 検証
+        assert compact(str(tmp_path)) == []
+        write_json(tmp_path, 'fitbit/activities/2021-11-02.json', ACTIVITIES)
+        assert compact(str(tmp_path)) == [str(tmp_path / 'compacted/source=fitbit_activities/month=2021-11/data.parquet')]
+        assert os.path.exists(tmp_path / 'compacted' / STATE_FILE_NAME)
+
+    def test_valid_ignore_other_files(self, tmp_path):
+        '''検証が正しい: 日次のファイル名の形式に合わないファイルは無視される
+        '''
+        (tmp_path / 'fitbit/foods').mkdir(parents=True)
+        (tmp_path / 'fitbit/foods/.gitkeep').write_text('')
+        assert compact(str(tmp_path)) == []
+
+    def test_valid_compressed(self, tmp_path):
+        '''検証が正しい: 圧縮して保存した日次のファイルも読み込める
+        '''
+        # 準備
+        path = tmp_path / 'fitbit/activities/2021-11-24.json'
+        path.parent.mkdir(parents=True)
+        path.write_bytes(dumps(ACTIVITIES, 'gzip')[0])
+
+        # 実行
+        compact(str(tmp_path))
+
+        # 検証
+        rows = pq.read_table(str(tmp_path / 'compacted/source=fitbit_activities/month=2021-11/data.parquet')).to_pylist()
+        assert rows[0]['steps'] == 8000
@@ -0,0 +1,64 @@
+import datetime
+
+from freezegun import freeze_time
+from src.dates import JST, parse_jst, subtract_months, today_jst, yesterday_str
+
+
+class TestSubtractMonths:
+    '''指定した月数だけ遡った日付を求められるか検証
+    - 正常系
+        - 同じ日が存在する月に遡る
+        - 年をまたいで遡る
+        - 遡った月に同じ日が存在せず月末となる
+        - 時刻を与えた場合は時刻とタイムゾーンを保持する
+    '''
+    def test_valid_same_day(self):
+        '''検証が正しい: 同じ日が存在する月に遡る
+        '''
+        assert subtract_months(datetime.date(2021, 11, 15), 3) == datetime.date(2021, 8, 15)
+
+    def test_valid_over_year(self):
+        '''検証が正しい: 年をまたいで遡る
+        '''
+        assert subtract_months(datetime.date(2022, 1, 10), 3) == datetime.date(2021, 10, 10)
+
+    def test_valid_end_of_month(self):
+        '''検証が正しい: 遡った月に同じ日が存在せず月末となる
+        '''
+        assert subtract_months(datetime.date(2021, 5, 31), 3) == datetime.date(2021, 2, 28)
+
+    def test_valid_datetime(self):
+        '''検証が正しい: 時刻を与えた場合は時刻とタイムゾーンを保持する
+        '''
+        dt = datetime.datetime(2021, 11, 30, 10, 0, tzinfo=JST)
+        assert subtract_months(dt, 3) == datetime.datetime(2021, 8, 30, 10, 0, tzinfo=JST)
+
+
+class TestToday:
+    '''Asia/Tokyoにおける日付を求められるか検証
+    - 正常系
+        - UTCでは前日であってもAsia/Tokyoの日付を返す
+        - 昨日の日付を"yyyy-mm-dd"形式で返す
+    '''
+    @freeze_time('2021-11-24 16:00:00')
+    def test_valid_today(self):
+        '''検証が正しい: UTCでは前日であってもAsia/Tokyoの日付を返す
+        '''
+        assert today_jst() == datetime.date(2021, 11, 25)
+
+    @freeze_time('2021-11-24 16:00:00')
+    def test_valid_yesterday(self):
+        '''検証が正しい: 昨日の日付を"yyyy-mm-dd"形式で返す
+        '''
+        assert yesterday_str() == '2021-11-24'
+
+
+class TestParseJst:
+    '''文字列をAsia/Tokyoの時刻として解釈できるか検証
+    - 正常系: Health Planetの日時をUTCに変換すると9時間前となる
+    '''
+    def test_valid(self):
+        '''検証が正しい: Health Planetの日時をUTCに変換すると9時間前となる
+        '''
+        dt = parse_jst('202111250830', '%Y%m%d%H%M')
+        assert dt.astimezone(datetime.timezone.utc) == datetime.datetime(2021, 11, 24, 23, 30, tzinfo=datetime.timezone.utc)
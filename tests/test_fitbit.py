@@ -1,7 +1,17 @@
+import datetime
+import json
+import re
+import threading
+import time
 import urllib
+import urllib.parse
 
 import pytest
-from src.fitbit import Fitbit
+from src.fitbit import ACTIVITY_TIME_SERIES, BodyLogEntry, Fitbit, RateLimitBudget
+from src.response_cache import ResponseCache
+from src.retry import RetryPolicy
+from src.transport import HttpTransport
+from tests.fake_server import FakeServer
 
 
 @pytest.mark.skip('input()やwebbrowser.open()を含む処理のテストの書き方')
@@ -163,11 +173,32 @@ class TestRefreshAccessToken:
         with pytest.raises(urllib.error.HTTPError, match='HTTP Error 401: Unauthorized'):
             fb.refresh_access_token()
 
-    @pytest.mark.skip('mockが作成できていないため')
     def test_valid(self):
         '''検証が正しい: access_tokenとrefresh_tokenが新しい値に更新される
         '''
-        pass
+        # 準備
+        def handler(method, path, headers, body):
+            res = {'access_token': 'new_access_token', 'refresh_token': 'new_refresh_token', 'expires_in': 28800}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(res).encode('utf-8')
+
+        # 実行
+        with FakeServer(handler) as server:
+            fb = Fitbit(
+                client_id=self.fake_client_id,
+                client_secret=self.fake_client_secret,
+                access_token=self.bad_access_token,
+                refresh_token=self.fake_refresh_token,
+                api_base=server.url
+            )
+            before = time.time()
+            fb.refresh_access_token()
+
+        # 検証
+        assert server.requests[0][1] == '/oauth2/token'
+        assert b'refresh_token=fake_refresh_token' in server.requests[0][3]
+        assert fb.access_token == 'new_access_token'
+        assert fb.refresh_token == 'new_refresh_token'
+        assert before + 28800 <= fb.expires_at <= time.time() + 28800
 
 
 # TODO: access_tokenが不正の場合にErrorを返すmockの作成方法
@@ -385,3 +416,534 @@ class TestCreateBodyLog:
         '''検証が正しい: プロフィールが格納された辞書型のデータを取得する
         '''
         pass
+
+
+class TestRateLimitBudget:
+    '''レスポンスヘッダからレート制限の残量を把握し, 残量がなければ回復まで待機するか検証
+    - 正常系
+        - レスポンスヘッダから残量と回復時刻を更新する
+        - 残量が残っていれば待機せずに1回分を確保する
+        - 残量がなければ回復時刻まで待機する
+        - ローカルのサーバが返すヘッダから残量を把握する
+        - HttpTransportが再送する場合も再送ごとに残量を確保し, 残量がなければ回復時刻まで待機する
+    '''
+    def setup_method(self, method):
+        '''時刻と待機を記録する関数を用意する
+        '''
+        self.now = 1000.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def test_valid_update(self):
+        '''検証が正しい: レスポンスヘッダから残量と回復時刻を更新する
+        '''
+        # 準備
+        budget = RateLimitBudget(clock=self.clock, sleep=self.sleep)
+        headers = {
+            'Fitbit-Rate-Limit-Limit': '150',
+            'Fitbit-Rate-Limit-Remaining': '149',
+            'Fitbit-Rate-Limit-Reset': '1800'
+        }
+
+        # 実行
+        budget.update(headers)
+
+        # 検証
+        assert budget.limit == 150
+        assert budget.remaining == 149
+        assert budget.reset_at == 2800.0
+
+    def test_valid_acquire_without_wait(self):
+        '''検証が正しい: 残量が残っていれば待機せずに1回分を確保する
+        '''
+        budget = RateLimitBudget(limit=150, remaining=2, reset_at=2800.0, clock=self.clock, sleep=self.sleep)
+        budget.acquire()
+        assert budget.remaining == 1
+        assert self.slept == []
+
+    def test_valid_acquire_wait_until_reset(self):
+        '''検証が正しい: 残量がなければ回復時刻まで待機する
+        '''
+        # 準備
+        budget = RateLimitBudget(limit=150, remaining=5, reset_at=1600.0, reserve=5, clock=self.clock, sleep=self.sleep)
+
+        # 実行
+        budget.acquire()
+
+        # 検証
+        assert self.slept == [600.0]
+        assert budget.remaining == 149
+
+    def test_valid_fake_server(self):
+        '''検証が正しい: ローカルのサーバが返すヘッダから残量を把握する
+        '''
+        # 準備
+        def handler(method, path, headers, body):
+            res_headers = {
+                'Content-Type': 'application/json',
+                'Fitbit-Rate-Limit-Limit': '150',
+                'Fitbit-Rate-Limit-Remaining': '148',
+                'Fitbit-Rate-Limit-Reset': '120'
+            }
+            return 200, res_headers, b'{"sleep": []}'
+
+        # 実行
+        with FakeServer(handler) as server:
+            fb = Fitbit(
+                client_id='fake_client_id',
+                client_secret='fake_client_secret',
+                access_token='fake_access_token',
+                api_base=server.url,
+                rate_limit=RateLimitBudget(clock=self.clock, sleep=self.sleep)
+            )
+            result = fb.fetch_trace_data('sleep', '2021-09-25')
+
+        # 検証
+        assert result == {'sleep': []}
+        assert server.requests[0][1] == '/1.2/user/-/sleep/date/2021-09-25.json'
+        assert fb.rate_limit.remaining == 148
+        assert fb.rate_limit.reset_at == 1120.0
+
+    def test_valid_retry(self):
+        '''検証が正しい: HttpTransportが再送する場合も再送ごとに残量を確保し, 残量がなければ回復時刻まで待機する
+        '''
+        # 準備
+        def handler(method, path, headers, body):
+            # NOTE: 1回目は残量が残り1回の状態で503を返し, 再送には回復後の残量を返す
+            if len(server.requests) == 1:
+                res_headers = {'Fitbit-Rate-Limit-Limit': '150', 'Fitbit-Rate-Limit-Remaining': '1', 'Fitbit-Rate-Limit-Reset': '600'}
+                return 503, res_headers, b'{}'
+            res_headers = {'Fitbit-Rate-Limit-Limit': '150', 'Fitbit-Rate-Limit-Remaining': '149', 'Fitbit-Rate-Limit-Reset': '3600'}
+            return 200, res_headers, b'{"sleep": []}'
+
+        retry_policy = RetryPolicy(random=lambda: 0.0, sleep=lambda seconds: None)
+
+        # 実行
+        with FakeServer(handler) as server:
+            fb = Fitbit(
+                client_id='fake_client_id',
+                client_secret='fake_client_secret',
+                access_token='fake_access_token',
+                api_base=server.url,
+                rate_limit=RateLimitBudget(reserve=1, clock=self.clock, sleep=self.sleep),
+                transport=HttpTransport(retry_policy=retry_policy)
+            )
+            result = fb.fetch_trace_data('sleep', '2021-09-25')
+
+        # 検証
+        assert result == {'sleep': []}
+        assert len(server.requests) == 2
+        assert self.slept == [600.0]
+        assert fb.rate_limit.remaining == 149
+
+
+class TestTokenRefresh:
+    '''access_tokenを事前に, もしくは期限切れ時に1回だけ更新できるか検証
+    - 異常系: 401以外のエラーではトークンを更新せずに例外を送出する
+    - 正常系
+        - 有効期限が近ければリクエストの前に更新する
+        - 401で失敗した場合は更新して再送し, 更新したトークンを保存する関数が呼ばれる
+        - 更新したトークンの保存に失敗しても, 更新を契機としたリクエストは成功する
+        - 同時に401で失敗した場合もトークンの更新は1回にまとめられる
+    '''
+    def setup_method(self, method):
+        '''有効なaccess_tokenと, トークンの更新回数を記録する変数を用意する
+        '''
+        self.valid_access_token = 'valid_access_token'
+        self.token_requests = 0
+        self.lock = threading.Lock()
+
+    def handler(self, method, path, headers, body):
+        '''トークンの更新と, 有効なaccess_tokenのみを受け付けるトレースデータの取得を再現する
+        '''
+        if path == '/oauth2/token':
+            with self.lock:
+                self.token_requests += 1
+            time.sleep(0.1)
+            res = {'access_token': self.valid_access_token, 'refresh_token': 'new_refresh_token', 'expires_in': 28800}
+            return 200, {}, json.dumps(res).encode('utf-8')
+        if path == '/1.2/user/-/sleep/date/2021-09-25.json':
+            return 500, {}, b'{}'
+        if headers.get('Authorization') != 'Bearer ' + self.valid_access_token:
+            return 401, {}, b'{"errors": [{"errorType": "expired_token"}]}'
+        return 200, {}, b'{"summary": {}}'
+
+    def create_fitbit(self, server, access_token, **kwargs):
+        return Fitbit(
+            client_id='fake_client_id',
+            client_secret='fake_client_secret',
+            access_token=access_token,
+            refresh_token='fake_refresh_token',
+            api_base=server.url,
+            **kwargs
+        )
+
+    def test_invalid_not_unauthorized(self):
+        '''検証が正しくない: 401以外のエラーではトークンを更新せずに例外を送出する
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, self.valid_access_token)
+            with pytest.raises(urllib.error.HTTPError, match='HTTP Error 500: Internal Server Error'):
+                fb.fetch_trace_data('sleep', '2021-09-25')
+        assert self.token_requests == 0
+
+    def test_valid_proactive(self):
+        '''検証が正しい: 有効期限が近ければリクエストの前に更新する
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, 'expiring_access_token', expires_at=time.time() + 60)
+            result = fb.fetch_trace_data('activities', '2021-09-25')
+        assert result == {'summary': {}}
+        assert [r[1] for r in server.requests] == ['/oauth2/token', '/1.2/user/-/activities/date/2021-09-25.json']
+
+    def test_valid_unauthorized(self):
+        '''検証が正しい: 401で失敗した場合は更新して再送し, 更新したトークンを保存する関数が呼ばれる
+        '''
+        # 準備
+        saved = []
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, 'expired_access_token', on_token_refresh=lambda f: saved.append(f.refresh_token))
+            result = fb.fetch_trace_data('activities', '2021-09-25')
+
+        # 検証
+        assert result == {'summary': {}}
+        assert self.token_requests == 1
+        assert saved == ['new_refresh_token']
+
+    def test_valid_save_failed(self):
+        '''検証が正しい: 更新したトークンの保存に失敗しても, 更新を契機としたリクエストは成功する
+        '''
+        # 準備
+        def on_token_refresh(fb):
+            raise PermissionError('Permission denied on secret')
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, 'expired_access_token', on_token_refresh=on_token_refresh)
+            result = fb.fetch_trace_data('activities', '2021-09-25')
+
+        # 検証
+        assert result == {'summary': {}}
+        assert fb.access_token == self.valid_access_token
+
+    def test_valid_single_flight(self):
+        '''検証が正しい: 同時に401で失敗した場合もトークンの更新は1回にまとめられる
+        '''
+        # 準備
+        results = []
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, 'expired_access_token')
+            threads = [
+                threading.Thread(target=lambda c: results.append(fb.fetch_trace_data(c, '2021-09-26')), args=(c,))
+                for c in ['activities', 'foods', 'sleep']
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        # 検証
+        assert len(results) == 3
+        assert self.token_requests == 1
+
+
+class TestFetchTraceDataRange:
+    '''期間を指定するエンドポイントで取得したデータを日ごとに分割できるか検証
+    - 異常系
+        - categoryに対象外の文字列が与えられる
+        - from_dateがto_dateよりも最近の値をとる
+        - 期間が上限の日数を超える
+    - 正常系
+        - 睡眠は1回のリクエストで取得し, dateOfSleepごとに分割される
+        - 運動はリソースごとの時系列からsummaryを組み立てる
+        - 食事は摂取カロリーと水分の時系列からsummaryを組み立てる
+    '''
+    def setup_method(self, method):
+        '''期間を指定するエンドポイントを再現するサーバの応答を用意する
+        '''
+        def handler(method, path, headers, body):
+            if path == '/1.2/user/-/sleep/date/2021-11-23/2021-11-24.json':
+                res = {'sleep': [
+                    {'dateOfSleep': '2021-11-24', 'logId': 2, 'minutesAsleep': 40, 'timeInBed': 50},
+                    {'dateOfSleep': '2021-11-24', 'logId': 1, 'minutesAsleep': 400, 'timeInBed': 430},
+                ]}
+                return 200, {}, json.dumps(res).encode('utf-8')
+            m = re.match(r'^/1/user/-/(activities|foods/log)/(\w+)/date/2021-11-23/2021-11-24.json$', path)
+            if m is None:
+                return 404, {}, b'{}'
+            value = '5.5' if m.group(2) == 'distance' else '100'
+            res = {'{}-{}'.format(m.group(1).replace('/', '-'), m.group(2)): [
+                {'dateTime': '2021-11-23', 'value': value},
+                {'dateTime': '2021-11-24', 'value': value},
+            ]}
+            return 200, {}, json.dumps(res).encode('utf-8')
+        self.handler = handler
+
+    def create_fitbit(self, server=None):
+        return Fitbit(
+            client_id='fake_client_id',
+            client_secret='fake_client_secret',
+            access_token='fake_access_token',
+            api_base=server.url if server is not None else 'https://api.fitbit.com'
+        )
+
+    def test_invalid_category_bad_string(self):
+        '''検証が正しくない: categoryに対象外の文字列が与えられる
+        '''
+        with pytest.raises(ValueError, match='Please input "activities" or "foods" or "sleep"'):
+            self.create_fitbit().fetch_trace_data_range('body', '2021-11-23', '2021-11-24')
+
+    def test_invalid_from_date_geq_to_date(self):
+        '''検証が正しくない: from_dateがto_dateよりも最近の値をとる
+        '''
+        with pytest.raises(ValueError, match='"to_date" is greater than "from_date".'):
+            self.create_fitbit().fetch_trace_data_range('sleep', '2021-11-24', '2021-11-23')
+
+    def test_invalid_over_max_days(self):
+        '''検証が正しくない: 期間が上限の日数を超える
+        '''
+        with pytest.raises(ValueError, match='"to_date" must be within 100 days from "from_date".'):
+            self.create_fitbit().fetch_trace_data_range('sleep', '2021-08-01', '2021-11-24')
+
+    def test_valid_sleep(self):
+        '''検証が正しい: 睡眠は1回のリクエストで取得し, dateOfSleepごとに分割される
+        '''
+        with FakeServer(self.handler) as server:
+            result = self.create_fitbit(server).fetch_trace_data_range('sleep', '2021-11-23', '2021-11-24')
+        assert len(server.requests) == 1
+        assert result['2021-11-23'] == {'sleep': [], 'summary': {'totalMinutesAsleep': 0, 'totalSleepRecords': 0, 'totalTimeInBed': 0}}
+        assert [s['logId'] for s in result['2021-11-24']['sleep']] == [2, 1]
+        assert result['2021-11-24']['summary'] == {'totalMinutesAsleep': 440, 'totalSleepRecords': 2, 'totalTimeInBed': 480}
+
+    def test_valid_activities(self):
+        '''検証が正しい: 運動はリソースごとの時系列からsummaryを組み立てる
+        '''
+        with FakeServer(self.handler) as server:
+            result = self.create_fitbit(server).fetch_trace_data_range('activities', '2021-11-23', '2021-11-24')
+        assert len(server.requests) == len(ACTIVITY_TIME_SERIES)
+        summary = result['2021-11-24']['summary']
+        assert summary['steps'] == 100
+        assert summary['caloriesOut'] == 100
+        assert summary['distances'] == [{'activity': 'total', 'distance': 5.5}]
+
+    def test_valid_foods(self):
+        '''検証が正しい: 食事は摂取カロリーと水分の時系列からsummaryを組み立てる
+        '''
+        with FakeServer(self.handler) as server:
+            result = self.create_fitbit(server).fetch_trace_data_range('foods', '2021-11-23', '2021-11-24')
+        assert sorted(r[1] for r in server.requests) == [
+            '/1/user/-/foods/log/caloriesIn/date/2021-11-23/2021-11-24.json',
+            '/1/user/-/foods/log/water/date/2021-11-23/2021-11-24.json',
+        ]
+        assert result == {d: {'summary': {'calories': 100, 'water': 100.0}} for d in ['2021-11-23', '2021-11-24']}
+
+
+class TestResponseCache:
+    '''レスポンスのキャッシュによりリクエストを省略できるか検証
+    - 正常系
+        - 確定期間より前の日付はキャッシュから返しリクエストしない
+        - 確定期間を過ぎる前にキャッシュしたものは確定期間より前の日付でも再検証し, 再検証後はキャッシュから返す
+        - 確定期間内の日付は条件付きリクエストで再検証し, 変更がなければ(304)キャッシュを返す
+        - 確定期間内の日付で変更があればレスポンスを返しキャッシュを更新する
+        - 期間を指定した取得は全ての日付が確定期間より前かつキャッシュ済みの場合のみリクエストしない
+    '''
+    def setup_method(self, method):
+        '''ETagに対応したサーバの応答を用意する
+        '''
+        self.etag = '"v1"'
+
+        def handler(method, path, headers, body):
+            if path.startswith('/1.2/user/-/sleep/date/2021-11-'):
+                if headers.get('If-None-Match') == self.etag:
+                    return 304, {'ETag': self.etag}, b''
+                return 200, {'ETag': self.etag}, json.dumps({'sleep': [], 'etag': self.etag}).encode('utf-8')
+            return 404, {}, b'{}'
+        self.handler = handler
+
+    def create_fitbit(self, server, tmp_path, **kwargs):
+        cache = ResponseCache(str(tmp_path), settle_days=7, today=lambda: datetime.date(2021, 11, 24), **kwargs)
+        return Fitbit(
+            client_id='fake_client_id',
+            client_secret='fake_client_secret',
+            access_token='fake_access_token',
+            api_base=server.url,
+            response_cache=cache
+        )
+
+    def test_valid_settled(self, tmp_path):
+        '''検証が正しい: 確定期間より前の日付はキャッシュから返しリクエストしない
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, tmp_path)
+            first = fb.fetch_trace_data('sleep', '2021-11-01')
+            second = fb.fetch_trace_data('sleep', '2021-11-01')
+        assert first == second
+        assert len(server.requests) == 1
+        assert fb.response_cache.hits == 1
+
+    def test_valid_settled_after_stored(self, tmp_path):
+        '''検証が正しい: 確定期間を過ぎる前にキャッシュしたものは確定期間より前の日付でも再検証し, 再検証後はキャッシュから返す
+        '''
+        # 準備
+        self.now = datetime.datetime(2021, 11, 2, 8, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=9))).timestamp()
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, tmp_path, clock=lambda: self.now)
+            fb.fetch_trace_data('sleep', '2021-11-01')
+            self.now += 22 * 86400
+            fb.fetch_trace_data('sleep', '2021-11-01')
+            fb.fetch_trace_data('sleep', '2021-11-01')
+
+        # 検証
+        assert len(server.requests) == 2
+        assert server.requests[1][2]['If-None-Match'] == '"v1"'
+        assert fb.response_cache.revalidated == 1
+        assert fb.response_cache.hits == 1
+
+    def test_valid_revalidate_not_modified(self, tmp_path):
+        '''検証が正しい: 確定期間内の日付は条件付きリクエストで再検証し, 変更がなければ(304)キャッシュを返す
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, tmp_path)
+            first = fb.fetch_trace_data('sleep', '2021-11-23')
+            second = fb.fetch_trace_data('sleep', '2021-11-23')
+        assert first == second == {'sleep': [], 'etag': '"v1"'}
+        assert server.requests[1][2]['If-None-Match'] == '"v1"'
+        assert fb.response_cache.revalidated == 1
+
+    def test_valid_revalidate_modified(self, tmp_path):
+        '''検証が正しい: 確定期間内の日付で変更があればレスポンスを返しキャッシュを更新する
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, tmp_path)
+            fb.fetch_trace_data('sleep', '2021-11-23')
+            self.etag = '"v2"'
+            result = fb.fetch_trace_data('sleep', '2021-11-23')
+        assert result['etag'] == '"v2"'
+        assert fb.response_cache.get('sleep', '2021-11-23').etag == '"v2"'
+
+    def test_valid_range(self, tmp_path):
+        '''検証が正しい: 期間を指定した取得は全ての日付が確定期間より前かつキャッシュ済みの場合のみリクエストしない
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.create_fitbit(server, tmp_path)
+            first = fb.fetch_trace_data_range('sleep', '2021-11-01', '2021-11-02')
+            second = fb.fetch_trace_data_range('sleep', '2021-11-01', '2021-11-02')
+            fb.fetch_trace_data_range('sleep', '2021-11-22', '2021-11-23')
+            fb.fetch_trace_data_range('sleep', '2021-11-22', '2021-11-23')
+        assert first == second
+        assert len(server.requests) == 3
+
+
+class TestSyncBodyLogs:
+    '''体組成の値のうちFitbitに未記録のものだけを記録できるか検証
+    - 異常系: max_workersに1未満の値が与えられる
+    - 正常系
+        - 記録済みの値は種類ごとに1度だけ取得し, 未記録の値のみ記録される
+        - 入力内で重複する値は1件だけ記録される
+        - 取得は31日ごとに分けてリクエストされる
+        - 記録に失敗した値は結果に含まれ, 残りの記録は継続される
+    '''
+    def setup_method(self, method):
+        '''記録済みの体組成と, 記録のリクエストを受け付けるサーバの応答を用意する
+        '''
+        self.lock = threading.Lock()
+        self.posted = []
+        self.fail_values = set()
+
+        def handler(method, path, headers, body):
+            if method == 'GET':
+                m = re.match(r'^/1/user/-/body/log/(weight|fat)/date/([0-9-]+)/([0-9-]+).json$', path)
+                logs = {
+                    'weight': [{'date': '2021-11-23', 'time': '07:12:00', 'weight': 70.1, 'logId': 1}],
+                    'fat': [],
+                }[m.group(1)]
+                return 200, {}, json.dumps({m.group(1): logs}).encode('utf-8')
+            form = urllib.parse.parse_qs(body.decode('utf-8'))
+            value = form.get('weight', form.get('fat'))[0]
+            if value in self.fail_values:
+                return 400, {}, b'{}'
+            with self.lock:
+                self.posted.append((path, form['date'][0], form['time'][0], value))
+            return 201, {}, b'{}'
+        self.handler = handler
+
+    def create_fitbit(self, server=None):
+        return Fitbit(
+            client_id='fake_client_id',
+            client_secret='fake_client_secret',
+            access_token='fake_access_token',
+            api_base=server.url if server is not None else 'https://api.fitbit.com'
+        )
+
+    def test_invalid_max_workers_lt_one(self):
+        '''検証が正しくない: max_workersに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_workers" must be over 1.'):
+            self.create_fitbit().sync_body_logs([], max_workers=0)
+
+    def test_valid_only_missing(self):
+        '''検証が正しい: 記録済みの値は種類ごとに1度だけ取得し, 未記録の値のみ記録される
+        '''
+        # 準備
+        entries = [
+            BodyLogEntry('weight', 70.1, '2021-11-23', '07:12:00'),
+            BodyLogEntry('fat', 20.5, '2021-11-23', '07:12:00'),
+            BodyLogEntry('weight', 69.9, '2021-11-24', '07:05:00'),
+            BodyLogEntry('weight', 69.9, '2021-11-24', '07:05:00'),
+        ]
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            result = self.create_fitbit(server).sync_body_logs(entries)
+
+        # 検証
+        gets = sorted(r[1] for r in server.requests if r[0] == 'GET')
+        assert gets == [
+            '/1/user/-/body/log/fat/date/2021-11-23/2021-11-24.json',
+            '/1/user/-/body/log/weight/date/2021-11-23/2021-11-24.json',
+        ]
+        assert sorted(self.posted) == [
+            ('/1/user/-/body/log/fat.json', '2021-11-23', '07:12:00', '20.5'),
+            ('/1/user/-/body/log/weight.json', '2021-11-24', '07:05:00', '69.9'),
+        ]
+        assert result.created == [entries[1], entries[2]]
+        assert result.skipped == [entries[0], entries[3]]
+        assert result.failed == []
+
+    def test_valid_chunked_fetch(self):
+        '''検証が正しい: 取得は31日ごとに分けてリクエストされる
+        '''
+        with FakeServer(self.handler) as server:
+            self.create_fitbit(server).fetch_body_logs('weight', '2021-10-01', '2021-11-24')
+        assert [r[1] for r in server.requests] == [
+            '/1/user/-/body/log/weight/date/2021-10-01/2021-10-31.json',
+            '/1/user/-/body/log/weight/date/2021-11-01/2021-11-24.json',
+        ]
+
+    def test_valid_partial_failure(self):
+        '''検証が正しい: 記録に失敗した値は結果に含まれ, 残りの記録は継続される
+        '''
+        # 準備
+        self.fail_values.add('21.0')
+        entries = [BodyLogEntry('fat', 21.0, '2021-11-24', '07:05:00'), BodyLogEntry('fat', 20.0, '2021-11-25', '07:05:00')]
+
+        # 実行
+        with FakeServer(self.handler) as server:
+            result = self.create_fitbit(server).sync_body_logs(entries, max_workers=2)
+
+        # 検証
+        assert result.created == [entries[1]]
+        assert [e for e, _ in result.failed] == [entries[0]]
+        assert isinstance(result.failed[0][1], urllib.error.HTTPError)
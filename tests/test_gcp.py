@@ -0,0 +1,249 @@
+import io
+
+import pytest
+from src.gcp import _SequentialReader, store_gcs, store_gcs_batch, store_gcs_data
+from tests.fake_gcs import FakeClient
+
+
+class TestStoreGcs:
+    '''ファイルをgcsへ転送できるか検証
+    - 正常系: 指定したバケットのパスにファイルの内容が格納される
+    '''
+    def test_valid(self, tmp_path):
+        '''検証が正しい: 指定したバケットのパスにファイルの内容が格納される
+        '''
+        # 準備
+        from_path = tmp_path / '2021-11-24.json'
+        from_path.write_bytes(b'{"data": []}')
+        client = FakeClient()
+
+        # 実行
+        store_gcs(str(from_path), 'health_planet/2021-11-24.json', client=client)
+
+        # 検証
+        assert client.bucket('export_from_devices').objects == {'health_planet/2021-11-24.json': b'{"data": []}'}
+
+
+class TestStoreGcsData:
+    '''メモリ上のデータをgcsへ転送できるか検証
+    - 異常系
+        - chunk_sizeにint以外の型が与えられる
+        - chunk_sizeに256KBの倍数以外の値が与えられる
+    - 正常系
+        - bytesがContent-Typeとともに格納される
+        - ファイルオブジェクトの内容が格納される
+        - chunk_sizeを指定するとchunk_sizeずつ読み込みながら転送する
+    '''
+    def test_invalid_chunk_size_not_int(self):
+        '''検証が正しくない: chunk_sizeにint以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"chunk_size" type must be int.'):
+            store_gcs_data(io.BytesIO(b''), 'a.png', chunk_size='262144', client=FakeClient())
+
+    def test_invalid_chunk_size_not_multiple_of_256kb(self):
+        '''検証が正しくない: chunk_sizeに256KBの倍数以外の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"chunk_size" must be a multiple of 256KB.'):
+            store_gcs_data(io.BytesIO(b''), 'a.png', chunk_size=1000, client=FakeClient())
+
+    def test_valid_bytes(self):
+        '''検証が正しい: bytesがContent-Typeとともに格納される
+        '''
+        # 実行
+        client = FakeClient()
+        store_gcs_data(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', content_type='application/json', client=client)
+
+        # 検証
+        bucket = client.bucket('export_from_devices')
+        assert bucket.objects == {'fitbit/sleep/2021-11-24.json': b'{"sleep": []}'}
+        assert bucket.content_types == {'fitbit/sleep/2021-11-24.json': 'application/json'}
+
+    def test_valid_file_object(self):
+        '''検証が正しい: ファイルオブジェクトの内容が格納される
+        '''
+        # 実行
+        client = FakeClient()
+        store_gcs_data(io.BytesIO(b'\x89PNG'), 'ring_fit_adventure/2021-11-24_a.png', client=client)
+
+        # 検証
+        assert client.bucket('export_from_devices').objects == {'ring_fit_adventure/2021-11-24_a.png': b'\x89PNG'}
+
+    def test_valid_chunk_size(self):
+        '''検証が正しい: chunk_sizeを指定するとchunk_sizeずつ読み込みながら転送する
+        '''
+        # 実行
+        client = FakeClient()
+        data = b'x' * (600 * 1024)
+        store_gcs_data(io.BytesIO(data), 'ring_fit_adventure/2021-11-24_a.png', chunk_size=256 * 1024, client=client)
+
+        # 検証
+        assert client.bucket('export_from_devices').objects == {'ring_fit_adventure/2021-11-24_a.png': data}
+        assert client.bucket('export_from_devices').read_sizes == [256 * 1024, 256 * 1024, 88 * 1024]
+
+
+class TestStoreGcsDataSkipIfIdentical:
+    '''同一のデータが格納済みの場合に転送を省略できるか検証
+    - 異常系: seekできないファイルオブジェクトが与えられる
+    - 正常系
+        - 同一のデータが格納済みならば転送せず"skipped"が返る
+        - 格納済みのデータと異なれば転送し"uploaded"が返る
+        - md5を持たないオブジェクトはcrc32cで比較する
+        - ファイルオブジェクトはチェックサムを求めた後, 先頭から転送される
+        - ファイルのパスを転送する場合も同一ならば転送しない
+    '''
+    def setup_method(self, method):
+        '''同一のデータを格納済みのバケットを準備する
+        '''
+        self.client = FakeClient()
+        self.bucket = self.client.bucket('export_from_devices')
+        self.bucket.blob('fitbit/sleep/2021-11-24.json').upload_from_string(b'{"sleep": []}')
+
+    def test_invalid_not_seekable(self):
+        '''検証が正しくない: seekできないファイルオブジェクトが与えられる
+        '''
+        with pytest.raises(ValueError, match='"skip_if_identical" requires bytes or a seekable file object.'):
+            store_gcs_data(_SequentialReader(io.BytesIO(b'')), 'a.png', skip_if_identical=True, client=self.client)
+
+    def test_valid_skipped(self):
+        '''検証が正しい: 同一のデータが格納済みならば転送せず"skipped"が返る
+        '''
+        result = store_gcs_data(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client)
+        assert result.status == 'skipped'
+        assert self.bucket.upload_count == 1
+
+    def test_valid_uploaded(self):
+        '''検証が正しい: 格納済みのデータと異なれば転送し"uploaded"が返る
+        '''
+        result = store_gcs_data(b'{"sleep": [{}]}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client)
+        assert result.status == 'uploaded'
+        assert self.bucket.objects['fitbit/sleep/2021-11-24.json'] == b'{"sleep": [{}]}'
+
+    def test_valid_crc32c(self):
+        '''検証が正しい: md5を持たないオブジェクトはcrc32cで比較する
+        '''
+        self.bucket.composite_paths.add('fitbit/sleep/2021-11-24.json')
+        assert store_gcs_data(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client).status == 'skipped'
+        assert store_gcs_data(b'{"sleep": [1]}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client).status == 'uploaded'
+
+    def test_valid_file_object(self):
+        '''検証が正しい: ファイルオブジェクトはチェックサムを求めた後, 先頭から転送される
+        '''
+        result = store_gcs_data(io.BytesIO(b'{"sleep": [{}]}'), 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client)
+        assert result.status == 'uploaded'
+        assert self.bucket.objects['fitbit/sleep/2021-11-24.json'] == b'{"sleep": [{}]}'
+
+    def test_valid_file_path(self, tmp_path):
+        '''検証が正しい: ファイルのパスを転送する場合も同一ならば転送しない
+        '''
+        from_path = tmp_path / '2021-11-24.json'
+        from_path.write_bytes(b'{"sleep": []}')
+        assert store_gcs(str(from_path), 'fitbit/sleep/2021-11-24.json', skip_if_identical=True, client=self.client).status == 'skipped'
+        assert self.bucket.upload_count == 1
+
+
+class TestSequentialReader:
+    '''先頭から順に読み込むストリームを直前の範囲内でseekできるか検証
+    - 異常系: 直前に読み込んだ範囲外にseekする
+    - 正常系: 直前に読み込んだ範囲内にseekすると, その位置から読み込み直せる
+    '''
+    def test_invalid_seek_out_of_last_chunk(self):
+        '''検証が正しくない: 直前に読み込んだ範囲外にseekする
+        '''
+        reader = _SequentialReader(io.BytesIO(b'0123456789'))
+        reader.read(4)
+        reader.read(4)
+        with pytest.raises(io.UnsupportedOperation):
+            reader.seek(2)
+
+    def test_valid_seek_in_last_chunk(self):
+        '''検証が正しい: 直前に読み込んだ範囲内にseekすると, その位置から読み込み直せる
+        '''
+        reader = _SequentialReader(io.BytesIO(b'0123456789'))
+        assert reader.read(4) == b'0123'
+        reader.seek(2)
+        assert reader.tell() == 2
+        assert reader.read(4) == b'2345'
+        assert reader.read() == b'6789'
+        assert reader.tell() == 10
+
+
+class TestStoreGcsBatch:
+    '''複数のデータを並行してgcsへ転送できるか検証
+    - 異常系
+        - max_workersにint以外の型が与えられる
+        - max_workersに1未満の値が与えられる
+    - 正常系
+        - ファイルのパスとbytesのいずれも転送される
+        - 一部の転送に失敗しても残りの転送は継続され, 結果がitemsと同じ順序で返る
+        - itemsが空の場合は空のリストが返る
+        - skip_if_identicalがTrueならば同一のデータは転送されず"skipped"が返る
+    '''
+    def test_invalid_max_workers_not_int(self):
+        '''検証が正しくない: max_workersにint以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"max_workers" type must be int.'):
+            store_gcs_batch([], max_workers='8', client=FakeClient())
+
+    def test_invalid_max_workers_lt_one(self):
+        '''検証が正しくない: max_workersに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_workers" must be over 1.'):
+            store_gcs_batch([], max_workers=0, client=FakeClient())
+
+    def test_valid_path_and_bytes(self, tmp_path):
+        '''検証が正しい: ファイルのパスとbytesのいずれも転送される
+        '''
+        # 準備
+        from_path = tmp_path / 'activities.json'
+        from_path.write_bytes(b'{"summary": {}}')
+        client = FakeClient()
+        items = [
+            (str(from_path), 'fitbit/activities/2021-11-24.json'),
+            (b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json'),
+        ]
+
+        # 実行
+        results = store_gcs_batch(items, client=client)
+
+        # 検証
+        assert [r.status for r in results] == ['uploaded', 'uploaded']
+        assert client.bucket('export_from_devices').objects == {
+            'fitbit/activities/2021-11-24.json': b'{"summary": {}}',
+            'fitbit/sleep/2021-11-24.json': b'{"sleep": []}',
+        }
+
+    def test_valid_partial_failure(self):
+        '''検証が正しい: 一部の転送に失敗しても残りの転送は継続され, 結果がitemsと同じ順序で返る
+        '''
+        # 準備
+        client = FakeClient()
+        client.bucket('export_from_devices').fail_paths.append('b.json')
+        items = [(b'a', 'a.json'), (b'b', 'b.json'), (b'c', 'c.json')]
+
+        # 実行
+        results = store_gcs_batch(items, max_workers=2, client=client)
+
+        # 検証
+        assert [(r.to_path, r.status) for r in results] == [('a.json', 'uploaded'), ('b.json', 'failed'), ('c.json', 'uploaded')]
+        assert isinstance(results[1].error, RuntimeError)
+        assert sorted(client.bucket('export_from_devices').objects) == ['a.json', 'c.json']
+
+    def test_valid_empty(self):
+        '''検証が正しい: itemsが空の場合は空のリストが返る
+        '''
+        assert store_gcs_batch([], client=FakeClient()) == []
+
+    def test_valid_skip_if_identical(self):
+        '''検証が正しい: skip_if_identicalがTrueならば同一のデータは転送されず"skipped"が返る
+        '''
+        # 準備
+        client = FakeClient()
+        client.bucket('export_from_devices').blob('a.json').upload_from_string(b'a')
+        items = [(b'a', 'a.json'), (b'b', 'b.json')]
+
+        # 実行
+        results = store_gcs_batch(items, client=client, skip_if_identical=True)
+
+        # 検証
+        assert [(r.to_path, r.status) for r in results] == [('a.json', 'skipped'), ('b.json', 'uploaded')]
+        assert client.bucket('export_from_devices').upload_count == 2
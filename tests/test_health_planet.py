@@ -1,5 +1,10 @@
+import json
+import urllib.parse
+
 import pytest
+from freezegun import freeze_time
 from src.health_planet import HealthPlanet
+from tests.fake_server import FakeServer
 
 
 class TestFetchBodyCompositionData:
@@ -112,3 +117,40 @@ class TestFetchBodyCompositionData:
         # 実行
         hp = HealthPlanet(self.fake_access_token)
         hp.fetch_body_composition_data(fake_from_date, fake_to_date)
+
+
+class TestFetchBodyCompositionDataByDate:
+    '''期間の体組成データを1回のリクエストで取得し測定日ごとに分割できるか検証
+    - 正常系: 1回のリクエストで取得し, 測定日ごとに分割される(測定のない日はdataが空)
+    '''
+    @freeze_time('2021-11-25 09:00:00+09:00')
+    def test_valid(self):
+        '''検証が正しい: 1回のリクエストで取得し, 測定日ごとに分割される(測定のない日はdataが空)
+        '''
+        # 準備
+        res = {
+            'birth_date': '19880101',
+            'height': '170',
+            'sex': 'male',
+            'data': [
+                {'date': '202111220712', 'keydata': '70.10', 'model': '01000117', 'tag': '6021'},
+                {'date': '202111240005', 'keydata': '69.90', 'model': '01000117', 'tag': '6021'},
+                {'date': '202111242350', 'keydata': '20.50', 'model': '01000117', 'tag': '6022'},
+            ],
+        }
+
+        def handler(method, path, headers, body):
+            return 200, {'Content-Type': 'application/json'}, json.dumps(res).encode('utf-8')
+
+        # 実行
+        with FakeServer(handler) as server:
+            hp = HealthPlanet('fake_access_token', api_base=server.url)
+            result = hp.fetch_body_composition_data_by_date('2021-11-22', '2021-11-24')
+
+        # 検証
+        assert len(server.requests) == 1
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(server.requests[0][1]).query)
+        assert (query['from'], query['to']) == (['20211122000000'], ['20211124235959'])
+        assert sorted(result) == ['2021-11-22', '2021-11-23', '2021-11-24']
+        assert result['2021-11-23'] == {'birth_date': '19880101', 'height': '170', 'sex': 'male', 'data': []}
+        assert [r['keydata'] for r in result['2021-11-24']['data']] == ['69.90', '20.50']
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_heavy_module(name):
+    '''cold startを遅くする重いモジュール(pandas, numpy, google cloudのSDK)であるか返す
+    '''
+    return name.split('.')[0] in ('pandas', 'numpy') or name.startswith('google.cloud')
+
+
+def import_main_in_subprocess():
+    '''新しいプロセスでmain.pyを読み込み, 読み込まれたモジュールを返す
+    '''
+    code = 'import json, sys\nimport main\nprint(json.dumps(sorted(sys.modules)))\n'
+    res = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True, check=True, text=True)
+    return json.loads(res.stdout)
+
+
+def importtime_of_main():
+    '''新しいプロセスで-X importtimeを指定してmain.pyを読み込み, 読み込んだモジュールと累積の読み込み時間(マイクロ秒)を返す
+    '''
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT_DIR, capture_output=True, check=True, text=True
+    )
+    # NOTE: 各行は"import time: self [us] | cumulative | imported package"の形式
+    entries = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries[name.strip()] = int(cumulative)
+    return entries
+
+
+class TestImportTime:
+    '''cloud functionsのcold startで実行されるmain.pyの読み込みが遅くなっていないか検証
+    - 正常系
+        - main.pyを読み込んでもpandasとgoogle cloudのSDKは読み込まれない
+        - main.pyの読み込み中に一時的にもpandasとgoogle cloudのSDKは読み込まれない
+    '''
+    def test_valid_heavy_modules_not_imported(self):
+        '''検証が正しい: main.pyを読み込んでもpandasとgoogle cloudのSDKは読み込まれない
+        '''
+        modules = import_main_in_subprocess()
+        assert [m for m in modules if is_heavy_module(m)] == []
+
+    def test_valid_heavy_modules_not_in_importtime(self):
+        '''検証が正しい: main.pyの読み込み中に一時的にもpandasとgoogle cloudのSDKは読み込まれない
+        '''
+        # NOTE: 処理時間は環境によって変わるため, 時間ではなく読み込んだモジュールで検証する
+        entries = importtime_of_main()
+        slowest = sorted(entries.items(), key=lambda e: e[1], reverse=True)[:5]
+        print('slowest imports: {}'.format(', '.join('{} {:.1f} ms'.format(n, us / 1000) for n, us in slowest)))
+        assert 'main' in entries
+        assert [n for n in entries if is_heavy_module(n)] == []
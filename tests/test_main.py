@@ -0,0 +1,516 @@
+import configparser
+import datetime
+import gzip
+import io
+import json
+import time
+from unittest import mock
+
+import main
+import pytest
+from benchmarks.fake_providers import ProviderConfig, fitbit_handler, health_planet_handler, twitter_handler
+from src import gcp
+from src.backfill import WorkUnit
+from src.codec import load_file, load_gcs
+from src.fitbit import BodyLogEntry
+from src.gcp import md5_base64
+from src.manifest import Manifest
+from src.secret import IniSecretProvider
+from src.storage import MemoryBackend
+from src.transport import HttpTransport
+from tests.fake_gcs import FakeClient
+from tests.fake_server import FakeServer
+
+
+class FakeBackend(MemoryBackend):
+    '''メモリ上に保存し, 転送ごとのchunk_sizeを記録する. failedがTrueならば転送に失敗する
+    '''
+    def __init__(self, failed=False):
+        super().__init__()
+        self.failed = failed
+        self.chunk_sizes = {}
+
+    def put(self, data, path, content_type='application/octet-stream', chunk_size=None, **kwargs):
+        if self.failed:
+            raise RuntimeError('fake upload error')
+        self.chunk_sizes[path] = chunk_size
+        return super().put(data, path, content_type, chunk_size=chunk_size, **kwargs)
+
+
+class TestOutputStore:
+    '''取得したデータをgcsへ転送し, 必要に応じてローカルに保存できるか検証
+    - 異常系
+        - strictがTrueでgcsへの転送に失敗した場合は例外が送出される
+    - 正常系
+        - local_dirが未指定ならばファイルを作らずにメモリ上のデータを転送する
+        - 転送に成功したらローカルのファイルを削除する
+        - keep_localがTrueならば転送後もローカルのファイルを残す
+        - 転送に失敗したらローカルのファイルを残す
+    '''
+    def test_invalid_strict(self):
+        '''検証が正しくない: strictがTrueでgcsへの転送に失敗した場合は例外が送出される
+        '''
+        with pytest.raises(RuntimeError, match='fake upload error'):
+            main._Output(storage=FakeBackend(failed=True)).store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json', strict=True)
+
+    def test_valid_memory(self, monkeypatch, tmp_path):
+        '''検証が正しい: local_dirが未指定ならばファイルを作らずにメモリ上のデータを転送する
+        '''
+        # 実行
+        storage = FakeBackend()
+        monkeypatch.chdir(tmp_path)
+        main._Output(storage=storage).store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json')
+
+        # 検証
+        assert storage.list() == ['fitbit/sleep/2021-11-24.json']
+        assert storage.get('fitbit/sleep/2021-11-24.json') == b'{}'
+        assert storage.content_type('fitbit/sleep/2021-11-24.json') == 'application/json'
+        assert list(tmp_path.iterdir()) == []
+
+    def test_valid_remove_local(self, tmp_path):
+        '''検証が正しい: 転送に成功したらローカルのファイルを削除する
+        '''
+        main._Output(local_dir=str(tmp_path), storage=FakeBackend()).store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json')
+        assert not (tmp_path / 'fitbit/sleep/2021-11-24.json').exists()
+
+    def test_valid_keep_local(self, tmp_path):
+        '''検証が正しい: keep_localがTrueならば転送後もローカルのファイルを残す
+        '''
+        output = main._Output(local_dir=str(tmp_path), keep_local=True, storage=FakeBackend())
+        output.store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json')
+        assert (tmp_path / 'fitbit/sleep/2021-11-24.json').read_bytes() == b'{}'
+
+    def test_valid_upload_failed(self, tmp_path):
+        '''検証が正しい: 転送に失敗したらローカルのファイルを残す
+        '''
+        main._Output(local_dir=str(tmp_path), storage=FakeBackend(failed=True)).store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json')
+        assert (tmp_path / 'fitbit/sleep/2021-11-24.json').read_bytes() == b'{}'
+
+
+class TestStoreRingFitAdventureFigure:
+    '''リングフィットの実績画像を読み込みながらgcsへ転送できるか検証
+    - 正常系: 画像がContent-Typeとともに日付を付与したパスへ転送される
+    '''
+    def test_valid(self):
+        '''検証が正しい: 画像がContent-Typeとともに日付を付与したパスへ転送される
+        '''
+        # 準備
+        image = b'\x89PNG' * 100000
+        storage = FakeBackend()
+
+        def handler(method, path, headers, body):
+            return 200, {'Content-Type': 'image/png'}, image
+
+        # 実行
+        with FakeServer(handler) as server:
+            main._store_ring_fit_adventure_figure(
+                server.url + '/media/FE_abc.png', '2021-11-24', main._Output(storage=storage), HttpTransport(), strict=True
+            )
+
+        # 検証
+        path = 'ring_fit_adventure/2021-11-24_FE_abc.png'
+        assert storage.list() == [path]
+        assert (storage.get(path), storage.content_type(path), storage.chunk_sizes[path]) == (image, 'image/png', main.MEDIA_CHUNK_SIZE)
+
+
+class TestOutputManifest:
+    '''転送したデータをmanifestに記録し, 記録済みのデータを判別できるか検証
+    - 正常系
+        - 転送したデータのサイズとmd5が作業単位とともに記録される
+        - ストリームを転送した場合も読み込んだデータのサイズとmd5が記録される
+        - 転送に失敗したデータは記録されない
+        - manifestを使用しない場合は常に未記録とする
+    '''
+    def test_valid_store(self):
+        '''検証が正しい: 転送したデータのサイズとmd5が作業単位とともに記録される
+        '''
+        # 実行
+        client = FakeClient()
+        output = main._Output(manifest=Manifest(client=client).load(), storage=FakeBackend())
+        unit = WorkUnit('fitbit', 'sleep', '2021-11-24')
+        output.store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json', unit=unit)
+
+        # 検証
+        assert output.is_stored(unit)
+        assert output.manifest.get(unit) == {'fitbit/sleep/2021-11-24.json': {'size': 2, 'md5': md5_base64(b'{}')}}
+
+    def test_valid_store_stream(self):
+        '''検証が正しい: ストリームを転送した場合も読み込んだデータのサイズとmd5が記録される
+        '''
+        # 準備
+        image = b'\x89PNG' * 100000
+        client = FakeClient()
+        output = main._Output(manifest=Manifest(client=client).load(), storage=FakeBackend())
+        unit = WorkUnit('ring_fit_adventure', 'figure', '2021-11-24')
+
+        # 実行
+        output.store_stream(io.BytesIO(image), 'ring_fit_adventure/2021-11-24_a.png', 'image/png', unit=unit)
+
+        # 検証
+        assert output.is_stored(unit, 'ring_fit_adventure/2021-11-24_a.png')
+        assert output.manifest.get(unit)['ring_fit_adventure/2021-11-24_a.png'] == {'size': len(image), 'md5': md5_base64(image)}
+
+    def test_valid_upload_failed(self):
+        '''検証が正しい: 転送に失敗したデータは記録されない
+        '''
+        output = main._Output(manifest=Manifest(client=FakeClient()).load(), storage=FakeBackend(failed=True))
+        unit = WorkUnit('fitbit', 'sleep', '2021-11-24')
+        output.store(b'{}', 'fitbit/sleep/2021-11-24.json', 'application/json', unit=unit)
+        assert not output.is_stored(unit)
+
+    def test_valid_without_manifest(self):
+        '''検証が正しい: manifestを使用しない場合は常に未記録とする
+        '''
+        assert not main._Output().is_stored(WorkUnit('fitbit', 'sleep', '2021-11-24'))
+
+
+class TestOutputCompression:
+    '''保存するデータを圧縮し, 圧縮形式によらず読み込めるか検証
+    - 異常系: compressionに対象外の文字列が与えられる
+    - 正常系
+        - 同じパスのまま圧縮したデータがContent-Encodingとともに転送され, ローカルのファイルも圧縮される
+        - manifestには圧縮後のデータのサイズとmd5が記録され, 同一のデータは再度転送しない
+    '''
+    def setup_method(self, method):
+        self.client = FakeClient()
+        self.bucket = self.client.bucket('export_from_devices')
+
+    def test_invalid_compression(self):
+        '''検証が正しくない: compressionに対象外の文字列が与えられる
+        '''
+        with pytest.raises(ValueError, match='"compression" must be in'):
+            main._Output(compression='bz2')
+
+    def test_valid_store(self, monkeypatch, tmp_path):
+        '''検証が正しい: 同じパスのまま圧縮したデータがContent-Encodingとともに転送され, ローカルのファイルも圧縮される
+        '''
+        # 実行
+        monkeypatch.setattr(gcp, 'get_storage_client', lambda: self.client)
+        output = main._Output(local_dir=str(tmp_path), keep_local=True, compression='gzip')
+        output.store(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', 'application/json')
+
+        # 検証
+        assert self.bucket.content_encodings == {'fitbit/sleep/2021-11-24.json': 'gzip'}
+        assert self.bucket.content_types == {'fitbit/sleep/2021-11-24.json': 'application/json'}
+        assert load_gcs('fitbit/sleep/2021-11-24.json', client=self.client) == {'sleep': []}
+        assert load_file(str(tmp_path / 'fitbit/sleep/2021-11-24.json')) == {'sleep': []}
+
+    def test_valid_manifest(self, monkeypatch):
+        '''検証が正しい: manifestには圧縮後のデータのサイズとmd5が記録され, 同一のデータは再度転送しない
+        '''
+        # 実行
+        monkeypatch.setattr(gcp, 'get_storage_client', lambda: self.client)
+        unit = WorkUnit('fitbit', 'sleep', '2021-11-24')
+        output = main._Output(manifest=Manifest(client=FakeClient()).load(), skip_if_identical=True, compression='gzip')
+        output.store(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', 'application/json', unit=unit)
+        result = output.store(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', 'application/json', unit=unit)
+
+        # 検証
+        stored = self.bucket.objects['fitbit/sleep/2021-11-24.json']
+        assert output.manifest.get(unit) == {'fitbit/sleep/2021-11-24.json': {'size': len(stored), 'md5': md5_base64(stored)}}
+        assert result.status == 'skipped'
+        assert self.bucket.upload_count == 1
+
+
+class TestStoreFitbitTraceDataRange:
+    '''期間を指定して取得したFitbitのデータを日ごとに転送できるか検証
+    - 正常系: 1回の取得で"fitbit_range"の日ごとのパスへ転送され, manifestには1日分のエンドポイントとは別の作業単位として記録される
+    '''
+    def test_valid(self):
+        '''検証が正しい: 1回の取得で"fitbit_range"の日ごとのパスへ転送され, manifestには1日分のエンドポイントとは別の作業単位として記録される
+        '''
+        # 準備
+        fb = mock.Mock()
+        fb.fetch_trace_data_range.return_value = {
+            '2021-11-23': {'sleep': []},
+            '2021-11-24': {'sleep': [{'logId': 1}]},
+        }
+        storage = FakeBackend()
+        output = main._Output(manifest=Manifest(client=FakeClient()).load(), storage=storage)
+
+        # 実行
+        main._store_fitbit_trace_data_range(fb, 'sleep', ['2021-11-23', '2021-11-24'], output)
+
+        # 検証
+        fb.fetch_trace_data_range.assert_called_once_with('sleep', '2021-11-23', '2021-11-24')
+        assert {p: storage.get(p) for p in storage.list()} == {
+            'fitbit_range/sleep/2021-11-23.json': b'{"sleep": []}',
+            'fitbit_range/sleep/2021-11-24.json': b'{"sleep": [{"logId": 1}]}',
+        }
+        assert output.is_stored(WorkUnit('fitbit_range', 'sleep', '2021-11-24'))
+        assert not output.is_stored(WorkUnit('fitbit', 'sleep', '2021-11-24'))
+
+
+class TestBackfillFitbitRange:
+    '''期間を指定して取得したFitbitのデータが1日分のエンドポイントで取得したデータを置き換えないか検証
+    - 正常系: fitbit_rangeで取得したデータは"fitbit_range"へ保存し, 後から1日分のエンドポイントで"fitbit"のデータを取得する
+    '''
+    def test_valid(self, monkeypatch, tmp_path):
+        '''検証が正しい: fitbit_rangeで取得したデータは"fitbit_range"へ保存し, 後から1日分のエンドポイントで"fitbit"のデータを取得する
+        '''
+        # 準備
+        config = ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1)
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        monkeypatch.setattr(main, 'today_jst', lambda: datetime.date(2021, 11, 25))
+        storage = MemoryBackend()
+
+        # 実行
+        with FakeServer(fitbit_handler(config)) as fb_server:
+            urls.update(health_planet=fb_server.url, fitbit=fb_server.url, twitter=fb_server.url)
+            main.backfill('2021-11-23', '2021-11-24', sources=['fitbit'], fitbit_range=True, storage=storage,
+                          checkpoint_path=str(tmp_path / 'range_checkpoint.json'))
+            range_paths = storage.list()
+            main.backfill('2021-11-23', '2021-11-24', sources=['fitbit'], storage=storage,
+                          checkpoint_path=str(tmp_path / 'range_checkpoint.json'))
+
+        # 検証
+        assert [p for p in range_paths if p != 'manifest.json'] == [
+            'fitbit_range/{}/{}.json'.format(c, d) for c in ['activities', 'foods', 'sleep'] for d in ['2021-11-23', '2021-11-24']
+        ]
+        assert storage.list('fitbit/') == [
+            'fitbit/{}/{}.json'.format(c, d) for c in ['activities', 'foods', 'sleep'] for d in ['2021-11-23', '2021-11-24']
+        ]
+
+
+class TestStoreHealthPlanetRange:
+    '''期間を指定して取得したHealth Planetのデータを測定日ごとに転送できるか検証
+    - 正常系: 1回の取得で測定日ごとのパスへ転送される
+    '''
+    def test_valid(self):
+        '''検証が正しい: 1回の取得で測定日ごとのパスへ転送される
+        '''
+        # 準備
+        hp = mock.Mock()
+        hp.fetch_body_composition_data_by_date.return_value = {
+            '2021-11-23': {'data': []},
+            '2021-11-24': {'data': [{'date': '202111240712', 'keydata': '70.10', 'tag': '6021'}]},
+        }
+        storage = FakeBackend()
+
+        # 実行
+        main._store_health_planet_range(hp, ['2021-11-23', '2021-11-24'], main._Output(storage=storage))
+
+        # 検証
+        hp.fetch_body_composition_data_by_date.assert_called_once_with('2021-11-23', '2021-11-24')
+        assert storage.list() == ['health_planet/2021-11-23.json', 'health_planet/2021-11-24.json']
+        assert storage.get('health_planet/2021-11-23.json') == b'{"data": []}'
+
+
+class TestToBodyLogEntries:
+    '''Health Planetの体組成データをFitbitに記録する値へ変換できるか検証
+    - 正常系: タグに応じた種類と, 測定日時(Asia/Tokyo)の日付・時刻に変換される
+    '''
+    def test_valid(self):
+        '''検証が正しい: タグに応じた種類と, 測定日時(Asia/Tokyo)の日付・時刻に変換される
+        '''
+        records = [
+            {'date': '202111240712', 'keydata': '70.10', 'model': '01000117', 'tag': '6021'},
+            {'date': '202111242350', 'keydata': '20.50', 'model': '01000117', 'tag': '6022'},
+        ]
+        assert main._to_body_log_entries(records) == [
+            BodyLogEntry('weight', 70.1, '2021-11-24', '07:12:00'),
+            BodyLogEntry('fat', 20.5, '2021-11-24', '23:50:00'),
+        ]
+
+
+def prepare_fake_providers(monkeypatch, tmp_path):
+    '''ローカル環境の接続情報を用意し, 各APIのクライアントの接続先を返した辞書に設定したurlとする
+    '''
+    (tmp_path / 'local.ini').write_text('\n'.join([
+        '[HEALTH PLANET]', 'access-token = hp-secret',
+        '[FITBIT]', 'client-id = id', 'client-secret = fb-secret', 'access-token = fb-access', 'refresh-token = fb-refresh',
+        '[TWITTER]', 'user-id = 1', 'escaped-bearer-token = tw-secret',
+    ]) + '\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, '_secret_providers', {})
+    build_clients = main._build_clients
+    urls = {}
+
+    def fake_build_clients(*args, **kwargs):
+        hp, fb, tw = build_clients(*args, **kwargs)
+        hp.api_base, fb.api_base, tw.api_base = urls['health_planet'], urls['fitbit'], urls['twitter']
+        return hp, fb, tw
+
+    monkeypatch.setattr(main, '_build_clients', fake_build_clients)
+    return urls
+
+
+class TestBuildClients:
+    '''保存した接続情報から生成したFitbitのクライアントがトークンの有効期限を引き継げるか検証
+    - 正常系
+        - 保存した有効期限が近ければ最初のリクエストの前にトークンを更新し, 新しいトークンと有効期限を保存する
+        - 有効期限が保存されていなければ事前に更新せずにリクエストする
+    '''
+    def handler(self, method, path, headers, body):
+        '''トークンの更新とトレースデータの取得を再現する
+        '''
+        if path == '/oauth2/token':
+            res = {'access_token': 'new_access_token', 'refresh_token': 'new_refresh_token', 'expires_in': 28800}
+            return 200, {}, json.dumps(res).encode('utf-8')
+        return 200, {}, b'{"summary": {}}'
+
+    def build_fitbit(self, monkeypatch, tmp_path, server, expires_at=None):
+        '''ローカル環境の接続情報(有効期限を含む)を保存し, 読み込んだ接続情報から接続先をserverとしたFitbitのクライアントを生成する
+        '''
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        urls.update(health_planet=server.url, fitbit=server.url, twitter=server.url)
+        if expires_at is not None:
+            ini = tmp_path / 'local.ini'
+            ini.write_text(ini.read_text().replace('[TWITTER]', 'expires-at = {:.0f}\n[TWITTER]'.format(expires_at)))
+        api_connect_values, save_tokens = main._load_api_connect_values(None)
+        _, fb, _ = main._build_clients(api_connect_values, HttpTransport(), save_tokens)
+        return fb
+
+    def test_valid_expiring(self, monkeypatch, tmp_path):
+        '''検証が正しい: 保存した有効期限が近ければ最初のリクエストの前にトークンを更新し, 新しいトークンと有効期限を保存する
+        '''
+        # 実行
+        with FakeServer(self.handler) as server:
+            fb = self.build_fitbit(monkeypatch, tmp_path, server, expires_at=time.time() + 60)
+            fb.fetch_trace_data('sleep', '2021-11-24')
+
+        # 検証
+        assert [r[1] for r in server.requests] == ['/oauth2/token', '/1.2/user/-/sleep/date/2021-11-24.json']
+        config_ini = configparser.ConfigParser()
+        config_ini.read(str(tmp_path / 'local.ini'), encoding='utf-8')
+        assert config_ini.get('FITBIT', 'refresh-token') == 'new_refresh_token'
+        assert float(config_ini.get('FITBIT', 'expires-at')) > time.time() + 28000
+
+    def test_valid_unknown(self, monkeypatch, tmp_path):
+        '''検証が正しい: 有効期限が保存されていなければ事前に更新せずにリクエストする
+        '''
+        with FakeServer(self.handler) as server:
+            fb = self.build_fitbit(monkeypatch, tmp_path, server)
+            fb.fetch_trace_data('sleep', '2021-11-24')
+        assert fb.expires_at is None
+        assert [r[1] for r in server.requests] == ['/1.2/user/-/sleep/date/2021-11-24.json']
+
+
+class TestRunStorage:
+    '''取得したデータとmanifestを指定した保存先へ保存できるか検証
+    - 正常系: 保存先にデータとmanifestを保存し, dataディレクトリには保存しない. 再実行では保存済みのデータを取得しない
+    '''
+    def test_valid(self, monkeypatch, tmp_path):
+        '''検証が正しい: 保存先にデータとmanifestを保存し, dataディレクトリには保存しない. 再実行では保存済みのデータを取得しない
+        '''
+        # 準備
+        config = ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=2, image_kb=1)
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        twitter = FakeServer(None)
+        twitter.handler = twitter_handler(config, twitter)
+        storage = MemoryBackend()
+
+        # 実行
+        with FakeServer(health_planet_handler(config)) as hp_server, FakeServer(fitbit_handler(config)) as fb_server, twitter:
+            urls.update(health_planet=hp_server.url, fitbit=fb_server.url, twitter=twitter.url)
+            main.run(max_workers=2, storage=storage)
+            first_requests = len(fb_server.requests)
+            main.run(max_workers=2, storage=storage)
+
+        # 検証
+        assert len(storage.list('fitbit/')) == 3
+        assert len(storage.list('ring_fit_adventure/')) == 2
+        assert storage.exists('manifest.json')
+        assert len(fb_server.requests) == first_requests
+        assert not (tmp_path / 'data').exists()
+
+
+class TestRunBodyLogSync:
+    '''Health Planetのデータが転送済みでもFitbitへ体組成データを転送できるか検証
+    - 正常系: manifestに記録済みのHealth Planetのデータは転送せず, 取得した体組成データをFitbitに記録する
+    '''
+    def test_valid(self, monkeypatch, tmp_path):
+        '''検証が正しい: manifestに記録済みのHealth Planetのデータは転送せず, 取得した体組成データをFitbitに記録する
+        '''
+        # 準備
+        config = ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=0, image_kb=1)
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        main._secret_providers['fake-project'] = IniSecretProvider('./local.ini')
+        twitter = FakeServer(None)
+        twitter.handler = twitter_handler(config, twitter)
+        storage = MemoryBackend()
+        day_str = main.yesterday_str()
+        manifest = Manifest(storage=storage).load()
+        manifest.record(WorkUnit('health_planet', 'body_composition', day_str), 'health_planet/{}.json'.format(day_str), 2, 'md5')
+        assert manifest.commit()
+
+        # 実行
+        with FakeServer(health_planet_handler(config)) as hp_server, FakeServer(fitbit_handler(config)) as fb_server, twitter:
+            urls.update(health_planet=hp_server.url, fitbit=fb_server.url, twitter=twitter.url)
+            main.run(prj='fake-project', max_workers=2, storage=storage)
+
+        # 検証
+        assert not storage.exists('health_planet/{}.json'.format(day_str))
+        assert len(hp_server.requests) == 1
+        assert sorted(r[1] for r in fb_server.requests if r[0] == 'POST') == ['/1/user/-/body/log/fat.json', '/1/user/-/body/log/weight.json']
+
+
+class TestRunCassette:
+    '''各APIと実績画像のレスポンスをcassetteに記録し, 送信せずに再生して同じデータを保存できるか検証
+    - 異常系: record_toとreplay_fromが同時に与えられる
+    - 正常系
+        - 記録したcassetteを各APIのサーバを停止した状態で再生し, 記録時と同じデータを保存する. cassetteに認証情報は含まれない
+        - storageを指定せずに再生した場合はgcsのデータとmanifestを参照・更新しない
+    '''
+    def test_invalid_record_and_replay(self):
+        '''検証が正しくない: record_toとreplay_fromが同時に与えられる
+        '''
+        with pytest.raises(ValueError, match='"record_to" and "replay_from" cannot be specified at the same time.'):
+            main.run(record_to='a.json.gz', replay_from='a.json.gz')
+
+    def test_valid(self, monkeypatch, tmp_path):
+        '''検証が正しい: 記録したcassetteを各APIのサーバを停止した状態で再生し, 記録時と同じデータを保存する. cassetteに認証情報は含まれない
+        '''
+        # 準備
+        config = ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=2, image_kb=1)
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        cassette_path = str(tmp_path / 'cassette.json.gz')
+        twitter = FakeServer(None)
+        twitter.handler = twitter_handler(config, twitter)
+        recorded_client, replayed_client = FakeClient(), FakeClient()
+
+        # 実行
+        with FakeServer(health_planet_handler(config)) as hp_server, FakeServer(fitbit_handler(config)) as fb_server, twitter:
+            urls.update(health_planet=hp_server.url, fitbit=fb_server.url, twitter=twitter.url)
+            monkeypatch.setattr(gcp, 'get_storage_client', lambda: recorded_client)
+            main.run(max_workers=2, use_manifest=False, record_to=cassette_path)
+        monkeypatch.setattr(gcp, 'get_storage_client', lambda: replayed_client)
+        main.run(max_workers=2, use_manifest=False, replay_from=cassette_path, storage='gs://export_from_devices')
+
+        # 検証
+        recorded = recorded_client.bucket('export_from_devices').objects
+        assert len([p for p in recorded if p.startswith('ring_fit_adventure/')]) == 2
+        assert len([p for p in recorded if p.startswith('fitbit/')]) == 3
+        assert replayed_client.bucket('export_from_devices').objects == recorded
+        cassette = gzip.decompress(open(cassette_path, 'rb').read())
+        for secret in [b'hp-secret', b'fb-secret', b'fb-access', b'tw-secret']:
+            assert secret not in cassette
+
+    def test_valid_default_storage(self, monkeypatch, tmp_path):
+        '''検証が正しい: storageを指定せずに再生した場合はgcsのデータとmanifestを参照・更新しない
+        '''
+        # 準備
+        config = ProviderConfig(latency_ms=0.0, fitbit_payload_kb=1, images=2, image_kb=1)
+        urls = prepare_fake_providers(monkeypatch, tmp_path)
+        cassette_path = str(tmp_path / 'cassette.json.gz')
+        twitter = FakeServer(None)
+        twitter.handler = twitter_handler(config, twitter)
+        with FakeServer(health_planet_handler(config)) as hp_server, FakeServer(fitbit_handler(config)) as fb_server, twitter:
+            urls.update(health_planet=hp_server.url, fitbit=fb_server.url, twitter=twitter.url)
+            monkeypatch.setattr(gcp, 'get_storage_client', lambda: FakeClient())
+            main.run(max_workers=2, use_manifest=False, record_to=cassette_path)
+
+        def get_storage_client():
+            pytest.fail('replay must not access gcs')
+        monkeypatch.setattr(gcp, 'get_storage_client', get_storage_client)
+        backends = []
+        build_storage = main._build_storage
+        monkeypatch.setattr(main, '_build_storage', lambda *args: backends.append(build_storage(*args)) or backends[-1])
+
+        # 実行
+        main.run(max_workers=2, replay_from=cassette_path)
+
+        # 検証
+        assert [type(b) for b in backends] == [MemoryBackend]
+        assert len(backends[0].list('fitbit/')) == 3
+        assert len(backends[0].list('ring_fit_adventure/')) == 2
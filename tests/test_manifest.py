@@ -0,0 +1,92 @@
+import io
+import json
+
+from src.backfill import WorkUnit
+from src.gcp import md5_base64
+from src.manifest import HashingReader, Manifest
+from tests.fake_gcs import FakeClient
+
+UNIT = WorkUnit('fitbit', 'sleep', '2021-11-24')
+
+
+class TestHashingReader:
+    '''ストリームを読み込みながらサイズとmd5を求められるか検証
+    - 正常系: 分割して読み込んだ場合も全体のサイズとmd5が求まる
+    '''
+    def test_valid(self):
+        '''検証が正しい: 分割して読み込んだ場合も全体のサイズとmd5が求まる
+        '''
+        data = b'\x89PNG' * 1000
+        reader = HashingReader(io.BytesIO(data))
+        while len(reader.read(1000)) > 0:
+            pass
+        assert reader.size == len(data)
+        assert reader.md5 == md5_base64(data)
+
+
+class TestManifest:
+    '''gcs上のmanifestで保存済みのデータを管理できるか検証
+    - 正常系
+        - manifestが存在しなければ空として読み込む
+        - 記録したデータは作業単位とパスで確認でき, commitするとgcsに反映される
+        - 記録したサイズとmd5がgcs上のオブジェクトと一致する
+        - 他の実行が先に更新した場合は読み込み直して両方の記録を反映する
+        - 記録がなければcommitしてもgcsに書き込まない
+    '''
+    def test_valid_empty(self):
+        '''検証が正しい: manifestが存在しなければ空として読み込む
+        '''
+        manifest = Manifest(client=FakeClient()).load()
+        assert not manifest.contains(UNIT)
+        assert not manifest.contains_object('fitbit/sleep/2021-11-24.json')
+
+    def test_valid_record_and_commit(self):
+        '''検証が正しい: 記録したデータは作業単位とパスで確認でき, commitするとgcsに反映される
+        '''
+        # 実行
+        client = FakeClient()
+        manifest = Manifest(client=client).load()
+        manifest.record(UNIT, 'fitbit/sleep/2021-11-24.json', 2, md5_base64(b'{}'))
+        assert manifest.contains(UNIT)
+        assert manifest.commit()
+
+        # 検証
+        reloaded = Manifest(client=client).load()
+        assert reloaded.contains(UNIT)
+        assert reloaded.contains_object('fitbit/sleep/2021-11-24.json')
+        assert not reloaded.contains(WorkUnit('fitbit', 'foods', '2021-11-24'))
+        assert reloaded.get(UNIT) == {'fitbit/sleep/2021-11-24.json': {'size': 2, 'md5': md5_base64(b'{}')}}
+
+    def test_valid_md5_matches_gcs(self):
+        '''検証が正しい: 記録したサイズとmd5がgcs上のオブジェクトと一致する
+        '''
+        client = FakeClient()
+        blob = client.bucket('export_from_devices').blob('fitbit/sleep/2021-11-24.json')
+        blob.upload_from_string(b'{"sleep": []}')
+        assert md5_base64(b'{"sleep": []}') == blob.md5_hash
+
+    def test_valid_conflict(self):
+        '''検証が正しい: 他の実行が先に更新した場合は読み込み直して両方の記録を反映する
+        '''
+        # 準備
+        client = FakeClient()
+        first = Manifest(client=client).load()
+        second = Manifest(client=client).load()
+        other_unit = WorkUnit('health_planet', 'body_composition', '2021-11-24')
+
+        # 実行
+        first.record(UNIT, 'fitbit/sleep/2021-11-24.json', 2, md5_base64(b'{}'))
+        second.record(other_unit, 'health_planet/2021-11-24.json', 2, md5_base64(b'{}'))
+        assert first.commit()
+        assert second.commit()
+
+        # 検証
+        stored = json.loads(client.bucket('export_from_devices').objects['manifest.json'])
+        assert set(stored['units']) == {UNIT.key, other_unit.key}
+
+    def test_valid_no_pending(self):
+        '''検証が正しい: 記録がなければcommitしてもgcsに書き込まない
+        '''
+        client = FakeClient()
+        assert Manifest(client=client).load().commit()
+        assert client.bucket('export_from_devices').upload_count == 0
@@ -0,0 +1,197 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from src.memory import MemoryMonitor, PayloadLimiter, current_rss, memory_limit, release_memory
+from src.tracing import Tracer, span
+
+
+class FakeRss:
+    '''設定した値をRSSとして返す
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self):
+        return self.value
+
+
+class TestMemoryMonitor:
+    '''区間ごとのメモリ使用量の最大値と上限までの余裕を求められるか検証
+    - 異常系
+        - intervalに数値以外の型が与えられる
+        - intervalに0以下の値が与えられる
+    - 正常系
+        - 区間ごとに開始時と開始からの最大のRSSを求め, 並行した区間はそれぞれの開始からの最大値とする
+        - 上限を環境変数から取得し, 上限までの余裕を求める
+        - tracemallocで区間ごとに割り当てたメモリを計測する
+        - Tracerに与えるとスパンごとに使用量を記録し, 余裕が少なければWARNINGとする
+        - 現在のRSSを/procから取得し, 解放したメモリを返却しても失敗しない
+    '''
+    def test_invalid_interval_not_number(self):
+        '''検証が正しくない: intervalに数値以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"interval" type must be float.'):
+            MemoryMonitor(interval='0.1')
+
+    def test_invalid_interval_le_zero(self):
+        '''検証が正しくない: intervalに0以下の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"interval" must be over 0.'):
+            MemoryMonitor(interval=0)
+
+    def test_valid_peak(self):
+        '''検証が正しい: 区間ごとに開始時と開始からの最大のRSSを求め, 並行した区間はそれぞれの開始からの最大値とする
+        '''
+        # 準備
+        rss = FakeRss(100)
+        monitor = MemoryMonitor(rss=rss)
+
+        # 実行
+        outer = monitor.begin()
+        rss.value = 300
+        monitor.sample()
+        inner = monitor.begin()
+        rss.value = 200
+        inner = monitor.end(inner)
+        rss.value = 150
+        outer = monitor.end(outer)
+        after = monitor.begin()
+        after = monitor.end(after)
+
+        # 検証
+        assert (outer.rss_start, outer.rss_peak) == (100, 300)
+        assert (inner.rss_start, inner.rss_peak) == (300, 300)
+        assert (after.rss_start, after.rss_peak) == (150, 150)
+        assert outer.to_attributes() == {'rss_start_bytes': 100, 'rss_peak_bytes': 300}
+        assert monitor.total.rss_peak == 300
+
+    def test_valid_summary(self, monkeypatch):
+        '''検証が正しい: 上限を環境変数から取得し, 上限までの余裕を求める
+        '''
+        monkeypatch.delenv('DIETER_MEMORY_LIMIT_MB', raising=False)
+        monkeypatch.delenv('FUNCTION_MEMORY_MB', raising=False)
+        assert memory_limit() is None
+        monkeypatch.setenv('FUNCTION_MEMORY_MB', '256')
+        assert memory_limit() == 256 * 1024 * 1024
+        monkeypatch.setenv('DIETER_MEMORY_LIMIT_MB', '128')
+        assert memory_limit() == 128 * 1024 * 1024
+
+        # NOTE: プロセスのRSSの最大値より大きい値を計測すれば, そちらを最大値とする
+        monitor = MemoryMonitor(rss=FakeRss(100 * 1024 * 1024 * 1024))
+        monitor.sample()
+        summary = monitor.summary(limit=200 * 1024 * 1024 * 1024)
+        assert summary == {
+            'peak_rss_bytes': 100 * 1024 * 1024 * 1024,
+            'max_rss_bytes': 100 * 1024 * 1024 * 1024,
+            'limit_bytes': 200 * 1024 * 1024 * 1024,
+            'headroom_bytes': 100 * 1024 * 1024 * 1024,
+        }
+
+    def test_valid_tracemalloc(self):
+        '''検証が正しい: tracemallocで区間ごとに割り当てたメモリを計測する
+        '''
+        with MemoryMonitor(interval=0.01, use_tracemalloc=True) as monitor:
+            usage = monitor.begin()
+            data = [bytes(1024) for _ in range(1024)]
+            time.sleep(0.05)
+            usage = monitor.end(usage)
+            del data
+        assert usage.to_attributes()['alloc_peak_bytes'] >= 1024 * 1024
+        assert monitor.summary()['peak_alloc_bytes'] >= 1024 * 1024
+
+    def test_valid_tracer(self, monkeypatch):
+        '''検証が正しい: Tracerに与えるとスパンごとに使用量を記録し, 余裕が少なければWARNINGとする
+        '''
+        # 準備
+        rss = FakeRss(100)
+        tracer = Tracer(memory=MemoryMonitor(rss=rss))
+
+        # 実行
+        with tracer.span('run'):
+            with span('fitbit.store'):
+                rss.value = 1000
+
+        # 検証
+        spans, _ = tracer.snapshot()
+        assert spans[1].attributes == {'rss_start_bytes': 100, 'rss_peak_bytes': 1000}
+        monkeypatch.delenv('FUNCTION_MEMORY_MB', raising=False)
+        monkeypatch.delenv('DIETER_MEMORY_LIMIT_MB', raising=False)
+        record = tracer.to_record()
+        assert record['severity'] == 'INFO'
+        assert record['memory']['peak_rss_bytes'] == 1000
+        assert record['memory']['headroom_bytes'] is None
+        # NOTE: プロセスのRSSの最大値は1MBを超えるため, 上限までの余裕が無い
+        monkeypatch.setenv('DIETER_MEMORY_LIMIT_MB', '1')
+        assert tracer.to_record()['severity'] == 'WARNING'
+
+    def test_valid_current_rss(self):
+        '''検証が正しい: 現在のRSSを/procから取得し, 解放したメモリを返却しても失敗しない
+        '''
+        release_memory()
+        rss = current_rss()
+        assert rss is None or rss > 0
+
+
+class TestPayloadLimiter:
+    '''取得したデータを保持する処理を同時に上限まで実行し, 終えるたびにメモリを解放できるか検証
+    - 異常系
+        - max_in_flightにint以外の型が与えられる
+        - max_in_flightに1未満の値が与えられる
+    - 正常系
+        - 同時に実行する処理が上限を超えず, 処理を終えるたびに解放する
+        - 処理が例外を送出しても解放し, 次の処理を実行できる
+    '''
+    def test_invalid_max_in_flight_not_int(self):
+        '''検証が正しくない: max_in_flightにint以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"max_in_flight" type must be int.'):
+            PayloadLimiter(max_in_flight='1')
+
+    def test_invalid_max_in_flight_lt_one(self):
+        '''検証が正しくない: max_in_flightに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_in_flight" must be over 1.'):
+            PayloadLimiter(max_in_flight=0)
+
+    def test_valid_limit(self):
+        '''検証が正しい: 同時に実行する処理が上限を超えず, 処理を終えるたびに解放する
+        '''
+        # 準備
+        released = []
+        limiter = PayloadLimiter(max_in_flight=2, release=lambda: released.append(True))
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def store(i):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return i
+
+        # 実行
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(limiter.wrap(store), range(6)))
+
+        # 検証
+        assert results == list(range(6))
+        assert state['max'] == 2
+        assert len(released) == 6
+
+    def test_valid_error(self):
+        '''検証が正しい: 処理が例外を送出しても解放し, 次の処理を実行できる
+        '''
+        released = []
+        limiter = PayloadLimiter(release=lambda: released.append(True))
+
+        def failed():
+            raise RuntimeError('failed')
+
+        with pytest.raises(RuntimeError, match='failed'):
+            limiter.wrap(failed)()
+        assert limiter.wrap(lambda: 'ok')() == 'ok'
+        assert len(released) == 2
@@ -0,0 +1,92 @@
+import datetime
+import os
+
+import pytest
+from src.response_cache import ResponseCache
+
+
+class TestResponseCache:
+    '''APIのレスポンスを(エンドポイント, 日付)ごとに保存し, 保存期間とサイズの上限で削除できるか検証
+    - 異常系
+        - settle_daysにint以外の値が与えられる
+        - max_bytesに負の値が与えられる
+        - dateが"yyyy-mm-dd"形式ではない
+    - 正常系
+        - 保存したレスポンスとETag, Last-Modifiedを読み込める
+        - 確定期間より前の日付のみ確定したものとみなす
+        - 確定期間を過ぎる前に保存したレスポンスは確定したものとみなさない
+        - 保存期間を過ぎたものは読み込まず, evictで削除される
+        - evictで合計サイズの上限を超えた分を保存した時刻の古いものから削除する
+    '''
+    def create_cache(self, tmp_path, **kwargs):
+        self.now = 1637712000.0
+        return ResponseCache(
+            str(tmp_path), today=lambda: datetime.date(2021, 11, 24), clock=lambda: self.now, **kwargs
+        )
+
+    def test_invalid_settle_days_not_int(self, tmp_path):
+        '''検証が正しくない: settle_daysにint以外の値が与えられる
+        '''
+        with pytest.raises(TypeError, match='"settle_days" type must be int.'):
+            ResponseCache(str(tmp_path), settle_days='7')
+
+    def test_invalid_max_bytes_lt_zero(self, tmp_path):
+        '''検証が正しくない: max_bytesに負の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_bytes" must be over 0.'):
+            ResponseCache(str(tmp_path), max_bytes=-1)
+
+    def test_invalid_date_not_abide_by_format(self, tmp_path):
+        '''検証が正しくない: dateが"yyyy-mm-dd"形式ではない
+        '''
+        with pytest.raises(ValueError, match='"date" must be yyyy-mm-dd.'):
+            self.create_cache(tmp_path).get('activities', '../2021-11-23')
+
+    def test_valid_put_get(self, tmp_path):
+        '''検証が正しい: 保存したレスポンスとETag, Last-Modifiedを読み込める
+        '''
+        cache = self.create_cache(tmp_path)
+        cache.put('activities', '2021-11-23', b'{"summary": {}}', {'ETag': '"abc"'})
+        cached = cache.get('activities', '2021-11-23')
+        assert cached.body == b'{"summary": {}}'
+        assert cached.conditional_headers() == {'If-None-Match': '"abc"'}
+        assert cache.get('sleep', '2021-11-23') is None
+
+    def test_valid_is_settled(self, tmp_path):
+        '''検証が正しい: 確定期間より前の日付のみ確定したものとみなす
+        '''
+        cache = self.create_cache(tmp_path, settle_days=7)
+        assert cache.is_settled('2021-11-16')
+        assert not cache.is_settled('2021-11-17')
+
+    def test_valid_is_settled_stored_at(self, tmp_path):
+        '''検証が正しい: 確定期間を過ぎる前に保存したレスポンスは確定したものとみなさない
+        '''
+        cache = self.create_cache(tmp_path, settle_days=7)
+        stored_at = datetime.datetime(2021, 11, 10, 8, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=9))).timestamp()
+        assert not cache.is_settled('2021-11-09', stored_at)
+        assert cache.is_settled('2021-11-03', stored_at)
+        assert not cache.is_settled('2021-11-20', self.now)
+
+    def test_valid_max_age(self, tmp_path):
+        '''検証が正しい: 保存期間を過ぎたものは読み込まず, evictで削除される
+        '''
+        cache = self.create_cache(tmp_path, max_age_days=1)
+        cache.put('activities', '2021-11-22', b'old')
+        self.now += 86400 + 1
+        cache.put('activities', '2021-11-23', b'new')
+        assert cache.get('activities', '2021-11-22') is None
+        assert [os.path.basename(p) for p in cache.evict()] == ['2021-11-22.cache']
+        assert cache.get('activities', '2021-11-23').body == b'new'
+
+    def test_valid_max_bytes(self, tmp_path):
+        '''検証が正しい: evictで合計サイズの上限を超えた分を保存した時刻の古いものから削除する
+        '''
+        cache = self.create_cache(tmp_path)
+        for i, date in enumerate(['2021-11-21', '2021-11-22', '2021-11-23']):
+            self.now += 1
+            cache.put('sleep' if i == 1 else 'foods', date, b'x' * 100)
+        size = os.path.getsize(os.path.join(str(tmp_path), 'sleep', '2021-11-22.cache'))
+        cache.max_bytes = size * 2
+        assert [os.path.basename(p) for p in cache.evict()] == ['2021-11-21.cache']
+        assert cache.get('sleep', '2021-11-22') is not None
@@ -0,0 +1,133 @@
+import urllib.error
+from email.message import Message
+
+import pytest
+from src.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def http_error(code, headers=None):
+    message = Message()
+    for k, v in (headers or {}).items():
+        message[k] = v
+    return urllib.error.HTTPError('http://example.com', code, 'error', message, None)
+
+
+class TestRetryPolicy:
+    '''一時的な失敗を再送するか判断し待機時間を求められるか検証
+    - 異常系: max_attemptsに1未満の値が与えられる
+    - 正常系
+        - 待機時間は指数的に増える上限の範囲でジッタを加えた値となる
+        - Retry-After(秒数・HTTP-date)があれば従い, 上限を超える場合は再送しない
+        - 冪等でないメソッドは429のみ再送する
+        - 4xx(429以外)や送信回数の上限に達した場合は再送しない
+        - 接続エラーは冪等なメソッドのみ再送し, 遮断による失敗は再送しない
+        - gcsのSDKに与えるRetryが同じ待機時間の方針となる
+    '''
+    def test_invalid_max_attempts_lt_one(self):
+        '''検証が正しくない: max_attemptsに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_attempts" must be over 1.'):
+            RetryPolicy(max_attempts=0)
+
+    def test_valid_backoff(self):
+        '''検証が正しい: 待機時間は指数的に増える上限の範囲でジッタを加えた値となる
+        '''
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, random=lambda: 0.5)
+        assert [policy.backoff(a) for a in [1, 2, 3, 4]] == [0.5, 1.0, 2.0, 2.5]
+
+    def test_valid_retry_after(self):
+        '''検証が正しい: Retry-After(秒数・HTTP-date)があれば従い, 上限を超える場合は再送しない
+        '''
+        policy = RetryPolicy(max_retry_after=60.0, clock=lambda: 1637712000.0)
+        assert policy.retry_delay('GET', 1, http_error(503, {'Retry-After': '7'})) == 7.0
+        assert policy.retry_delay('GET', 1, http_error(429, {'Retry-After': 'Wed, 24 Nov 2021 00:00:30 GMT'})) == 30.0
+        assert policy.retry_delay('GET', 1, http_error(429, {'Retry-After': '3600'})) is None
+
+    def test_valid_non_idempotent(self):
+        '''検証が正しい: 冪等でないメソッドは429のみ再送する
+        '''
+        policy = RetryPolicy(random=lambda: 1.0)
+        assert policy.retry_delay('POST', 1, http_error(503)) is None
+        assert policy.retry_delay('POST', 1, http_error(429)) == 0.5
+
+    def test_valid_not_retryable(self):
+        '''検証が正しい: 4xx(429以外)や送信回数の上限に達した場合は再送しない
+        '''
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.retry_delay('GET', 1, http_error(401)) is None
+        assert policy.retry_delay('GET', 2, http_error(500)) is not None
+        assert policy.retry_delay('GET', 3, http_error(500)) is None
+
+    def test_valid_connection_error(self):
+        '''検証が正しい: 接続エラーは冪等なメソッドのみ再送し, 遮断による失敗は再送しない
+        '''
+        policy = RetryPolicy()
+        assert policy.retry_delay('GET', 1, urllib.error.URLError('timed out')) is not None
+        assert policy.retry_delay('POST', 1, urllib.error.URLError('timed out')) is None
+        assert policy.retry_delay('GET', 1, CircuitOpenError('example.com', 0.0)) is None
+
+    def test_valid_gcs_retry(self):
+        '''検証が正しい: gcsのSDKに与えるRetryが同じ待機時間の方針となる
+        '''
+        retry = RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=3.0).gcs_retry()
+        assert retry._initial == 1.0
+        assert retry._maximum == 3.0
+        assert retry._deadline == 6.0
+        assert retry._predicate(ConnectionError('reset'))
+
+
+class TestCircuitBreaker:
+    '''接続先ごとに連続した失敗で遮断し, 一定時間後に試しに送信できるか検証
+    - 正常系
+        - 連続した失敗が閾値に達すると遮断され, 他の接続先は遮断されない
+        - 一定時間後は1件だけ試しに送信でき, 成功すれば遮断が解除される
+        - 試しに送信して失敗すれば再び遮断される
+        - 成功すると連続した失敗の回数がリセットされる
+    '''
+    def setup_method(self, method):
+        '''時刻を固定した遮断器を用意する
+        '''
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0, clock=lambda: self.now)
+
+    def test_valid_open(self):
+        '''検証が正しい: 連続した失敗が閾値に達すると遮断され, 他の接続先は遮断されない
+        '''
+        self.breaker.record_failure('api.fitbit.com')
+        self.breaker.before_request('api.fitbit.com')
+        self.breaker.record_failure('api.fitbit.com')
+        with pytest.raises(CircuitOpenError, match='circuit breaker is open for api.fitbit.com'):
+            self.breaker.before_request('api.fitbit.com')
+        self.breaker.before_request('www.healthplanet.jp')
+
+    def test_valid_half_open_success(self):
+        '''検証が正しい: 一定時間後は1件だけ試しに送信でき, 成功すれば遮断が解除される
+        '''
+        self.breaker.record_failure('api.fitbit.com')
+        self.breaker.record_failure('api.fitbit.com')
+        self.now = 30.0
+        self.breaker.before_request('api.fitbit.com')
+        with pytest.raises(CircuitOpenError):
+            self.breaker.before_request('api.fitbit.com')
+        self.breaker.record_success('api.fitbit.com')
+        assert not self.breaker.is_open('api.fitbit.com')
+
+    def test_valid_half_open_failure(self):
+        '''検証が正しい: 試しに送信して失敗すれば再び遮断される
+        '''
+        self.breaker.record_failure('api.fitbit.com')
+        self.breaker.record_failure('api.fitbit.com')
+        self.now = 30.0
+        self.breaker.before_request('api.fitbit.com')
+        self.breaker.record_failure('api.fitbit.com')
+        self.now = 59.0
+        with pytest.raises(CircuitOpenError):
+            self.breaker.before_request('api.fitbit.com')
+
+    def test_valid_reset_on_success(self):
+        '''検証が正しい: 成功すると連続した失敗の回数がリセットされる
+        '''
+        self.breaker.record_failure('api.fitbit.com')
+        self.breaker.record_success('api.fitbit.com')
+        self.breaker.record_failure('api.fitbit.com')
+        assert not self.breaker.is_open('api.fitbit.com')
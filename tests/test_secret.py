@@ -0,0 +1,218 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import NotFound
+from src.secret import IniSecretProvider, SecretManagerProvider, SecretProvider
+
+
+class FakeSecretManagerClient:
+    '''secret managerのクライアントのうち使用するメソッドのみを再現する
+    '''
+    def __init__(self, secrets):
+        self.secrets = {k: [v] for k, v in secrets.items()}
+        self.access_count = 0
+        self.lock = threading.Lock()
+
+    def secret_version_path(self, project, secret, version):
+        return 'projects/{}/secrets/{}/versions/{}'.format(project, secret, version)
+
+    def secret_path(self, project, secret):
+        return 'projects/{}/secrets/{}'.format(project, secret)
+
+    def access_secret_version(self, request):
+        with self.lock:
+            self.access_count += 1
+        secret = request['name'].split('/')[3]
+        if len(self.secrets.get(secret, [])) == 0:
+            raise NotFound('Secret [{}] not found or has no versions.'.format(secret))
+        return SimpleNamespace(payload=SimpleNamespace(data=self.secrets[secret][-1].encode('utf-8')))
+
+    def get_secret_version(self, request):
+        secret = request['name'].split('/')[3]
+        if len(self.secrets.get(secret, [])) == 0:
+            raise NotFound('Secret [{}] not found or has no versions.'.format(secret))
+        return SimpleNamespace(name=request['name'])
+
+    def disable_secret_version(self, request):
+        return None
+
+    def add_secret_version(self, request):
+        secret = request['parent'].split('/')[3]
+        if secret not in self.secrets:
+            raise NotFound('Secret [{}] not found.'.format(secret))
+        self.secrets[secret].append(request['payload']['data'].decode('utf-8'))
+
+
+class TestSecretProvider:
+    '''取得元の実装が不足していれば生成時に検出できるか検証
+    - 異常系: _storeを実装していない取得元を生成するとTypeErrorが送出される
+    '''
+    def test_invalid_incomplete(self):
+        '''検証が正しくない: _storeを実装していない取得元を生成するとTypeErrorが送出される
+        '''
+        class FetchOnlyProvider(SecretProvider):
+            def _fetch(self, keys):
+                return {}
+
+        with pytest.raises(TypeError, match='abstract'):
+            FetchOnlyProvider()
+
+
+class TestIniSecretProvider:
+    '''iniファイルから接続情報を取得・更新できるか検証
+    - 正常系
+        - キーに対応するセクションとオプションの値を取得する
+        - 更新した値がiniファイルに書き込まれ, 次の取得で新しい値が返る
+        - 未設定でもよいキーが存在しなければ空文字列を返し, 更新すると書き込まれる
+    '''
+    def setup_method(self, method):
+        self.ini = (
+            '[FITBIT]\n'
+            'client-id = fake_client_id\n'
+            'access-token = old_access_token\n'
+            'refresh-token = old_refresh_token\n'
+        )
+
+    def test_valid_get_many(self, tmp_path):
+        '''検証が正しい: キーに対応するセクションとオプションの値を取得する
+        '''
+        path = tmp_path / 'local.ini'
+        path.write_text(self.ini)
+        provider = IniSecretProvider(str(path))
+        assert provider.get_many(['fb-client-id', 'fb-access-token']) == {
+            'fb-client-id': 'fake_client_id',
+            'fb-access-token': 'old_access_token'
+        }
+
+    def test_valid_update(self, tmp_path):
+        '''検証が正しい: 更新した値がiniファイルに書き込まれ, 次の取得で新しい値が返る
+        '''
+        # 準備
+        path = tmp_path / 'local.ini'
+        path.write_text(self.ini)
+        provider = IniSecretProvider(str(path))
+        provider.get('fb-access-token')
+
+        # 実行
+        provider.update({'fb-access-token': 'new_access_token', 'fb-refresh-token': 'new_refresh_token'})
+
+        # 検証
+        assert provider.get('fb-access-token') == 'new_access_token'
+        assert IniSecretProvider(str(path)).get('fb-refresh-token') == 'new_refresh_token'
+
+    def test_valid_optional(self, tmp_path):
+        '''検証が正しい: 未設定でもよいキーが存在しなければ空文字列を返し, 更新すると書き込まれる
+        '''
+        path = tmp_path / 'local.ini'
+        path.write_text(self.ini)
+        provider = IniSecretProvider(str(path))
+        assert provider.get('fb-expires-at') == ''
+        provider.update({'fb-expires-at': '1637740800'})
+        assert IniSecretProvider(str(path)).get('fb-expires-at') == '1637740800'
+
+
+class TestSecretManagerProvider:
+    '''secret managerから接続情報を取得し, ttlの間保持できるか検証
+    - 異常系
+        - ttlに数値以外の型が与えられる
+        - ttlに0未満の値が与えられる
+    - 正常系
+        - 保持期間内は取得元に問い合わせない
+        - 保持期間を過ぎると取得元に問い合わせる
+        - 更新した値は保持している値が無効になり, 新しいversionが返る
+        - bundle_secretを指定すると1回の問い合わせで全ての値を取得する
+        - 未設定でもよいキーのsecretにversionがなければ空文字列を返し, 事前に作成したsecretのみ更新できる
+    '''
+    def setup_method(self, method):
+        self.now = 0.0
+        self.client = FakeSecretManagerClient({
+            'fb-client-id': 'fake_client_id',
+            'fb-access-token': 'old_access_token',
+            'fb-refresh-token': 'old_refresh_token'
+        })
+
+    def clock(self):
+        return self.now
+
+    def test_invalid_ttl_not_number(self):
+        '''検証が正しくない: ttlに数値以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"ttl" type must be int or float.'):
+            SecretManagerProvider('fake-project', ttl='600', client=self.client)
+
+    def test_invalid_ttl_lt_zero(self):
+        '''検証が正しくない: ttlに0未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"ttl" must be over 0.'):
+            SecretManagerProvider('fake-project', ttl=-1, client=self.client)
+
+    def test_valid_cache(self):
+        '''検証が正しい: 保持期間内は取得元に問い合わせない
+        '''
+        provider = SecretManagerProvider('fake-project', ttl=60, client=self.client, clock=self.clock)
+        keys = ['fb-client-id', 'fb-access-token', 'fb-refresh-token']
+        assert provider.get_many(keys) == provider.get_many(keys)
+        assert self.client.access_count == 3
+
+    def test_valid_cache_expired(self):
+        '''検証が正しい: 保持期間を過ぎると取得元に問い合わせる
+        '''
+        provider = SecretManagerProvider('fake-project', ttl=60, client=self.client, clock=self.clock)
+        provider.get('fb-client-id')
+        self.now = 61.0
+        provider.get('fb-client-id')
+        assert self.client.access_count == 2
+
+    def test_valid_update(self):
+        '''検証が正しい: 更新した値は保持している値が無効になり, 新しいversionが返る
+        '''
+        # 準備
+        provider = SecretManagerProvider('fake-project', ttl=60, client=self.client, clock=self.clock)
+        provider.get_many(['fb-client-id', 'fb-access-token'])
+
+        # 実行
+        provider.update({'fb-access-token': 'new_access_token'})
+
+        # 検証
+        assert provider.get_many(['fb-client-id', 'fb-access-token']) == {
+            'fb-client-id': 'fake_client_id',
+            'fb-access-token': 'new_access_token'
+        }
+        assert self.client.access_count == 3
+
+    def test_valid_bundle_secret(self):
+        '''検証が正しい: bundle_secretを指定すると1回の問い合わせで全ての値を取得する
+        '''
+        # 準備
+        client = FakeSecretManagerClient({
+            'dieter-secrets': json.dumps({'fb-client-id': 'fake_client_id', 'fb-access-token': 'old_access_token'})
+        })
+        provider = SecretManagerProvider('fake-project', bundle_secret='dieter-secrets', client=client, clock=self.clock)
+
+        # 実行
+        values = provider.get_many(['fb-client-id', 'fb-access-token'])
+        provider.update({'fb-access-token': 'new_access_token'})
+
+        # 検証
+        assert values == {'fb-client-id': 'fake_client_id', 'fb-access-token': 'old_access_token'}
+        assert client.access_count == 2
+        assert json.loads(client.secrets['dieter-secrets'][-1]) == {'fb-client-id': 'fake_client_id', 'fb-access-token': 'new_access_token'}
+
+    def test_valid_optional(self):
+        '''検証が正しい: 未設定でもよいキーのsecretにversionがなければ空文字列を返し, 事前に作成したsecretのみ更新できる
+        '''
+        # 準備
+        provider = SecretManagerProvider('fake-project', ttl=60, client=self.client, clock=self.clock)
+
+        # 実行・検証
+        assert provider.get_many(['fb-client-id', 'fb-expires-at']) == {'fb-client-id': 'fake_client_id', 'fb-expires-at': ''}
+        with pytest.raises(NotFound):
+            provider.update({'fb-expires-at': '1637740800'})
+        self.client.secrets['fb-expires-at'] = []
+        provider.update({'fb-expires-at': '1637740800'})
+        assert provider.get('fb-expires-at') == '1637740800'
+        assert self.client.secrets['fb-expires-at'] == ['1637740800']
+        with pytest.raises(NotFound):
+            provider.update({'tw-user-id': '1'})
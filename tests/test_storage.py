@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+
+import pytest
+from src.backfill import WorkUnit
+from src.codec import compress, load_file
+from src.manifest import Manifest
+from src.storage import GcsBackend, LocalBackend, MemoryBackend, PreconditionError, StorageBackend, open_storage
+from tests.fake_gcs import FakeClient
+
+
+class StorageBackendCases:
+    '''各保存先で共通の検証, サブクラスのsetup_methodでself.storageを用意する
+    '''
+    def test_invalid_get_missing(self):
+        '''検証が正しくない: 存在しないパスを読み込むとFileNotFoundErrorが送出される
+        '''
+        with pytest.raises(FileNotFoundError):
+            self.storage.get('fitbit/sleep/2021-11-24.json')
+        with pytest.raises(FileNotFoundError):
+            self.storage.delete('fitbit/sleep/2021-11-24.json')
+
+    def test_invalid_generation(self):
+        '''検証が正しくない: 保存先のgenerationが一致しない条件付きの書き込みはPreconditionErrorが送出される
+        '''
+        self.storage.put(b'{"version": 1}', 'manifest.json')
+        with pytest.raises(PreconditionError):
+            self.storage.put(b'{"version": 2}', 'manifest.json', if_generation_match=0)
+        assert self.storage.get('manifest.json') == b'{"version": 1}'
+
+    def test_valid_put_get(self):
+        '''検証が正しい: bytesとストリームを保存し, 保存したままのデータを読み込み, 存在を確認する
+        '''
+        # 実行
+        self.storage.put(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', content_type='application/json')
+        self.storage.put(io.BytesIO(b'\x89PNG' * 1000), 'ring_fit_adventure/2021-11-24_a.png', 'image/png', chunk_size=256 * 1024)
+        compressed, encoding = compress(b'{"data": []}', 'gzip')
+        self.storage.put(compressed, 'health_planet/2021-11-24.json', 'application/json', content_encoding=encoding)
+
+        # 検証
+        assert self.storage.get('fitbit/sleep/2021-11-24.json') == b'{"sleep": []}'
+        assert self.storage.get('ring_fit_adventure/2021-11-24_a.png') == b'\x89PNG' * 1000
+        assert self.storage.get('health_planet/2021-11-24.json') == compressed
+        assert self.storage.exists('fitbit/sleep/2021-11-24.json')
+        assert not self.storage.exists('fitbit/sleep/2021-11-23.json')
+        assert self.storage.stat('fitbit/sleep/2021-11-24.json').size == len(b'{"sleep": []}')
+        assert self.storage.stat('fitbit/sleep/2021-11-23.json') is None
+
+    def test_valid_list_delete(self):
+        '''検証が正しい: prefixから始まるパスを昇順に返し, 削除したパスは含めない
+        '''
+        for path in ['fitbit/sleep/2021-11-24.json', 'fitbit/foods/2021-11-24.json', 'health_planet/2021-11-24.json']:
+            self.storage.put(b'{}', path)
+        self.storage.delete('fitbit/foods/2021-11-24.json')
+        assert self.storage.list('fitbit/') == ['fitbit/sleep/2021-11-24.json']
+        assert self.storage.list() == ['fitbit/sleep/2021-11-24.json', 'health_planet/2021-11-24.json']
+
+    def test_valid_skip_if_identical(self):
+        '''検証が正しい: 同一のデータが保存済みならば保存しない
+        '''
+        assert self.storage.put(b'{}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True).status == 'uploaded'
+        assert self.storage.put(b'{}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True).status == 'skipped'
+        assert self.storage.put(io.BytesIO(b'{}'), 'fitbit/sleep/2021-11-24.json', skip_if_identical=True).status == 'skipped'
+        assert self.storage.put(b'{"sleep": []}', 'fitbit/sleep/2021-11-24.json', skip_if_identical=True).status == 'uploaded'
+
+    def test_valid_put_batch(self, tmp_path):
+        '''検証が正しい: ファイルとbytesを並行して保存し, itemsと同じ順序で保存結果を返す
+        '''
+        from_path = tmp_path / 'source.json'
+        from_path.write_bytes(b'{"file": true}')
+        results = self.storage.put_batch([(str(from_path), 'a.json'), (b'{}', 'b.json'), (str(tmp_path / 'missing.json'), 'c.json')])
+        assert [r.status for r in results] == ['uploaded', 'uploaded', 'failed']
+        assert isinstance(results[2].error, FileNotFoundError)
+        assert self.storage.get('a.json') == b'{"file": true}'
+        assert self.storage.list() == ['a.json', 'b.json']
+
+    def test_valid_manifest(self):
+        '''検証が正しい: manifestを保存先に書き込み, 他の実行が先に更新していても記録を失わない
+        '''
+        # 準備
+        first = Manifest(storage=self.storage).load()
+        second = Manifest(storage=self.storage).load()
+
+        # 実行
+        first.record(WorkUnit('fitbit', 'sleep', '2021-11-24'), 'fitbit/sleep/2021-11-24.json', 2, 'md5-a')
+        second.record(WorkUnit('fitbit', 'foods', '2021-11-24'), 'fitbit/foods/2021-11-24.json', 2, 'md5-b')
+        assert first.commit()
+        assert second.commit()
+
+        # 検証
+        reloaded = Manifest(storage=self.storage).load()
+        assert reloaded.contains(WorkUnit('fitbit', 'sleep', '2021-11-24'))
+        assert reloaded.contains(WorkUnit('fitbit', 'foods', '2021-11-24'))
+
+
+class TestGcsBackend(StorageBackendCases):
+    '''gcsのバケットへ保存できるか検証
+    - 異常系
+        - 存在しないパスを読み込むとFileNotFoundErrorが送出される
+        - 保存先のgenerationが一致しない条件付きの書き込みはPreconditionErrorが送出される
+    - 正常系
+        - bytesとストリームを保存し, 保存したままのデータを読み込み, 存在を確認する
+        - prefixから始まるパスを昇順に返し, 削除したパスは含めない
+        - 同一のデータが保存済みならば保存しない
+        - ファイルとbytesを並行して保存し, itemsと同じ順序で保存結果を返す
+        - manifestを保存先に書き込み, 他の実行が先に更新していても記録を失わない
+        - Content-TypeとContent-Encodingをオブジェクトに設定する
+    '''
+    def setup_method(self, method):
+        self.client = FakeClient()
+        self.storage = GcsBackend('export_from_devices', client=self.client)
+
+    def test_valid_metadata(self):
+        '''検証が正しい: Content-TypeとContent-Encodingをオブジェクトに設定する
+        '''
+        compressed, encoding = compress(b'{"data": []}', 'gzip')
+        self.storage.put(compressed, 'health_planet/2021-11-24.json', 'application/json', content_encoding=encoding)
+        bucket = self.client.bucket('export_from_devices')
+        assert bucket.content_types == {'health_planet/2021-11-24.json': 'application/json'}
+        assert self.storage.stat('health_planet/2021-11-24.json').content_encoding == 'gzip'
+
+
+class TestLocalBackend(StorageBackendCases):
+    '''ローカルのディレクトリへバケットと同じ構成で保存できるか検証
+    - 異常系
+        - 存在しないパスを読み込むとFileNotFoundErrorが送出される
+        - 保存先のgenerationが一致しない条件付きの書き込みはPreconditionErrorが送出される
+    - 正常系
+        - bytesとストリームを保存し, 保存したままのデータを読み込み, 存在を確認する
+        - prefixから始まるパスを昇順に返し, 削除したパスは含めない
+        - 同一のデータが保存済みならば保存しない
+        - ファイルとbytesを並行して保存し, itemsと同じ順序で保存結果を返す
+        - manifestを保存先に書き込み, 他の実行が先に更新していても記録を失わない
+        - rootからの相対パスにファイルとして保存し, 圧縮したjsonはload_fileで読み込める
+    '''
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'data')
+        self.storage = LocalBackend(self.root)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_valid_layout(self):
+        '''検証が正しい: rootからの相対パスにファイルとして保存し, 圧縮したjsonはload_fileで読み込める
+        '''
+        compressed, encoding = compress(b'{"data": []}', 'gzip')
+        self.storage.put(compressed, 'health_planet/2021-11-24.json', 'application/json', content_encoding=encoding)
+        assert load_file(os.path.join(self.root, 'health_planet', '2021-11-24.json')) == {'data': []}
+        assert os.listdir(os.path.join(self.root, 'health_planet')) == ['2021-11-24.json']
+
+
+class TestMemoryBackend(StorageBackendCases):
+    '''プロセスのメモリ上に保存できるか検証
+    - 異常系
+        - 存在しないパスを読み込むとFileNotFoundErrorが送出される
+        - 保存先のgenerationが一致しない条件付きの書き込みはPreconditionErrorが送出される
+    - 正常系
+        - bytesとストリームを保存し, 保存したままのデータを読み込み, 存在を確認する
+        - prefixから始まるパスを昇順に返し, 削除したパスは含めない
+        - 同一のデータが保存済みならば保存しない
+        - ファイルとbytesを並行して保存し, itemsと同じ順序で保存結果を返す
+        - manifestを保存先に書き込み, 他の実行が先に更新していても記録を失わない
+    '''
+    def setup_method(self, method):
+        self.storage = MemoryBackend()
+
+
+class TestStorageBackend:
+    '''保存先の実装が不足していれば生成時に検出できるか検証
+    - 異常系: put以外を実装していない保存先を生成するとTypeErrorが送出される
+    '''
+    def test_invalid_incomplete(self):
+        '''検証が正しくない: put以外を実装していない保存先を生成するとTypeErrorが送出される
+        '''
+        class PutOnlyBackend(StorageBackend):
+            def put(self, data, path, **kwargs):
+                pass
+
+        with pytest.raises(TypeError, match='abstract'):
+            PutOnlyBackend()
+
+
+class TestOpenStorage:
+    '''urlに応じた保存先を返せるか検証
+    - 異常系: バケット名もしくはディレクトリが与えられない
+    - 正常系: "gs://", "file://", "memory://"とディレクトリのパスに応じた保存先を返す
+    '''
+    def test_invalid_empty(self):
+        '''検証が正しくない: バケット名もしくはディレクトリが与えられない
+        '''
+        with pytest.raises(ValueError, match='"url" must include the bucket name.'):
+            open_storage('gs://')
+        with pytest.raises(ValueError, match='"url" must include the directory.'):
+            open_storage('file://')
+
+    def test_valid(self):
+        '''検証が正しい: "gs://", "file://", "memory://"とディレクトリのパスに応じた保存先を返す
+        '''
+        gcs = open_storage('gs://export_from_devices/')
+        assert isinstance(gcs, GcsBackend) and gcs.bucket_name == 'export_from_devices'
+        assert isinstance(open_storage('memory://'), MemoryBackend)
+        assert open_storage('file:///tmp/data').root == '/tmp/data'
+        assert open_storage('data').root == 'data'
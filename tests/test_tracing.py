@@ -0,0 +1,216 @@
+import json
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from src.tracing import OtlpExporter, Tracer, annotate, propagate, span
+from src.transport import HttpTransport
+from tests.fake_server import FakeServer
+
+
+class FakeClock:
+    '''呼ばれるたびに1秒進む時計
+    '''
+    def __init__(self):
+        self.now = 1637712000.0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.now += 1.0
+            return self.now
+
+
+class TestTracer:
+    '''段階ごとのスパンを親子関係とともに記録できるか検証
+    - 異常系
+        - max_spansにint以外の型が与えられる
+        - max_spansに1未満の値が与えられる
+    - 正常系
+        - 入れ子のスパンを親子関係, 処理時間, 属性とともに記録する
+        - 例外が送出されたスパンはerrorとして記録し, 例外はそのまま送出する
+        - propagateで包んだ関数は他のスレッドでも呼び出した時点のスパンを親とする
+        - Tracerが無い場合はスパンを記録せず, 属性の追加も失敗しない
+        - 上限を超えたスパンは件数のみ記録する
+        - HttpTransportのリクエストをクエリを除いたパスと転送量とともに記録する
+    '''
+    def test_invalid_max_spans_not_int(self):
+        '''検証が正しくない: max_spansにint以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"max_spans" type must be int.'):
+            Tracer(max_spans='10')
+
+    def test_invalid_max_spans_lt_one(self):
+        '''検証が正しくない: max_spansに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_spans" must be over 1.'):
+            Tracer(max_spans=0)
+
+    def test_valid_nested(self):
+        '''検証が正しい: 入れ子のスパンを親子関係, 処理時間, 属性とともに記録する
+        '''
+        # 準備
+        clock = FakeClock()
+        tracer = Tracer(clock=clock, perf_counter=clock)
+
+        # 実行
+        with tracer.span('run', env='local'):
+            with span('fitbit.store', category='sleep') as s:
+                annotate(bytes=10)
+                s.set(result='uploaded')
+
+        # 検証
+        record = tracer.to_record()
+        assert record['severity'] == 'INFO'
+        assert record['message'] == 'trace run'
+        assert record['trace_id'] == tracer.trace_id
+        assert record['errors'] == 0
+        run_span, store_span = record['spans']
+        assert run_span['name'] == 'run'
+        assert run_span['parent_id'] is None
+        assert run_span['attributes'] == {'env': 'local'}
+        assert store_span['parent_id'] == run_span['span_id']
+        assert store_span['start_ms'] == 2000.0
+        assert store_span['duration_ms'] == 1000.0
+        assert store_span['attributes'] == {'category': 'sleep', 'bytes': 10, 'result': 'uploaded'}
+        assert record['duration_ms'] == run_span['duration_ms']
+        assert json.loads(json.dumps(record)) == record
+
+    def test_valid_error(self):
+        '''検証が正しい: 例外が送出されたスパンはerrorとして記録し, 例外はそのまま送出する
+        '''
+        tracer = Tracer()
+        with pytest.raises(ValueError, match='broken'):
+            with tracer.span('run'):
+                with span('secrets.load'):
+                    raise ValueError('broken')
+        record = tracer.to_record()
+        assert record['severity'] == 'WARNING'
+        assert record['errors'] == 2
+        assert [s['error'] for s in record['spans']] == ["ValueError('broken')"] * 2
+
+    def test_valid_propagate(self):
+        '''検証が正しい: propagateで包んだ関数は他のスレッドでも呼び出した時点のスパンを親とする
+        '''
+        # 準備
+        tracer = Tracer()
+
+        def store(category):
+            with span('fitbit.store', category=category):
+                pass
+
+        # 実行
+        with tracer.span('run') as root:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                list(executor.map(propagate(store), ['activities', 'foods', 'sleep']))
+                executor.submit(store, 'body').result()
+
+        # 検証
+        spans, _ = tracer.snapshot()
+        parents = {s.attributes['category']: s.parent_id for s in spans if s.name == 'fitbit.store'}
+        assert parents == {'activities': root.span_id, 'foods': root.span_id, 'sleep': root.span_id}
+
+    def test_valid_without_tracer(self):
+        '''検証が正しい: Tracerが無い場合はスパンを記録せず, 属性の追加も失敗しない
+        '''
+        with span('gcs.upload', path='a.json') as s:
+            s.set(bytes=1)
+            annotate(result='uploaded')
+        assert s.attributes == {'path': 'a.json', 'bytes': 1}
+
+    def test_valid_max_spans(self):
+        '''検証が正しい: 上限を超えたスパンは件数のみ記録する
+        '''
+        tracer = Tracer(max_spans=2)
+        with tracer.span('run'):
+            for _ in range(3):
+                with span('gcs.upload'):
+                    pass
+        record = tracer.to_record()
+        assert len(record['spans']) == 2
+        assert record['dropped_spans'] == 2
+
+    def test_valid_http(self):
+        '''検証が正しい: HttpTransportのリクエストをクエリを除いたパスと転送量とともに記録する
+        '''
+        # 準備
+        def handler(method, path, headers, body):
+            if path.startswith('/missing'):
+                return 404, {}, b'not found'
+            return 200, {}, b'0123456789'
+
+        tracer = Tracer()
+        transport = HttpTransport()
+
+        # 実行
+        with FakeServer(handler) as server, tracer.span('run'):
+            transport.request('POST', server.url + '/status?access_token=secret', data=b'abc')
+            with pytest.raises(urllib.error.HTTPError):
+                transport.request('GET', server.url + '/missing')
+
+        # 検証
+        ok, missing = [s for s in tracer.snapshot()[0] if s.kind == 'client']
+        assert ok.name == 'http POST'
+        assert ok.attributes == {
+            'method': 'POST', 'host': '127.0.0.1', 'path': '/status', 'request_bytes': 3, 'attempts': 1, 'status': 200, 'response_bytes': 10
+        }
+        assert missing.status == 'error'
+        assert missing.attributes['status'] == 404
+
+
+class TestOtlpExporter:
+    '''記録したスパンをOTLP/HTTP(json)でcollectorへ送信できるか検証
+    - 異常系: collectorがエラーを返すとurllib.error.HTTPErrorが送出される
+    - 正常系: トレースID, 親子関係, 時刻, 属性, ステータスをOTLPの形式で送信する
+    '''
+    def setup_method(self, method):
+        '''スパンを記録したTracerを用意する
+        '''
+        clock = FakeClock()
+        self.tracer = Tracer(clock=clock, perf_counter=clock)
+        with pytest.raises(RuntimeError):
+            with self.tracer.span('run'):
+                with span('http GET', kind='client', status=200, response_bytes=10, cached=False):
+                    pass
+                raise RuntimeError('failed')
+
+    def test_invalid_collector_error(self):
+        '''検証が正しくない: collectorがエラーを返すとurllib.error.HTTPErrorが送出される
+        '''
+        with FakeServer(lambda *args: (503, {}, b'')) as server:
+            with pytest.raises(urllib.error.HTTPError, match='HTTP Error 503'):
+                OtlpExporter(server.url + '/v1/traces', transport=HttpTransport()).export(self.tracer)
+
+    def test_valid(self):
+        '''検証が正しい: トレースID, 親子関係, 時刻, 属性, ステータスをOTLPの形式で送信する
+        '''
+        # 準備
+        with FakeServer(lambda *args: (200, {'Content-Type': 'application/json'}, b'{}')) as server:
+            exporter = OtlpExporter(server.url + '/v1/traces', service_name='dieter-test', headers={'X-Api-Key': 'key'})
+
+            # 実行
+            exporter.export(self.tracer)
+
+        # 検証
+        method, path, headers, body = server.requests[0]
+        assert (method, path) == ('POST', '/v1/traces')
+        assert headers['Content-Type'] == 'application/json'
+        assert headers['X-Api-Key'] == 'key'
+        resource_spans = json.loads(body.decode('utf-8'))['resourceSpans'][0]
+        assert resource_spans['resource']['attributes'] == [{'key': 'service.name', 'value': {'stringValue': 'dieter-test'}}]
+        run_span, http_span = resource_spans['scopeSpans'][0]['spans']
+        assert run_span['traceId'] == self.tracer.trace_id
+        assert 'parentSpanId' not in run_span
+        assert run_span['kind'] == 1
+        assert run_span['status'] == {'code': 2, 'message': "RuntimeError('failed')"}
+        assert run_span['startTimeUnixNano'] == str(1637712001 * 10 ** 9)
+        assert run_span['endTimeUnixNano'] == str(1637712005 * 10 ** 9)
+        assert http_span['parentSpanId'] == run_span['spanId']
+        assert http_span['kind'] == 3
+        assert http_span['status'] == {'code': 1}
+        assert http_span['attributes'] == [
+            {'key': 'status', 'value': {'intValue': '200'}},
+            {'key': 'response_bytes', 'value': {'intValue': '10'}},
+            {'key': 'cached', 'value': {'boolValue': False}},
+        ]
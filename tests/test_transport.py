@@ -0,0 +1,265 @@
+import contextlib
+import socket
+import threading
+import urllib
+
+import pytest
+from src.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from src.transport import HttpTransport
+from tests.fake_server import FakeServer
+
+
+def ok_handler(method, path, headers, body):
+    '''リクエストされたパスをそのまま返す
+    '''
+    return 200, {'Content-Type': 'text/plain'}, path.encode('utf-8')
+
+
+@contextlib.contextmanager
+def bad_status_server(requests):
+    '''HTTPとして解釈できないステータス行を返すサーバを起動し, ベースURLを返す
+
+    Args:
+        requests (list): 受け付けたリクエストを記録するリスト
+    '''
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            with conn:
+                requests.append(conn.recv(65536))
+                conn.sendall(b'NOT HTTP\r\n\r\n')
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(listener.getsockname()[1])
+    finally:
+        listener.close()
+        thread.join(1)
+
+
+class TestHttpTransport:
+    '''接続を使い回してリクエストできるか検証
+    - 異常系
+        - max_connections_per_hostにint以外の型が与えられる
+        - max_connections_per_hostに1未満の値が与えられる
+        - urlのschemeがhttp, https以外である
+        - ステータスコードが400以上でurllib.error.HTTPErrorが送出される
+    - 正常系
+        - 連続したリクエストで同じ接続が使い回される
+        - サーバ側で切断された接続を再利用した場合は再接続して送信する
+        - 同時に使用する接続数が上限を超えない
+        - リダイレクト先を辿る
+    '''
+    def test_invalid_max_connections_not_int(self):
+        '''検証が正しくない: max_connections_per_hostにint以外の型が与えられる
+        '''
+        with pytest.raises(TypeError, match='"max_connections_per_host" type must be int.'):
+            HttpTransport(max_connections_per_host='4')
+
+    def test_invalid_max_connections_lt_one(self):
+        '''検証が正しくない: max_connections_per_hostに1未満の値が与えられる
+        '''
+        with pytest.raises(ValueError, match='"max_connections_per_host" must be over 1.'):
+            HttpTransport(max_connections_per_host=0)
+
+    def test_invalid_url_scheme(self):
+        '''検証が正しくない: urlのschemeがhttp, https以外である
+        '''
+        with pytest.raises(ValueError, match='"url" scheme must be http or https.'):
+            HttpTransport().request('GET', 'ftp://example.com/')
+
+    def test_invalid_http_error(self):
+        '''検証が正しくない: ステータスコードが400以上でurllib.error.HTTPErrorが送出される
+        '''
+        def handler(method, path, headers, body):
+            return 401, {}, b'{"errors": []}'
+
+        with FakeServer(handler) as server:
+            with pytest.raises(urllib.error.HTTPError, match='HTTP Error 401: Unauthorized') as e:
+                HttpTransport().request('GET', server.url + '/')
+        assert e.value.read() == b'{"errors": []}'
+
+    def test_valid_keep_alive(self):
+        '''検証が正しい: 連続したリクエストで同じ接続が使い回される
+        '''
+        # 実行
+        transport = HttpTransport()
+        with FakeServer(ok_handler) as server:
+            bodies = [transport.request('GET', server.url + '/{}'.format(i)).body for i in range(5)]
+        transport.close()
+
+        # 検証
+        assert bodies == [b'/0', b'/1', b'/2', b'/3', b'/4']
+        assert len(server.client_ports) == 1
+
+    def test_valid_reconnect_stale_connection(self):
+        '''検証が正しい: サーバ側で切断された接続を再利用した場合は再接続して送信する
+        '''
+        # 準備
+        transport = HttpTransport()
+        with FakeServer(ok_handler) as server:
+            transport.request('GET', server.url + '/0')
+            for connections in transport._idle.values():
+                for conn in connections:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+
+            # 実行
+            res = transport.request('GET', server.url + '/1')
+
+        # 検証
+        assert res.body == b'/1'
+
+    def test_valid_max_connections_per_host(self):
+        '''検証が正しい: 同時に使用する接続数が上限を超えない
+        '''
+        # 準備
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        release = threading.Event()
+
+        def handler(method, path, headers, body):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[0], in_flight[1])
+            release.wait(0.2)
+            with lock:
+                in_flight[0] -= 1
+            return ok_handler(method, path, headers, body)
+
+        # 実行
+        transport = HttpTransport(max_connections_per_host=2)
+        with FakeServer(handler) as server:
+            threads = [threading.Thread(target=transport.request, args=('GET', server.url + '/')) for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        # 検証
+        assert in_flight[1] == 2
+        assert len(server.client_ports) == 2
+
+    def test_valid_redirect(self):
+        '''検証が正しい: リダイレクト先を辿る
+        '''
+        def handler(method, path, headers, body):
+            if path == '/old':
+                return 302, {'Location': '/new'}, b''
+            return ok_handler(method, path, headers, body)
+
+        with FakeServer(handler) as server:
+            res = HttpTransport().request('GET', server.url + '/old')
+        assert res.url == server.url + '/new'
+        assert res.body == b'/new'
+
+
+class TestHttpTransportRetry:
+    '''一時的な失敗を再送し, 障害が続く接続先へのリクエストを遮断できるか検証
+    - 異常系
+        - 再送の上限に達した場合は最後のHTTPErrorが送出される
+        - 遮断中の接続先にはリクエストを送信せずにCircuitOpenErrorが送出される
+        - 不正なステータス行はURLErrorとして再送され, 遮断器に失敗として記録される
+    - 正常系
+        - 5xxで失敗した後にRetry-Afterに従って再送し成功する
+        - 再送しない方針(None)では1回で失敗する
+        - 再送のログにはクエリ文字列を含めない
+    '''
+    def setup_method(self, method):
+        '''待機時間を記録し, 指定した回数だけ503を返すサーバの応答を用意する
+        '''
+        self.slept = []
+        self.failures = 0
+        self.policy = RetryPolicy(max_attempts=3, random=lambda: 0.0, sleep=self.slept.append)
+
+        def handler(method, path, headers, body):
+            if self.failures > 0:
+                self.failures -= 1
+                return 503, {'Retry-After': '2'}, b''
+            return 200, {}, b'ok'
+        self.handler = handler
+
+    def test_invalid_max_attempts(self):
+        '''検証が正しくない: 再送の上限に達した場合は最後のHTTPErrorが送出される
+        '''
+        self.failures = 3
+        with FakeServer(self.handler) as server:
+            transport = HttpTransport(retry_policy=self.policy)
+            with pytest.raises(urllib.error.HTTPError, match='HTTP Error 503'):
+                transport.request('GET', server.url + '/a')
+        assert len(server.requests) == 3
+        assert self.slept == [2.0, 2.0]
+
+    def test_invalid_circuit_open(self):
+        '''検証が正しくない: 遮断中の接続先にはリクエストを送信せずにCircuitOpenErrorが送出される
+        '''
+        self.failures = 10
+        with FakeServer(self.handler) as server:
+            transport = HttpTransport(retry_policy=self.policy, circuit_breaker=CircuitBreaker(failure_threshold=2))
+            with pytest.raises(CircuitOpenError):
+                transport.request('GET', server.url + '/a')
+            with pytest.raises(CircuitOpenError):
+                transport.request('GET', server.url + '/b')
+        assert len(server.requests) == 2
+
+    def test_invalid_bad_status_line(self):
+        '''検証が正しくない: 不正なステータス行はURLErrorとして再送され, 遮断器に失敗として記録される
+        '''
+        # 準備
+        now = [0.0]
+        requests = []
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=lambda: now[0])
+        transport = HttpTransport(retry_policy=self.policy, circuit_breaker=breaker)
+        with bad_status_server(requests) as url:
+            # 実行
+            with pytest.raises(urllib.error.URLError, match='NOT HTTP'):
+                transport.request('GET', url + '/a')
+            sent = len(requests)
+            # 遮断が解除される時間が経過するたびに試しの送信を1件だけ行う
+            for now[0] in (20.0, 40.0):
+                with pytest.raises(CircuitOpenError):
+                    transport.request('GET', url + '/b')
+
+        # 検証
+        assert sent == 3
+        assert len(requests) == 5
+        assert breaker.is_open('127.0.0.1')
+
+    def test_valid_retry(self):
+        '''検証が正しい: 5xxで失敗した後にRetry-Afterに従って再送し成功する
+        '''
+        self.failures = 1
+        with FakeServer(self.handler) as server:
+            res = HttpTransport(retry_policy=self.policy).request('GET', server.url + '/a')
+        assert res.body == b'ok'
+        assert self.slept == [2.0]
+
+    def test_valid_no_retry_policy(self):
+        '''検証が正しい: 再送しない方針(None)では1回で失敗する
+        '''
+        self.failures = 1
+        with FakeServer(self.handler) as server:
+            with pytest.raises(urllib.error.HTTPError):
+                HttpTransport().request('GET', server.url + '/a')
+        assert len(server.requests) == 1
+
+    def test_valid_retry_log_without_query(self, capsys):
+        '''検証が正しい: 再送のログにはクエリ文字列を含めない
+        '''
+        # 準備
+        self.failures = 1
+        with FakeServer(self.handler) as server:
+            # 実行
+            HttpTransport(retry_policy=self.policy).request('GET', server.url + '/a?access_token=secret')
+
+        # 検証
+        out = capsys.readouterr().out
+        assert 'retry GET 127.0.0.1/a in 2.0s' in out
+        assert 'secret' not in out